@@ -48,7 +48,31 @@ import profile
 # Module metadata
 #######################################################################
 
-__version__ = '0.5.0'
+__version__ = '0.6.0'
+
+#######################################################################
+# Constants
+#######################################################################
+
+# Legend descriptions for all possible columns
+MACS2_LEGENDS = { 'order': "Sorting order FE",
+                  'chr': "Chromosome location of binding region",
+                  'start': "Start coordinate of binding region",
+                  'end': "Start coordinate of binding region",
+                  'summit+100': "Summit + 100bp",
+                  'summit-1': "Summit of binding region - 1",
+                  'summit': "Summit of binding region",
+                  'abs_summit+100': "Summit + 100bp",
+                  'abs_summit-100': "Summit of binding region - 100bp",
+                  'abs_summit': "Summit of binding region",
+                  'length': "Length of binding region",
+                  'abs_summit': "Coordinate of region summit",
+                  'pileup': "Number of non-degenerate and position corrected reads at summit",
+                  '-log10(pvalue)': "Transformed Pvalue -log10(Pvalue) for the binding region (e.g. if Pvalue=1e-10, then this value should be 10)",
+                  'fold_enrichment': "Fold enrichment for this region against random Poisson distribution with local lambda",
+                  '-log10(qvalue)': "Transformed Qvalue -log10(Pvalue) for the binding region (e.g. if Qvalue=0.05, then this value should be 1.3)",
+                  'name': "Name"
+                 }
 
 #######################################################################
 # Class definitions
@@ -291,6 +315,54 @@ def xls_for_macs2(macs_xls,row_limit=None,cell_char_limit=None):
     Returns:
       simple_xls.XLSWorkBook
 
+    """
+    xls = simple_xls.XLSWorkBook()
+    populate_workbook_for_macs2(xls,macs_xls,
+                                row_limit=row_limit,
+                                cell_char_limit=cell_char_limit)
+    return xls
+
+def xlsx_for_macs2(macs_xls,xlsx_out,row_limit=None,cell_char_limit=None):
+    """Write an XLSX file for MACS2 output
+
+    Rows are streamed directly to the output file (via a
+    simple_xls.XLSXStreamWorkBook) without building an
+    XLSWorkBook in memory first.
+
+    Arguments:
+      macs_xls: populated MacsXLS object (must be from MACS2)
+      xlsx_out: name of the XLSX file to write
+      row_limit: explicitly specify maximum number of rows per
+        output sheet
+      cell_character_limit: explicitly specify maximum number
+        of characters per cell
+
+    """
+    xlsx = simple_xls.XLSXStreamWorkBook(xlsx_out)
+    try:
+        populate_workbook_for_macs2(xlsx,macs_xls,
+                                    row_limit=row_limit,
+                                    cell_char_limit=cell_char_limit)
+    finally:
+        xlsx.close()
+
+def populate_workbook_for_macs2(xls,macs_xls,row_limit=None,
+                                cell_char_limit=None):
+    """Add the sheets for MACS2 output to a workbook
+
+    Creates 'data' sheet(s) with the tabulated data plus the
+    extra formulae columns, plus 'notes' and 'legends' sheets.
+    Rows are only ever appended, so the workbook can be either
+    a simple_xls.XLSWorkBook or a simple_xls.XLSXStreamWorkBook.
+
+    Arguments:
+      xls: workbook object to add the sheets to
+      macs_xls: populated MacsXLS object (must be from MACS2)
+      row_limit: explicitly specify maximum number of rows per
+        output sheet
+      cell_character_limit: explicitly specify maximum number
+        of characters per cell
+
     """
 
     # Check MACS version - can't handle MACS 1.*
@@ -313,32 +385,13 @@ def xls_for_macs2(macs_xls,row_limit=None,cell_char_limit=None):
     # Maximum length of a data sheet title
     sheet_title_limit = simple_xls.Limits.MAX_LEN_WORKSHEET_TITLE
 
-    # Legend descriptions for all possible columns
-    legends_text = { 'order': "Sorting order FE",
-                     'chr': "Chromosome location of binding region",
-                     'start': "Start coordinate of binding region",
-                     'end': "Start coordinate of binding region",
-                     'summit+100': "Summit + 100bp",
-                     'summit-1': "Summit of binding region - 1",
-                     'summit': "Summit of binding region",
-                     'abs_summit+100': "Summit + 100bp",
-                     'abs_summit-100': "Summit of binding region - 100bp",
-                     'abs_summit': "Summit of binding region",
-                     'length': "Length of binding region",
-                     'abs_summit': "Coordinate of region summit",
-                     'pileup': "Number of non-degenerate and position corrected reads at summit",
-                     '-log10(pvalue)': "Transformed Pvalue -log10(Pvalue) for the binding region (e.g. if Pvalue=1e-10, then this value should be 10)",
-                     'fold_enrichment': "Fold enrichment for this region against random Poisson distribution with local lambda",
-                     '-log10(qvalue)': "Transformed Qvalue -log10(Pvalue) for the binding region (e.g. if Qvalue=0.05, then this value should be 1.3)",
-                     'name': "Name"
-                 }
-
-    # Create a new spreadsheet
-    xls = simple_xls.XLSWorkBook()
-
     # Set up styles
     boldstyle = simple_xls.XLSStyle(bold=True)
 
+    # Columns for the 'data' sheet(s)
+    columns = data_columns_for_macs2(macs_xls)
+    header = [title for title,source in columns]
+
     # Create and populate the 'data' sheet(s)
     # If there are more records than will fit into a single spreadsheet
     # then make multiple sheets
@@ -357,63 +410,36 @@ def xls_for_macs2(macs_xls,row_limit=None,cell_char_limit=None):
         # If this is an empty sheet add the column titles and
         # store in the list of data sheets
         if data.next_row == 1:
-            data.write_row(1,data=macs_xls.columns_as_xls_header)
+            data.append_row(data=header)
             data_sheets.append(data)
-        # Write data to sheet
-        data.append_row(line)
-    
-    # Insert and populate formulae columns for each data sheet
-    for data in data_sheets:
-        if not macs_xls.with_broad_option:
-            # Copy of chr column
-            data.insert_column('E',text="chr")
-            data.write_column('E',fill="=B?",from_row=2)
-            # Summit-100
-            data.insert_column('F',text="abs_summit-100")
-            data.write_column('F',fill="=L?-100",from_row=2)
-            # Summit+100
-            data.insert_column('G',text="abs_summit+100")
-            data.write_column('G',fill="=L?+100",from_row=2)
-            # Copy of chr column
-            data.insert_column('H',text="chr")
-            data.write_column('H',fill="=B?",from_row=2)
-            # Summit-1
-            data.insert_column('I',text="summit-1")
-            data.write_column('I',fill="=L?-1",from_row=2)
-            # Summit
-            data.insert_column('J',text="summit")
-            data.write_column('J',fill="=L?",from_row=2)
-        else:
-            # Copy of chr column
-            data.insert_column('E',text="chr")
-            data.write_column('E',fill="=B?",from_row=2)
+        # Write data (and formulae) to sheet
+        data.append_row(data=[source if source.startswith('=')
+                              else line[source]
+                              for title,source in columns])
 
     # Build the 'notes' sheet with the header data
     notes = xls.add_work_sheet('notes',"Notes")
-    notes.write_row(1,text="MACS RUN NOTES:",style=boldstyle)
-    notes.write_column('A',macs_xls.header,from_row=notes.next_row)
-    notes.append_row(text="ADDITIONAL NOTES:",style=boldstyle)
-    notes.append_row(text="By default regions are sorted by fold enrichment "
-                     "(in descending order)")
-
-    # Check for and address too-long "Command line" cell i.e. if it
-    # exceeds maximum size for a spreadsheet cell
-    for row in range(1,notes.last_row+1):
-        if notes['A'][row].startswith("# Command line:"):
-            command_line = notes['A'][row]
-            if len(command_line) > cell_char_limit:
-                # Chop up command line string over multiple cells
-                logging.warning("Splitting command line over multiple cells")
-                row_data = chunk(command_line,cell_char_limit,delimiter=' ')
-                notes.write_row(row,data=row_data)
-        
+    notes.append_row(data=["MACS RUN NOTES:"],style=boldstyle)
+    for line in macs_xls.header:
+        if line.startswith("# Command line:") and \
+           len(line) > cell_char_limit:
+            # Chop up too-long command line string over
+            # multiple cells
+            logging.warning("Splitting command line over multiple cells")
+            notes.append_row(data=chunk(line,cell_char_limit,
+                                        delimiter=' '))
+        else:
+            notes.append_row(data=[line])
+    notes.append_row(data=["ADDITIONAL NOTES:"],style=boldstyle)
+    notes.append_row(data=["By default regions are sorted by fold "
+                           "enrichment (in descending order)"])
+
     # Build the 'legends' sheet based on content of 'data'
-    data = data_sheets[0]
     legends = xls.add_work_sheet('legends',"Legends")
-    for col in simple_xls.ColumnRange(data.last_column):
-        name = data[col][1].lstrip('#')
+    for title in header:
+        name = title.lstrip('#')
         try:
-            legends.append_row(data=(name,legends_text[name]))
+            legends.append_row(data=(name,MACS2_LEGENDS[name]))
         except KeyError:
             logging.warning("No legend description found for column '%s'" % name)
             legends.append_row(data=(name,name.title()))
@@ -422,8 +448,35 @@ def xls_for_macs2(macs_xls,row_limit=None,cell_char_limit=None):
     for data in data_sheets:
         data.freeze_panes = 'A2'
 
-    # Return spreadsheet object
-    return xls
+def data_columns_for_macs2(macs_xls):
+    """Return the columns to output for MACS2 data
+
+    The columns are those in the MACS2 data, plus additional
+    formulae columns (e.g. summit+/-100bps) inserted after the
+    'end' column.
+
+    Arguments:
+      macs_xls: populated MacsXLS object (must be from MACS2)
+
+    Returns:
+      List of (title,source) tuples, where 'source' is either
+      the name of a column in the MACS2 data, or a formula
+      (starting with '=').
+
+    """
+    columns = [(name,name) for name in macs_xls.columns]
+    # Prepend a hash to the first column title
+    columns[0] = ('#'+columns[0][0],columns[0][1])
+    if not macs_xls.with_broad_option:
+        formulae = [("chr","=B?"),               # Copy of chr column
+                    ("abs_summit-100","=L?-100"),# Summit-100
+                    ("abs_summit+100","=L?+100"),# Summit+100
+                    ("chr","=B?"),               # Copy of chr column
+                    ("summit-1","=L?-1"),        # Summit-1
+                    ("summit","=L?")]            # Summit
+    else:
+        formulae = [("chr","=B?")]               # Copy of chr column
+    return columns[:4] + formulae + columns[4:]
 
 def bed_for_macs2(macs_xls):
     """
@@ -495,6 +548,9 @@ def chunk(line,chunksize,delimiter=None):
 
 import unittest
 import cStringIO
+import tempfile
+import shutil
+import zipfile
 
 MACS140beta_data = """# This file is generated by MACS version 1.4.0beta
 # ARGUMENTS LIST:
@@ -1000,6 +1056,43 @@ class TestXlsForMacs2Function(unittest.TestCase):
         macsxls = MacsXLS(fp=cStringIO.StringIO(MACS140beta_data))
         self.assertRaises(Exception,xls_for_macs2,macsxls)
 
+class TestXlsxForMacs2Function(unittest.TestCase):
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_xlsx_for_macs2_with_2010_20131216(self):
+        """Write XLSX file for MACS2.0.10.20131216 data
+
+        """
+        macsxls = MacsXLS(fp=cStringIO.StringIO(MACS2010_20131216_data))
+        xlsx_out = os.path.join(self.wd,'test.xlsx')
+        xlsx_for_macs2(macsxls,xlsx_out)
+        self.assertTrue(os.path.isfile(xlsx_out))
+        xlsx = zipfile.ZipFile(xlsx_out)
+        workbook = xlsx.read('xl/workbook.xml')
+        for title in ("NW-H3K27ac-chIP_vs_input_E13.5_",'Notes','Legends'):
+            self.assertTrue('name="%s"' % title in workbook)
+        data = xlsx.read('xl/worksheets/sheet1.xml')
+        # Check first line of data (including formulae results)
+        self.assertTrue('<c r="C2"><v>6214126</v></c>' in data)
+        self.assertTrue('<f>B2</f><v>chr1</v>' in data)
+        self.assertTrue('<f>L2-100</f><v>6214692</v>' in data)
+        self.assertTrue('<f>L2+100</f><v>6214892</v>' in data)
+        self.assertTrue('<f>L2-1</f><v>6214791</v>' in data)
+        self.assertTrue('<f>L2</f><v>6214792</v>' in data)
+
+    def test_xlsx_for_macs2_with_140beta(self):
+        """Writing XLSX file for MACS 1.4.0beta data raises exception
+
+        """
+        macsxls = MacsXLS(fp=cStringIO.StringIO(MACS140beta_data))
+        xlsx_out = os.path.join(self.wd,'test.xlsx')
+        self.assertRaises(Exception,xlsx_for_macs2,macsxls,xlsx_out)
+
 class TestBedForMacs2Function(unittest.TestCase):
 
     def test_bed_for_macs2_with_2010_20130419(self):
@@ -1117,15 +1210,19 @@ def main(macs_file,xls_out,xls_format="xlsx",bed_out=None):
         xls_max_rows = simple_xls.XLSLimits.MAX_NUMBER_ROWS_PER_WORKSHEET
         xls_cell_width = simple_xls.XLSLimits.MAX_LEN_WORKSHEET_CELL_VALUE
     try:
-        xls = xls_for_macs2(macs_xls,
-                            row_limit=xls_max_rows,
-                            cell_char_limit=xls_cell_width)
+        if xls_format == "xlsx":
+            # Stream rows directly to the XLSX file
+            xlsx_for_macs2(macs_xls,xls_out,
+                           row_limit=xls_max_rows,
+                           cell_char_limit=xls_cell_width)
+        elif xls_format == "xls":
+            xls = xls_for_macs2(macs_xls,
+                                row_limit=xls_max_rows,
+                                cell_char_limit=xls_cell_width)
     except Exception,ex:
         logging.error("failed to convert to XLS: %s" % ex)
         sys.exit(1)
-    if xls_format == "xlsx":
-        xls.save_as_xlsx(xls_out)
-    elif xls_format == "xls":
+    if xls_format == "xls":
         xls.save_as_xls(xls_out)
 
     # Create BED file
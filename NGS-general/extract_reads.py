@@ -35,12 +35,13 @@ import re
 from bcftbx.ngsutils import getreads
 from bcftbx.ngsutils import getreads_subset
 from bcftbx.ngsutils import getreads_regex
+from bcftbx.ngsutils import getreads_random_sample
 
 #######################################################################
 # Module metadata
 #######################################################################
 
-__version__ = "0.2.0"
+__version__ = "0.3.0"
 
 __description__ = """Extract subsets of reads from each of the
 supplied files according to specified criteria (e.g. random,
@@ -91,32 +92,43 @@ def main(args=None):
                 for read in getreads_regex(f,opts.pattern):
                     fp.write('\n'.join(read) + '\n')
     else:
-        # Seed random number generator
-        if opts.seed is not None:
-            random.seed(opts.seed)
-        # Count the reads
-        nreads = sum(1 for i in getreads(args[0]))
-        print "Number of reads: %s" % nreads
-        if len(args) > 1:
-            print "Verifying read numbers match between files"
-        for f in args[1:]:
-            if sum(1 for i in getreads(f)) != nreads:
-                print "Inconsistent numbers of reads between files"
-                sys.exit(1)
-        # Generate a subset of read indices to extract
+        # Determine the size of the subset
         try:
             nsubset = int(opts.n)
         except ValueError:
             if str(opts.n).endswith('%'):
-                nsubset = int(float(opts.n[:-1])*nreads/100.0)
-        if nsubset > nreads:
-            print "Requested subset (%s) is larger than file (%s)" % (nsubset,
-                                                                      nreads)
-            sys.exit(1)
-        print "Generating set of %s random indices" % nsubset
-        subset_indices = random.sample(xrange(nreads),nsubset)
+                nsubset = None
+            else:
+                p.error("Bad value for -n: '%s'" % opts.n)
+        if nsubset is not None:
+            # Sample the reads in a single pass
+            print "Sampling %s random reads" % nsubset
+            subset = [reads for reads in
+                      getreads_random_sample(args,nsubset,seed=opts.seed)]
+            if len(subset) < nsubset:
+                print "Requested subset (%s) is larger than file (%s)" % \
+                    (nsubset,len(subset))
+                sys.exit(1)
+        else:
+            # Percentage requires the read count in advance
+            if opts.seed is not None:
+                random.seed(opts.seed)
+            # Count the reads
+            nreads = sum(1 for i in getreads(args[0]))
+            print "Number of reads: %s" % nreads
+            if len(args) > 1:
+                print "Verifying read numbers match between files"
+            for f in args[1:]:
+                if sum(1 for i in getreads(f)) != nreads:
+                    print "Inconsistent numbers of reads between files"
+                    sys.exit(1)
+            # Generate a subset of read indices to extract
+            nsubset = int(float(opts.n[:-1])*nreads/100.0)
+            print "Generating set of %s random indices" % nsubset
+            subset_indices = random.sample(xrange(nreads),nsubset)
+            subset = None
         # Extract the reads to separate files
-        for f in args:
+        for i,f in enumerate(args):
             if f.endswith('.gz'):
                 outfile = os.path.basename(os.path.splitext(f[:-3])[0])
             else:
@@ -124,8 +136,12 @@ def main(args=None):
             outfile += '.subset_%s.fq' % nsubset
             print "Extracting to %s" % outfile
             with open(outfile,'w') as fp:
-                for read in getreads_subset(f,subset_indices):
-                    fp.write('\n'.join(read) + '\n')
+                if subset is not None:
+                    for reads in subset:
+                        fp.write('\n'.join(reads[i]) + '\n')
+                else:
+                    for read in getreads_subset(f,subset_indices):
+                        fp.write('\n'.join(read) + '\n')
 
 if __name__ == "__main__":
     main()
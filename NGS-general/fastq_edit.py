@@ -9,7 +9,7 @@
 #
 ########################################################################
 
-__version__ = "0.0.2"
+__version__ = "0.1.0"
 
 """fastq_edit.py
 
@@ -41,6 +41,7 @@ SHARE_DIR = os.path.abspath(
         os.path.join(os.path.dirname(sys.argv[0]),'..')))
 sys.path.append(SHARE_DIR)
 import bcftbx.FASTQFile as FASTQFile
+import bcftbx.FASTQStats as FASTQStats
 
 #######################################################################
 # Functions
@@ -64,35 +65,40 @@ def edit_instrument_name(fastq_file,new_instrument_name):
 
 def stats(fastq_file):
     """Generate basic stats from FASTQ file
+
+    The statistics are generated in bulk by the
+    'collect_fastq_stats' function from the bcftbx.FASTQStats
+    module, and reported on stdout.
     """
-    # Loop over all reads in the FASTQ
-    n_reads = 0
-    read_lengths = {}
-    index_sequences = {}
-    for read in FASTQFile.FastqIterator(fastq_file):
-        # Count of reads
-        n_reads += 1
-        # Read length distribution
-        read_len = len(read.sequence)
-        if read_len in read_lengths:
-            read_lengths[read_len] += 1
-        else:
-            read_lengths[read_len] = 1
-        # Tag name distribution
-        index_seq = read.seqid.index_sequence
-        if index_seq is not None:
-            if index_seq in index_sequences:
-                index_sequences[index_seq] += 1
-            else:
-                index_sequences[index_seq] = 1
-    # Finished
-    print "Total reads: %d" % n_reads
+    fqstats = FASTQStats.collect_fastq_stats(fastq_file)
+    print "Total reads: %d" % fqstats.nreads
     print "Read lengths"
-    for len_ in read_lengths:
-        print "\t%d: %d" % (len_,read_lengths[len_])
+    for len_ in sorted(fqstats.read_lengths):
+        print "\t%d: %d" % (len_,fqstats.read_lengths[len_])
     print "Index sequences"
-    for seq in index_sequences:
-        print "\t%s: %d" % (seq,index_sequences[seq])
+    for seq in sorted(fqstats.index_sequences):
+        print "\t%s: %d" % (seq,fqstats.index_sequences[seq])
+    print "Base composition"
+    for base in sorted(fqstats.base_composition):
+        print "\t%s: %d" % (base,fqstats.base_composition[base])
+    print "N content"
+    print "\tReads with N: %d" % fqstats.reads_with_n
+    print "\tFraction of bases: %.4f" % fqstats.n_content
+    print "Quality"
+    if fqstats.min_quality is None:
+        print "\tNo quality values"
+        return
+    print "\tMin,max: %d,%d\t(%s,%s)" % (ord(fqstats.min_quality),
+                                         ord(fqstats.max_quality),
+                                         fqstats.min_quality,
+                                         fqstats.max_quality)
+    encodings = fqstats.quality_encodings()
+    if encodings:
+        print "\tPossible encodings: %s" % \
+            ', '.join([e[0] for e in encodings])
+    print "Mean quality per position (Phred+33)"
+    for i,mean in enumerate(fqstats.mean_quality_per_position()):
+        print "\t%d: %.2f" % (i+1,mean)
 
 #######################################################################
 # Main program
@@ -9,11 +9,11 @@
 #
 ########################################################################
 
-__version__ = "0.0.2"
+__version__ = "0.2.0"
 
 """fastq_sniffer.py
 
-Usage: fastq_sniffer.py [ --subset N ] <fastq_file>
+Usage: fastq_sniffer.py [ --subset N | --quick ] <fastq_file>
 
 "Sniff" FASTQ file to try and determine likely format and quality encoding.
 
@@ -33,6 +33,7 @@ SHARE_DIR = os.path.abspath(
         os.path.join(os.path.dirname(sys.argv[0]),'..')))
 sys.path.append(SHARE_DIR)
 import bcftbx.FASTQFile as FASTQFile
+import bcftbx.FASTQStats as FASTQStats
 
 #######################################################################
 # Main program
@@ -49,6 +50,10 @@ if __name__ == "__main__":
                  help="try to determine encoding from a subset of consisting of the first "
                  "N_SUBSET reads. (Quicker than using all reads but may not be accurate "
                  "if subset is not representative of the file as a whole.)")
+    p.add_option('--quick',action="store_true",dest="quick",default=False,
+                 help="sample blocks of reads from across the file and stop as soon "
+                 "as the quality encoding is unambiguous, reporting the encoding "
+                 "with a confidence value. (Much quicker than checking all reads.)")
 
     # Process the command line
     options,arguments = p.parse_args()
@@ -70,55 +75,52 @@ if __name__ == "__main__":
         print "\tSeq length:\t%d" % read.seqlen
         break
 
+    # Quickly sample the quality encoding
+    if options.quick:
+        sniff = FASTQFile.sniff_quality_encoding(
+            fastq_file,colorspace=(fastq_format == 'colorspace'))
+        print "\nSampled %d reads from %d blocks" % (sniff.nreads,sniff.nblocks)
+        if sniff.min_quality is not None:
+            print "Min,max quality scores:\t%d,%d\t(%s,%s)" % \
+                (ord(sniff.min_quality),ord(sniff.max_quality),
+                 sniff.min_quality,sniff.max_quality)
+        print "\nLikely encodings:"
+        if sniff.encodings:
+            for encoding in sniff.encodings:
+                print "\t%s" % encoding
+        else:
+            print "\tNone identified"
+        print "\nConfidence:\t%.2f" % sniff.confidence
+        sys.exit(0)
+
     # Determine the quality score range (and count reads)
     try:
         n_subset = int(options.n_subset)
     except TypeError:
         n_subset = None
-    n_reads = 0
-    min_max_qual = (None,None)
-    for read in FASTQFile.FastqIterator(fastq_file):
-        n_reads += 1
-        if min_max_qual == (None,None):
-            min_max_qual = (ord(read.minquality),ord(read.maxquality))
-        else:
-            min_max_qual = (min(min_max_qual[0],ord(read.minquality)),
-                            max(min_max_qual[1],ord(read.maxquality)))
-        if n_subset is not None and n_reads == n_subset:
-            break
+    fqstats = FASTQStats.collect_fastq_stats(fastq_file,
+                                             max_reads=n_subset,
+                                             per_position=False)
 
     # Number of reads
-    print "\nProcessed %d reads" % n_reads
+    print "\nProcessed %d reads" % fqstats.nreads
     # Print min,max quality values
-    min_qual = min_max_qual[0]
-    max_qual = min_max_qual[1]
+    min_qual = ord(fqstats.min_quality)
+    max_qual = ord(fqstats.max_quality)
     print "Min,max quality scores:\t%d,%d\t(%s,%s)" % \
         (min_qual,max_qual,chr(min_qual),chr(max_qual))
     # Match to possible formats and quality encodings
     print "\nIdentifying possible formats/quality encodings..."
     encodings = []
     galaxy_types = []
-    if min_qual >= ord('!') and max_qual <= ord('I'):
-        print "\tPossible Sanger/Phred+33"
-        encodings.append('Phred+33')
-    if fastq_format != 'colorspace':
-        if min_qual >= ord(';') and max_qual <= ord('h'):
-            print "\tPossible Solexa/Solexa+64"
-            encodings.append('Solexa+64')
-            galaxy_types.append('fastqsolexa')
-        if min_qual >= ord('@') and max_qual <= ord('h'):
-            print "\tPossible Illumina 1.3+/Phred+64"
-            encodings.append('Phred+64')
-            galaxy_types.append('fastqillumina')
-        if min_qual >= ord('C') and max_qual <= ord('h'):
-            print "\tPossible Illumina 1.5+/Phred+64"
-            encodings.append('Phred+64')
-            galaxy_types.append('fastqillumina')
-        if min_qual >= ord('!') and max_qual <= ord('I'):
-            print "\tPossible Illumina 1.8+/Phred+33"
-            encodings.append('Phred+33')
-            galaxy_types.append('fastqsanger')
-    else:
+    colorspace = (fastq_format == 'colorspace')
+    for description,encoding,galaxy_type in \
+        fqstats.quality_encodings(colorspace=colorspace):
+        print "\tPossible %s" % description
+        encodings.append(encoding)
+        if galaxy_type is not None:
+            galaxy_types.append(galaxy_type)
+    if colorspace and not galaxy_types:
         galaxy_types.append('fastqcssanger')
     print "\nLikely encodings:"
     if encodings:
@@ -3,6 +3,8 @@
 # Remove "singleton" reads from fastq file
 import sys
 import os
+import itertools
+import tempfile
 import logging
 
 # Put .. onto Python search path for modules
@@ -12,6 +14,14 @@ SHARE_DIR = os.path.abspath(
 sys.path.append(SHARE_DIR)
 import bcftbx.FASTQFile as FASTQFile
 
+def write_headers(fastq,headers_file):
+    # Write the header line of each read in a fastq file
+    fp_headers = open(headers_file,'w')
+    with open(fastq,'r') as fp:
+        for header in itertools.islice(fp,0,None,4):
+            fp_headers.write(header)
+    fp_headers.close()
+
 # Main program
 if __name__ == "__main__":
     # Collect input fastq file name
@@ -23,41 +33,19 @@ if __name__ == "__main__":
     fastq_out = fastq+".paired"
     singles_header = fastq+".single.header"
     pairs_header = fastq+".pair.header"
-    # Loop over file and collect read names
-    headers = set()
-    pairs = set()
-    n = 1
-    for read in FASTQFile.FastqIterator(fastq):
-        seqid = str(read.seqid)
-        if seqid in headers:
-            # Part of a pair
-            pairs.add(seqid)
-        else:
-            headers.add(seqid)
-        n += 1
-        if not (n % 1000000): print "%s" % n
-    # Loop again outputing only paired reads
-    fp = open(fastq_out,'w')
-    fp_singles = open(singles_header,'w')
-    fp_pairs = open(pairs_header,'w')
-    n = 1
-    for read in FASTQFile.FastqIterator(fastq):
-        seqid = str(read.seqid)
-        if seqid in pairs:
-            # Output one read from pair
-            fp.write(str(read)+"\n")
-            fp_pairs.write(seqid+"\n")
-        else:
-            # Singleton read
-            fp_singles.write(seqid+"\n")
-        n += 1
-        if not (n % 1000000): print "%s" % n
-    # Close files
-    fp.close()
-    fp_singles.close()
-    fp_pairs.close()
-    
-                
-    
-    
-    
+    # Match up the reads (partitioning them on disk rather
+    # than holding all the read names in memory), writing
+    # the pairs to the output file and the singletons to a
+    # temporary file
+    fd,singles = tempfile.mkstemp(suffix='.single.fastq',dir=os.getcwd())
+    os.close(fd)
+    try:
+        result = FASTQFile.repair_fastq_pairs([fastq],fastq_out,
+                                              singles=singles,
+                                              tmpdir=os.getcwd())
+        print "%d pairs, %d singletons" % (result.npairs,result.nsingles)
+        # Output the headers
+        write_headers(fastq_out,pairs_header)
+        write_headers(singles,singles_header)
+    finally:
+        os.remove(singles)
@@ -16,6 +16,7 @@ from bcftbx.IlluminaData import IlluminaDataError
 from bcftbx.utils import parse_lanes
 from bcftbx.ngsutils import getreads
 from bcftbx.ngsutils import getreads_regex
+from bcftbx.FASTQFile import FastqIterator
 
 #######################################################################
 # Unit tests
@@ -140,6 +141,117 @@ AAF#FJJJJJJJJJJJ
         self.assertEqual(len(reads_l8),2)
         self.assertEqual('\n'.join(reads_l8),self.fastq_data_l8.strip())
 
+class TestSplitFastqByLanes(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.pwd = os.getcwd()
+        os.chdir(self.wd)
+        self.fastq_data_l2 = """@K00311:43:HL3LWBBXX:2:1101:21440:1121 1:N:0:CNATGT
+GCCNGACAGCAGAAAT
++
+AAF#FJJJJJJJJJJJ
+@K00311:43:HL3LWBBXX:2:1101:21460:1121 1:N:0:CNATGT
+GGGNGTCATTGATCAT
++
+AAF#FJJJJJJJJJJJ
+@K00311:43:HL3LWBBXX:2:1101:21805:1121 1:N:0:CNATGT
+CCCNACCCTTGCCTAC
++
+AAF#FJJJJJJJJJJJ
+"""
+        self.fastq_data_l8 = """@K00311:43:HL3LWBBXX:8:1101:21440:1121 1:N:0:CNATGT
+GCCNGACAGCAGAAAT
++
+AAF#FJJJJJJJJJJJ
+@K00311:43:HL3LWBBXX:8:1101:21460:1121 1:N:0:CNATGT
+GGGNGTCATTGATCAT
++
+AAF#FJJJJJJJJJJJ
+"""
+    def tearDown(self):
+        os.chdir(self.pwd)
+        if os.path.exists(self.wd):
+            shutil.rmtree(self.wd)
+    def _make_fastq(self,name):
+        # Make test Fastq with interleaved lanes
+        l2 = self.fastq_data_l2.split('\n')
+        l8 = self.fastq_data_l8.split('\n')
+        data = '\n'.join(l2[0:4]+l8[0:4]+l2[4:8]+l8[4:8]+l2[8:12])+'\n'
+        fastq_in = os.path.join(self.wd,name)
+        if name.endswith('.gz'):
+            fp = gzip.open(fastq_in,'w')
+        else:
+            fp = open(fastq_in,'w')
+        fp.write(data)
+        fp.close()
+        return fastq_in
+    def test_split_fastq_by_lanes(self):
+        fastq_in = self._make_fastq("Test_S1_R1_001.fastq")
+        nreads = split_fastq_by_lanes(fastq_in)
+        self.assertEqual(nreads,{ 2: 3, 8: 2 })
+        self.assertEqual(open("Test_S1_L002_R1_001.fastq").read(),
+                         self.fastq_data_l2)
+        self.assertEqual(open("Test_S1_L008_R1_001.fastq").read(),
+                         self.fastq_data_l8)
+    def test_split_fastq_by_lanes_subset_of_lanes(self):
+        fastq_in = self._make_fastq("Test_S1_R1_001.fastq")
+        nreads = split_fastq_by_lanes(fastq_in,lanes=[8])
+        self.assertEqual(nreads,{ 8: 2 })
+        self.assertFalse(os.path.exists("Test_S1_L002_R1_001.fastq"))
+        self.assertEqual(open("Test_S1_L008_R1_001.fastq").read(),
+                         self.fastq_data_l8)
+    def test_split_fastq_by_lanes_missing_lane(self):
+        fastq_in = self._make_fastq("Test_S1_R1_001.fastq")
+        self.assertRaises(Exception,
+                          split_fastq_by_lanes,
+                          fastq_in,lanes=[2,3])
+        self.assertEqual(sorted(os.listdir(self.wd)),
+                         ["Test_S1_R1_001.fastq"])
+    def test_split_fastq_by_lanes_bad_header(self):
+        fastq_in = os.path.join(self.wd,"Test_S1_R1_001.fastq")
+        with open(fastq_in,'w') as fp:
+            fp.write(self.fastq_data_l2)
+            fp.write(self.fastq_data_l8.replace(":8:1101:21460",
+                                                ":X:1101:21460"))
+        self.assertRaises(Exception,
+                          split_fastq_by_lanes,
+                          fastq_in,buffer_reads=1)
+        self.assertEqual(sorted(os.listdir(self.wd)),
+                         ["Test_S1_R1_001.fastq"])
+    def test_split_fastq_by_lanes_zero_padded_lane(self):
+        fastq_in = os.path.join(self.wd,"Test_S1_R1_001.fastq")
+        with open(fastq_in,'w') as fp:
+            fp.write(self.fastq_data_l2.replace(":2:1101:21460",
+                                                ":02:1101:21460"))
+        nreads = split_fastq_by_lanes(fastq_in,buffer_reads=1)
+        self.assertEqual(nreads,{ 2: 3 })
+        self.assertEqual(open("Test_S1_L002_R1_001.fastq").read(),
+                         self.fastq_data_l2.replace(":2:1101:21460",
+                                                    ":02:1101:21460"))
+    def test_split_fastq_by_lanes_gzipped_input_and_output(self):
+        fastq_in = self._make_fastq("Test_S1_R1_001.fastq.gz")
+        nreads = split_fastq_by_lanes(fastq_in,gzip_output=True)
+        self.assertEqual(nreads,{ 2: 3, 8: 2 })
+        self.assertEqual(gzip.open("Test_S1_L002_R1_001.fastq.gz").read(),
+                         self.fastq_data_l2)
+        self.assertEqual(gzip.open("Test_S1_L008_R1_001.fastq.gz").read(),
+                         self.fastq_data_l8)
+    def test_split_fastq_by_lanes_small_write_buffer(self):
+        fastq_in = self._make_fastq("Test_S1_R1_001.fastq")
+        nreads = split_fastq_by_lanes(fastq_in,buffer_reads=1)
+        self.assertEqual(nreads,{ 2: 3, 8: 2 })
+        self.assertEqual(open("Test_S1_L002_R1_001.fastq").read(),
+                         self.fastq_data_l2)
+        self.assertEqual(open("Test_S1_L008_R1_001.fastq").read(),
+                         self.fastq_data_l8)
+
+#######################################################################
+# Constants
+#######################################################################
+
+# Number of reads to buffer for each lane before writing
+WRITE_BUFFER_READS = 10000
+
 #######################################################################
 # Functions
 #######################################################################
@@ -194,6 +306,128 @@ def extract_reads_for_lane(fastq,lane):
     for read in getreads_regex(fastq,regex_pattern):
         yield '\n'.join(read)
 
+def split_fastq_by_lanes(fastq,lanes=None,gzip_output=False,
+                         buffer_reads=WRITE_BUFFER_READS):
+    """
+    Split Fastq into one Fastq per lane in a single pass
+
+    Reads through the Fastq once, and sends each read
+    to the output Fastq for its lane. The lane is taken
+    directly from the fourth colon-delimited field of the
+    read header. Reads for each lane are buffered and
+    written in blocks of 'buffer_reads' records.
+
+    Output file names are generated by the
+    'output_fastq_name' function; each output is written
+    to a temporary '.part' file which is renamed once all
+    reads have been processed. If any of the requested
+    lanes aren't present in the Fastq, or an error occurs
+    while reading it, then the temporary files are removed
+    and an exception is raised, so no outputs are produced.
+
+    Arguments:
+      fastq (str): path to Fastq (can be gzipped)
+      lanes (list): optional, list of integer lane
+        numbers to extract (default is to extract all
+        lanes present in the Fastq)
+      gzip_output (bool): if True then write gzipped
+        output Fastqs (default is to write uncompressed
+        output)
+      buffer_reads (int): optional, number of reads to
+        buffer for each lane before writing
+
+    Returns:
+      Dictionary: mapping of lane numbers to the number
+        of reads written for each lane.
+    """
+    if lanes is not None:
+        lanes = [int(l) for l in lanes]
+    # Lookup of lane numbers keyed on the lane field from
+    # the header (None for lanes which are being skipped)
+    fields = {}
+    # Lookups keyed on the integer lane number
+    buffers = {}
+    writers = {}
+    outfiles = {}
+    nreads = {}
+    def add_lane(field,header):
+        try:
+            lane = int(field)
+        except ValueError:
+            raise Exception("Failed to find lane in read %s: "
+                            "not a valid Fastq file?" % header)
+        if lanes is not None and lane not in lanes:
+            return None
+        if lane in writers:
+            # Same lane written differently (e.g. '2' and '02')
+            return lane
+        outfile = output_fastq_name(fastq,lane)
+        if gzip_output:
+            outfile += ".gz"
+            writer = gzip.open("%s.part" % outfile,'wb',
+                               compresslevel=6)
+        else:
+            writer = open("%s.part" % outfile,'wb')
+        outfiles[lane] = outfile
+        writers[lane] = writer
+        buffers[lane] = []
+        nreads[lane] = 0
+        return lane
+    def flush(lane):
+        writers[lane].write('\n'.join(buffers[lane]))
+        writers[lane].write('\n')
+        del(buffers[lane][:])
+    # Split the reads (removing the temporary files if
+    # anything goes wrong)
+    completed = False
+    try:
+        for read in FastqIterator(fastq,lazy=True):
+            header = read.raw_seqid
+            try:
+                field = header.split(':',4)[3]
+            except IndexError:
+                raise Exception("Failed to find lane in read %s: "
+                                "not a valid Fastq file?" % header)
+            try:
+                lane = fields[field]
+            except KeyError:
+                lane = fields[field] = add_lane(field,header)
+            if lane is None:
+                continue
+            buf = buffers[lane]
+            buf.append(read.raw_record)
+            nreads[lane] += 1
+            if len(buf) >= buffer_reads:
+                flush(lane)
+        # Write remaining data
+        for lane in writers:
+            if buffers[lane]:
+                flush(lane)
+            writers[lane].close()
+        # Check that all the requested lanes were found
+        if lanes is not None:
+            missing_lanes = [l for l in lanes if l not in writers]
+            if missing_lanes:
+                raise Exception("Requested lane(s) %s not found in %s" %
+                                (','.join([str(x) for x in missing_lanes]),
+                                 fastq))
+        completed = True
+    finally:
+        if not completed:
+            for lane in writers:
+                try:
+                    writers[lane].close()
+                except IOError:
+                    pass
+                try:
+                    os.remove("%s.part" % outfiles[lane])
+                except OSError:
+                    pass
+    # Finalise the outputs
+    for lane in writers:
+        os.rename("%s.part" % outfiles[lane],outfiles[lane])
+    return nreads
+
 def output_fastq_name(fastq,lane):
     """
     Generate an output Fastq name
@@ -231,35 +465,29 @@ if __name__ == "__main__":
                    "a comma-separated list (e.g. 1,3), a range (e.g. "
                    "5-7) or a combination (e.g. 1,3,5-7). Default is "
                    "to extract all lanes in the Fastq")
+    p.add_argument("-z","--gzip",action='store_true',
+                   help="write gzip-compressed output Fastqs")
     p.add_argument("fastq",metavar="FASTQ",
                    help="Fastq to split")
     args = p.parse_args()
-    # Extract lanes from Fastq
-    print "Determining lanes present in %s" % args.fastq
-    nreads,fastq_lanes = get_fastq_lanes(args.fastq)
-    print "-- %d reads" % nreads
-    print "-- Lanes: %s" % ','.join([str(x) for x in fastq_lanes])
     # Lanes
     if args.lanes:
         lanes = parse_lanes(args.lanes)
-        for lane in lanes:
-            if lane not in fastq_lanes:
-                raise Exception("Requested lane %s not found "
-                                "in %s" % (lane,args.fastq))
+        print "Extracting lanes: %s" % ','.join([str(x) for x in lanes])
     else:
-        lanes = fastq_lanes
-    print "Extracting lanes: %s" % ','.join([str(x) for x in lanes])
+        lanes = None
+        print "Extracting all lanes"
     # Split the fastq
-    for lane in lanes:
-        print "-- Lane %s" % lane
-        nreads = 0
+    print "Splitting %s" % args.fastq
+    nreads = split_fastq_by_lanes(args.fastq,lanes=lanes,
+                                  gzip_output=args.gzip)
+    # Report the counts
+    for lane in sorted(nreads.keys()):
         outfile = output_fastq_name(args.fastq,lane)
-        tmp_outfile = "%s.part" % outfile
+        if args.gzip:
+            outfile += ".gz"
+        print "-- Lane %s" % lane
         print "   %s" % outfile
-        with open(tmp_outfile,'w') as fq:
-            for i,read in enumerate(extract_reads_for_lane(args.fastq,lane)):
-                nreads += 1
-                fq.write("%s\n" % read)
-        os.rename(tmp_outfile,outfile)
-        print "   %d reads" % nreads
+        print "   %d reads" % nreads[lane]
+    print "-- %d reads in total" % sum(nreads.values())
     print "Done"
@@ -4,7 +4,7 @@
 #     Copyright (C) University of Manchester 2017-2018 Peter Briggs
 #
 
-__version__ = "0.0.4"
+__version__ = "0.0.5"
 
 #######################################################################
 # Imports
@@ -14,13 +14,13 @@ import sys
 import os
 import argparse
 import tempfile
-import random
+import itertools
 import subprocess
 import shutil
 import logging
 from bcftbx.utils import find_program
 from bcftbx.ngsutils import getreads
-from bcftbx.ngsutils import getreads_subset
+from bcftbx.ngsutils import getreads_random_sample
 from bcftbx.qc.report import strip_ngs_extensions
 
 #######################################################################
@@ -429,6 +429,12 @@ def fastq_strand(argv,working_dir=None):
                    help="use a random subset of read pairs "
                    "from the input Fastqs; set to zero to "
                    "use all reads (default: 10000)")
+    p.add_argument("--seed",
+                   default=None,
+                   help="specify seed for random number generator "
+                   "used when selecting the subset of read pairs "
+                   "(using the same seed should produce the same "
+                   "subset)")
     p.add_argument("-o","--outdir",
                    default=None,
                    help="specify directory to write final "
@@ -513,34 +519,35 @@ def fastq_strand(argv,working_dir=None):
             raise Exception("Bad working directory: %s" % working_dir)
     print "Working directory: %s" % working_dir
     # Make subset of input read pairs
-    nreads = sum(1 for i in getreads(os.path.abspath(args.r1)))
-    print "%d reads" % nreads
+    fqs_in = filter(lambda fq: fq is not None,(args.r1,args.r2))
+    fqs_in = [os.path.abspath(fq) for fq in fqs_in]
     if args.subset == 0:
         print "Using all read pairs in Fastq files"
-        subset = nreads
-    elif args.subset > nreads:
-        print "Actual number of read pairs smaller than requested subset"
-        subset = nreads
+        reads = itertools.izip(*[getreads(fq) for fq in fqs_in])
     else:
-        subset = args.subset
-        print "Using random subset of %d read pairs" % subset
-    if subset == nreads:
-        subset_indices = [i for i in xrange(nreads)]
-    else:
-        subset_indices = random.sample(xrange(nreads),subset)
-    fqs_in = filter(lambda fq: fq is not None,(args.r1,args.r2))
+        print "Using random subset of %d read pairs" % args.subset
+        reads = getreads_random_sample(fqs_in,args.subset,
+                                       seed=args.seed)
     fastqs = []
+    fps = []
     for fq in fqs_in:
         fq_subset = os.path.join(working_dir,
                                  os.path.basename(fq))
         if fq_subset.endswith(".gz"):
             fq_subset = '.'.join(fq_subset.split('.')[:-1])
         fq_subset = "%s.subset.fq" % '.'.join(fq_subset.split('.')[:-1])
-        with open(fq_subset,'w') as fp:
-            for read in getreads_subset(os.path.abspath(fq),
-                                        subset_indices):
-                fp.write('\n'.join(read) + '\n')
         fastqs.append(fq_subset)
+        fps.append(open(fq_subset,'w'))
+    subset = 0
+    for read_pair in reads:
+        subset += 1
+        for fp,read in zip(fps,read_pair):
+            fp.write('\n'.join(read) + '\n')
+    for fp in fps:
+        fp.close()
+    print "%d reads in subset" % subset
+    if args.subset > subset:
+        print "Actual number of read pairs smaller than requested subset"
     # Make directory to keep output from STAR
     if args.keep_star_output:
         star_output_dir = os.path.join(outdir,
@@ -156,6 +156,18 @@ if __name__ == "__main__":
                      "complete")
     group.add_option('--log-dir',action='store',dest='log_dir',default=None,
                      help="put log files into LOG_DIR (defaults to cwd)")
+    group.add_option('--profile',action='store',dest='profile_file',default=None,
+                     help="write a profile of the resources used by each job, with a "
+                     "summary for each group, to PROFILE_FILE on completion (JSON if "
+                     "the name ends with '.json', otherwise tab-delimited)")
+    group.add_option('--journal',action='store',dest='journal_file',default=None,
+                     help="record the progress of the pipeline in JOURNAL_FILE, so that "
+                     "it can be resumed if interrupted (see --resume)")
+    group.add_option('--resume',action='store_true',dest='resume',default=False,
+                     help="resume an interrupted run using the journal file specified "
+                     "by --journal: jobs which already completed successfully are not "
+                     "rerun, and Grid Engine jobs which are still running are monitored "
+                     "rather than being resubmitted")
     p.add_option_group(group)
 
     # Advanced options
@@ -164,8 +176,9 @@ if __name__ == "__main__":
                      help="regular expression to match input files against")
     group.add_option('--runner',action='store',dest='runner',default=runner_type,
                      help="specify how jobs are executed: ge = Grid Engine, drmma = Grid "
-                     "Engine via DRMAA interface, simple = use local system. Default is "
-                     "'%s'" % runner_type)
+                     "Engine via DRMAA interface, simple = use local system, local = "
+                     "use local system with CPU and memory limits (e.g. "
+                     "'local(cpus=64,mem=256G)'). Default is '%s'" % runner_type)
     p.add_option_group(group)
 
     # Grid engine specific options
@@ -189,6 +202,8 @@ if __name__ == "__main__":
     options,arguments = p.parse_args()
 
     # Check arguments
+    if options.resume and not options.journal_file:
+        p.error("--resume requires a journal file (use --journal)")
     if len(arguments) < 2:
         p.error("Takes at least two arguments: script and one or more directories")
     else:
@@ -253,6 +268,8 @@ if __name__ == "__main__":
                                        ge_extra_args=ge_extra_args)
     elif options.runner == 'drmaa':
         runner = JobRunner.DRMAAJobRunner(queue=options.ge_queue)
+    elif options.runner.startswith('local'):
+        runner = JobRunner.fetch_runner(options.runner)
     else:
         logging.error("Unknown job runner: '%s'" % options.runner)
         sys.exit(1)
@@ -262,7 +279,9 @@ if __name__ == "__main__":
     pipeline = Pipeline.PipelineRunner(runner,max_concurrent_jobs=options.max_concurrent_jobs,
                                        jobCompletionHandler=JobCleanup,
                                        groupCompletionHandler=lambda group,jobs,
-                                       email=options.email_addr: SendReport(email,group,jobs))
+                                       email=options.email_addr: SendReport(email,group,jobs),
+                                       background_handlers=True,
+                                       journal=options.journal_file)
     for data_dir in data_dirs:
         # Get for this directory
         print "Collecting data from %s" % data_dir
@@ -293,7 +312,10 @@ if __name__ == "__main__":
                 args.append(arg)
             pipeline.queueJob(data_dir,script,args,label=label,group=group)
     # Run the pipeline
-    pipeline.run()
+    pipeline.run(resume=options.resume)
+    if options.profile_file:
+        print "Writing profile to %s" % options.profile_file
+        pipeline.write_profile(options.profile_file)
 
     # Finished
     if email_addr is not None:
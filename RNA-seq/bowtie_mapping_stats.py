@@ -65,17 +65,18 @@ In both cases any extraneous lines are ignored.
 The program extracts data from the "reads processed"/"reads; of these",
 "reads with at least one reported alignment"/"aligned exactly 1 time"",
 and "reads that failed to align"/"aligned 0 times" lines for each block,
-and then writes these to an output XLS file.
+and then writes these to an output XLS (or XLSX) file.
 
 The program depends upon the simple_xls module, and the 3rd party
-Python modules xlwt, xlrd and xlutils.
+Python modules xlwt, xlrd and xlutils (plus xlsxwriter for XLSX
+output).
 """
 
 #######################################################################
 # Module metadata
 #######################################################################
 
-__version__ = "1.1.5"
+__version__ = "1.2.0"
 
 #######################################################################
 # Import
@@ -98,7 +99,7 @@ sys.path.append(SHARE_DIR)
 
 # Get local modules and functions
 try:
-    from bcftbx.simple_xls import XLSWorkBook,XLSStyle
+    from bcftbx.simple_xls import XLSWorkBook,XLSXStreamWorkBook,XLSStyle
     from bcftbx.simple_xls import cell,column_integer_to_index,NumberFormats
 except ImportError,ex:
     logging.error("Failed to import local modules: %s" % ex)
@@ -131,6 +132,10 @@ class BowtieMappingStats:
 
     >>> stats.xls('stats.xls')
 
+    or an XLSX file:
+
+    >>> stats.xlsx('stats.xlsx')
+
     or to get the information as a tab-delimited file:
 
     >>> stats.tab_file('stats.tsv')
@@ -274,10 +279,7 @@ class BowtieMappingStats:
         mapping.set_style(XLSStyle(bold=True),'A1','A11')
         # Build spreadsheet
         for sample in self.samples:
-            sample_name = sample.name
-            # Add input file names to sample ids if there were multiple input files
-            if len(self.files) > 1 and sample.filen is not None:
-                sample_name += " (" + sample.filen + ")"
+            sample_name = self.__sample_name(sample)
             # Insert data into the spreadsheet
             col = mapping.append_column(data=[sample_name,
                                               '',
@@ -304,6 +306,69 @@ class BowtieMappingStats:
             wb.save_as_xls(xls_out)
         return wb
 
+    def xlsx(self,xlsx_out):
+        """Output an XLSX spreadsheet with the sample data
+
+        Writes the same layout as the 'xls' method, but streams
+        the rows directly to the XLSX file without creating an
+        XLSWorkBook first.
+
+        Arguments:
+          xlsx_out: specify the name of the XLSX file to write
+            the spreadsheet to. Will overwrite an existing file
+            with the same name.
+
+        """
+        # Set up reusable spreadsheet styles
+        reads_style = XLSStyle(bgcolor='ivory',border='medium',
+                               number_format=NumberFormats.THOUSAND_SEPARATOR,
+                               centre=True)
+        pcent_style = XLSStyle(bgcolor='ivory',border='medium',
+                               number_format=NumberFormats.PERCENTAGE,
+                               centre=True)
+        headr_style = XLSStyle(color='red',bgcolor='ivory',border='medium')
+        table_style = XLSStyle(bgcolor='ivory',border='medium',centre=True)
+        label_style = XLSStyle(bold=True)
+        # Rows are statistics and columns are samples
+        rows = (("Sample",headr_style,
+                 [self.__sample_name(s) for s in self.samples]),
+                ('',table_style,['']*self.n_samples),
+                ("total reads",reads_style,
+                 [s.total_reads for s in self.samples]),
+                ("didn't align",reads_style,
+                 [s.didnt_align for s in self.samples]),
+                ("total mapped reads",reads_style,
+                 ["=#5-#6"]*self.n_samples),
+                ("  % of all reads",pcent_style,
+                 ["=#7/#5"]*self.n_samples),
+                ("uniquely mapped",reads_style,
+                 [s.uniquely_mapped for s in self.samples]),
+                ("  % of all reads",pcent_style,
+                 ["=#9/#5"]*self.n_samples),
+                ("  % of mapped reads",pcent_style,
+                 ["=#9/#7"]*self.n_samples))
+        # Write spreadsheet
+        print "Writing statistics to XLSX file %s" % xlsx_out
+        wb = XLSXStreamWorkBook(xlsx_out)
+        mapping = wb.add_work_sheet("mapping")
+        mapping.append_row(data=["MAPPING STATS",'',"Mapped with Bowtie"],
+                           style=[label_style,None,XLSStyle(centre=True)])
+        mapping.append_row(data=[''],style=label_style)
+        for label,style,data in rows:
+            mapping.append_row(data=[label]+data,
+                               style=[label_style]+[style]*len(data))
+        wb.close()
+
+    def __sample_name(self,sample):
+        """Internal: return the name to output for a sample
+
+        """
+        sample_name = sample.name
+        # Add input file names to sample ids if there were multiple input files
+        if len(self.files) > 1 and sample.filen is not None:
+            sample_name += " (" + sample.filen + ")"
+        return sample_name
+
     def tab_file(self,tab_file=None):
         """Output a tab-delimited version of the spreadsheet data
  
@@ -685,7 +750,8 @@ if __name__ == "__main__":
 
     p.add_option('-o',action="store",dest="stats_xls",metavar="xls_file",default=None,
                  help="specify name of the output XLS file (otherwise defaults to "
-                 "'mapping_summary.xls').")
+                 "'mapping_summary.xls'). If the name ends with '.xlsx' then an "
+                 "XLSX file will be written instead.")
     p.add_option('-t',action="store_true",dest="tab_file",metavar="tab_file",default=False,
                  help="write data to tab-delimited file in addition to the XLS file. The tab "
                  "file will have the same name as the XLS file, with the extension replaced "
@@ -734,7 +800,10 @@ if __name__ == "__main__":
     # Output files
     if stats.n_samples > 0:
         # Create spreadsheet
-        stats.xls(xls_out)
+        if xls_out.endswith('.xlsx'):
+            stats.xlsx(xls_out)
+        else:
+            stats.xls(xls_out)
         # Create tab-delimited file if requested
         if tab_file:
             stats.tab_file(tab_file)
@@ -13,6 +13,7 @@ the data within them:
 
 * FastqIterator: enables looping through all read records in FASTQ file
 * FastqRead: provides access to a single FASTQ read record
+* LazyFastqRead: lightweight read record which only builds strings on demand
 * SequenceIdentifier: provides access to sequence identifier info in a read
 * FastqAttributes: provides access to gross attributes of FASTQ file
 
@@ -20,7 +21,14 @@ Additionally there are a few utility functions:
 
 * get_fastq_file_handle: return a file handled opened for reading a FASTQ file
 * nreads: return the number of reads in a FASTQ file
+* get_fastq_stats: return (cached) statistics for a FASTQ file
+* compute_fastq_stats: calculate statistics for a FASTQ file
 * fastqs_are_pair: check whether two FASTQs form an R1/R2 pair
+* verify_fastq_pair: locate the first unpaired read in two FASTQs
+* repair_fastq_pairs: match up reads from out-of-sync or interleaved FASTQs
+* split_interleaved_fastq: de-interleave a FASTQ into R1 and R2 FASTQs
+* quality_encodings: identify possible quality encodings from a range
+* sniff_quality_encoding: quickly determine the quality encoding of a file
 
 Information on the FASTQ file format: http://en.wikipedia.org/wiki/FASTQ_format
 
@@ -30,6 +38,20 @@ __version__ = "1.0.0"
 
 CHUNKSIZE = 102400
 
+# Extension for FASTQ statistics cache files
+STATS_CACHE_EXT = '.fqstats'
+STATS_CACHE_VERSION = 1
+
+# Quality encodings, as tuples of (description,encoding,Galaxy
+# datatype,lowest quality character,highest quality character)
+QUALITY_ENCODINGS = (
+    ('Sanger/Phred+33','Phred+33',None,'!','I'),
+    ('Solexa/Solexa+64','Solexa+64','fastqsolexa',';','h'),
+    ('Illumina 1.3+/Phred+64','Phred+64','fastqillumina','@','h'),
+    ('Illumina 1.5+/Phred+64','Phred+64','fastqillumina','C','h'),
+    ('Illumina 1.8+/Phred+33','Phred+33','fastqsanger','!','I'),
+)
+
 #######################################################################
 # Import modules that this module depends on
 #######################################################################
@@ -37,8 +59,15 @@ from collections import Iterator
 import os
 import re
 import logging
-import gzip
 import itertools
+import json
+import tempfile
+import shutil
+import zlib
+from multiprocessing.pool import ThreadPool
+from .utils import open_gzipped_file
+from .utils import is_gzipped_file
+from .utils import AttributeDictionary
 
 #######################################################################
 # Precompiled regular expressions
@@ -75,9 +104,19 @@ class FastqIterator(Iterator):
     >>>    print read
     >>> fp.close()
 
+    For large files where most of the read data isn't examined,
+    setting 'lazy=True' returns LazyFastqRead objects instead;
+    these store offsets into the chunk of data read from the
+    file and only construct the sequence, quality etc strings
+    when they are accessed:
+
+    >>> for read in FastqIterator(fastq_file,lazy=True):
+    >>>    print read.seqlen
+
     """
 
-    def __init__(self,fastq_file=None,fp=None,bufsize=CHUNKSIZE):
+    def __init__(self,fastq_file=None,fp=None,bufsize=CHUNKSIZE,
+                 lazy=False):
         """Create a new FastqIterator
 
         The input FASTQ can be either a text file or a compressed (gzipped)
@@ -89,10 +128,14 @@ class FastqIterator(Iterator):
            fp: file-like object opened for reading
            bufsize: optional; integer specifying number of bytes to
              read as a single 'chunk' from disk
+           lazy: optional; if True then return LazyFastqRead
+             objects rather than FastqRead objects (default:
+             False)
 
         """
         self.__fastq_file = fastq_file
         self.__bufsize = bufsize
+        self.__lazy = lazy
         if fp is None:
             self.__fp = get_fastq_file_handle(self.__fastq_file)
         else:
@@ -100,10 +143,21 @@ class FastqIterator(Iterator):
         self._buf = ''
         self._lines = []
         self._ip = 0
+        if self.__lazy:
+            self._lazy_iter = self._lazy_reads()
+
+    def __iter__(self):
+        if self.__lazy:
+            # Hand back the generator directly to avoid the
+            # overhead of calling 'next' for each record
+            return self._lazy_iter
+        return self
 
     def next(self):
         """Return next record from FASTQ file as a FastqRead object
         """
+        if self.__lazy:
+            return self._lazy_iter.next()
         # Convenience variables
         lines = self._lines
         buf = self._buf
@@ -144,6 +198,54 @@ class FastqIterator(Iterator):
         self._ip = ip
         return FastqRead(*read)
 
+    def _lazy_reads(self):
+        """Generator yielding LazyFastqRead objects from the FASTQ file
+
+        Locates the four newlines delimiting the next record
+        within the current chunk buffer and yields a record
+        referencing those offsets; the buffer is only extended
+        (by appending the next chunk to the unconsumed tail)
+        when it doesn't contain a complete record.
+        """
+        # Convenience variables
+        fp = self.__fp
+        bufsize = self.__bufsize
+        buf = ''
+        start = 0
+        while True:
+            # Yield all complete records in the buffer
+            find = buf.find
+            while True:
+                e1 = find('\n',start)
+                if e1 == -1:
+                    break
+                e2 = find('\n',e1+1)
+                if e2 == -1:
+                    break
+                e3 = find('\n',e2+1)
+                if e3 == -1:
+                    break
+                e4 = find('\n',e3+1)
+                if e4 == -1:
+                    break
+                yield LazyFastqRead(buf,start,e1,e2,e3,e4)
+                start = e4 + 1
+            # Fetch more data
+            data = fp.read(bufsize)
+            if not data:
+                # Reached EOF
+                if self.__fastq_file is None:
+                    fp.close()
+                if e1 != -1 and e2 != -1 and e3 != -1 and \
+                   len(buf) > e3 + 1:
+                    # Final record without trailing newline
+                    yield LazyFastqRead(buf,start,e1,e2,e3,len(buf))
+                return
+            # Discard the consumed part of the buffer and
+            # append the new data
+            buf = buf[start:] + data
+            start = 0
+
 class FastqRead:
     """Class to store a FASTQ record with information about a read
 
@@ -262,6 +364,132 @@ class FastqRead:
     def __eq__(self,other):
         return (str(self) == str(other))
 
+class LazyFastqRead(object):
+    """Class providing on-demand access to a FASTQ record in a buffer
+
+    Lightweight alternative to FastqRead which is returned by
+    FastqIterator when the 'lazy' option is used. Rather than
+    copying each line of the record into a new string when it's
+    created, it stores a reference to the buffer holding the
+    raw data along with the offsets of the line ends within
+    it; the strings are only constructed when the corresponding
+    property is accessed (only the parsed sequence identifier
+    is cached).
+
+    Provides the same properties as FastqRead (i.e. 'seqid',
+    'sequence', 'optid', 'quality', 'raw_seqid', 'seqlen',
+    'maxquality', 'minquality' and 'is_colorspace'), plus
+    'raw_record' which returns the unmodified record text.
+
+    Note that each object holds a reference to the whole chunk
+    of data it was read from, so storing large numbers of
+    these objects will use more memory than the equivalent
+    FastqRead objects.
+    """
+    __slots__ = ('_buf','_start','_e1','_e2','_e3','_e4',
+                 '_seqid','_is_colorspace',)
+
+    def __init__(self,buf,start,e1,e2,e3,e4):
+        """Create a new LazyFastqRead object
+
+        Arguments:
+          buf: string holding the raw FASTQ data
+          start: offset of the start of the record in 'buf'
+          e1: offset of the newline terminating the first
+            (sequence identifier) line of the record
+          e2: offset of the end of the second (sequence) line
+          e3: offset of the end of the third (optional id) line
+          e4: offset of the end of the fourth (quality) line
+        """
+        self._buf = buf
+        self._start = start
+        self._e1 = e1
+        self._e2 = e2
+        self._e3 = e3
+        self._e4 = e4
+
+    @property
+    def raw_seqid(self):
+        return self._buf[self._start:self._e1]
+
+    @property
+    def seqid(self):
+        try:
+            return self._seqid
+        except AttributeError:
+            self._seqid = SequenceIdentifier(self.raw_seqid)
+            return self._seqid
+
+    @property
+    def raw_record(self):
+        """Return the whole record exactly as it appears in the file
+
+        The record is returned as a single string (without
+        the trailing newline).
+        """
+        return self._buf[self._start:self._e4]
+
+    @property
+    def sequence(self):
+        return self._buf[self._e1+1:self._e2].rstrip()
+
+    @property
+    def optid(self):
+        return self._buf[self._e2+1:self._e3].rstrip()
+
+    @property
+    def quality(self):
+        return self._buf[self._e3+1:self._e4].rstrip()
+
+    @property
+    def seqlen(self):
+        if self._buf[self._e2-1:self._e2] not in ('\r',' ','\t'):
+            # Avoid building the sequence string where possible
+            seqlen = self._e2 - self._e1 - 1
+        else:
+            seqlen = len(self.sequence)
+        if self.is_colorspace:
+            seqlen -= 1
+        return seqlen
+
+    @property
+    def maxquality(self):
+        if self.quality:
+            return max(self.quality)
+        return ''
+
+    @property
+    def minquality(self):
+        if self.quality:
+            return min(self.quality)
+        return ''
+
+    @property
+    def is_colorspace(self):
+        try:
+            return self._is_colorspace
+        except AttributeError:
+            self._is_colorspace = False
+            if self._buf[self._e1+1:self._e1+2] == 'T' and \
+               self.seqid.format is None:
+                # Sequence starts with 'T' and only contains
+                # characters 0-3 or '.'
+                self._is_colorspace = \
+                    not self.sequence[1:].strip('.0123')
+        return self._is_colorspace
+
+    def __repr__(self):
+        return '\n'.join((str(self.seqid),
+                          self.sequence,
+                          self.optid,
+                          self.quality))
+
+    def __eq__(self,other):
+        return (str(self) == str(other))
+
+    def __ne__(self,other):
+        return not self.__eq__(other)
+
 class SequenceIdentifier:
     """Class to store/manipulate sequence identifier information from a FASTQ record
 
@@ -394,7 +622,11 @@ class FastqAttributes:
 
     nreads: number of reads in the FASTQ file
     fsize:  size of the file (in bytes)
-    
+    stats:  statistics for the FASTQ file (see 'get_fastq_stats')
+
+    If the FASTQ was specified as a file name then the read
+    count and statistics are taken from the statistics cache
+    file (if it's up to date).
 
     """
     def __init__(self,fastq_file=None,fp=None):
@@ -411,6 +643,7 @@ class FastqAttributes:
         else:
             self.__fp = fp
         self.__nreads = None
+        self.__stats = None
 
     @property
     def nreads(self):
@@ -418,9 +651,24 @@ class FastqAttributes:
 
         """
         if self.__nreads is None:
-            self.__nreads = nreads(fastq=self.__fastq_file,fp=self.__fp)
+            if self.__fastq_file is not None:
+                self.__nreads = self.stats.nreads
+            else:
+                self.__nreads = nreads(fp=self.__fp)
         return self.__nreads
 
+    @property
+    def stats(self):
+        """Return statistics for the FASTQ file
+
+        """
+        if self.__stats is None:
+            if self.__fastq_file is not None:
+                self.__stats = get_fastq_stats(self.__fastq_file)
+            else:
+                self.__stats = compute_fastq_stats(fp=self.__fp)
+        return self.__stats
+
     @property
     def fsize(self):
         """Return size of the FASTQ file (bytes)
@@ -432,26 +680,33 @@ class FastqAttributes:
 # Functions
 #######################################################################
 
-def get_fastq_file_handle(fastq):
+def get_fastq_file_handle(fastq,gzip_backend=None):
     """Return a file handle opened for reading for a FASTQ file
 
     Deals with both compressed (gzipped) and uncompressed FASTQ
     files.
 
+    Gzipped files are opened using 'bcftbx.utils.open_gzipped_file';
+    the decompression backend can be specified explicitly via the
+    'gzip_backend' argument, otherwise the default backend is used
+    (see 'bcftbx.utils.GZIP_BACKEND').
+
     Arguments:
       fastq: name (including path, if required) of FASTQ file.
         The file can be gzipped (must have '.gz' extension)
+      gzip_backend: optional, name of the backend to use for
+        decompressing gzipped files
 
     Returns:
       File handle that can be used for read operations.
 
     """
     if os.path.splitext(fastq)[1] == '.gz':
-        return gzip.open(fastq,'rb')
+        return open_gzipped_file(fastq,backend=gzip_backend)
     else:
         return open(fastq,'rb')
 
-def nreads(fastq=None,fp=None):
+def nreads(fastq=None,fp=None,use_cache=True):
     """Return number of reads in a FASTQ file
 
     Performs a simple-minded read count, by counting the number of lines
@@ -464,17 +719,25 @@ def nreads(fastq=None,fp=None):
     This function can handle gzipped FASTQ files supplied via the 'fastq'
     argument.
 
+    If the FASTQ is supplied via the 'fastq' argument then the count is
+    taken from the statistics cache (see 'get_fastq_stats'), unless
+    'use_cache' is False.
+
     Line counting uses a variant of the "buf count" method outlined here:
     http://stackoverflow.com/a/850962/579925
 
     Arguments:
       fastq: fastq(.gz) file
       fp: open file descriptor for fastq file
+      use_cache: if True (the default) then use the statistics cache
+        for files specified via 'fastq'
 
     Returns:
       Number of reads
 
     """
+    if fastq is not None and fp is None and use_cache:
+        return get_fastq_stats(fastq).nreads
     nlines = 0
     if fp is None:
         fp = get_fastq_file_handle(fastq)
@@ -490,6 +753,393 @@ def nreads(fastq=None,fp=None):
         raise Exception,"Bad read count (not fastq file, or corrupted?)"
     return nlines/4
 
+def compute_fastq_stats(fastq=None,fp=None,bufsize=1024*1024):
+    """Calculate statistics for a FASTQ file
+
+    Makes a single pass through the FASTQ file and calculates
+    the number of reads, total number of bases, the number of
+    reads of each length, and the minimum and maximum quality
+    values (as characters).
+
+    The FASTQ file can be specified either as a file name (using
+    the 'fastq' argument) or as a file-like object opened for
+    reading (using the 'fp' argument).
+
+    Arguments:
+      fastq: fastq(.gz) file
+      fp: open file descriptor for fastq file
+      bufsize: optional, number of bytes to read at a time
+
+    Returns:
+      AttributeDictionary with the keys 'nreads', 'total_bases',
+      'read_lengths' (a dictionary mapping read lengths to the
+      number of reads with that length), 'min_quality' and
+      'max_quality' (None if there are no quality values).
+
+    """
+    if fp is None:
+        fp = get_fastq_file_handle(fastq)
+    nreads = 0
+    total_bases = 0
+    read_lengths = {}
+    min_quality = None
+    max_quality = None
+    partial = ''
+    lines = []
+    while True:
+        data = fp.read(bufsize)
+        if data:
+            # Split complete lines from the data
+            data = partial + data
+            i = data.rfind('\n')
+            if i == -1:
+                partial = data
+                continue
+            partial = data[i+1:]
+            lines.extend(data[:i].split('\n'))
+        elif partial:
+            # Final line with no trailing newline
+            lines.append(partial)
+            partial = ''
+        # Process all complete records
+        n = len(lines) - len(lines)%4
+        if n:
+            nreads += n/4
+            lengths = map(len,lines[1:n:4])
+            total_bases += sum(lengths)
+            for l in lengths:
+                read_lengths[l] = read_lengths.get(l,0) + 1
+            qualities = filter(None,lines[3:n:4])
+            if qualities:
+                qmin = min(map(min,qualities))
+                qmax = max(map(max,qualities))
+                if min_quality is None or qmin < min_quality:
+                    min_quality = qmin
+                if max_quality is None or qmax > max_quality:
+                    max_quality = qmax
+            del(lines[:n])
+        if not data:
+            break
+    if fastq is not None:
+        fp.close()
+    if lines:
+        raise Exception("Bad read count (not fastq file, or corrupted?)")
+    return AttributeDictionary(nreads=nreads,
+                               total_bases=total_bases,
+                               read_lengths=read_lengths,
+                               min_quality=min_quality,
+                               max_quality=max_quality)
+
+def get_fastq_stats(fastq,use_cache=True):
+    """Return statistics for a FASTQ file, using a cache file
+
+    The statistics (see 'compute_fastq_stats') are stored in a
+    JSON-format cache file alongside the FASTQ (with the same
+    name plus a '.fqstats' extension), and are reused on
+    subsequent calls as long as the path, size, modification
+    time and inode of the FASTQ haven't changed since the
+    statistics were computed.
+
+    If the cache file is missing or out of date then the
+    statistics are recalculated and the cache file is updated.
+    Failure to write the cache file (e.g. if the directory
+    isn't writable) is not an error.
+
+    Arguments:
+      fastq: fastq(.gz) file
+      use_cache: if False then don't read or write the cache
+        file (default is to use the cache)
+
+    Returns:
+      AttributeDictionary with the statistics.
+
+    """
+    if not use_cache:
+        return compute_fastq_stats(fastq)
+    cache_file = fastq + STATS_CACHE_EXT
+    key = _fastq_stats_cache_key(fastq)
+    # Look for up-to-date cached statistics
+    try:
+        with open(cache_file,'r') as fp:
+            cache = json.load(fp)
+        if cache['version'] == STATS_CACHE_VERSION and \
+           cache['key'] == key:
+            stats = cache['stats']
+            stats['read_lengths'] = dict(
+                [(int(l),n) for l,n in stats['read_lengths'].items()])
+            for q in ('min_quality','max_quality'):
+                if stats[q] is not None:
+                    stats[q] = str(stats[q])
+            return AttributeDictionary(**stats)
+        logging.debug("%s: out of date" % cache_file)
+    except (IOError,ValueError,KeyError,TypeError) as ex:
+        logging.debug("%s: unable to load cached statistics: %s" %
+                      (cache_file,ex))
+    # Compute and store the statistics
+    stats = compute_fastq_stats(fastq)
+    try:
+        fd,tmp_file = tempfile.mkstemp(dir=os.path.dirname(cache_file),
+                                       prefix=".%s" %
+                                       os.path.basename(cache_file))
+        with os.fdopen(fd,'w') as fp:
+            json.dump(dict(version=STATS_CACHE_VERSION,
+                           key=key,
+                           stats=stats),fp)
+        os.chmod(tmp_file,0644)
+        os.rename(tmp_file,cache_file)
+    except (IOError,OSError) as ex:
+        logging.debug("%s: unable to write cached statistics: %s" %
+                      (cache_file,ex))
+    return stats
+
+def _fastq_stats_cache_key(fastq):
+    # Generate the key identifying the FASTQ file for
+    # the statistics cache
+    st = os.stat(fastq)
+    return dict(path=os.path.abspath(fastq),
+                size=st.st_size,
+                mtime=st.st_mtime,
+                inode=st.st_ino)
+
+def quality_encodings(min_quality,max_quality,colorspace=False):
+    """Identify the quality encodings consistent with a range of values
+
+    Checks the range of quality characters against each of
+    the encodings in QUALITY_ENCODINGS in turn. Only the
+    'Sanger/Phred+33' encoding is considered for colorspace
+    data (with the Galaxy datatype 'fastqcssanger').
+
+    Arguments:
+      min_quality: lowest quality character in the data
+      max_quality: highest quality character in the data
+      colorspace: if True then the data are colorspace
+
+    Returns:
+      List of tuples (description,encoding,galaxy_type) for
+      the possible encodings (the Galaxy datatype can be None).
+
+    """
+    if colorspace:
+        description,encoding,galaxy_type,lowest,highest = \
+            QUALITY_ENCODINGS[0]
+        candidates = ((description,encoding,'fastqcssanger',
+                       lowest,highest),)
+    else:
+        candidates = QUALITY_ENCODINGS
+    encodings = []
+    for description,encoding,galaxy_type,lowest,highest in candidates:
+        if min_quality >= lowest and max_quality <= highest:
+            encodings.append((description,encoding,galaxy_type))
+    return encodings
+
+def sniff_quality_encoding(fastq,nblocks=8,blocksize=CHUNKSIZE,
+                           colorspace=False):
+    """Quickly determine the likely quality encoding of a FASTQ file
+
+    Reads blocks of up to 'blocksize' bytes of data from
+    'nblocks' offsets spread evenly through the file, starting
+    with the beginning of the file, and narrows down the
+    possible quality encodings using the range of quality
+    values seen so far. Sampling stops as soon as only one
+    encoding is consistent with the data.
+
+    For gzipped files, each block after the first is read by
+    decompressing from the first gzip member boundary found
+    after the offset (as for BGZF files, or those written by
+    e.g. 'pigz'); if the file consists of a single member then
+    only the start of the stream is sampled.
+
+    The 'confidence' in the returned data is 1.0 if only one
+    encoding is consistent with the sampled quality values, or
+    1/N if N encodings are consistent (or zero if none are).
+    Note that data using Phred+64 can only be distinguished
+    from Solexa+64 once qualities below '@' are seen. The
+    'encodings' list is ordered so that the encodings with
+    the narrowest ranges come first, and 'encoding' is the
+    first of these.
+
+    Arguments:
+      fastq: name of the fastq(.gz) file
+      nblocks: optional, maximum number of blocks to sample
+      blocksize: optional, number of bytes of FASTQ data to
+        read in each block
+      colorspace: if True then the data are colorspace
+
+    Returns:
+      AttributeDictionary with the keys 'encoding' (the most
+      likely encoding, or None), 'encodings' (list of possible
+      encodings), 'confidence', 'min_quality', 'max_quality',
+      'nreads' (number of reads sampled) and 'nblocks' (number
+      of blocks sampled).
+
+    """
+    gzipped = is_gzipped_file(fastq)
+    fp = open(fastq,'rb')
+    try:
+        fp.seek(0,os.SEEK_END)
+        filesize = fp.tell()
+        offsets = sorted(set([i*filesize/nblocks for i in xrange(nblocks)]))
+        min_quality = None
+        max_quality = None
+        encodings = []
+        nreads = 0
+        nsampled = 0
+        for offset in offsets:
+            # Fetch a block of FASTQ data
+            if not gzipped:
+                fp.seek(offset)
+                data = fp.read(blocksize)
+            elif offset == 0:
+                data = _inflate_gzip_data(fp,0,blocksize)
+            else:
+                data = _inflate_gzip_member(fp,offset,blocksize)
+            if not data:
+                continue
+            nsampled += 1
+            # Find the first complete record and extract the
+            # quality lines
+            lines = data.split('\n')[:-1]
+            if offset == 0:
+                start = 0
+            else:
+                start = _find_fastq_record(lines)
+                if start is None:
+                    continue
+            lines = lines[start:]
+            lines = lines[:len(lines)-len(lines)%4]
+            nreads += len(lines)/4
+            qualities = ''.join(lines[3::4]).replace('\r','')
+            if not qualities:
+                continue
+            # Update the quality range and possible encodings
+            quality_chars = set(qualities)
+            if min_quality is None:
+                min_quality = min(quality_chars)
+                max_quality = max(quality_chars)
+            else:
+                min_quality = min(min_quality,min(quality_chars))
+                max_quality = max(max_quality,max(quality_chars))
+            encodings = []
+            for description,encoding,galaxy_type in \
+                quality_encodings(min_quality,max_quality,colorspace):
+                if encoding not in encodings:
+                    encodings.append(encoding)
+            if len(encodings) < 2:
+                break
+    finally:
+        fp.close()
+    # Put the narrowest encodings first
+    ranges = {}
+    for description,encoding,galaxy_type,lowest,highest in \
+        QUALITY_ENCODINGS:
+        if encoding in ranges:
+            lowest = min(lowest,ranges[encoding][0])
+            highest = max(highest,ranges[encoding][1])
+        ranges[encoding] = (lowest,highest)
+    encodings.sort(key=lambda e: ord(ranges[e][1])-ord(ranges[e][0]))
+    if encodings:
+        confidence = 1.0/len(encodings)
+        encoding = encodings[0]
+    else:
+        confidence = 0.0
+        encoding = None
+    return AttributeDictionary(encoding=encoding,
+                               encodings=encodings,
+                               confidence=confidence,
+                               min_quality=min_quality,
+                               max_quality=max_quality,
+                               nreads=nreads,
+                               nblocks=nsampled)
+
+def _inflate_gzip_data(fp,offset,size):
+    """Internal: decompress gzipped data starting from an offset
+
+    Decompresses data from the gzip member starting at
+    'offset' in the file (and any members following it)
+    until at least 'size' bytes have been obtained or the end
+    of the file is reached.
+
+    Raises zlib.error if the data at the offset can't be
+    decompressed.
+
+    Arguments:
+      fp: file object opened for reading the gzipped file
+      offset: position of the start of a gzip member
+      size: number of bytes of decompressed data to return
+
+    Returns:
+      String with up to 'size' bytes of decompressed data.
+    """
+    fp.seek(offset)
+    decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+    data = []
+    ndata = 0
+    while ndata < size:
+        raw = fp.read(CHUNKSIZE)
+        if not raw:
+            break
+        block = decompressor.decompress(raw)
+        unused = decompressor.unused_data
+        while unused and unused.strip('\0'):
+            # Start of the next gzip member
+            decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+            block += decompressor.decompress(unused)
+            unused = decompressor.unused_data
+        data.append(block)
+        ndata += len(block)
+    return ''.join(data)[:size]
+
+def _inflate_gzip_member(fp,offset,size):
+    """Internal: decompress data from the next gzip member
+
+    Looks for the first gzip member header within 'size'
+    bytes after 'offset' which can be decompressed, and
+    returns up to 'size' bytes of decompressed data from it.
+
+    Arguments:
+      fp: file object opened for reading the gzipped file
+      offset: position in the file to search from
+      size: number of bytes of decompressed data to return
+
+    Returns:
+      String with up to 'size' bytes of decompressed data
+      (empty if no gzip member was found).
+    """
+    fp.seek(offset)
+    raw = fp.read(size)
+    i = raw.find('\x1f\x8b\x08')
+    while i != -1:
+        try:
+            data = _inflate_gzip_data(fp,offset+i,size)
+            if data:
+                return data
+        except zlib.error:
+            # Not a real member header
+            pass
+        i = raw.find('\x1f\x8b\x08',i+1)
+    return ''
+
+def _find_fastq_record(lines):
+    """Internal: locate the first complete record in a list of lines
+
+    A record is taken to start at a line beginning with '@'
+    where the line two places later begins with '+' (a quality
+    line starting with '@' will be followed two lines later by
+    a sequence line instead).
+
+    Arguments:
+      lines: list of lines from a FASTQ file, where the first
+        line may be partial
+
+    Returns:
+      Index of the first line of the first complete record,
+      or None if no record was found.
+    """
+    for i in xrange(1,len(lines)-3):
+        if lines[i].startswith('@') and lines[i+2].startswith('+'):
+            return i
+    return None
+
 def fastqs_are_pair(fastq1=None,fastq2=None,verbose=True,fp1=None,fp2=None):
     """Check that two FASTQs form an R1/R2 pair
 
@@ -504,18 +1154,453 @@ def fastqs_are_pair(fastq1=None,fastq2=None,verbose=True,fp1=None,fp2=None):
       than the other).
 
     """
-    # Use itertools.izip_longest, which will return None if either of
-    # the fastqs is exhausted before the other
-    i = 0
-    for r1,r2 in itertools.izip_longest(FastqIterator(fastq_file=fastq1,fp=fp1),
-                                        FastqIterator(fastq_file=fastq2,fp=fp2)):
-        i += 1
+    result = verify_fastq_pair(fastq1=fastq1,fastq2=fastq2,fp1=fp1,fp2=fp2)
+    if not result.paired:
         if verbose:
-            if i%100000 == 0:
-                print "Examining pair #%d" % i
-        if not r1.seqid.is_pair_of(r2.seqid):
-            if verbose:
-                print "Unpaired headers for read position #%d:" % i
-                print "%s\n%s" % (r1.seqid,r2.seqid)
-            return False
+            print "Unpaired headers for read position #%d:" % result.position
+            print "%s\n%s" % (result.header1,result.header2)
+        return False
     return True
+
+def verify_fastq_pair(fastq1=None,fastq2=None,fp1=None,fp2=None,
+                      bufsize=1024*1024):
+    """Locate the first read which doesn't form an R1/R2 pair
+
+    Reads the two FASTQs concurrently in chunks of 'bufsize'
+    bytes, and compares the sequence identifier lines for the
+    reads in each chunk.
+
+    Headers form a pair if they're identical apart from the
+    read number, which is either the first field after the
+    space (for Illumina 1.8+ format, e.g. ' 1:N:0:ATCACG') or
+    a trailing '/1' or '/2' (for earlier Illumina formats).
+    The whole of each chunk is checked at once by substituting
+    the read number in the joined R1 headers; the individual
+    headers are only examined if this check fails.
+
+    The FASTQs can be specified either as file names (using
+    the 'fastq1' and 'fastq2' arguments) or as file-like
+    objects opened for reading (using the 'fp1' and 'fp2'
+    arguments).
+
+    Arguments:
+      fastq1: first FASTQ
+      fastq2: second FASTQ
+      fp1: open file descriptor for first FASTQ
+      fp2: open file descriptor for second FASTQ
+      bufsize: optional, number of bytes to read at a time
+
+    Returns:
+      AttributeDictionary with the keys 'paired' (True if all
+      the reads form pairs), 'npairs' (number of pairs before
+      the first unpaired read), 'position' (position of the
+      first unpaired read, or None), and 'header1' and 'header2'
+      (the headers at that position, or None if one of the
+      FASTQs has no more reads).
+
+    """
+    if fp1 is None:
+        fp1 = get_fastq_file_handle(fastq1)
+    if fp2 is None:
+        fp2 = get_fastq_file_handle(fastq2)
+    readers = (_FastqChunkReader(fp1,bufsize),
+               _FastqChunkReader(fp2,bufsize))
+    pool = ThreadPool(2)
+    npairs = 0
+    lines1 = []
+    lines2 = []
+    try:
+        while True:
+            chunk1,chunk2 = pool.map(_FastqChunkReader.read,readers)
+            lines1.extend(chunk1)
+            lines2.extend(chunk2)
+            n = min(len(lines1),len(lines2))
+            if n:
+                i = _find_unpaired_header(lines1[0:n:4],lines2[0:n:4])
+                if i is not None:
+                    return AttributeDictionary(paired=False,
+                                               npairs=npairs+i,
+                                               position=npairs+i+1,
+                                               header1=lines1[4*i],
+                                               header2=lines2[4*i])
+                npairs += n/4
+                del(lines1[:n])
+                del(lines2[:n])
+            if not chunk1 and not chunk2:
+                break
+    finally:
+        pool.terminate()
+        if fastq1 is not None:
+            fp1.close()
+        if fastq2 is not None:
+            fp2.close()
+    if lines1 or lines2:
+        # One FASTQ has more reads than the other
+        return AttributeDictionary(paired=False,
+                                   npairs=npairs,
+                                   position=npairs+1,
+                                   header1=(lines1[0] if lines1 else None),
+                                   header2=(lines2[0] if lines2 else None))
+    return AttributeDictionary(paired=True,
+                               npairs=npairs,
+                               position=None,
+                               header1=None,
+                               header2=None)
+
+def repair_fastq_pairs(fastqs,out1,out2=None,singles=None,tmpdir=None,
+                       max_memory=256*1024*1024,bufsize=1024*1024):
+    """Match up paired reads from out-of-sync or interleaved FASTQs
+
+    Reads which share the same name (i.e. the sequence
+    identifier up to the first whitespace, ignoring any
+    trailing '/1' or '/2') are treated as a pair.
+
+    If 'fastqs' holds two FASTQs then reads from the first
+    are paired with reads from the second, regardless of the
+    order of the reads in each file; if it holds a single
+    (interleaved) FASTQ then pairs are formed from reads
+    within that file.
+
+    So that the memory used is bounded, the reads are first
+    partitioned into temporary files on disk according to a
+    hash of the read name, and each partition is then matched
+    up separately. The number of partitions is chosen so that
+    each holds no more than about 'max_memory' bytes of FASTQ
+    data (assuming that gzipped FASTQs are compressed by a
+    factor of 4).
+
+    Pairs are written out in partition order (not in the
+    order of the input reads), with the R1 read of each pair
+    written to 'out1' and the R2 read to 'out2'; if 'out2' is
+    not specified then both reads are written to 'out1' (i.e.
+    the output is interleaved). Reads without a mate are
+    written to 'singles', if specified, and are otherwise
+    discarded.
+
+    Arguments:
+      fastqs: list of one or two fastq(.gz) files
+      out1: name of the output FASTQ for R1 reads
+      out2: optional, name of the output FASTQ for R2 reads
+      singles: optional, name of the output FASTQ for
+        unpaired reads
+      tmpdir: optional, directory to put the partitions in
+        (defaults to the system temporary directory)
+      max_memory: optional, the approximate maximum number of
+        bytes of FASTQ data to hold in memory at once
+      bufsize: optional, number of bytes to read at a time
+
+    Returns:
+      AttributeDictionary with the keys 'npairs' (number of
+      pairs written) and 'nsingles' (number of unpaired reads).
+
+    """
+    # Determine the number of partitions
+    total_size = 0
+    for fastq in fastqs:
+        if is_gzipped_file(fastq):
+            total_size += 4*os.path.getsize(fastq)
+        else:
+            total_size += os.path.getsize(fastq)
+    npartitions = max(1,(total_size+max_memory-1)/max_memory)
+    npairs = 0
+    nsingles = 0
+    wd = tempfile.mkdtemp(dir=tmpdir,suffix='.partitions')
+    try:
+        # Partition the reads from each FASTQ
+        partitions = []
+        for fastq in fastqs:
+            partitions.append(_partition_fastq(fastq,wd,npartitions,
+                                               bufsize))
+        # Match up the reads in each partition
+        fp1 = open(out1,'w')
+        if out2 is not None:
+            fp2 = open(out2,'w')
+        else:
+            fp2 = fp1
+        if singles is not None:
+            fp_singles = open(singles,'w')
+        for i in xrange(npartitions):
+            pairs,unpaired = _pair_partition([p[i] for p in partitions])
+            npairs += len(pairs)
+            nsingles += len(unpaired)
+            if pairs:
+                if fp2 is fp1:
+                    fp1.write(''.join([r1+r2 for r1,r2 in pairs]))
+                else:
+                    fp1.write(''.join([r1 for r1,r2 in pairs]))
+                    fp2.write(''.join([r2 for r1,r2 in pairs]))
+            if unpaired and singles is not None:
+                fp_singles.write(''.join(unpaired))
+        fp1.close()
+        if out2 is not None:
+            fp2.close()
+        if singles is not None:
+            fp_singles.close()
+    finally:
+        shutil.rmtree(wd)
+    return AttributeDictionary(npairs=npairs,nsingles=nsingles)
+
+def split_interleaved_fastq(fastq,out1,out2,fp=None,bufsize=1024*1024):
+    """Split an interleaved FASTQ into separate R1 and R2 FASTQs
+
+    Makes a single pass through the interleaved FASTQ, writing
+    the first read of each consecutive pair to 'out1' and the
+    second to 'out2'.
+
+    An exception is raised if the reads in any pair have
+    different names (i.e. the sequence identifiers differ up
+    to the first whitespace, ignoring any trailing '/1' or
+    '/2'), or if there are an odd number of reads; use
+    'repair_fastq_pairs' to deal with interleaved FASTQs
+    with missing reads.
+
+    The FASTQ file can be specified either as a file name (using
+    the 'fastq' argument) or as a file-like object opened for
+    reading (using the 'fp' argument).
+
+    Arguments:
+      fastq: interleaved fastq(.gz) file
+      out1: name of the output FASTQ for the first reads
+      out2: name of the output FASTQ for the second reads
+      fp: open file descriptor for interleaved fastq file
+      bufsize: optional, number of bytes to read at a time
+
+    Returns:
+      Number of read pairs written.
+
+    """
+    if fp is None:
+        fp = get_fastq_file_handle(fastq)
+    reader = _FastqChunkReader(fp,bufsize,nlines=8)
+    npairs = 0
+    fp1 = open(out1,'w')
+    fp2 = open(out2,'w')
+    try:
+        while True:
+            lines = reader.read()
+            if not lines:
+                break
+            names1 = map(_read_name,lines[0::8])
+            names2 = map(_read_name,lines[4::8])
+            if names1 != names2:
+                for i,(name1,name2) in enumerate(zip(names1,names2)):
+                    if name1 != name2:
+                        raise Exception("Reads %d and %d are not a pair "
+                                        "(%s, %s)" % (2*(npairs+i)+1,
+                                                      2*(npairs+i)+2,
+                                                      name1,name2))
+            npairs += len(names1)
+            records = map('\n'.join,itertools.izip(lines[0::4],
+                                                   lines[1::4],
+                                                   lines[2::4],
+                                                   lines[3::4]))
+            fp1.write('\n'.join(records[0::2])+'\n')
+            fp2.write('\n'.join(records[1::2])+'\n')
+    finally:
+        fp1.close()
+        fp2.close()
+        if fastq is not None:
+            fp.close()
+    return npairs
+
+class _FastqChunkReader(object):
+    """Internal: read complete FASTQ records in chunks of lines
+
+    Each call to the 'read' method returns the lines (with
+    line endings removed) for the complete records in the
+    next chunk of data, as a list whose length is a multiple
+    of 'nlines'; an empty list is returned at the end of the
+    file. An exception is raised if the file ends with an
+    incomplete set of lines.
+    """
+    def __init__(self,fp,bufsize,nlines=4):
+        self.__fp = fp
+        self.__bufsize = bufsize
+        self.__nlines = nlines
+        self.__partial = ''
+        self.__lines = []
+
+    def read(self):
+        lines = self.__lines
+        while True:
+            data = self.__fp.read(self.__bufsize)
+            if data:
+                # Split complete lines from the data
+                data = self.__partial + data
+                i = data.rfind('\n')
+                if i == -1:
+                    self.__partial = data
+                    continue
+                self.__partial = data[i+1:]
+                data = data[:i]
+                if '\r' in data:
+                    data = data.replace('\r','')
+                lines.extend(data.split('\n'))
+            elif self.__partial:
+                # Final line with no trailing newline
+                lines.append(self.__partial.rstrip('\r'))
+                self.__partial = ''
+            n = len(lines) - len(lines)%self.__nlines
+            if n or not data:
+                break
+        if not data and len(lines) != n:
+            raise Exception("Bad read count (not fastq file, or corrupted?)")
+        chunk = lines[:n]
+        del(lines[:n])
+        return chunk
+
+def _find_unpaired_header(headers1,headers2):
+    """Internal: locate the first pair of headers which aren't mates
+
+    Arguments:
+      headers1: list of headers from the first FASTQ
+      headers2: list of headers from the second FASTQ (must
+        be the same length as 'headers1')
+
+    Returns:
+      Index of the first pair of headers which don't form an
+      R1/R2 pair, or None if all are pairs.
+    """
+    nheaders = len(headers1)
+    joined1 = '\n'.join(headers1) + '\n'
+    joined2 = '\n'.join(headers2) + '\n'
+    # Illumina 1.8+ format e.g.
+    # @EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG
+    if joined1.count(' 1:') == nheaders and \
+       joined1.replace(' 1:',' 2:') == joined2:
+        return None
+    # Earlier Illumina format e.g.
+    # @HWUSI-EAS100R:6:73:941:1973#0/1
+    if joined1.count('/1\n') == nheaders and \
+       joined1.replace('/1\n','/2\n') == joined2:
+        return None
+    # Check the headers individually
+    for i,(header1,header2) in enumerate(zip(headers1,headers2)):
+        if not (_is_mate_header(header1,header2) or
+                _is_mate_header(header2,header1)):
+            return i
+    return None
+
+def _is_mate_header(header1,header2):
+    """Internal: check if R2 header matches the R1 header
+
+    Arguments:
+      header1: header for the R1 read
+      header2: header for the R2 read
+
+    Returns:
+      True if the headers are identical apart from the read
+      number, False otherwise.
+    """
+    if header1.count(' 1:') == 1:
+        return header2 == header1.replace(' 1:',' 2:')
+    if header1.endswith('/1'):
+        return header2 == header1[:-2] + '/2'
+    return False
+
+def _read_name(header):
+    """Internal: return the read name from a header line
+
+    The name is the sequence identifier up to the first
+    whitespace, with any trailing '/1' or '/2' removed.
+    """
+    name = header.split(None,1)[0] if header else ''
+    if name.endswith('/1') or name.endswith('/2'):
+        name = name[:-2]
+    return name
+
+def _partition_fastq(fastq,dirn,npartitions,bufsize):
+    """Internal: split the reads in a FASTQ into partitions
+
+    Writes each read to one of 'npartitions' files in 'dirn'
+    according to a hash of the read name (so that reads with
+    the same name always end up in the same partition).
+
+    Arguments:
+      fastq: fastq(.gz) file to partition
+      dirn: directory to write the partition files to
+      npartitions: number of partitions
+      bufsize: number of bytes to read at a time
+
+    Returns:
+      List of the partition file names.
+    """
+    fd,prefix = tempfile.mkstemp(dir=dirn)
+    os.close(fd)
+    partitions = ["%s.%d" % (prefix,i) for i in xrange(npartitions)]
+    fps = [open(partition,'w') for partition in partitions]
+    fp = get_fastq_file_handle(fastq)
+    try:
+        reader = _FastqChunkReader(fp,bufsize)
+        while True:
+            lines = reader.read()
+            if not lines:
+                break
+            buckets = [[] for i in xrange(npartitions)]
+            for record in itertools.izip(lines[0::4],lines[1::4],
+                                         lines[2::4],lines[3::4]):
+                buckets[hash(_read_name(record[0]))%npartitions].append(
+                    '\n'.join(record))
+            for fp_partition,bucket in zip(fps,buckets):
+                if bucket:
+                    fp_partition.write('\n'.join(bucket)+'\n')
+    finally:
+        fp.close()
+        for fp_partition in fps:
+            fp_partition.close()
+    return partitions
+
+def _pair_partition(partitions):
+    """Internal: match up the reads in a set of partition files
+
+    Arguments:
+      partitions: list with the partition file for each of
+        the input FASTQs (one or two files)
+
+    Returns:
+      Tuple (pairs,unpaired) where 'pairs' is a list of
+      (r1,r2) tuples of the paired FASTQ records and 'unpaired'
+      is a list of the unpaired records.
+    """
+    pairs = []
+    unpaired = []
+    pending = {}
+    if len(partitions) == 1:
+        # Interleaved: pair each read with the next one
+        # with the same name
+        for i,(name,record) in enumerate(_read_partition(partitions[0])):
+            mate = pending.pop(name,None)
+            if mate is None:
+                pending[name] = (i,record)
+            else:
+                pairs.append((mate[1],record))
+    else:
+        # R1/R2: pair reads from the second partition
+        # with those from the first
+        for i,(name,record) in enumerate(_read_partition(partitions[0])):
+            if name in pending:
+                # Duplicated name
+                unpaired.append(record)
+            else:
+                pending[name] = (i,record)
+        for name,record in _read_partition(partitions[1]):
+            mate = pending.pop(name,None)
+            if mate is None:
+                unpaired.append(record)
+            else:
+                pairs.append((mate[1],record))
+    unpaired.extend([record for i,record in sorted(pending.values())])
+    return pairs,unpaired
+
+def _read_partition(partition):
+    """Internal: iterate over the reads in a partition file
+
+    Yields a tuple (name,record) for each read, where 'record'
+    is the FASTQ record (including the final newline).
+    """
+    with open(partition,'r') as fp:
+        lines = fp.read().split('\n')[:-1]
+    for record in itertools.izip(lines[0::4],lines[1::4],
+                                 lines[2::4],lines[3::4]):
+        yield (_read_name(record[0]),'\n'.join(record)+'\n')
+
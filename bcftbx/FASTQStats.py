@@ -0,0 +1,304 @@
+#     FASTQStats.py: bulk statistics for FASTQ files
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+########################################################################
+#
+# FASTQStats.py
+#
+#########################################################################
+
+"""
+Classes and functions for generating statistics from FASTQ files:
+
+* FastqStats: container for statistics accumulated from FASTQ data
+* collect_fastq_stats: generate statistics for a FASTQ file
+
+The statistics are gathered by reading the FASTQ data in large
+chunks and processing the sequence and quality lines from each
+chunk together (using string operations such as 'join' and 'count'
+rather than examining each read individually), so that they can
+be generated for full files in a reasonable time.
+
+Usage:
+
+>>> from bcftbx.FASTQStats import collect_fastq_stats
+>>> stats = collect_fastq_stats("reads.fastq.gz")
+>>> print "%d reads" % stats.nreads
+
+"""
+
+__version__ = "0.0.1"
+
+#######################################################################
+# Import modules that this module depends on
+#######################################################################
+
+import itertools
+from .FASTQFile import SequenceIdentifier
+from .FASTQFile import get_fastq_file_handle
+from .FASTQFile import quality_encodings
+
+#######################################################################
+# Class definitions
+#######################################################################
+
+class FastqStats(object):
+    """
+    Statistics accumulated from FASTQ data
+
+    The following attributes are available:
+
+    nreads: total number of reads
+    total_bases: total number of bases
+    read_lengths: dictionary mapping read lengths to the
+      number of reads with that length
+    base_composition: dictionary mapping each base (i.e.
+      sequence character) to the total number of times it
+      occurs
+    reads_with_n: number of reads with at least one N
+    min_quality: lowest quality character (or None)
+    max_quality: highest quality character (or None)
+    index_sequences: dictionary mapping index sequences
+      (from the read headers) to the number of reads
+    per_position_bases: list of dictionaries (one for each
+      position in the reads) mapping bases to counts
+    per_position_qualities: list of dictionaries (one for
+      each position in the reads) mapping quality characters
+      to counts
+
+    The per-position distributions are only populated if
+    'per_position' is True.
+
+    Data are added using the 'add_records' method.
+    """
+    def __init__(self,per_position=True):
+        """
+        Create a new FastqStats instance
+
+        Arguments:
+          per_position: if True (the default) then also
+            collect the per-position base and quality
+            distributions
+        """
+        self.per_position = per_position
+        self.nreads = 0
+        self.total_bases = 0
+        self.read_lengths = {}
+        self.base_composition = {}
+        self.reads_with_n = 0
+        self.min_quality = None
+        self.max_quality = None
+        self.index_sequences = {}
+        self.per_position_bases = []
+        self.per_position_qualities = []
+
+    def add_records(self,headers,sequences,qualities):
+        """
+        Update the statistics with a block of reads
+
+        Arguments:
+          headers: list of sequence identifier lines
+          sequences: list of sequence lines
+          qualities: list of quality lines (in the same
+            order as the sequences)
+        """
+        if not sequences:
+            return
+        self.nreads += len(sequences)
+        # Read lengths
+        lengths = map(len,sequences)
+        self.total_bases += sum(lengths)
+        for l in set(lengths):
+            self.read_lengths[l] = self.read_lengths.get(l,0) + \
+                                   lengths.count(l)
+        # Base composition and N content
+        bases = ''.join(sequences)
+        _count_chars(bases,self.base_composition)
+        if 'N' in bases:
+            self.reads_with_n += len(filter(lambda s: 'N' in s,
+                                            sequences))
+        # Quality range
+        qualities = filter(None,qualities)
+        if qualities:
+            quality_chars = set(''.join(qualities))
+            qmin = min(quality_chars)
+            qmax = max(quality_chars)
+            if self.min_quality is None or qmin < self.min_quality:
+                self.min_quality = qmin
+            if self.max_quality is None or qmax > self.max_quality:
+                self.max_quality = qmax
+        # Index sequences
+        for header in headers:
+            fields = header.split(':')
+            if len(fields) == 10:
+                # Illumina 1.8+ e.g.
+                # @EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG
+                index_seq = fields[9]
+            else:
+                index_seq = SequenceIdentifier(header).index_sequence
+                if index_seq is None:
+                    continue
+            self.index_sequences[index_seq] = \
+                self.index_sequences.get(index_seq,0) + 1
+        # Per-position distributions
+        if self.per_position:
+            _count_positions(sequences,self.per_position_bases)
+            _count_positions(qualities,self.per_position_qualities)
+
+    @property
+    def max_read_length(self):
+        """
+        Length of the longest read (zero if there are no reads)
+        """
+        if not self.read_lengths:
+            return 0
+        return max(self.read_lengths)
+
+    @property
+    def n_content(self):
+        """
+        Fraction of all bases which are N (zero if no bases)
+        """
+        if not self.total_bases:
+            return 0.0
+        return float(self.base_composition.get('N',0))/self.total_bases
+
+    def mean_quality_per_position(self,offset=33):
+        """
+        Return the mean quality score at each position
+
+        Arguments:
+          offset: value to subtract from the ASCII code of
+            each quality character to get the score (default:
+            33, i.e. Phred+33)
+
+        Returns:
+          List with the mean quality score for each position.
+        """
+        means = []
+        for counts in self.per_position_qualities:
+            total = sum(counts.values())
+            score = sum([(ord(q)-offset)*counts[q] for q in counts])
+            means.append(float(score)/total)
+        return means
+
+    def quality_encodings(self,colorspace=False):
+        """
+        Return the quality encodings consistent with the data
+
+        Arguments:
+          colorspace: if True then the data are colorspace
+
+        Returns:
+          List of tuples (description,encoding,galaxy_type)
+          as returned by the FASTQFile.quality_encodings
+          function (empty if there are no quality values).
+        """
+        if self.min_quality is None:
+            return []
+        return quality_encodings(self.min_quality,self.max_quality,
+                                 colorspace=colorspace)
+
+#######################################################################
+# Functions
+#######################################################################
+
+def collect_fastq_stats(fastq=None,fp=None,bufsize=1024*1024,
+                        max_reads=None,per_position=True):
+    """Generate statistics for a FASTQ file
+
+    Makes a single pass through the FASTQ file, reading it
+    in chunks of 'bufsize' bytes, and returns a FastqStats
+    instance populated from the reads.
+
+    The FASTQ file can be specified either as a file name (using
+    the 'fastq' argument) or as a file-like object opened for
+    reading (using the 'fp' argument).
+
+    Arguments:
+      fastq: fastq(.gz) file
+      fp: open file descriptor for fastq file
+      bufsize: optional, number of bytes to read at a time
+      max_reads: optional, if set then only process this
+        many reads from the start of the file
+      per_position: if True (the default) then also collect
+        the per-position base and quality distributions
+
+    Returns:
+      Populated FastqStats instance.
+
+    """
+    if fp is None:
+        fp = get_fastq_file_handle(fastq)
+    stats = FastqStats(per_position=per_position)
+    partial = ''
+    lines = []
+    while True:
+        data = fp.read(bufsize)
+        if data:
+            # Split complete lines from the data
+            data = partial + data
+            i = data.rfind('\n')
+            if i == -1:
+                partial = data
+                continue
+            partial = data[i+1:]
+            data = data[:i]
+            if '\r' in data:
+                data = data.replace('\r','')
+            lines.extend(data.split('\n'))
+        elif partial:
+            # Final line with no trailing newline
+            lines.append(partial.rstrip('\r'))
+            partial = ''
+        # Process all complete records
+        n = len(lines) - len(lines)%4
+        if max_reads is not None:
+            n = min(n,(max_reads - stats.nreads)*4)
+        if n:
+            stats.add_records(lines[0:n:4],lines[1:n:4],lines[3:n:4])
+            del(lines[:n])
+        if not data or stats.nreads == max_reads:
+            break
+    if fastq is not None:
+        fp.close()
+    if lines and stats.nreads != max_reads:
+        raise Exception("Bad read count (not fastq file, or corrupted?)")
+    return stats
+
+def _count_chars(s,counts):
+    """Internal: add the counts of each character in a string
+
+    Arguments:
+      s: string to count characters from
+      counts: dictionary mapping characters to counts, which
+        will be updated in place
+    """
+    for c in set(s):
+        counts[c] = counts.get(c,0) + s.count(c)
+
+def _count_positions(strings,distributions):
+    """Internal: add per-position character counts for strings
+
+    The strings are grouped by length and each group is
+    joined, so that the characters at each position can be
+    extracted with a single slice of the joined string.
+
+    Arguments:
+      strings: list of strings to count characters from
+      distributions: list of dictionaries mapping characters
+        to counts (one for each position), which will be
+        extended and updated in place
+    """
+    lengths = map(len,strings)
+    unique_lengths = set(lengths)
+    for l in unique_lengths:
+        if len(unique_lengths) == 1:
+            group = strings
+        else:
+            group = [s for s,n in itertools.izip(strings,lengths) if n == l]
+        while len(distributions) < l:
+            distributions.append({})
+        joined = ''.join(group)
+        for i in xrange(l):
+            _count_chars(joined[i::l],distributions[i])
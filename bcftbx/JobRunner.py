@@ -15,9 +15,11 @@ Classes for starting, stopping and managing jobs.
 Class BaseJobRunner is a template with methods that need to be implemented
 by subclasses. The subclasses implemented here are:
 
-* SimpleJobRunner: run jobs (e.g. scripts) on a local file system.
-* GEJobRunner    : run jobs using Grid Engine (GE) i.e. qsub, qdel etc
-* DRMAAJobRunner : run jobs using the DRMAA interface to Grid Engine
+* SimpleJobRunner   : run jobs (e.g. scripts) on a local file system.
+* LocalPoolJobRunner: run local jobs within a pool of CPUs and memory
+* PythonPoolJobRunner: run Python functions in a pool of worker processes
+* GEJobRunner       : run jobs using Grid Engine (GE) i.e. qsub, qdel etc
+* DRMAAJobRunner    : run jobs using the DRMAA interface to Grid Engine
 
 A single JobRunner instance can be used to start and manage multiple processes.
 
@@ -25,7 +27,9 @@ Each job is started by invoking the 'run' method of the runner. This returns
 an id string which is then used in calls to the 'isRunning', 'terminate' etc
 methods to check on and control the job.
 
-The runner's 'list' method returns a list of running job ids.
+The runner's 'list' method returns a list of running job ids, and its
+'wait' method blocks until one of its jobs may have finished (or until a
+timeout expires), so callers don't need to poll on a fixed interval.
 
 Simple usage example:
 
@@ -53,6 +57,18 @@ import time
 import tempfile
 import shutil
 import atexit
+import Queue
+import sys
+import signal
+import errno
+import re
+import threading
+import multiprocessing
+import importlib
+import imp
+import inspect
+import resource
+import traceback
 try:
     import drmaa
 except ImportError:
@@ -157,6 +173,40 @@ class BaseJobRunner(object):
         """
         return None
 
+    def resource_usage(self,job_id):
+        """Return the resources used by a finished job
+
+        Returns a dictionary with the keys:
+
+        - 'queue_wait': time (s) between submission and start
+        - 'wall_time': time (s) that the job ran for
+        - 'user_time': user CPU time (s)
+        - 'sys_time': system CPU time (s)
+        - 'max_rss': maximum resident set size (Kb)
+
+        with any values that aren't known set to None; or returns
+        None if the job hasn't finished or the runner doesn't
+        record resource usage.
+        """
+        return None
+
+    def wait(self,timeout):
+        """Wait for a job to finish
+
+        Blocks until a job managed by the runner may have
+        finished, or until 'timeout' seconds have passed.
+
+        The default implementation just sleeps for 'timeout'
+        seconds; runners which can detect job completion
+        should override it to return as soon as a job
+        finishes.
+
+        Returns True if a job finished while waiting, False
+        otherwise.
+        """
+        time.sleep(timeout)
+        return False
+
     @property
     def log_dir(self):
         """Return the current log directory setting
@@ -206,6 +256,10 @@ class SimpleJobRunner(BaseJobRunner):
         self.__err_files = {}
         self.__exit_status = {}
         self.__job_popen = {}
+        self.__start_time = {}
+        self.__rusage = {}
+        # Reap finished processes as soon as they exit
+        self.__watcher = _ProcessWatcher()
 
     def __repr__(self):
         return 'SimpleJobRunner'
@@ -233,20 +287,21 @@ class SimpleJobRunner(BaseJobRunner):
         # Build command to be submitted
         cmd = [script]
         cmd.extend(args)
-        # Capture current dir
-        current_dir = os.getcwd()
-        if working_dir:
-            # Move to working directory
-            os.chdir(working_dir)
         logging.debug("RunScript: command: %s" % cmd)
-        cwd = os.getcwd()
+        # Directory to run the command in (nb use 'cwd' argument
+        # of Popen rather than changing directory, which isn't
+        # thread-safe)
+        if working_dir:
+            cwd = os.path.abspath(working_dir)
+        else:
+            cwd = os.getcwd()
         # Check that this exists
         logging.debug("RunScript: executing in %s" % cwd)
         if not os.path.exists(cwd):
             logging.error("RunScript: cwd doesn't exist!")
             return None
         # Set up log files
-        lognames = self.__assign_log_files(name,working_dir)
+        lognames = self.__assign_log_files(name,cwd)
         log = open(lognames[0],'w')
         if not self.__join_logs:
             err = open(lognames[1],'w')
@@ -261,14 +316,12 @@ class SimpleJobRunner(BaseJobRunner):
         self.__job_list.append(job_id)
         self.__log_files[job_id] = lognames[0]
         self.__job_popen[job_id] = p
+        self.__start_time[job_id] = time.time()
+        self.__watcher.watch(job_id,p)
         if not self.__join_logs:
             self.__err_files[job_id] = lognames[1]
         else:
             self.__err_files[job_id] = None
-        # Return to original dir if necessary
-        if working_dir:
-            # Move to working directory
-            os.chdir(current_dir)
         # Store name against job id
         if job_id is not None:
             self.__names[job_id] = name
@@ -284,9 +337,13 @@ class SimpleJobRunner(BaseJobRunner):
             return False
         # Attempt to terminate
         logging.debug("KillJob: deleting job")
-        p = self.__job_popen[job_id]
-        p.terminate()
-        p.wait()
+        try:
+            p = self.__job_popen[job_id]
+            p.terminate()
+            self.__job_finished(job_id,*self.__watcher.join(job_id))
+        except KeyError:
+            # Already finished
+            pass
         if job_id not in self.list():
             logging.debug("KillJob: deleted job %s" % job_id)
             return True
@@ -314,21 +371,21 @@ class SimpleJobRunner(BaseJobRunner):
         """
         job_ids = []
         for job_id in [jid for jid in self.__job_popen]:
-            p = self.__job_popen[job_id]
-            status = p.poll()
+            status,rusage,end_time = self.__watcher.poll(job_id)
             if status is None:
                 job_ids.append(job_id)
             else:
-                logging.debug("Job id %s: finished (%s)" % (job_id,
-                                                            status))
-                self.__exit_status[job_id] = status
-                try:
-                    del(self.__job_popen[job_id])
-                except KeyError:
-                    logging.warning("Job id %s: already deleted"
-                                    % job_id)
+                self.__job_finished(job_id,status,rusage,end_time)
         return job_ids
 
+    def wait(self,timeout):
+        """Wait for a job to finish
+
+        Returns as soon as any running job exits, or after
+        'timeout' seconds.
+        """
+        return self.__watcher.wait(timeout)
+
     def exit_status(self,job_id):
         """Return exit status from command run by a job
         """
@@ -342,6 +399,27 @@ class SimpleJobRunner(BaseJobRunner):
             logging.error("Don't know anything about job %s" % job_id)
             return None
 
+    def resource_usage(self,job_id):
+        """Return the resources used by a finished job
+
+        See BaseJobRunner.resource_usage for details.
+        """
+        return self.__rusage.get(job_id)
+
+    def __job_finished(self,job_id,status,rusage,end_time):
+        """Internal: record the exit status and resources for a job
+        """
+        logging.debug("Job id %s: finished (%s)" % (job_id,status))
+        self.__exit_status[job_id] = status
+        self.__rusage[job_id] = _resource_usage(
+            queue_wait=0.0,
+            wall_time=end_time-self.__start_time[job_id],
+            rusage=rusage)
+        try:
+            del(self.__job_popen[job_id])
+        except KeyError:
+            logging.warning("Job id %s: already deleted" % job_id)
+
     def __assign_log_files(self,name,working_dir):
         """Internal: return log file names for stdout and stderr
 
@@ -352,7 +430,7 @@ class SimpleJobRunner(BaseJobRunner):
         log_file = "%s.o%s" % (name,timestamp)
         error_file = "%s.e%s" % (name,timestamp)
         if self.log_dir is None:
-            log_dir = os.getcwd()
+            log_dir = working_dir
         else:
             log_dir = self.log_dir
         log_file = os.path.join(log_dir,log_file)
@@ -360,6 +438,655 @@ class SimpleJobRunner(BaseJobRunner):
         self.__log_id += 1
         return (log_file,error_file)
 
+class LocalPoolJobRunner(BaseJobRunner):
+    """Class implementing job runner for local pool of resources
+
+    LocalPoolJobRunner runs jobs as processes on the local
+    system, like SimpleJobRunner, but manages a pool of CPU
+    slots and memory: each job can request a number of slots
+    and an amount of memory, and is only started once those
+    resources are free (jobs that can't start yet are held in
+    an internal queue and started in the order they were
+    submitted). Jobs which are waiting or running are both
+    reported by the 'list' method.
+
+    Finished jobs are reaped using 'os.wait4', so the CPU time
+    and maximum resident set size used by each job are also
+    recorded (see the 'resource_usage' method). Each process is
+    reaped as soon as it exits, so the 'wait' method returns
+    (and a waiting job can be started) as soon as resources are
+    freed.
+    """
+
+    def __init__(self,cpus=None,mem=None,log_dir=None,join_logs=False):
+        """Create a new LocalPoolJobRunner instance
+
+        Arguments:
+          cpus: Number of CPU slots available for running jobs
+                (defaults to the number of CPUs on the system)
+          mem: Amount of memory (in Gb) available for running
+               jobs (set to 'None' to not limit memory)
+          log_dir: Directory to write log files to (set to 'None' to use
+                   the working directory)
+          join_logs: Combine stderr and stdout into a single log file (by
+                   default stdout and stderr have their own log files)
+        """
+        if cpus is None:
+            cpus = multiprocessing.cpu_count()
+        self.__cpus = int(cpus)
+        if mem is not None:
+            mem = float(mem)
+        self.__mem = mem
+        # Resources currently in use
+        self.__slots_in_use = 0
+        self.__mem_in_use = 0.0
+        # Internal job count (used for job ids)
+        self.__job_count = 0
+        # Job ids waiting to start
+        self.__waiting = []
+        # Keep track of data for each job
+        self.__names = {}
+        self.__commands = {}
+        self.__resources = {}
+        self.__log_files = {}
+        self.__err_files = {}
+        self.__job_popen = {}
+        self.__exit_status = {}
+        self.__rusage = {}
+        self.__submit_time = {}
+        self.__start_time = {}
+        # Reap finished processes as soon as they exit
+        self.__watcher = _ProcessWatcher()
+        # Directory for log files
+        self.set_log_dir(log_dir)
+        # Join stderr to stdout
+        self.__join_logs = join_logs
+
+    def __repr__(self):
+        name = 'LocalPoolJobRunner(cpus=%d' % self.__cpus
+        if self.__mem is not None:
+            name += ',mem=%sG' % self.__mem
+        name += ')'
+        return name
+
+    @property
+    def cpus(self):
+        """Return the number of CPU slots in the pool
+        """
+        return self.__cpus
+
+    @property
+    def mem(self):
+        """Return the amount of memory (Gb) in the pool
+
+        Returns None if memory is not limited.
+        """
+        return self.__mem
+
+    @property
+    def slots_in_use(self):
+        """Return the number of CPU slots currently in use
+        """
+        return self.__slots_in_use
+
+    @property
+    def mem_in_use(self):
+        """Return the amount of memory (Gb) currently in use
+        """
+        return self.__mem_in_use
+
+    def run(self,name,working_dir,script,args,nslots=1,mem_gb=None):
+        """Queue a command to run when resources are available
+
+        Arguments:
+          name: Name to give the job
+          working_dir: Directory to run the job in
+          script: Script file to run
+          args: List of arguments to supply to the script
+          nslots: Number of CPU slots required by the job
+            (default 1)
+          mem_gb: Amount of memory (in Gb) required by the job
+            (default is no memory requirement)
+
+        Returns:
+          Job id for submitted job, or 'None' if the working
+          directory doesn't exist.
+        """
+        logging.debug("LocalPoolJobRunner: submitting job")
+        logging.debug("Name       : %s" % name)
+        logging.debug("Working_dir: %s" % working_dir)
+        logging.debug("Log dir    : %s" % self.log_dir)
+        logging.debug("Join logs  : %s" % self.__join_logs)
+        logging.debug("Script     : %s" % script)
+        logging.debug("Arguments  : %s" % str(args))
+        logging.debug("Slots      : %s" % nslots)
+        logging.debug("Memory (Gb): %s" % mem_gb)
+        if not working_dir:
+            working_dir = os.getcwd()
+        working_dir = os.path.abspath(working_dir)
+        if not os.path.isdir(working_dir):
+            logging.error("LocalPoolJobRunner: working dir '%s' doesn't "
+                          "exist!" % working_dir)
+            return None
+        if mem_gb is None:
+            mem_gb = 0.0
+        if nslots > self.__cpus or \
+           (self.__mem is not None and mem_gb > self.__mem):
+            logging.warning("LocalPoolJobRunner: job '%s' requests more "
+                            "resources than the pool has; it will only "
+                            "run when no other jobs are running" % name)
+        # Assign job id and store the job data
+        self.__job_count += 1
+        job_id = str(self.__job_count)
+        self.__names[job_id] = name
+        self.__commands[job_id] = (working_dir,[script] + list(args))
+        self.__resources[job_id] = (int(nslots),float(mem_gb))
+        self.__submit_time[job_id] = time.time()
+        self.__log_files[job_id],self.__err_files[job_id] = \
+            self.__assign_log_files(job_id,name,working_dir)
+        # Queue the job and start any that can run
+        self.__waiting.append(job_id)
+        self.__start_jobs()
+        return job_id
+
+    def terminate(self,job_id):
+        """Terminate a waiting or running job
+        """
+        if job_id in self.__waiting:
+            # Remove from the queue
+            logging.debug("LocalPoolJobRunner: removing waiting job %s"
+                          % job_id)
+            self.__waiting.remove(job_id)
+            self.__exit_status[job_id] = -signal.SIGTERM
+            return True
+        if job_id not in self.__job_popen:
+            logging.debug("Don't own job %s, can't delete" % job_id)
+            return False
+        logging.debug("LocalPoolJobRunner: terminating job %s" % job_id)
+        p = self.__job_popen[job_id]
+        try:
+            p.terminate()
+        except OSError:
+            # Already finished
+            pass
+        self.__job_finished(job_id,*self.__watcher.join(job_id))
+        self.__start_jobs()
+        return True
+
+    def name(self,job_id):
+        """Return the name for a job
+        """
+        return self.__names[job_id]
+
+    def logFile(self,job_id):
+        """Return the log file name for a job
+        """
+        return self.__log_files[job_id]
+
+    def errFile(self,job_id):
+        """Return the error file name for a job
+        """
+        return self.__err_files[job_id]
+
+    def list(self):
+        """Return a list of waiting and running job_ids
+
+        Also reaps any jobs which have finished, and starts
+        waiting jobs if resources have become available.
+        """
+        for job_id in self.__job_popen.keys():
+            status,rusage,end_time = self.__watcher.poll(job_id)
+            if status is None:
+                # Still running
+                continue
+            self.__job_finished(job_id,status,rusage,end_time)
+        self.__start_jobs()
+        return self.__waiting + self.__job_popen.keys()
+
+    def wait(self,timeout):
+        """Wait for a job to finish
+
+        Returns as soon as any running job exits, or after
+        'timeout' seconds.
+        """
+        return self.__watcher.wait(timeout)
+
+    def exit_status(self,job_id):
+        """Return exit status from command run by a job
+
+        Returns None if the job is waiting or still running.
+        """
+        try:
+            return self.__exit_status[job_id]
+        except KeyError:
+            if job_id not in self.__names:
+                logging.error("Don't know anything about job %s" % job_id)
+            return None
+
+    def resource_usage(self,job_id):
+        """Return the resources used by a finished job
+
+        See BaseJobRunner.resource_usage for details; the
+        queue wait is the time the job spent waiting for
+        resources to become free.
+        """
+        return self.__rusage.get(job_id)
+
+    def __start_jobs(self):
+        """Internal: start waiting jobs if resources are available
+
+        Jobs are started in the order they were submitted; a
+        job that can't start yet blocks those behind it (so
+        jobs requesting large amounts of resources are not
+        starved by smaller ones).
+        """
+        while self.__waiting:
+            job_id = self.__waiting[0]
+            nslots,mem_gb = self.__resources[job_id]
+            if self.__job_popen:
+                # Check there are enough free resources
+                if (self.__slots_in_use + nslots) > self.__cpus:
+                    break
+                if self.__mem is not None and \
+                   (self.__mem_in_use + mem_gb) > self.__mem:
+                    break
+            self.__waiting.pop(0)
+            self.__start_job(job_id)
+
+    def __start_job(self,job_id):
+        """Internal: start the process for a job
+        """
+        working_dir,cmd = self.__commands[job_id]
+        logging.debug("LocalPoolJobRunner: starting job %s: %s" %
+                      (job_id,cmd))
+        log = open(self.__log_files[job_id],'w')
+        if not self.__join_logs:
+            err = open(self.__err_files[job_id],'w')
+        else:
+            err = subprocess.STDOUT
+        try:
+            p = subprocess.Popen(cmd,cwd=working_dir,stdout=log,stderr=err)
+        except OSError as ex:
+            logging.error("LocalPoolJobRunner: failed to start job %s: %s"
+                          % (job_id,ex))
+            log.write("Failed to start '%s': %s\n" % (cmd[0],ex))
+            self.__exit_status[job_id] = 127
+            return
+        finally:
+            log.close()
+            if not self.__join_logs:
+                err.close()
+        nslots,mem_gb = self.__resources[job_id]
+        self.__slots_in_use += nslots
+        self.__mem_in_use += mem_gb
+        self.__job_popen[job_id] = p
+        self.__start_time[job_id] = time.time()
+        self.__watcher.watch(job_id,p)
+        logging.debug("LocalPoolJobRunner: job %s has pid %s" %
+                      (job_id,p.pid))
+
+    def __job_finished(self,job_id,exit_status,rusage,end_time):
+        """Internal: release resources and record status for a job
+        """
+        del(self.__job_popen[job_id])
+        logging.debug("Job id %s: finished (%s)" % (job_id,exit_status))
+        self.__exit_status[job_id] = exit_status
+        start_time = self.__start_time[job_id]
+        self.__rusage[job_id] = _resource_usage(
+            queue_wait=start_time-self.__submit_time[job_id],
+            wall_time=end_time-start_time,
+            rusage=rusage)
+        nslots,mem_gb = self.__resources[job_id]
+        self.__slots_in_use -= nslots
+        self.__mem_in_use -= mem_gb
+
+    def __assign_log_files(self,job_id,name,working_dir):
+        """Internal: return log file names for stdout and stderr
+
+        Names are '<name>.o<job_id>' and '<name>.e<job_id>' (the
+        latter is None if stdout and stderr are joined).
+        """
+        if self.log_dir is None:
+            log_dir = working_dir
+        else:
+            log_dir = self.log_dir
+        log_file = os.path.join(log_dir,"%s.o%s" % (name,job_id))
+        if self.__join_logs:
+            error_file = None
+        else:
+            error_file = os.path.join(log_dir,"%s.e%s" % (name,job_id))
+        return (log_file,error_file)
+
+class PythonPoolJobRunner(BaseJobRunner):
+    """Class implementing job runner for Python functions
+
+    PythonPoolJobRunner runs jobs in a pool of long-lived worker
+    processes (using 'multiprocessing'). Instead of a script, each
+    job specifies a Python function as a target of the form
+    'module:function' (e.g. 'bcftbx.utils:main'), or
+    'path/to/script.py:function' for functions in stand-alone
+    scripts. The function is called in a worker with the job's
+    arguments as a list, e.g. 'function(['-o','out.txt'])', from
+    the job's working directory and with stdout and stderr going
+    to the job's log files; 'sys.argv' is also set for the call,
+    so a function which takes no arguments (e.g. a script's
+    'main' function which parses 'sys.argv') is simply called
+    as 'function()'.
+    The job's exit status is the function's return value if that
+    is an integer (None counts as 0), or the code passed to
+    'sys.exit'; if the function raises an exception then the
+    traceback is written to stderr and the exit status is 1.
+
+    Since the workers (and any modules that they've already
+    imported) are reused from one job to the next, short jobs
+    avoid the overhead of starting a new interpreter each time.
+
+    Jobs with a script that isn't a Python target are run as
+    a subprocess from a worker, as for SimpleJobRunner; the
+    subprocess is started in its own process group, which is
+    killed if the job is terminated.
+
+    Jobs are started in the order they were submitted as workers
+    become free, and both waiting and running jobs are reported
+    by the 'list' method. Running jobs are terminated by killing
+    the worker process (which is then replaced in the pool); the
+    worker checks that it is still running the job before it
+    exits, so a worker which has moved on to another job isn't
+    killed.
+    """
+
+    def __init__(self,workers=None,log_dir=None,join_logs=False):
+        """Create a new PythonPoolJobRunner instance
+
+        Arguments:
+          workers: Number of worker processes to run jobs in
+                (defaults to the number of CPUs on the system)
+          log_dir: Directory to write log files to (set to 'None' to use
+                   the working directory)
+          join_logs: Combine stderr and stdout into a single log file (by
+                   default stdout and stderr have their own log files)
+        """
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.__workers = int(workers)
+        # Pool of workers (created when the first job starts)
+        self.__pool = None
+        self.__pid_queue = None
+        self.__kill_jobs = None
+        # Internal job count (used for job ids)
+        self.__job_count = 0
+        # Job ids waiting to start, and running
+        self.__waiting = []
+        self.__running = {}
+        # Keep track of data for each job
+        self.__names = {}
+        self.__commands = {}
+        self.__log_files = {}
+        self.__err_files = {}
+        self.__pids = {}
+        self.__exit_status = {}
+        self.__rusage = {}
+        self.__submit_time = {}
+        self.__start_time = {}
+        # Results returned from the workers
+        self.__lock = threading.Lock()
+        self.__results = {}
+        self.__finished = threading.Event()
+        # Directory for log files
+        self.set_log_dir(log_dir)
+        # Join stderr to stdout
+        self.__join_logs = join_logs
+
+    def __repr__(self):
+        return 'PythonPoolJobRunner(workers=%d)' % self.__workers
+
+    @property
+    def workers(self):
+        """Return the number of worker processes
+        """
+        return self.__workers
+
+    def run(self,name,working_dir,script,args):
+        """Queue a Python function or script to run in the pool
+
+        Arguments:
+          name: Name to give the job
+          working_dir: Directory to run the job in
+          script: Python target ('module:function') or script
+            file to run
+          args: List of arguments to supply to the function or
+            script
+
+        Returns:
+          Job id for submitted job, or 'None' if the working
+          directory doesn't exist.
+        """
+        logging.debug("PythonPoolJobRunner: submitting job")
+        logging.debug("Name       : %s" % name)
+        logging.debug("Working_dir: %s" % working_dir)
+        logging.debug("Log dir    : %s" % self.log_dir)
+        logging.debug("Join logs  : %s" % self.__join_logs)
+        logging.debug("Target     : %s" % script)
+        logging.debug("Arguments  : %s" % str(args))
+        if not working_dir:
+            working_dir = os.getcwd()
+        working_dir = os.path.abspath(working_dir)
+        if not os.path.isdir(working_dir):
+            logging.error("PythonPoolJobRunner: working dir '%s' doesn't "
+                          "exist!" % working_dir)
+            return None
+        # Assign job id and store the job data
+        self.__job_count += 1
+        job_id = str(self.__job_count)
+        self.__names[job_id] = name
+        self.__commands[job_id] = (working_dir,script,list(args))
+        self.__submit_time[job_id] = time.time()
+        if self.log_dir is None:
+            log_dir = working_dir
+        else:
+            log_dir = self.log_dir
+        self.__log_files[job_id] = os.path.join(log_dir,"%s.o%s" %
+                                                (name,job_id))
+        if self.__join_logs:
+            self.__err_files[job_id] = None
+        else:
+            self.__err_files[job_id] = os.path.join(log_dir,"%s.e%s" %
+                                                    (name,job_id))
+        # Queue the job and start any that can run
+        self.__waiting.append(job_id)
+        self.__start_jobs()
+        return job_id
+
+    def terminate(self,job_id):
+        """Terminate a waiting or running job
+
+        Running jobs are terminated by killing the worker
+        process that they're running in (and the process
+        group of the job's script, for jobs which aren't
+        Python targets).
+        """
+        if job_id in self.__waiting:
+            logging.debug("PythonPoolJobRunner: removing waiting job %s"
+                          % job_id)
+            self.__waiting.remove(job_id)
+            self.__exit_status[job_id] = -signal.SIGTERM
+            return True
+        if job_id not in self.__running:
+            logging.debug("Don't own job %s, can't delete" % job_id)
+            return False
+        logging.debug("PythonPoolJobRunner: terminating job %s" % job_id)
+        # Wait for the worker to report its pid
+        start_time = time.time()
+        while job_id not in self.__pids and job_id not in self.__results:
+            if (time.time() - start_time) > 10.0:
+                logging.error("PythonPoolJobRunner: unable to get worker "
+                              "for job %s" % job_id)
+                return False
+            self.__update_pids(timeout=0.1)
+        with self.__lock:
+            if job_id in self.__results:
+                # Already finished
+                return True
+            # The worker only exits if it's still running
+            # this job
+            if not _add_kill_job(self.__kill_jobs,job_id):
+                logging.error("PythonPoolJobRunner: too many jobs "
+                              "waiting to be terminated, unable to "
+                              "terminate job %s" % job_id)
+                return False
+            try:
+                os.kill(self.__pids[job_id],signal.SIGTERM)
+            except OSError as ex:
+                logging.warning("PythonPoolJobRunner: failed to kill "
+                                "worker for job %s: %s" % (job_id,ex))
+            self.__results[job_id] = (-signal.SIGTERM,None,time.time())
+        self.list()
+        return True
+
+    def name(self,job_id):
+        """Return the name for a job
+        """
+        return self.__names[job_id]
+
+    def logFile(self,job_id):
+        """Return the log file name for a job
+        """
+        return self.__log_files[job_id]
+
+    def errFile(self,job_id):
+        """Return the error file name for a job
+        """
+        return self.__err_files[job_id]
+
+    def list(self):
+        """Return a list of waiting and running job_ids
+
+        Also handles any jobs which have finished, and starts
+        waiting jobs if workers have become free.
+        """
+        self.__update_pids()
+        with self.__lock:
+            results = self.__results
+            self.__results = {}
+        for job_id in results:
+            if job_id in self.__running:
+                self.__job_finished(job_id,*results[job_id])
+        self.__start_jobs()
+        return self.__waiting + self.__running.keys()
+
+    def wait(self,timeout):
+        """Wait for a job to finish
+
+        Returns as soon as any running job finishes, or after
+        'timeout' seconds.
+        """
+        finished = self.__finished.wait(timeout)
+        self.__finished.clear()
+        return bool(finished)
+
+    def exit_status(self,job_id):
+        """Return exit status from the function or script run by a job
+
+        Returns None if the job is waiting or still running.
+        """
+        try:
+            return self.__exit_status[job_id]
+        except KeyError:
+            if job_id not in self.__names:
+                logging.error("Don't know anything about job %s" % job_id)
+            return None
+
+    def resource_usage(self,job_id):
+        """Return the resources used by a finished job
+
+        See BaseJobRunner.resource_usage for details. The CPU
+        times are those used by the worker while running the
+        job (plus any subprocesses it ran); the maximum RSS is
+        the peak for the worker process, which may include
+        earlier jobs run in the same worker.
+        """
+        return self.__rusage.get(job_id)
+
+    def __start_jobs(self):
+        """Internal: start waiting jobs if workers are free
+        """
+        while self.__waiting and len(self.__running) < self.__workers:
+            job_id = self.__waiting.pop(0)
+            self.__start_job(job_id)
+
+    def __start_job(self,job_id):
+        """Internal: send a job to the pool of workers
+        """
+        if self.__pool is None:
+            self.__pid_queue = multiprocessing.Queue()
+            # Ids of jobs to kill (0 marks a free slot)
+            self.__kill_jobs = multiprocessing.Array(
+                'i',2*self.__workers,lock=False)
+            self.__pool = multiprocessing.Pool(
+                processes=self.__workers,
+                initializer=_init_python_worker,
+                initargs=(self.__pid_queue,self.__kill_jobs))
+        working_dir,target,args = self.__commands[job_id]
+        logging.debug("PythonPoolJobRunner: starting job %s: %s %s" %
+                      (job_id,target,args))
+        self.__running[job_id] = self.__pool.apply_async(
+            _run_python_job,
+            (job_id,working_dir,target,args,
+             self.__log_files[job_id],self.__err_files[job_id]),
+            callback=self.__job_returned)
+        self.__start_time[job_id] = time.time()
+
+    def __job_returned(self,result):
+        """Internal: store the result from a worker
+
+        Invoked (in a separate thread) by the pool when a job
+        returns.
+        """
+        job_id,exit_status,usage = result
+        with self.__lock:
+            # Worker has finished with the job so it no longer
+            # needs to be killed
+            _remove_kill_job(self.__kill_jobs,job_id)
+            if job_id not in self.__results:
+                self.__results[job_id] = (exit_status,usage,time.time())
+        self.__finished.set()
+
+    def __update_pids(self,timeout=None):
+        """Internal: collect the pids of the workers running jobs
+
+        If 'timeout' is set then waits up to that long for the
+        first pid to arrive. Pids for jobs which have already
+        finished are discarded.
+        """
+        if self.__pid_queue is None:
+            return
+        block = (timeout is not None)
+        while True:
+            try:
+                job_id,pid = self.__pid_queue.get(block,timeout)
+            except Queue.Empty:
+                return
+            if job_id in self.__running:
+                self.__pids[job_id] = pid
+            block = False
+
+    def __job_finished(self,job_id,exit_status,usage,end_time):
+        """Internal: record the exit status and resources for a job
+        """
+        del(self.__running[job_id])
+        try:
+            del(self.__pids[job_id])
+        except KeyError:
+            pass
+        logging.debug("Job id %s: finished (%s)" % (job_id,exit_status))
+        self.__exit_status[job_id] = exit_status
+        start_time = self.__start_time[job_id]
+        if usage is None:
+            usage = _resource_usage()
+        usage['queue_wait'] = start_time - self.__submit_time[job_id]
+        usage['wall_time'] = end_time - start_time
+        self.__rusage[job_id] = usage
+
 class GEJobRunner(BaseJobRunner):
     """Class implementing job runner for Grid Engine
 
@@ -370,9 +1097,27 @@ class GEJobRunner(BaseJobRunner):
     Additionally the runner can be configured for a specific GE
     queue on initialisation.
 
+    Multiple commands can be submitted together as a single GE
+    array job using the 'run_batch' method.
+
     Each GEJobRunner instance creates a temporary directory which
     it uses for internal admin; this will be removed at program
     exit via 'atexit'.
+
+    When a job finishes it moves a file with its exit code (and
+    queue) into the '__exit_codes' subdirectory of the admin
+    directory, so that all completed jobs can be detected with a
+    single listing of that directory (rather than checking for
+    files for each job individually, which is expensive on a
+    networked file system). The 'wait' method lists the same
+    directory at short intervals, so that a finished job is
+    picked up within a fraction of a second.
+
+    Jobs submitted by another GEJobRunner instance (e.g. in an
+    earlier run of a program which has since died) can be taken
+    over using the 'attach' method, with the information that
+    was returned by 'attach_info' for the job in the original
+    runner.
     """
 
     def __init__(self,queue=None,log_dir=None,ge_extra_args=None,
@@ -390,6 +1135,9 @@ class GEJobRunner(BaseJobRunner):
         """
         # Internal parameters
         self.__admin_dir = self.__make_admin_dir()
+        self.__exit_codes_dir = os.path.join(self.__admin_dir,
+                                             "__exit_codes")
+        os.mkdir(self.__exit_codes_dir)
         self.__job_count = 0
         self.__shell = "/bin/bash"
         self.__ge_queue = queue
@@ -405,6 +1153,9 @@ class GEJobRunner(BaseJobRunner):
         self.__updating_grace_period = {}
         self.__queue = {}
         self.__start_time = {}
+        self.__submit_time = {}
+        self.__rusage = {}
+        self.__attached = {}
         self.__ge_extra_args = ge_extra_args
         # Lock on job submission
         self.__submit_lock = False
@@ -417,11 +1168,16 @@ class GEJobRunner(BaseJobRunner):
         self.__cached_qstat_output_lifetime = 2.0
         self.__cached_qstat_output_timestamp = 0.0
         self.__cached_qstat_output = None
+        # Count of filesystem operations made by 'list'
+        self.__nfs_ops = 0
         # Grace period for new jobs
         self.__new_job_grace_period = 2.0
         # Polling intervals and timeout periods (seconds)
         self.__ge_poll_interval = poll_interval
         self.__ge_timeout = timeout
+        # Interval (seconds) for checking for completed jobs
+        # in 'wait'
+        self.__completion_poll_interval = 0.25
         # Register clean up function
         atexit.register(self.__clean_up_admin_dir)
 
@@ -493,10 +1249,9 @@ class GEJobRunner(BaseJobRunner):
             fp.write("""#!%s
 echo "$QUEUE" > %s/__queue
 %s
-exit_code=$?
-echo "$exit_code" > %s/__exit_code
 exit $exit_code
-""" % (self.__shell,job_dir,cmd,job_dir))
+""" % (self.__shell,job_dir,
+       self.__run_cmd(cmd,job_dir,job_number)))
         os.chmod(job_script,0755)
         # Sanitize name for GE by replacing invalid characters
         # (colon, asterisk...)
@@ -547,11 +1302,176 @@ exit $exit_code
             else:
                 self.__log_dirs[job_id] = self.log_dir
             self.__start_time[job_id] = time.time()
+            self.__submit_time[job_id] = self.__start_time[job_id]
         # Force refresh of job list
         self.__cached_job_list_force_update = True
         # Return the job id
         return job_id
 
+    def run_batch(self,name,commands):
+        """Submit multiple commands to the cluster as an array job
+
+        The commands are submitted as the tasks of a single
+        Grid Engine array job via one 'qsub -t 1-N' call, which
+        avoids the overhead of submitting each one individually.
+
+        Each task has its own admin directory (and so its own
+        exit code file) and writes its own log files, named
+        '<name>.o<job_id>' and '<name>.e<job_id>' (in the log
+        directory, or the command's working directory if no log
+        directory is set).
+
+        Arguments:
+          name: Name to give the array job
+          commands: list of (working_dir,script,args) tuples
+            with the working directory, script file and list of
+            script arguments for each command
+
+        Returns:
+          List of job ids for the submitted commands (of the
+          form '<array_job_id>.<task_id>'), in the same order
+          as the commands; if the submission failed then all
+          the ids will be 'None'.
+        """
+        ntasks = len(commands)
+        logging.debug("GEJobRunner: submitting array job")
+        logging.debug("Name       : %s" % name)
+        logging.debug("Tasks      : %d" % ntasks)
+        logging.debug("Queue      : %s" % self.__ge_queue)
+        logging.debug("Extra args : %s" % self.__ge_extra_args)
+        logging.debug("Log dir    : %s" % self.log_dir)
+        if not ntasks:
+            return []
+        # Wait for lock on job submission
+        start_time = time.time()
+        while self.__submit_lock:
+            time.sleep(1.0)
+            if (time.time() - start_time) > self.__ge_timeout:
+                raise Exception("GEJobRunner: timed out waiting "
+                                "for job submission lock")
+        # Grab the lock and get a block of internal job numbers
+        # (one for each task)
+        self.__submit_lock = True
+        first_job_number = self.__job_count + 1
+        self.__job_count += ntasks
+        logging.debug("Internal job count: %s" % self.__job_count)
+        # Release the lock
+        self.__submit_lock = False
+        # Sanitize name for GE
+        ge_name = self.__ge_name(name)
+        logging.debug("GE job name: %s" % ge_name)
+        # Check if stdout and stderr should be joined
+        join_logs = False
+        if self.__ge_extra_args:
+            extra_args = list(self.__ge_extra_args)
+            for i,arg in enumerate(extra_args[:-1]):
+                if arg == '-j' and extra_args[i+1] == 'y':
+                    join_logs = True
+        # Build scripts to run each command as a task
+        log_dirs = []
+        for i,(working_dir,script,args) in enumerate(commands):
+            job_number = first_job_number + i
+            job_dir = os.path.join(self.__admin_dir,str(job_number))
+            logging.debug("Task %d admin dir: %s" % (i+1,job_dir))
+            os.mkdir(job_dir)
+            if not working_dir:
+                working_dir = os.getcwd()
+            if self.log_dir is None:
+                log_dir = working_dir
+            else:
+                log_dir = self.log_dir
+            log_dirs.append(log_dir)
+            log_file = os.path.join(log_dir,
+                                    "%s.o${JOB_ID}.${SGE_TASK_ID}" % ge_name)
+            if join_logs:
+                redirect = "exec >\"%s\" 2>&1" % log_file
+            else:
+                err_file = os.path.join(log_dir,
+                                        "%s.e${JOB_ID}.${SGE_TASK_ID}" %
+                                        ge_name)
+                redirect = "exec >\"%s\" 2>\"%s\"" % (log_file,err_file)
+            cmd_args = [script]
+            for arg in args:
+                # Quote arguments containing whitespace
+                if arg.count(' ') or arg.count('\t'):
+                    arg = "\"%s\"" % arg
+                cmd_args.append(arg)
+            cmd = ' '.join(cmd_args)
+            job_script = os.path.join(job_dir,"job_script.sh")
+            with open(job_script,'w') as fp:
+                fp.write("""#!%s
+%s
+echo "$QUEUE" > %s/__queue
+cd "%s"
+%s
+exit $exit_code
+""" % (self.__shell,redirect,job_dir,working_dir,
+       self.__run_cmd(cmd,job_dir,job_number)))
+            os.chmod(job_script,0755)
+        # Build the array job script which runs the script for
+        # the appropriate task
+        array_script = os.path.join(self.__admin_dir,
+                                    "array_job_script.%d.sh" %
+                                    first_job_number)
+        with open(array_script,'w') as fp:
+            fp.write("""#!%s
+exec %s/$((SGE_TASK_ID + %d))/job_script.sh
+""" % (self.__shell,self.__admin_dir,first_job_number-1))
+        os.chmod(array_script,0755)
+        # Build qsub command to submit the array job
+        # Nb output from GE itself goes to the admin directory
+        # as the tasks write their own log files
+        qsub = ['qsub','-b','y','-V','-N',ge_name,'-t','1-%d' % ntasks,
+                '-o',self.__admin_dir,'-e',self.__admin_dir,
+                '-wd',self.__admin_dir]
+        if self.__ge_queue:
+            qsub.extend(('-q',self.__ge_queue))
+        if self.__ge_extra_args:
+            qsub.extend(self.__ge_extra_args)
+        qsub.append(array_script)
+        logging.debug("GEJobRunner: qsub command: %s" % qsub)
+        # Run the qsub job in the current directory
+        cwd = os.getcwd()
+        logging.debug("GEJobRunner: executing in %s" % cwd)
+        if not os.path.exists(cwd):
+            logging.error("GEJobRunner: cwd doesn't exist!")
+            return [None]*ntasks
+        p = subprocess.Popen(qsub,cwd=cwd,
+                             stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE)
+        p.wait()
+        # Check stderr
+        error = p.stderr.read().strip()
+        if error:
+            # Just echo error message as a warning
+            logging.warning("GEJobRunner: '%s'" % error)
+        # Capture the array job id from the output, which
+        # looks like e.g.
+        # Your job-array 12345.1-4:1 ("name") has been submitted
+        array_job_id = None
+        for line in p.stdout:
+            if line.startswith('Your job-array'):
+                array_job_id = line.split()[2].split('.')[0]
+        logging.debug("GEJobRunner: done - array job id = %s" %
+                      array_job_id)
+        if array_job_id is None:
+            return [None]*ntasks
+        # Store internal number, name and log dir against the
+        # job id for each task
+        job_ids = []
+        for i in xrange(ntasks):
+            job_id = "%s.%d" % (array_job_id,i+1)
+            self.__job_number[job_id] = first_job_number + i
+            self.__names[job_id] = name
+            self.__log_dirs[job_id] = log_dirs[i]
+            self.__start_time[job_id] = time.time()
+            self.__submit_time[job_id] = self.__start_time[job_id]
+            job_ids.append(job_id)
+        # Force refresh of job list
+        self.__cached_job_list_force_update = True
+        # Return the job ids
+        return job_ids
+
     def terminate(self,job_id):
         """Remove a job from the GE queue using 'qdel'
         """
@@ -563,10 +1483,10 @@ exit $exit_code
         logging.debug("GEJobRunner: qdel: %s" % message)
         if job_id in self.__start_time:
             del(self.__start_time[job_id])
+        if job_id in self.__attached:
+            del(self.__attached[job_id])
         # Write an exit code file for the job
-        exit_code_file = os.path.join(self.__admin_dir,
-                                      str(self.__job_number[job_id]),
-                                      "__exit_code")
+        exit_code_file = self.__exit_code_file(self.__job_number[job_id])
         with open(exit_code_file,'w') as fp:
             fp.write("-1\n")
         # Force update of cached job list
@@ -632,12 +1552,14 @@ exit $exit_code
                                   str(self.__job_number[job_id]),
                                   "__queue")
         logging.debug("GEJobRunner: queue file: %s" % queue_file)
+        self.__nfs_ops += 1
         if not os.path.exists(queue_file):
             # No queue file available
             logging.debug("GEJobRunner: queue file not found")
             return None
         # Extract queue name from file
         try:
+            self.__nfs_ops += 1
             with open(queue_file,'r') as fp:
                 queue = fp.read().strip()
             logging.debug("GEJobRunner: queue: %s" % queue)
@@ -669,8 +1591,18 @@ exit $exit_code
         for job_id in self.__start_time.keys():
             self.__update_job_grace_period(job_id)
         grace_period_jobs = self.__start_time.keys()
+        # Collect exit codes for re-attached jobs
+        self.__nfs_ops = 0
+        if self.__attached:
+            self.__check_attached_jobs()
+        # Get the internal numbers of the finished jobs from a
+        # single listing of the exit codes directory
+        self.__nfs_ops += 1
+        finished_jobs = set(os.listdir(self.__exit_codes_dir))
         # Build initial list from directory contents
         job_ids = []
+        njobs = 0
+        ncompleted = 0
         for job_id in self.__job_number.keys():
             try:
                 job_number = self.__job_number[job_id]
@@ -678,19 +1610,19 @@ exit $exit_code
                 # Job has been removed since the list was
                 # fetched? Ignore
                 continue
-            job_dir = os.path.join(self.__admin_dir,str(job_number))
-            exit_code_file = os.path.join(job_dir,"__exit_code")
-            logging.debug("GEJobRunner: checking job %s (#%s)"
-                          % (job_id,job_number))
-            if os.path.exists(job_dir):
-                logging.debug("GEJobRunner: -- found %s" % job_dir)
-                # Job dir exists
-                if os.path.exists(exit_code_file):
-                    # Job has finished, handle completion
-                    self.__handle_job_completion(job_id)
-                else:
-                    # Job still running
-                    job_ids.append(job_id)
+            njobs += 1
+            if str(job_number) in finished_jobs:
+                # Job has finished, handle completion
+                logging.debug("GEJobRunner: job %s (#%s) has finished"
+                              % (job_id,job_number))
+                self.__handle_job_completion(job_id)
+                ncompleted += 1
+            else:
+                # Job still running
+                job_ids.append(job_id)
+        logging.debug("GEJobRunner: 'list' checked %d jobs (%d completed) "
+                      "using %d filesystem operations" %
+                      (njobs,ncompleted,self.__nfs_ops))
         # Update cache
         self.__cached_job_list_timestamp = time.time()
         self.__cached_job_list = [j for j in job_ids]
@@ -705,6 +1637,91 @@ exit $exit_code
         logging.debug("GEJobRunner: 'list' returning %s" % job_ids)
         return job_ids
 
+    def wait(self,timeout):
+        """Wait for a job to finish
+
+        Checks the exit codes directory at short intervals and
+        returns as soon as a file for one of the jobs appears
+        there (forcing the next call to 'list' to update), or
+        after 'timeout' seconds.
+        """
+        end_time = time.time() + timeout
+        while True:
+            job_numbers = set([str(n) for n in self.__job_number.values()])
+            if job_numbers.intersection(os.listdir(self.__exit_codes_dir)):
+                self.__cached_job_list_force_update = True
+                return True
+            remaining = end_time - time.time()
+            if remaining <= 0:
+                return False
+            time.sleep(min(self.__completion_poll_interval,remaining))
+
+    def attach_info(self,job_id):
+        """Return the information needed to re-attach to a job
+
+        Returns a dictionary (which can be serialised e.g. as
+        JSON) which can be passed to the 'attach' method of
+        another GEJobRunner instance, to allow that runner to
+        take over monitoring the job (for example if the program
+        which submitted it dies). Returns None if the job isn't
+        known.
+        """
+        try:
+            job_number = self.__job_number[job_id]
+        except KeyError:
+            return None
+        return dict(name=self.__names[job_id],
+                    log_dir=self.__log_dirs[job_id],
+                    exit_code_file=self.__exit_code_file(job_number),
+                    submit_time=self.__submit_time.get(job_id))
+
+    def attach(self,job_id,info):
+        """Take over monitoring of a job submitted elsewhere
+
+        The job is then handled in the same way as jobs that
+        were submitted by this runner, except that the exit
+        code file is looked for in the admin directory of the
+        original runner. If the job is no longer in the queue
+        and no exit code was written (e.g. the original admin
+        directory was removed) then the exit status will be
+        set to 127.
+
+        Arguments:
+          job_id: GE job id of the job to attach to
+          info: dictionary returned by 'attach_info' for the
+            job in the original runner
+
+        Returns:
+          True if the job was attached, False otherwise.
+        """
+        if job_id in self.__job_number:
+            logging.warning("GEJobRunner: job %s is already managed "
+                            "by this runner" % job_id)
+            return False
+        try:
+            name = info['name']
+            log_dir = info['log_dir']
+            exit_code_file = info['exit_code_file']
+        except (KeyError,TypeError) as ex:
+            logging.error("GEJobRunner: bad information for attaching "
+                          "to job %s: %s" % (job_id,ex))
+            return False
+        logging.debug("GEJobRunner: attaching to job %s" % job_id)
+        self.__job_count += 1
+        job_number = self.__job_count
+        os.mkdir(os.path.join(self.__admin_dir,str(job_number)))
+        self.__job_number[job_id] = job_number
+        self.__names[job_id] = name
+        self.__log_dirs[job_id] = log_dir
+        self.__attached[job_id] = exit_code_file
+        self.__start_time[job_id] = time.time()
+        submit_time = info.get('submit_time')
+        if submit_time is not None:
+            self.__submit_time[job_id] = submit_time
+        # Force refresh of job list
+        self.__cached_job_list_force_update = True
+        return True
+
     def exit_status(self,job_id):
         """
         Return exit status from command run by a job
@@ -726,6 +1743,91 @@ exit $exit_code
         # Return cached exit status
         return self.__exit_status[job_id]
 
+    def resource_usage(self,job_id):
+        """Return the resources used by a finished job
+
+        See BaseJobRunner.resource_usage for details. The queue
+        wait is the time from submission to the job starting on
+        the execution host; the maximum RSS is only available if
+        '/usr/bin/time' is installed on the execution host.
+        """
+        if self.isRunning(job_id):
+            return None
+        return self.__rusage.get(job_id)
+
+    def __check_attached_jobs(self):
+        """Internal: collect exit codes for re-attached jobs
+
+        For each job attached via the 'attach' method, moves the
+        exit code file from the original admin directory into
+        this runner's exit codes directory, if it exists. If
+        the job is no longer in the queue and the file doesn't
+        exist then an exit code file is written with the exit
+        status 127.
+        """
+        for job_id in self.__attached.keys():
+            exit_code_file = self.__attached[job_id]
+            job_number = self.__job_number[job_id]
+            # Check the queue before the file, so a job which
+            # finishes in between isn't treated as lost
+            in_queue = bool(self.__job_state_code(job_id))
+            self.__nfs_ops += 1
+            if os.path.exists(exit_code_file):
+                self.__nfs_ops += 1
+                shutil.move(exit_code_file,
+                            self.__exit_code_file(job_number))
+            elif not in_queue:
+                logging.warning("GEJobRunner: attached job %s has "
+                                "left the queue without writing an "
+                                "exit code" % job_id)
+                with open(self.__exit_code_file(job_number),'w') as fp:
+                    fp.write("127\n")
+            else:
+                # Still running
+                continue
+            del(self.__attached[job_id])
+
+    def __exit_code_file(self,job_number):
+        """Internal: return path to the exit code file for a job
+
+        The file is named for the internal job number, in the
+        '__exit_codes' subdirectory of the admin directory.
+        """
+        return os.path.join(self.__exit_codes_dir,str(job_number))
+
+    def __run_cmd(self,cmd,job_dir,job_number):
+        """Internal: return shell commands to run a job command
+
+        The commands run the command (setting 'exit_code'), and
+        then write the exit code, queue, start and end times and
+        CPU usage to a file in the job's admin directory, which
+        is then moved into the exit codes directory (so that the
+        file is complete when it appears there).
+
+        CPU times and maximum RSS come from '/usr/bin/time' if
+        it's available on the execution host; otherwise the CPU
+        times are taken from the 'times' shell builtin.
+        """
+        return """__start_time=$(date +%%s.%%N)
+if [ -x /usr/bin/time ] ; then
+/usr/bin/time -f "%%U:%%S:%%M" -o %s/__rusage %s
+else
+%s
+fi
+exit_code=$?
+__end_time=$(date +%%s.%%N)
+times > %s/__times
+printf "%%s\\n%%s\\n%%s %%s\\n" "$exit_code" "$QUEUE" "$__start_time" "$__end_time" > %s/__exit_code
+if [ -f %s/__rusage ] ; then
+tail -n 1 %s/__rusage >> %s/__exit_code
+else
+tail -n 1 %s/__times >> %s/__exit_code
+fi
+mv %s/__exit_code %s""" % (job_dir,cmd,cmd,
+                           job_dir,job_dir,
+                           job_dir,job_dir,job_dir,job_dir,job_dir,
+                           job_dir,self.__exit_code_file(job_number))
+
     def __make_admin_dir(self):
         """Internal: create temporary directory for admin etc
 
@@ -800,20 +1902,17 @@ exit $exit_code
 
         Peforms the following operations:
 
-        - checks that an '__exit_code' file exists for
-          the job
-        - read and store the exit status/return code from
-          this file
+        - read and store the exit status/return code (and
+          the queue, if present) from the job's exit code
+          file
         - ensure that the queue is set for the job
         - call the clean up function to remove all the
           associated files
         - remove the job from the internal job count
 
-        If the '__exit_code' file associated with the job
-        can't be found after a number of attempts to locate
-        it, or if the exit status cannot be read from the
-        file, then the exit status for the job will be
-        set to '127'.
+        If the exit status cannot be read from the exit code
+        file, then the exit status for the job will be set
+        to '127'.
         """
         logging.debug("GEJobRunner: handle job completion for %s"
                       % job_id)
@@ -827,20 +1926,24 @@ exit $exit_code
         except KeyError:
             logging.debug("GEJobRunner: finalizing job %s" % job_id)
         self.__finalizing[job_id] = True
-        # Check there is an exit code file
-        exit_code_file = os.path.join(self.__admin_dir,
-                                      str(self.__job_number[job_id]),
-                                      "__exit_code")
-        assert(os.path.exists(exit_code_file))
+        # Read the exit code file
+        exit_code_file = self.__exit_code_file(self.__job_number[job_id])
         try:
+            self.__nfs_ops += 1
             with open(exit_code_file,'r') as fp:
-                exit_status = int(fp.read())
+                data = fp.read().split('\n')
+            exit_status = int(data[0])
+            if len(data) > 1 and data[1] and job_id not in self.__queue:
+                self.__queue[job_id] = data[1]
         except Exception as ex:
             # Set exit status to 127
             logging.error("GEJobRunner: exception when "
                           "reading exit_status for job "
                           "%s: %s" % (job_id,ex))
             exit_status = 127
+            data = []
+        # Store resource usage
+        self.__rusage[job_id] = self.__parse_resource_usage(job_id,data[2:])
         # Update queue information
         self.queue(job_id)
         # Store exit status and clean up
@@ -849,6 +1952,48 @@ exit $exit_code
         # Release finalization lock
         del(self.__finalizing[job_id])
 
+    def __parse_resource_usage(self,job_id,data):
+        """Internal: get resource usage from exit code file data
+
+        'data' should be a list of lines from the exit code file
+        after the exit code and queue, i.e. the start and end
+        times of the job (seconds since the epoch), and then
+        either the output from '/usr/bin/time' (user and system
+        CPU times and maximum RSS, separated by colons) or from
+        'times' (the last line, with the user and system CPU
+        times for child processes e.g. '0m1.023s 0m0.120s').
+
+        Returns a resource usage dictionary (see
+        BaseJobRunner.resource_usage); values which can't be
+        determined are set to None.
+        """
+        usage = _resource_usage()
+        try:
+            start_time,end_time = [float(t) for t in data[0].split()]
+            usage['wall_time'] = end_time - start_time
+            usage['queue_wait'] = max(start_time -
+                                      self.__submit_time[job_id],0.0)
+        except (IndexError,KeyError,ValueError):
+            pass
+        try:
+            cpu = data[1].strip()
+            if ':' in cpu:
+                # From /usr/bin/time
+                user_time,sys_time,max_rss = cpu.split(':')
+                usage['user_time'] = float(user_time)
+                usage['sys_time'] = float(sys_time)
+                usage['max_rss'] = int(max_rss)
+            else:
+                # From 'times' e.g. '0m1.023s 0m0.120s'
+                cpu_times = []
+                for t in cpu.split():
+                    mins,secs = t.rstrip('s').split('m')
+                    cpu_times.append(int(mins)*60.0 + float(secs))
+                usage['user_time'],usage['sys_time'] = cpu_times
+        except (IndexError,ValueError):
+            pass
+        return usage
+
     def __clean_up_job(self,job_id):
         """Internal: clean up internal job files
 
@@ -869,8 +2014,11 @@ exit $exit_code
             return
         job_dir = os.path.join(self.__admin_dir,str(job_number))
         try:
-            # Remove the directory and contents
+            # Remove the directory and contents, and the
+            # exit code file
+            self.__nfs_ops += 2
             shutil.rmtree(job_dir)
+            os.remove(self.__exit_code_file(job_number))
         except Exception as ex:
             logging.warning("GEJobRunner: exception cleaning up for "
                             "job %s (ignored): %s" % (job_id,ex))
@@ -1023,18 +2171,55 @@ exit $exit_code
         logging.debug("GEJobRunner: acquiring state for job %s"
                       % job_id)
         qstat = self.__run_qstat()
-        job_ids = []
-        job_states = {}
+        # Array job tasks have ids of the form '<job_id>.<task_id>'
+        try:
+            job_id,task_id = job_id.split('.')
+            task_id = int(task_id)
+        except ValueError:
+            task_id = None
         for job_data in qstat:
             id_ = job_data[0]
             state = job_data[4]
             logging.debug("GEJobRunner: found job %s (state '%s')"
                           % (id_,state))
             if id_ == job_id:
-                return state
+                if task_id is None:
+                    return state
+                # Check the task is in the 'ja-task-ID' field
+                # (last field of the line for array jobs)
+                if len(job_data) > 8 and \
+                   task_id in self.__expand_task_ids(job_data[-1]):
+                    return state
         # Job not found
         return ""
 
+    def __expand_task_ids(self,task_ids):
+        """
+        Internal: expand the task ids for an array job from qstat
+
+        Converts the 'ja-task-ID' field from qstat (for example
+        '3', '1-4:1' or '1,5-7:2') into a list of integer task ids.
+        Returns an empty list if the field can't be interpreted.
+        """
+        expanded = []
+        try:
+            for task_range in task_ids.split(','):
+                task_range = task_range.split(':')
+                try:
+                    step = int(task_range[1])
+                except IndexError:
+                    step = 1
+                task_range = task_range[0].split('-')
+                start = int(task_range[0])
+                try:
+                    end = int(task_range[1])
+                except IndexError:
+                    end = start
+                expanded.extend(range(start,end+1,step))
+        except ValueError:
+            return []
+        return expanded
+
     def __ge_name(self,name):
         """Internal: sanitize a name for use with GE
         """
@@ -1170,6 +2355,73 @@ class DRMAAJobRunner(BaseJobRunner):
                 job_ids.append(job)
         return job_ids
 
+class _ProcessWatcher(object):
+    """Internal: reap child processes as soon as they exit
+
+    Each process added to the watcher gets its own (daemon)
+    thread, which blocks in 'os.wait4' until the process exits
+    and then stores the exit status, resource usage and end
+    time, and wakes up anything blocked in the 'wait' method.
+
+    This means that the local job runners don't have to poll
+    their child processes to find out when they've finished.
+    """
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__finished = threading.Event()
+        self.__threads = {}
+        self.__results = {}
+
+    def watch(self,key,p):
+        """Start watching a process from a Popen instance
+        """
+        thread = threading.Thread(target=self.__reap,args=(key,p))
+        thread.daemon = True
+        self.__threads[key] = thread
+        thread.start()
+
+    def poll(self,key):
+        """Check whether a watched process has finished
+
+        Returns a tuple (exit_status,rusage,end_time) if the
+        process has finished (in which case it is no longer
+        watched), or (None,None,None) if it is still running.
+        """
+        with self.__lock:
+            try:
+                result = self.__results.pop(key)
+            except KeyError:
+                return (None,None,None)
+        del(self.__threads[key])
+        return result
+
+    def join(self,key):
+        """Wait for a watched process to finish
+
+        Returns the tuple (exit_status,rusage,end_time).
+        """
+        self.__threads[key].join()
+        return self.poll(key)
+
+    def wait(self,timeout):
+        """Wait for any watched process to finish
+
+        Returns True if a process finished within 'timeout'
+        seconds (or had already finished since the last call),
+        False otherwise.
+        """
+        finished = self.__finished.wait(timeout)
+        self.__finished.clear()
+        return bool(finished)
+
+    def __reap(self,key,p):
+        """Internal: wait for a process to exit and store the result
+        """
+        status,rusage = _reap(p,0)
+        with self.__lock:
+            self.__results[key] = (status,rusage,time.time())
+        self.__finished.set()
+
 #######################################################################
 # Functions
 #######################################################################
@@ -1184,14 +2436,62 @@ def fetch_runner(definition):
 
       RunnerName[(args)]
 
-    RunnerName can be 'SimpleJobRunner' or 'GEJobRunner'.
-    If '(args)' are also supplied then these are passed to
-    the job runner on instantiation (only works for
-    GE runners).
+    RunnerName can be 'SimpleJobRunner', 'GEJobRunner',
+    'local' (or 'LocalPoolJobRunner') or 'python' (or
+    'PythonPoolJobRunner'). If '(args)' are also supplied then
+    these are passed to the job runner on instantiation (only
+    works for GE, local and python runners).
+
+    For GE runners the arguments are passed to 'qsub'; for
+    local runners they are comma-separated 'cpus' and 'mem'
+    settings, e.g. 'local(cpus=64,mem=256G)' (memory can
+    have a unit of 'M', 'G' or 'T'; if no unit is given then
+    Gb are assumed). For python runners the argument is the
+    number of workers, e.g. 'python(workers=8)'.
 
     """
     if definition.startswith('SimpleJobRunner'):
         return SimpleJobRunner(join_logs=True)
+    elif definition.startswith('local') or \
+         definition.startswith('LocalPoolJobRunner'):
+        kws = {}
+        if definition.endswith(')') and definition.count('('):
+            args = definition[definition.index('(')+1:len(definition)-1]
+            for arg in args.split(','):
+                if not arg.strip():
+                    continue
+                try:
+                    key,value = [x.strip() for x in arg.split('=')]
+                except ValueError:
+                    raise Exception("Bad argument '%s' in runner "
+                                    "definition: %s" % (arg,definition))
+                if key == 'cpus':
+                    kws['cpus'] = int(value)
+                elif key == 'mem':
+                    kws['mem'] = _mem_in_gb(value)
+                else:
+                    raise Exception("Unrecognised argument '%s' in runner "
+                                    "definition: %s" % (key,definition))
+        return LocalPoolJobRunner(join_logs=True,**kws)
+    elif definition.startswith('python') or \
+         definition.startswith('PythonPoolJobRunner'):
+        kws = {}
+        if definition.endswith(')') and definition.count('('):
+            args = definition[definition.index('(')+1:len(definition)-1]
+            for arg in args.split(','):
+                if not arg.strip():
+                    continue
+                try:
+                    key,value = [x.strip() for x in arg.split('=')]
+                except ValueError:
+                    raise Exception("Bad argument '%s' in runner "
+                                    "definition: %s" % (arg,definition))
+                if key == 'workers':
+                    kws['workers'] = int(value)
+                else:
+                    raise Exception("Unrecognised argument '%s' in runner "
+                                    "definition: %s" % (key,definition))
+        return PythonPoolJobRunner(join_logs=True,**kws)
     elif definition.startswith('GEJobRunner'):
         if definition.startswith('GEJobRunner(') and definition.endswith(')'):
             ge_extra_args = definition[len('GEJobRunner('):len(definition)-1].split(' ')
@@ -1199,3 +2499,279 @@ def fetch_runner(definition):
         else:
             return GEJobRunner()
     raise Exception("Unrecognised runner definition: %s" % definition)
+
+# Globals for PythonPoolJobRunner worker processes
+_python_worker_pid_queue = None
+_python_worker_kill_jobs = None
+_python_worker_job = None
+_python_worker_child = None
+_python_targets = {}
+
+def _init_python_worker(pid_queue,kill_jobs):
+    """Internal: initialise a PythonPoolJobRunner worker process
+
+    Stores the queue used to report which worker is running
+    each job, and the shared array holding the ids of the jobs
+    which should be terminated.
+    """
+    global _python_worker_pid_queue
+    global _python_worker_kill_jobs
+    _python_worker_pid_queue = pid_queue
+    _python_worker_kill_jobs = kill_jobs
+    signal.signal(signal.SIGTERM,_terminate_python_worker)
+
+def _add_kill_job(kill_jobs,job_id):
+    """Internal: add a job id to the shared array of jobs to kill
+
+    Returns True if the job id was added, False if there was
+    no free slot in the array.
+    """
+    job_id = int(job_id)
+    for i in xrange(len(kill_jobs)):
+        if kill_jobs[i] == job_id:
+            return True
+    for i in xrange(len(kill_jobs)):
+        if kill_jobs[i] == 0:
+            kill_jobs[i] = job_id
+            return True
+    return False
+
+def _remove_kill_job(kill_jobs,job_id):
+    """Internal: remove a job id from the shared array of jobs to kill
+
+    Returns True if the job id was in the array.
+    """
+    job_id = int(job_id)
+    found = False
+    for i in xrange(len(kill_jobs)):
+        if kill_jobs[i] == job_id:
+            kill_jobs[i] = 0
+            found = True
+    return found
+
+def _terminate_python_worker(signum,frame):
+    """Internal: handle SIGTERM in a PythonPoolJobRunner worker
+
+    The worker is only killed if it is still running a job
+    that was requested to be terminated; otherwise (e.g. the
+    job finished and the worker has moved on to another one)
+    the signal is ignored. If the job is running a script
+    then the script's process group is killed first.
+    """
+    if _python_worker_job is None or \
+       _python_worker_kill_jobs is None or \
+       not _remove_kill_job(_python_worker_kill_jobs,_python_worker_job):
+        return
+    if _python_worker_child is not None and \
+       _python_worker_child.returncode is None:
+        try:
+            os.killpg(_python_worker_child.pid,signal.SIGTERM)
+        except OSError:
+            pass
+    # Restore default signal handling and kill the worker
+    signal.signal(signal.SIGTERM,signal.SIG_DFL)
+    os.kill(os.getpid(),signal.SIGTERM)
+
+def _load_python_target(target):
+    """Internal: return the function for a Python job target
+
+    'target' should be of the form 'module:function' or
+    'path/to/script.py:function'; returns None if it isn't a
+    Python target. Functions are cached, so each module is only
+    loaded once per worker.
+    """
+    try:
+        return _python_targets[target]
+    except KeyError:
+        pass
+    match = re.match(r"^(.+):([A-Za-z_][A-Za-z0-9_]*)$",target)
+    if not match:
+        return None
+    module,function = match.groups()
+    if module.endswith('.py'):
+        name = "_pythonpooljob_%d" % len(_python_targets)
+        module = imp.load_source(name,os.path.abspath(module))
+    else:
+        module = importlib.import_module(module)
+    func = getattr(module,function)
+    _python_targets[target] = func
+    return func
+
+def _takes_arguments(func):
+    """Internal: check if a Python job function takes arguments
+
+    Returns False only if the function is known to take no
+    arguments at all (e.g. 'def main():'); otherwise returns
+    True.
+    """
+    try:
+        argspec = inspect.getargspec(func)
+    except TypeError:
+        # Not a Python function (e.g. a builtin or callable
+        # object), assume it takes arguments
+        return True
+    return bool(argspec.args or argspec.varargs)
+
+def _run_python_job(job_id,working_dir,target,args,log_file,err_file):
+    """Internal: run a PythonPoolJobRunner job in a worker process
+
+    Redirects stdout and stderr (at the file descriptor level, so
+    output from subprocesses is also captured) to the log files,
+    changes to the working directory, and runs the target function
+    (or script, via a subprocess). The worker's state is restored
+    afterwards.
+
+    Functions which take no arguments (e.g. a 'main' function
+    which reads 'sys.argv') are called without the argument list.
+
+    Returns a tuple (job_id,exit_status,usage) where usage is a
+    resource usage dictionary.
+    """
+    global _python_worker_job
+    global _python_worker_child
+    _python_worker_job = job_id
+    if _python_worker_pid_queue is not None:
+        _python_worker_pid_queue.put((job_id,os.getpid()))
+    usage_start = (resource.getrusage(resource.RUSAGE_SELF),
+                   resource.getrusage(resource.RUSAGE_CHILDREN))
+    sys.stdout.flush()
+    sys.stderr.flush()
+    saved_fds = (os.dup(1),os.dup(2))
+    saved_argv = sys.argv
+    cwd = os.getcwd()
+    try:
+        try:
+            with open(log_file,'w') as log:
+                os.dup2(log.fileno(),1)
+            if err_file is not None:
+                with open(err_file,'w') as err:
+                    os.dup2(err.fileno(),2)
+            else:
+                os.dup2(1,2)
+            os.chdir(working_dir)
+            func = _load_python_target(target)
+            if func is None:
+                # Not a Python target, run as a script (in its
+                # own process group, so that it can be killed
+                # along with any processes it starts)
+                _python_worker_child = subprocess.Popen(
+                    [target] + list(args),
+                    preexec_fn=os.setsid)
+                exit_status = _python_worker_child.wait()
+            else:
+                sys.argv = [target] + list(args)
+                if _takes_arguments(func):
+                    exit_status = func(list(args))
+                else:
+                    exit_status = func()
+                if exit_status is None:
+                    exit_status = 0
+                elif not isinstance(exit_status,int):
+                    exit_status = 1
+        except SystemExit as ex:
+            if ex.code is None:
+                exit_status = 0
+            elif isinstance(ex.code,int):
+                exit_status = ex.code
+            else:
+                sys.stderr.write("%s\n" % ex.code)
+                exit_status = 1
+        except BaseException:
+            traceback.print_exc()
+            exit_status = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os.dup2(saved_fds[0],1)
+        os.dup2(saved_fds[1],2)
+        for fd in saved_fds:
+            os.close(fd)
+        sys.argv = saved_argv
+        os.chdir(cwd)
+        if _python_worker_kill_jobs is not None:
+            _remove_kill_job(_python_worker_kill_jobs,job_id)
+        _python_worker_job = None
+        _python_worker_child = None
+    usage_end = (resource.getrusage(resource.RUSAGE_SELF),
+                 resource.getrusage(resource.RUSAGE_CHILDREN))
+    usage = _resource_usage(
+        user_time=sum([end.ru_utime - start.ru_utime
+                       for start,end in zip(usage_start,usage_end)]),
+        sys_time=sum([end.ru_stime - start.ru_stime
+                      for start,end in zip(usage_start,usage_end)]),
+        max_rss=max([u.ru_maxrss for u in usage_end]))
+    return (job_id,exit_status,usage)
+
+def _mem_in_gb(mem):
+    """Internal: convert a memory specification to Gb
+
+    Converts a string such as '256G', '512M' or '1T' to a
+    number of Gb (a string with no unit is assumed to be in
+    Gb already).
+    """
+    mem = mem.strip().upper()
+    if mem.endswith('B'):
+        mem = mem[:-1]
+    units = { 'M': 1.0/1024.0, 'G': 1.0, 'T': 1024.0 }
+    if mem and mem[-1] in units:
+        return float(mem[:-1])*units[mem[-1]]
+    return float(mem)
+
+def _reap(p,options=os.WNOHANG):
+    """Internal: reap a child process and get its resource usage
+
+    Uses 'os.wait4' to wait for the process from a Popen
+    instance (by default without blocking).
+
+    Returns a tuple (exit_status,rusage), where exit_status
+    follows the Popen convention (i.e. negative signal number if
+    the process was killed by a signal) and rusage is the
+    resource usage structure from 'os.wait4'; if the process is
+    still running then returns (None,None). If the status can't
+    be collected (e.g. because the process was already reaped
+    elsewhere) then the exit status is set to 127, unless the
+    Popen instance already has a return code.
+    """
+    while True:
+        try:
+            pid,status,rusage = os.wait4(p.pid,options)
+            break
+        except OSError as ex:
+            if ex.errno == errno.EINTR:
+                # Interrupted by a signal, try again
+                continue
+            # Process already reaped elsewhere? If its exit status
+            # is unknown then report a failure
+            logging.error("Failed to check process %s: %s" % (p.pid,ex))
+            if p.returncode is None:
+                p.returncode = 127
+            return (p.returncode,None)
+    if pid == 0:
+        # Still running
+        return (None,None)
+    if os.WIFSIGNALED(status):
+        exit_status = -os.WTERMSIG(status)
+    else:
+        exit_status = os.WEXITSTATUS(status)
+    # Process has been reaped so tell the Popen instance
+    p.returncode = exit_status
+    return (exit_status,rusage)
+
+def _resource_usage(queue_wait=None,wall_time=None,user_time=None,
+                    sys_time=None,max_rss=None,rusage=None):
+    """Internal: make a resource usage dictionary for a job
+
+    The values for the CPU times and maximum RSS can be taken
+    from a resource usage structure (e.g. from 'os.wait4') if
+    one is supplied. See BaseJobRunner.resource_usage for the
+    keys.
+    """
+    if rusage is not None:
+        user_time = rusage.ru_utime
+        sys_time = rusage.ru_stime
+        max_rss = rusage.ru_maxrss
+    return dict(queue_wait=queue_wait,
+                wall_time=wall_time,
+                user_time=user_time,
+                sys_time=sys_time,
+                max_rss=max_rss)
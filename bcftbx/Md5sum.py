@@ -37,13 +37,22 @@ There is also a high-level class 'Md5Checker' which implements various
 class methods for running MD5 checks across all files in a directory, and
 a wrapper class 'Md5Reporter' which
 
+The Md5Checker methods which operate on multiple files accept an
+optional 'nthreads' argument; if this is greater than one then the
+MD5 sums are computed using a pool of worker threads, with the
+results still being yielded in the same order as for the serial
+case, e.g.
+
+>>> for f,chksum in Md5Checker.compute_md5sums(dirn,nthreads=4):
+...    print "%s  %s" % (chksum,f)
+
 """
 
 #######################################################################
 # Module metadata
 #######################################################################
 
-__version__ = "1.1.0"
+__version__ = "1.2.0"
 
 #######################################################################
 # Import modules that this module depends on
@@ -52,6 +61,10 @@ __version__ = "1.1.0"
 import sys
 import os
 import logging
+import binascii
+import tempfile
+from collections import deque
+from multiprocessing.pool import ThreadPool
 try:
     # Preferentially use hashlib module
     import hashlib
@@ -64,6 +77,8 @@ except ImportError:
 #######################################################################
 
 BLOCKSIZE = 1024*1024
+NTHREADS = 1
+MANIFEST_STAT_TAG = '#stat:'
 
 #######################################################################
 # Classes
@@ -126,7 +141,7 @@ class Md5Checker:
                     yield os.path.normpath(path)
 
     @classmethod
-    def md5_walk(self,dirn,links=FOLLOW_LINKS):
+    def md5_walk(self,dirn,links=FOLLOW_LINKS,nthreads=NTHREADS):
         """Calculate MD5 sums for all files in directory
 
         Given a directory, traverses the structure underneath (including
@@ -139,14 +154,18 @@ class Md5Checker:
         Arguments:
           dirn: name of the top-level directory
           links: (optional) specify how symbolic links are handled
+          nthreads: (optional) number of threads to use for computing
+            the MD5 sums (default is to compute them serially)
 
         Returns:
           Yields a tuple (f,md5) where f is the path of a file relative to
           the top-level directory, and md5 is the calculated MD5 sum.
 
         """
-        for f in self.walk(dirn,links=links):
-            yield (os.path.relpath(f,dirn),md5sum(f))
+        for f,chksum in ordered_map(lambda f: (f,md5sum(f)),
+                                    self.walk(dirn,links=links),
+                                    nthreads=nthreads):
+            yield (os.path.relpath(f,dirn),chksum)
 
     @classmethod
     def md5cmp_files(self,f1,f2):
@@ -187,7 +206,7 @@ class Md5Checker:
         return status
 
     @classmethod
-    def md5cmp_dirs(self,d1,d2,links=FOLLOW_LINKS):
+    def md5cmp_dirs(self,d1,d2,links=FOLLOW_LINKS,nthreads=NTHREADS):
         """Compares the contents of one directory with another using MD5 sums
 
         Given two directory names 'd1' and 'd2', compares the MD5 sum of
@@ -216,6 +235,8 @@ class Md5Checker:
           d1: 'reference' directory
           d2: 'target' directory to be compared with the reference
           links: (optional) specify how symbolic links are handled.
+          nthreads: (optional) number of threads to use for comparing
+            the files (default is to compare them serially)
 
         Returns:
           Yields a tuple (f,status) where f is the relative path of the
@@ -223,23 +244,26 @@ class Md5Checker:
           representing the outcome of the comparison.
 
         """
-        for f1 in self.walk(d1,links=links):
+        def cmp_file(f1):
             f2 = os.path.join(d2,os.path.relpath(f1,d1))
             if not os.path.exists(f2):
-                result = self.MISSING_TARGET
-            else:
-                try:
-                    result = self.md5cmp_files(f1,f2)
-                except Exception,ex:
-                    logging.debug("Failed to compute one or both checksums:")
-                    logging.debug("Reference file: %s" % f1)
-                    logging.debug("Target file   : %s" % f2)
-                    logging.debug("Exception     : %s" % ex)
-                    result = self.MD5_ERROR
+                return self.MISSING_TARGET
+            try:
+                return self.md5cmp_files(f1,f2)
+            except Exception,ex:
+                logging.debug("Failed to compute one or both checksums:")
+                logging.debug("Reference file: %s" % f1)
+                logging.debug("Target file   : %s" % f2)
+                logging.debug("Exception     : %s" % ex)
+                return self.MD5_ERROR
+        files = self.walk(d1,links=links)
+        for f1,result in ordered_map(lambda f1: (f1,cmp_file(f1)),
+                                     files,
+                                     nthreads=nthreads):
             yield (os.path.relpath(f1,d1),result)
 
     @classmethod
-    def compute_md5sums(self,d,links=FOLLOW_LINKS):
+    def compute_md5sums(self,d,links=FOLLOW_LINKS,nthreads=NTHREADS):
         """Calculate MD5 sums for all files in directory
 
         Given a directory, traverses the structure underneath (including
@@ -249,24 +273,35 @@ class Md5Checker:
         The 'links' option determines how symbolic links are handled, see
         the 'walk' function for details.
 
+        Files for which the MD5 sum cannot be computed are reported
+        via logging and skipped.
+
         Arguments:
           dirn: name of the top-level directory
           links: (optional) specify how symbolic links are handled
+          nthreads: (optional) number of threads to use for computing
+            the MD5 sums (default is to compute them serially)
 
         Returns:
           Yields a tuple (f,md5) where f is the path of a file relative to
           the top-level directory, and md5 is the calculated MD5 sum.
 
         """
-        for f in self.walk(d,links=links):
+        def compute_md5(f):
             try:
-                md5 = md5sum(f)
-                yield (os.path.relpath(f,d),md5)
+                return (f,md5sum(f),None)
             except IOError,ex:
+                return (f,None,ex)
+        for f,md5,ex in ordered_map(compute_md5,
+                                    self.walk(d,links=links),
+                                    nthreads=nthreads):
+            if ex is not None:
                 logging.error("md5sum: %s: %s" % (f,ex))
+            else:
+                yield (os.path.relpath(f,d),md5)
 
     @classmethod
-    def verify_md5sums(self,filen=None,fp=None):
+    def verify_md5sums(self,filen=None,fp=None,nthreads=NTHREADS):
         """Verify md5sums from a file
 
         Given a file (or a file-like object opened for reading), reads
@@ -279,6 +314,9 @@ class Md5Checker:
 
         66b201ae074c36ae9bffec7fb74ff03a  md5checker.py
 
+        (Lines starting with '#' are ignored, so manifest files
+        written by Md5Manifest can also be verified.)
+
         It then attempts to verify the MD5 sum against the file located
         on the file system, and yields the result as an Md5checker constant
         for each file line i.e.:
@@ -293,6 +331,8 @@ class Md5Checker:
         Arguments:
           filen: name of the file containing md5sum output
           fp   : file-like object opened for reading, with md5sum output
+          nthreads: (optional) number of threads to use for computing
+            the MD5 sums (default is to compute them serially)
 
         Returns:
           Yields a tuple (f,status) where f is the path of the file being
@@ -304,12 +344,19 @@ class Md5Checker:
             filen=None
         else:
             fp = open(filen,'rU')
-        for line in fp:
-            items = line.strip().split()
-            if len(items) < 2:
-                raise IndexError,"Bad MD5 sum line: %s" % line.rstrip('\n')
-            chksum = items[0]
-            f = line[len(chksum):].strip()
+        def md5sum_lines():
+            for line in fp:
+                if line.startswith('#'):
+                    # Skip comments (e.g. stat lines in manifests)
+                    continue
+                items = line.strip().split()
+                if len(items) < 2:
+                    raise IndexError,"Bad MD5 sum line: %s" % line.rstrip('\n')
+                chksum = items[0]
+                f = line[len(chksum):].strip()
+                yield (f,chksum)
+        def verify_md5sum(item):
+            f,chksum = item
             try:
                 if not os.path.exists(f):
                     status = self.MISSING_TARGET
@@ -321,7 +368,113 @@ class Md5Checker:
                 # Error accessing file
                 logging.error("%s: error while generating MD5 sum: '%s'" % (f,ex))
                 status = self.MD5_ERROR
-            yield (f,status)
+            return (f,status)
+        for result in ordered_map(verify_md5sum,md5sum_lines(),
+                                  nthreads=nthreads):
+            yield result
+
+    @classmethod
+    def compute_manifest(self,d,previous=None,links=FOLLOW_LINKS,
+                         nthreads=NTHREADS):
+        """Calculate MD5 sums and stat information for files in directory
+
+        Given a directory, traverses the structure underneath and
+        yields the path, MD5 sum and stat information (see the
+        'file_stat' function) for each file that is found.
+
+        If an existing Md5Manifest is supplied via 'previous' then
+        files which have an entry with the same stat information
+        as the file on disk are not rehashed; instead the MD5 sum
+        from the manifest is reused. Entries in 'previous' are
+        looked up using the path relative to 'd' and then using
+        the path joined to 'd'.
+
+        Files for which the MD5 sum cannot be computed are reported
+        via logging and skipped.
+
+        Arguments:
+          d: name of the top-level directory
+          previous: (optional) Md5Manifest with previously computed
+            MD5 sums
+          links: (optional) specify how symbolic links are handled
+          nthreads: (optional) number of threads to use for computing
+            the MD5 sums (default is to compute them serially)
+
+        Returns:
+          Yields a tuple (f,md5,stat,hashed) where f is the path of a
+          file relative to the top-level directory, md5 and stat are
+          the MD5 sum and stat information, and hashed is True if the
+          MD5 sum was computed (False if it was taken from 'previous').
+
+        """
+        def compute_entry(path):
+            f = os.path.relpath(path,d)
+            try:
+                stat = file_stat(path)
+                if previous is not None:
+                    for name in (f,os.path.join(d,f)):
+                        if name in previous:
+                            if previous.stat(name) == stat:
+                                return (f,previous.chksum(name),stat,False,None)
+                            break
+                return (f,md5sum(path),stat,True,None)
+            except (IOError,OSError),ex:
+                return (f,None,None,True,ex)
+        for f,md5,stat,hashed,ex in ordered_map(compute_entry,
+                                                self.walk(d,links=links),
+                                                nthreads=nthreads):
+            if ex is not None:
+                logging.error("md5sum: %s: %s" % (os.path.join(d,f),ex))
+            else:
+                yield (f,md5,stat,hashed)
+
+    @classmethod
+    def verify_manifest(self,manifest,nthreads=NTHREADS):
+        """Verify MD5 sums in a manifest, skipping unchanged files
+
+        For each entry in the supplied Md5Manifest, checks whether
+        the file on disk has the same stat information as recorded
+        in the manifest; if it does then the file is assumed to be
+        unchanged and is not rehashed. Otherwise the MD5 sum is
+        computed and checked against the manifest, and (if the
+        check passes) the stat information in the manifest is
+        updated.
+
+        Arguments:
+          manifest: Md5Manifest instance
+          nthreads: (optional) number of threads to use for computing
+            the MD5 sums (default is to compute them serially)
+
+        Returns:
+          Yields a tuple (f,status,hashed) where f is the path of the
+          file being verified (as it appears in the manifest), status
+          is the Md5Checker constant representing the outcome, and
+          hashed is True if the MD5 sum was recomputed.
+
+        """
+        def verify_entry(entry):
+            f,chksum,stat = entry
+            try:
+                if not os.path.exists(f):
+                    return (f,self.MISSING_TARGET,False,None)
+                current_stat = file_stat(f)
+                if stat is not None and stat == current_stat:
+                    return (f,self.MD5_OK,False,None)
+                if md5sum(f) == chksum:
+                    return (f,self.MD5_OK,True,current_stat)
+                else:
+                    return (f,self.MD5_FAILED,True,None)
+            except (IOError,OSError),ex:
+                # Error accessing file
+                logging.error("%s: error while generating MD5 sum: '%s'" %
+                              (f,ex))
+                return (f,self.MD5_ERROR,True,None)
+        for f,status,hashed,stat in ordered_map(verify_entry,
+                                                list(manifest),
+                                                nthreads=nthreads):
+            if stat is not None:
+                manifest.set_stat(f,stat)
+            yield (f,status,hashed)
 
 class Md5CheckReporter:
     """Provides a generic reporting class for Md5Checker methods
@@ -464,6 +617,156 @@ class Md5CheckReporter:
         else:
             return 1
 
+class Md5Manifest:
+    """Class for storing MD5 sums along with file stat information
+
+    A manifest is an extension of the output from the Linux 'md5sum'
+    program, where each MD5 sum line can be preceded by a comment
+    line recording the size, modification time (in nanoseconds) and
+    inode of the file when its MD5 sum was computed or last verified
+    (see the 'file_stat' function), e.g.
+
+    #stat: 1024 1520934129123456000 5382617
+    66b201ae074c36ae9bffec7fb74ff03a  md5checker.py
+
+    Since the stat lines are comments, manifests can still be checked
+    using 'Md5Checker.verify_md5sums' (or 'md5sum -c').
+
+    Example usage:
+
+    >>> m = Md5Manifest("checksums.md5")
+    >>> for f,status,hashed in Md5Checker.verify_manifest(m):
+    ...    print "%s: %s" % (f,status)
+    >>> m.write("checksums.md5")
+
+    """
+    def __init__(self,filen=None,fp=None):
+        """Create a new Md5Manifest instance
+
+        Arguments:
+          filen: (optional) name of manifest or md5sum file to
+            load entries from
+          fp: (optional) file-like object opened for reading, to
+            load entries from
+
+        """
+        self._files = []
+        self._entries = {}
+        if filen is not None or fp is not None:
+            self.read(filen=filen,fp=fp)
+
+    def __iter__(self):
+        for f in self._files:
+            chksum,stat = self._entries[f]
+            yield (f,chksum,stat)
+
+    def __len__(self):
+        return len(self._files)
+
+    def __contains__(self,f):
+        return f in self._entries
+
+    def add(self,f,chksum,stat=None):
+        """Add or replace an entry in the manifest
+
+        Arguments:
+          f: path of the file
+          chksum: MD5 sum for the file
+          stat: (optional) tuple with the stat information for
+            the file (as returned by 'file_stat')
+
+        """
+        if f not in self._entries:
+            self._files.append(f)
+        self._entries[f] = (chksum,stat)
+
+    def chksum(self,f):
+        """Return the MD5 sum stored for a file
+        """
+        return self._entries[f][0]
+
+    def stat(self,f):
+        """Return the stat information stored for a file
+
+        Returns None if no stat information is stored.
+        """
+        return self._entries[f][1]
+
+    def set_stat(self,f,stat):
+        """Update the stat information stored for a file
+        """
+        self._entries[f] = (self.chksum(f),stat)
+
+    def read(self,filen=None,fp=None):
+        """Load entries from a manifest or md5sum file
+
+        Arguments:
+          filen: name of the file to read from
+          fp: file-like object opened for reading
+
+        """
+        if fp is None:
+            fp = open(filen,'rU')
+        else:
+            filen = None
+        stat = None
+        for line in fp:
+            if line.startswith(MANIFEST_STAT_TAG):
+                try:
+                    stat = tuple([int(x) for x in
+                                  line[len(MANIFEST_STAT_TAG):].split()])
+                    if len(stat) != 3:
+                        raise ValueError
+                except ValueError:
+                    raise IndexError,"Bad stat line: %s" % line.rstrip('\n')
+                continue
+            elif line.startswith('#'):
+                continue
+            items = line.strip().split()
+            if len(items) < 2:
+                raise IndexError,"Bad MD5 sum line: %s" % line.rstrip('\n')
+            chksum = items[0]
+            f = line[len(chksum):].strip()
+            self.add(f,chksum,stat)
+            stat = None
+        if filen is not None:
+            fp.close()
+
+    def write(self,filen=None,fp=None):
+        """Write the entries to a manifest file
+
+        If a file name is supplied then the manifest is first
+        written to a temporary file which then replaces the
+        target, so an existing manifest is never left partially
+        written.
+
+        Arguments:
+          filen: name of the file to write to
+          fp: file-like object opened for writing
+
+        """
+        if fp is not None:
+            self._write(fp)
+            return
+        dirn = os.path.dirname(os.path.abspath(filen))
+        fd,tmp_file = tempfile.mkstemp(dir=dirn,
+                                       prefix=".%s" % os.path.basename(filen))
+        try:
+            with os.fdopen(fd,'w') as fp:
+                self._write(fp)
+            os.chmod(tmp_file,0644)
+            os.rename(tmp_file,filen)
+        except Exception:
+            os.remove(tmp_file)
+            raise
+
+    def _write(self,fp):
+        # Write the manifest entries to a stream
+        for f,chksum,stat in self:
+            if stat is not None:
+                fp.write("%s %d %d %d\n" % ((MANIFEST_STAT_TAG,) + stat))
+            fp.write("%s  %s\n" % (chksum,f))
+
 #######################################################################
 # Functions
 #######################################################################
@@ -472,9 +775,26 @@ def hexify(s):
     """Return the hex representation of a string
 
     """
-    return ("%02x"*len(s)) % tuple(map(ord, s))
+    return binascii.hexlify(s)
+
+def file_stat(f):
+    """Return the stat information used to detect changes to a file
+
+    Arguments:
+      f: name of the file
+
+    Returns:
+      Tuple (size,mtime_ns,inode) for the file.
+
+    """
+    st = os.stat(f)
+    try:
+        mtime_ns = st.st_mtime_ns
+    except AttributeError:
+        mtime_ns = int(st.st_mtime*1000000000)
+    return (st.st_size,mtime_ns,st.st_ino)
 
-def md5sum(f):
+def md5sum(f,blocksize=BLOCKSIZE):
     """Return md5sum digest for a file or stream
     
     This implements the md5sum checksum generation using both
@@ -486,9 +806,15 @@ def md5sum(f):
     is no need for the invoking subprogram to decide: the resulting
     checksums are the same using either library regardless.
 
+    Data is read in blocks into a single reusable buffer (where
+    the stream supports 'readinto'), which avoids allocating a
+    new string for every block.
+
     Arguments:
       f: name of the file to generate the checksum from, or
         a file-like object opened for reading in binary mode.
+      blocksize: (optional) size of the blocks to read the
+        data in (defaults to BLOCKSIZE)
         
     Returns:
       Md5sum digest for the named file.
@@ -501,9 +827,69 @@ def md5sum(f):
         chksum = md5.new()
     # Generate checksum
     try:
-        f = open(f,"rb")
+        fp = open(f,"rb")
     except TypeError:
-        pass
-    for block in iter(lambda: f.read(BLOCKSIZE), ''):
-        chksum.update(block)
-    return hexify(chksum.digest())
+        fp = f
+    try:
+        try:
+            readinto = fp.readinto
+        except AttributeError:
+            readinto = None
+        if readinto is not None:
+            buf = bytearray(blocksize)
+            view = memoryview(buf)
+            while True:
+                n = readinto(buf)
+                if not n:
+                    break
+                chksum.update(view[:n])
+        else:
+            for block in iter(lambda: fp.read(blocksize), ''):
+                chksum.update(block)
+    finally:
+        if fp is not f:
+            fp.close()
+    return chksum.hexdigest()
+
+def ordered_map(func,items,nthreads=NTHREADS):
+    """Apply a function to items, yielding results in order
+
+    Generator which applies 'func' to each item from the
+    iterable 'items' and yields the results in the same
+    order as the input items.
+
+    If 'nthreads' is greater than one then the function
+    calls are distributed across a pool of worker threads;
+    at most '2*nthreads' items are in progress at any one
+    time, so results are streamed back as they become
+    available rather than being accumulated. Exceptions
+    raised by 'func' are re-raised by the generator at the
+    point where the corresponding result would have been
+    yielded.
+
+    Arguments:
+      func: function which takes a single argument
+      items: iterable supplying the arguments
+      nthreads: (optional) number of worker threads
+        (default is to apply the function serially)
+
+    Returns:
+      Yields the result of 'func' for each item.
+
+    """
+    if not nthreads or nthreads <= 1:
+        for item in items:
+            yield func(item)
+        return
+    pool = ThreadPool(nthreads)
+    try:
+        pending = deque()
+        for item in items:
+            pending.append(pool.apply_async(func,(item,)))
+            if len(pending) >= 2*nthreads:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
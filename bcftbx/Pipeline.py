@@ -47,7 +47,7 @@ system. So typical usage might look like:
 # Module metadata
 #######################################################################
 
-__version__ = "0.1.3"
+__version__ = "0.4.0"
 
 #######################################################################
 # Import modules that this module depends on
@@ -58,7 +58,19 @@ import os
 import re
 import time
 import Queue
+import threading
 import logging
+import json
+
+#######################################################################
+# Constants
+#######################################################################
+
+# Fields for each job in pipeline profiles written as TSV
+# (see PipelineRunner.write_profile)
+PROFILE_FIELDS = ('name','label','group','job_id','working_dir','status',
+                  'exit_status','submit_time','end_time','elapsed_time',
+                  'queue_wait','wall_time','user_time','sys_time','max_rss')
 
 #######################################################################
 # Class definitions
@@ -84,6 +96,8 @@ class Job:
       args
       label
       group_label
+      nslots
+      mem_gb
 
     Additional information is set once the job has started or stopped running:
 
@@ -92,11 +106,23 @@ class Job:
       start_time  The start time (seconds since the epoch)
       end_time    The end time (seconds since the epoch)
       exit_status The exit code from the command that was run (integer, or None)
+      skipped     True if the job was never run because a job it depended on
+                  failed (see PipelineRunner.queueJob)
+      resource_usage Dictionary with the resources used by the job, as
+                  reported by the JobRunner once the job has finished (see
+                  BaseJobRunner.resource_usage), or None if not available
+      depends_on  List of the jobs that this job depends on
+      outputs     List of the output files produced by the job (used to check
+                  whether results from a previous run can be reused, see
+                  PipelineRunner.run)
+      restored    True if the job wasn't run because it had already completed
+                  successfully in a previous run (see PipelineRunner.run)
 
     The Job class uses a JobRunner instance (which supplies the necessary methods for
     starting, stopping and monitoring) for low-level job interactions.
     """
-    def __init__(self,runner,name,dirn,script,args,label=None,group=None):
+    def __init__(self,runner,name,dirn,script,args,label=None,group=None,
+                 nslots=None,mem_gb=None):
         """Create an instance of Job.
 
         Arguments:
@@ -111,6 +137,11 @@ class Job:
           group: (optional) arbitrary string to use as a 'group' identifier;
             assign the same 'group' label to multiple jobs to indicate they're
             related
+          nslots: (optional) number of CPU slots to request from the runner
+            (only for runners which support resource requests, e.g.
+            LocalPoolJobRunner)
+          mem_gb: (optional) amount of memory (in Gb) to request from the
+            runner (only for runners which support resource requests)
         """
         self.name = name
         self.working_dir = dirn
@@ -118,11 +149,18 @@ class Job:
         self.args = args
         self.label = label
         self.group_label = group
+        self.nslots = nslots
+        self.mem_gb = mem_gb
+        self.depends_on = []
+        self.outputs = []
+        self.restored = False
+        self.resource_usage = None
         self.job_id = None
         self.log = None
         self.submitted = False
         self.failed = False
         self.terminated = False
+        self.skipped = False
         self.start_time = None
         self.end_time = None
         self.exit_status = None
@@ -136,14 +174,29 @@ class Job:
         # (seconds)
         self.__timeout = 3600
 
-    def start(self):
+    def start(self,job_id=None):
         """Start the job running
 
+        Arguments:
+          job_id: (optional) if supplied then the job is assumed
+            to have already been submitted to the runner (e.g. as
+            part of a batch) with this id, and is not submitted
+            again
+
         Returns:
           Id for job
         """
         if not self.submitted and not self.__finished:
-            self.job_id = self.__runner.run(self.name,self.working_dir,self.script,self.args)
+            if job_id is None:
+                resources = {}
+                if self.nslots is not None:
+                    resources['nslots'] = self.nslots
+                if self.mem_gb is not None:
+                    resources['mem_gb'] = self.mem_gb
+                job_id = self.__runner.run(self.name,self.working_dir,
+                                           self.script,self.args,
+                                           **resources)
+            self.job_id = job_id
             self.submitted = True
             self.start_time = time.time()
             if self.job_id is None:
@@ -205,15 +258,22 @@ class Job:
         self.start_time = None
         self.end_time = None
         self.exit_status = None
+        self.resource_usage = None
         # Resubmit
         return self.start()
 
-    def isRunning(self):
+    def isRunning(self,running_job_ids=None):
         """Check if job is still running
+
+        Arguments:
+          running_job_ids: (optional) collection of the ids of
+            jobs known to be running (e.g. from the runner's
+            'list' method); if supplied then this is used
+            instead of querying the runner for this job
         """
         if not self.submitted:
             return False
-        self.update()
+        self.update(running_job_ids)
         return not self.__finished
 
     def errorState(self):
@@ -221,9 +281,26 @@ class Job:
         """
         return self.__runner.errorState(self.job_id)
 
+    def isSuccessful(self):
+        """Check if the job finished successfully
+
+        Returns True if the job has finished without failing
+        to start, without being terminated or skipped, and
+        without a non-zero exit status (an exit status of None,
+        which some runners return if the status can't be
+        determined, is not treated as a failure).
+        """
+        return (self.__finished and
+                not self.failed and
+                not self.terminated and
+                not self.skipped and
+                not self.exit_status)
+
     def status(self):
         """Return descriptive string indicating job status
         """
+        if self.skipped:
+            return "Skipped"
         if self.__finished:
             if self.terminated:
                 return "Terminated"
@@ -237,14 +314,54 @@ class Job:
         else:
             return "Waiting"
 
-    def update(self):
+    def update(self,running_job_ids=None):
         """Update status of job
+
+        Arguments:
+          running_job_ids: (optional) collection of the ids of
+            jobs known to be running (e.g. from the runner's
+            'list' method); if supplied then this is used
+            instead of querying the runner for this job
         """
         if not self.__finished:
-            if not self.__runner.isRunning(self.job_id):
+            if running_job_ids is not None:
+                is_running = (self.job_id in running_job_ids)
+            else:
+                is_running = self.__runner.isRunning(self.job_id)
+            if not is_running:
                 self.__finished = True
                 self.end_time = time.time()
                 self.exit_status = self.__runner.exit_status(self.job_id)
+                try:
+                    self.resource_usage = \
+                        self.__runner.resource_usage(self.job_id)
+                except AttributeError:
+                    pass
+
+    def restore(self,job_id,exit_status,start_time=None,end_time=None,
+                resource_usage=None):
+        """Mark the job as having finished in a previous run
+
+        The job is set to the finished state using the supplied
+        values (e.g. from a pipeline journal) without being run.
+
+        Arguments:
+          job_id: the id the job ran with
+          exit_status: the exit code from the job
+          start_time: (optional) start time (seconds since the
+            epoch)
+          end_time: (optional) end time (seconds since the epoch)
+          resource_usage: (optional) dictionary with the resources
+            used by the job
+        """
+        self.job_id = job_id
+        self.exit_status = exit_status
+        self.start_time = start_time
+        self.end_time = end_time
+        self.resource_usage = resource_usage
+        self.submitted = True
+        self.restored = True
+        self.__finished = True
 
     def wait(self):
         """Wait for job to complete
@@ -282,40 +399,117 @@ class PipelineRunner:
     jobs have been submitted and have completed; see the 'run' method for details of
     how to operate the pipeline in non-blocking mode.
 
+    Jobs can depend on other jobs by supplying a list of previously queued jobs via
+    the 'depends_on' argument of 'queueJob', e.g.
+
+    >>> align = p.queueJob('/home/foo','align.sh',['sample1.fq'])
+    >>> p.queueJob('/home/foo','stats.sh',['sample1.bam'],depends_on=[align])
+
+    A job with dependencies only becomes eligible to run once all the jobs it depends
+    on have completed successfully (and still counts towards the maximum number of
+    concurrent jobs once started). If any of those jobs fails then the job and all its
+    descendants are skipped. In this way the pipeline runs as a directed acyclic graph
+    (DAG), and downstream jobs for one set of inputs can start while upstream jobs for
+    other inputs are still running.
+
+    If the job runner supports batch submission (e.g. GEJobRunner, which can submit
+    multiple jobs as a single Grid Engine array job) then jobs which are ready to start
+    at the same time and which run the same script are submitted together as a batch.
+
     The invoking subprogram can also specify functions that will be called when a job
     completes ('jobCompletionHandler'), and when a group completes
     ('groupCompletionHandler'). These can perform any specific actions that are required
     such as sending notification email, setting file ownerships and permissions etc.
+
+    On each update the runner is asked for the ids of all its running jobs in a
+    single call (via its 'list' method), rather than checking each job individually.
+    In 'blocking' mode the interval between updates adapts to the state of the
+    pipeline: it drops to 'min_poll_interval' when jobs have just started or
+    finished, or when running jobs are expected to finish soon (based on the
+    average run time of the jobs completed so far), and backs off towards
+    'poll_interval' while nothing is changing. Between updates the pipeline
+    waits on the job runner (via its 'wait' method) rather than simply sleeping,
+    so for runners which can detect job completion (e.g. SimpleJobRunner,
+    LocalPoolJobRunner and GEJobRunner) the next update happens as soon as a
+    job finishes, and any waiting jobs are started straight away.
+
+    By default the completion handlers are called from the pipeline's update
+    loop; if 'background_handlers' is set then they are instead run in order
+    in a separate thread, so that slow handlers (e.g. sending email) don't
+    hold up the starting of new jobs. In this case the pipeline isn't
+    considered to have finished until all the handlers have completed, and
+    the handlers shouldn't modify the pipeline (e.g. by queueing new jobs).
+
+    If a 'journal' file is specified then the pipeline appends a record to it (as a
+    line of JSON) each time a job is queued, started or finished (the journal is
+    started afresh each time the pipeline is run without resuming). If the program
+    running the pipeline dies then it can be rerun with the same jobs queued and
+    'run(resume=True)': jobs which finished successfully in the previous run are then
+    not run again, and (for runners which support it, e.g. GEJobRunner) jobs which
+    were still running are re-attached to rather than being resubmitted.
     """
     def __init__(self,runner,max_concurrent_jobs=4,poll_interval=30,jobCompletionHandler=None,
-                 groupCompletionHandler=None):
+                 groupCompletionHandler=None,min_poll_interval=1,
+                 background_handlers=False,journal=None):
         """Create new PipelineRunner instance.
 
         Arguments:
           runner: a JobRunner instance
           max_concurrent_jobs: maximum number of jobs that the script will allow to run
             at one time (default = 4)
-          poll_interval: time interval (in seconds) between checks on the queue status
-            (only used when pipeline is run in 'blocking' mode)
+          poll_interval: maximum time interval (in seconds) between checks on the queue
+            status (only used when pipeline is run in 'blocking' mode)
+          min_poll_interval: minimum time interval (in seconds) between checks on the
+            queue status (only used when pipeline is run in 'blocking' mode)
+          background_handlers: if True then run the job and group completion
+            handlers in a separate thread (default is to run them in the
+            update loop)
+          journal: (optional) file to record the progress of the pipeline in,
+            so that it can be resumed if interrupted
         """
         # Parameters
         self.__runner = runner
         self.max_concurrent_jobs = max_concurrent_jobs
         self.poll_interval = poll_interval
+        self.min_poll_interval = min(min_poll_interval,poll_interval)
         # Groups
         self.groups = []
         self.njobs_in_group = {}
+        self.completed_in_group = {}
         # Queue of jobs to run
         self.jobs = Queue.Queue()
-        # Subset that are currently running
-        self.running = []
-        # Subset that have completed
+        # Subset that are currently running (keyed by job id)
+        self.running = {}
+        # Subset that have completed (also as a set, for
+        # checking dependencies)
         self.completed = []
+        self.__finished_jobs = set()
+        # Subset that were skipped due to failed dependencies
+        self.skipped = []
+        # Jobs waiting on dependencies, with number of unfinished
+        # parents, and jobs depending on each job
+        self.blocked = {}
+        self.dependents = {}
         # Callback functions
         self.handle_job_completion = jobCompletionHandler
         self.handle_group_completion = groupCompletionHandler
-
-    def queueJob(self,working_dir,script,script_args,label=None,group=None):
+        # Queue and thread for running callbacks in the background
+        self.__background_handlers = background_handlers
+        self.__handler_queue = Queue.Queue()
+        self.__handler_thread = None
+        # Journal file, and keys identifying each queued job
+        self.journal = journal
+        self.__job_keys = {}
+        self.__job_key_counts = {}
+        self.__queued_jobs = []
+        self.__journal_started = False
+        # Adaptive polling
+        self.__current_poll_interval = self.min_poll_interval
+        self.__total_job_time = 0.0
+        self.__ntimed_jobs = 0
+
+    def queueJob(self,working_dir,script,script_args,label=None,group=None,
+                 depends_on=None,nslots=None,mem_gb=None,outputs=None):
         """Add a job to the pipeline.
 
         The job will be queued and executed once the pipeline's 'run' method has been
@@ -329,23 +523,80 @@ class PipelineRunner:
           group: (optional) arbitrary string to use as a 'group' identifier;
             assign the same 'group' label to multiple jobs to indicate they're
             related
+          depends_on: (optional) list of Job instances (as returned by previous
+            calls to 'queueJob' for this pipeline) which must complete
+            successfully before this job can start; an exception is raised
+            if any of them weren't queued in this pipeline
+          nslots: (optional) number of CPU slots required by the job (only
+            for runners which support resource requests, e.g.
+            LocalPoolJobRunner)
+          mem_gb: (optional) amount of memory (in Gb) required by the job
+            (only for runners which support resource requests)
+          outputs: (optional) list of output files produced by the job
+            (relative to the working directory); when resuming from a
+            journal, a job which previously succeeded is only skipped if
+            these files are unchanged since it finished
+
+        Returns:
+          Job instance for the queued job.
         """
         job_name = os.path.splitext(os.path.basename(script))[0]+'.'+str(label)
+        if depends_on:
+            for parent in depends_on:
+                if parent not in self.__job_keys:
+                    # Parent would never finish, so the job would
+                    # block the pipeline indefinitely
+                    raise Exception("Job '%s' depends on job '%s' which "
+                                    "isn't queued in this pipeline" %
+                                    (job_name,parent.name))
         if group:
-            if group not in self.groups:
+            if group not in self.njobs_in_group:
                 # New group label
                 self.groups.append(group)
                 self.njobs_in_group[group] = 1
+                self.completed_in_group[group] = []
             else:
                 self.njobs_in_group[group] += 1
-        self.jobs.put(Job(self.__runner,job_name,working_dir,script,script_args,
-                          label,group))
-        logging.debug("Added job: now %d jobs in pipeline" % self.jobs.qsize())
+        job = Job(self.__runner,job_name,working_dir,script,script_args,
+                  label,group,nslots=nslots,mem_gb=mem_gb)
+        if depends_on:
+            job.depends_on = list(depends_on)
+        if outputs:
+            job.outputs = list(outputs)
+        self.__add_to_journal(job)
+        # Check dependencies
+        nparents = 0
+        skip = False
+        if depends_on:
+            for parent in depends_on:
+                if parent.skipped or \
+                   (parent in self.__finished_jobs and
+                    not parent.isSuccessful()):
+                    # Parent has already failed
+                    skip = True
+                elif parent not in self.__finished_jobs:
+                    # Parent hasn't finished yet
+                    nparents += 1
+                    try:
+                        self.dependents[parent].append(job)
+                    except KeyError:
+                        self.dependents[parent] = [job]
+        if skip:
+            self.__skip_job(job)
+        elif nparents:
+            self.blocked[job] = nparents
+        else:
+            self.jobs.put(job)
+        logging.debug("Added job: now %d jobs in pipeline" % self.nWaiting())
+        return job
 
     def nWaiting(self):
         """Return the number of jobs still waiting to be started
+
+        This includes jobs that are waiting for the jobs they depend
+        on to complete.
         """
-        return self.jobs.qsize()
+        return self.jobs.qsize() + len(self.blocked)
 
     def nRunning(self):
         """Return the number of jobs currently running
@@ -357,23 +608,41 @@ class PipelineRunner:
         """
         return len(self.completed)
 
+    def nSkipped(self):
+        """Return the number of jobs that were skipped
+
+        Jobs are skipped if a job they depend on fails.
+        """
+        return len(self.skipped)
+
     def isRunning(self):
         """Check whether the pipeline is still running
 
         Returns True if the pipeline is still running (i.e. has either
-        running jobs, waiting jobs or both) and False otherwise.
+        running jobs, waiting jobs or both, or completion handlers which
+        are still running in the background) and False otherwise.
         """
         # First update the pipeline status
         self.update()
         # Return the status
-        return (self.nWaiting() > 0 or self.nRunning() > 0)
+        return (self.nWaiting() > 0 or self.nRunning() > 0 or
+                self.__handler_queue.unfinished_tasks > 0)
 
-    def run(self,blocking=True):
+    def run(self,blocking=True,resume=False):
         """Execute the jobs in the pipeline
 
         Each job previously added to the pipeline by 'queueJob' will be
         started and checked periodically for termination.
 
+        If 'resume' is True then the journal from a previous run of the
+        pipeline is read first: jobs which completed successfully in that
+        run (and whose outputs haven't changed since) are marked as
+        completed without being run again, and jobs which were still
+        running are re-attached to if the runner supports it (otherwise
+        they are run again). Jobs are matched to the journal by their
+        working directory, script, arguments and label, so the same jobs
+        should be queued as for the previous run.
+
         By default 'run' operates in 'blocking' mode, so it doesn't return
         until all jobs have been submitted and have finished executing.
 
@@ -391,6 +660,9 @@ class PipelineRunner:
         logging.debug("PipelineRunner: started")
         logging.debug("Blocking mode : %s" % blocking)
         # Report set up
+        if resume:
+            self.__resume()
+        self.__start_journal(resume)
         print "Initially %d jobs waiting, %d running, %d finished" % \
             (self.nWaiting(),self.nRunning(),self.nCompleted())
         # Initial update sets the jobs running
@@ -398,7 +670,7 @@ class PipelineRunner:
         if blocking:
             while self.isRunning():
                 # Pipeline is still executing so wait
-                time.sleep(self.poll_interval)
+                self.__wait(self.__current_poll_interval)
             # Pipeline has finished
             print "Pipeline completed"
 
@@ -411,55 +683,613 @@ class PipelineRunner:
         # Flag to report updated status
         updated_status = False
         # Look for running jobs that have completed
-        for job in self.running[::-1]:
-            if not job.isRunning():
-                # Job has completed
-                self.running.remove(job)
-                self.completed.append(job)
-                updated_status = True
-                print "Job has completed: %s: %s %s (%s)" % (
-                    job.job_id,
-                    job.name,
-                    os.path.basename(job.working_dir),
-                    time.asctime(time.localtime(job.end_time)))
-                # Invoke callback on job completion
-                if self.handle_job_completion:
-                    self.handle_job_completion(job)
-                # Check for completed group
-                if job.group_label is not None:
-                    jobs_in_group = []
-                    for check_job in self.completed:
-                        if check_job.group_label == job.group_label:
-                            jobs_in_group.append(check_job)
-                    if self.njobs_in_group[job.group_label] == len(jobs_in_group):
-                        # All jobs in group have completed
-                        print "Group '%s' has completed" % job.group_label
-                        # Invoke callback on group completion
-                        if self.handle_group_completion:
-                            self.handle_group_completion(job.group_label,jobs_in_group)
-            else:
-                # Job is running, check it's not in an error state
-                if job.errorState():
-                    # Terminate jobs in error state
-                    logging.warning("Terminating job %s in error state" % job.job_id)
-                    job.terminate()
+        if self.running:
+            # Get the ids of all running jobs in a single call
+            running_job_ids = set(self.__runner.list())
+            for job_id in self.running.keys():
+                job = self.running[job_id]
+                if not job.isRunning(running_job_ids):
+                    # Job has completed
+                    del(self.running[job_id])
+                    self.__job_completed(job)
+                    updated_status = True
+                else:
+                    # Job is running, check it's not in an error state
+                    if job.errorState():
+                        # Terminate jobs in error state
+                        logging.warning("Terminating job %s in error state" % job.job_id)
+                        job.terminate()
+        # Collect new jobs to submit
+        next_jobs = []
+        while not self.jobs.empty() and \
+              (self.nRunning() + len(next_jobs)) < self.max_concurrent_jobs:
+            next_jobs.append(self.jobs.get())
         # Submit new jobs to GE queue
-        while not self.jobs.empty() and self.nRunning() < self.max_concurrent_jobs:
-            next_job = self.jobs.get()
-            next_job.start()
-            self.running.append(next_job)
+        for next_job in self.__start_jobs(next_jobs):
             updated_status = True
             print "Job has started: %s: %s %s (%s)" % (
                 next_job.job_id,
                 next_job.name,
                 os.path.basename(next_job.working_dir),
                 time.asctime(time.localtime(next_job.start_time)))
-            if self.jobs.empty():
-                logging.debug("PipelineRunner: all jobs now submitted")
+            if next_job.job_id is None:
+                # Failed to submit
+                self.__job_completed(next_job)
+            else:
+                self.running[next_job.job_id] = next_job
+                self.__write_journal('started',next_job)
+        if next_jobs and self.jobs.empty():
+            logging.debug("PipelineRunner: all jobs now submitted")
         # Report
         if updated_status:
             print "Currently %d jobs waiting, %d running, %d finished" % \
                 (self.nWaiting(),self.nRunning(),self.nCompleted())
+        # Set the interval to the next update
+        self.__update_poll_interval(updated_status)
+
+    def __start_jobs(self,jobs):
+        """Internal: start a set of jobs
+
+        If the job runner provides a 'run_batch' method (e.g.
+        GEJobRunner) then jobs which run the same script are
+        submitted together in a single batch (e.g. as a Grid
+        Engine array job); otherwise (or if batch submission
+        fails) each job is submitted individually.
+
+        Returns a list of the jobs, in the order they were
+        started.
+        """
+        run_batch = getattr(self.__runner,'run_batch',None)
+        # Group the jobs by script
+        scripts = []
+        batches = {}
+        for job in jobs:
+            if job.script not in batches:
+                scripts.append(job.script)
+                batches[job.script] = []
+            batches[job.script].append(job)
+        # Start the jobs
+        started = []
+        for script in scripts:
+            batch = batches[script]
+            job_ids = [None]*len(batch)
+            if run_batch is not None and len(batch) > 1:
+                name = os.path.splitext(os.path.basename(script))[0]
+                logging.debug("PipelineRunner: submitting batch of %d "
+                              "jobs for %s" % (len(batch),name))
+                job_ids = run_batch(name,[(job.working_dir,
+                                           job.script,
+                                           job.args) for job in batch])
+                if None in job_ids:
+                    logging.warning("Batch submission failed for %s, "
+                                    "submitting jobs individually" % name)
+                    job_ids = [None]*len(batch)
+            for job,job_id in zip(batch,job_ids):
+                job.start(job_id)
+                started.append(job)
+        return started
+
+    def __job_completed(self,job):
+        """Internal: handle a job which has completed
+
+        Adds the job to the list of completed jobs, invokes the
+        job completion handler and, if the job was the last one
+        in its group, the group completion handler.
+
+        For jobs restored from the journal of a previous run the
+        job completion handler isn't invoked (since it will have
+        been invoked in that run).
+        """
+        self.completed.append(job)
+        self.__finished_jobs.add(job)
+        if job.restored:
+            print "Job completed in previous run: %s: %s %s" % (
+                job.job_id,
+                job.name,
+                os.path.basename(job.working_dir))
+        else:
+            print "Job has completed: %s: %s %s (%s)" % (
+                job.job_id,
+                job.name,
+                os.path.basename(job.working_dir),
+                time.asctime(time.localtime(job.end_time)))
+            self.__write_journal('finished',job)
+        # Store the run time for adaptive polling
+        if job.job_id is not None and job.end_time is not None and \
+           not job.restored:
+            self.__total_job_time += job.end_time - job.start_time
+            self.__ntimed_jobs += 1
+        # Invoke callback on job completion
+        if self.handle_job_completion and not job.restored:
+            self.__invoke_handler(self.handle_job_completion,job)
+        # Update jobs which depend on this one
+        for child in self.dependents.pop(job,[]):
+            if child.skipped:
+                continue
+            if job.isSuccessful():
+                self.blocked[child] -= 1
+                if self.blocked[child] == 0:
+                    # All dependencies satisfied
+                    del(self.blocked[child])
+                    self.jobs.put(child)
+            else:
+                self.__skip_job(child)
+        # Check for completed group
+        self.__update_group(job)
+
+    def __add_to_journal(self,job):
+        """Internal: assign a journal key to a job and record it
+
+        The key is made from the job's working directory, script,
+        arguments and label, plus a count to distinguish jobs
+        which are otherwise identical. The job is only recorded
+        in the journal once the pipeline has started running.
+        """
+        key = [os.path.abspath(job.working_dir),job.script,
+               list(job.args),job.label]
+        count = self.__job_key_counts.get(json.dumps(key),0)
+        self.__job_key_counts[json.dumps(key)] = count + 1
+        self.__job_keys[job] = key + [count]
+        self.__queued_jobs.append(job)
+        if self.__journal_started:
+            self.__write_journal('queued',job)
+
+    def __start_journal(self,resume=False):
+        """Internal: start recording the pipeline in the journal
+
+        Unless 'resume' is True any existing journal is
+        discarded, so that records from earlier runs can't be
+        picked up when resuming a later run. Records are then
+        written for all the jobs queued so far.
+
+        Does nothing if no journal file was specified.
+        """
+        self.__journal_started = True
+        if not self.journal:
+            return
+        if not resume:
+            open(self.journal,'w').close()
+        for job in self.__queued_jobs:
+            self.__write_journal('queued',job)
+
+    def __write_journal(self,event,job):
+        """Internal: append a record for a job to the journal
+
+        Each record is a single line of JSON with the event
+        ('queued', 'started' or 'finished'), the job's key
+        and name, and data depending on the event: the job id
+        (and information needed to re-attach to the job, if
+        the runner provides it) when the job starts; and the
+        job id, exit status, times, resource usage and output
+        file fingerprints when it finishes.
+
+        Does nothing if no journal file was specified.
+        """
+        if not self.journal:
+            return
+        record = dict(event=event,
+                      key=self.__job_keys[job],
+                      name=job.name)
+        if event == 'started':
+            record['job_id'] = job.job_id
+            try:
+                record['attach_info'] = \
+                    self.__runner.attach_info(job.job_id)
+            except AttributeError:
+                pass
+        elif event == 'finished':
+            record['job_id'] = job.job_id
+            record['exit_status'] = job.exit_status
+            record['successful'] = job.isSuccessful()
+            record['start_time'] = job.start_time
+            record['end_time'] = job.end_time
+            record['resource_usage'] = job.resource_usage
+            record['outputs'] = self.__fingerprint_outputs(job)
+        with open(self.journal,'a') as fp:
+            fp.write("%s\n" % json.dumps(record))
+            if event != 'queued':
+                # Make sure the record survives a crash
+                fp.flush()
+                os.fsync(fp.fileno())
+
+    def __read_journal(self):
+        """Internal: read the journal from a previous run
+
+        Returns a dictionary where the keys are job keys (as
+        JSON strings) and the values are the last record for that key
+        in the journal. Incomplete lines (e.g. if the program
+        died while writing) are ignored.
+        """
+        records = {}
+        if not self.journal or not os.path.exists(self.journal):
+            return records
+        with open(self.journal,'r') as fp:
+            for line in fp:
+                try:
+                    record = json.loads(line)
+                    key = json.dumps(record['key'])
+                except (ValueError,KeyError):
+                    logging.warning("PipelineRunner: ignoring bad line in "
+                                    "journal: %s" % line.rstrip())
+                    continue
+                if record['event'] == 'queued':
+                    # Don't overwrite the outcome of an earlier run
+                    records.setdefault(key,record)
+                else:
+                    records[key] = record
+        return records
+
+    def __fingerprint_outputs(self,job):
+        """Internal: get fingerprints for a job's output files
+
+        Returns a dictionary with the path for each output file
+        as the key and a list [size,mtime] as the value (or None
+        if the file doesn't exist).
+        """
+        fingerprints = {}
+        for output in job.outputs:
+            path = os.path.join(job.working_dir,output)
+            try:
+                st = os.stat(path)
+                fingerprints[output] = [st.st_size,st.st_mtime]
+            except OSError:
+                fingerprints[output] = None
+        return fingerprints
+
+    def __resume(self):
+        """Internal: restore the state of the pipeline from the journal
+
+        Queued jobs which finished successfully according to the
+        journal (and whose outputs still exist and are unchanged)
+        are marked as completed; jobs which were still running
+        are re-attached to, if the runner supports it. Jobs are
+        only restored if none of the jobs they depend on need to
+        be run again; all other jobs are left to be run as normal.
+        """
+        if not self.journal:
+            logging.warning("PipelineRunner: no journal, can't resume")
+            return
+        records = self.__read_journal()
+        nrestored = 0
+        nattached = 0
+        for job in self.__queued_jobs:
+            if job.skipped or job in self.blocked:
+                continue
+            try:
+                record = records[json.dumps(self.__job_keys[job])]
+            except KeyError:
+                continue
+            if record['event'] == 'finished':
+                if not record['successful']:
+                    continue
+                outputs = self.__fingerprint_outputs(job)
+                if outputs != record['outputs'] or None in outputs.values():
+                    logging.debug("PipelineRunner: outputs changed for %s, "
+                                  "will rerun" % job.name)
+                    continue
+                job.restore(record['job_id'],record['exit_status'],
+                            start_time=record['start_time'],
+                            end_time=record['end_time'],
+                            resource_usage=record['resource_usage'])
+                self.__remove_from_queue(job)
+                self.__job_completed(job)
+                nrestored += 1
+            elif record['event'] == 'started':
+                job_id = record['job_id']
+                try:
+                    attached = self.__runner.attach(job_id,
+                                                    record['attach_info'])
+                except (AttributeError,KeyError):
+                    attached = False
+                if not attached:
+                    continue
+                self.__remove_from_queue(job)
+                job.start(job_id=job_id)
+                self.running[job_id] = job
+                print "Job re-attached: %s: %s %s" % (
+                    job_id,
+                    job.name,
+                    os.path.basename(job.working_dir))
+                nattached += 1
+        print "Resumed from journal: %d jobs already completed, %d " \
+            "re-attached" % (nrestored,nattached)
+
+    def __remove_from_queue(self,job):
+        """Internal: remove a job from the queue of waiting jobs
+        """
+        jobs = []
+        while not self.jobs.empty():
+            jobs.append(self.jobs.get())
+        for j in jobs:
+            if j is not job:
+                self.jobs.put(j)
+
+    def __skip_job(self,job):
+        """Internal: skip a job and all the jobs depending on it
+
+        The job is marked as skipped and moved to the list of
+        skipped jobs (and so will never be run); the same is then
+        done for all the jobs which depend on it.
+        """
+        job.skipped = True
+        try:
+            del(self.blocked[job])
+        except KeyError:
+            pass
+        self.skipped.append(job)
+        print "Job skipped (failed dependency): %s %s" % (
+            job.name,
+            os.path.basename(job.working_dir))
+        for child in self.dependents.pop(job,[]):
+            if not child.skipped:
+                self.__skip_job(child)
+        self.__update_group(job)
+
+    def __update_group(self,job):
+        """Internal: update the group for a finished or skipped job
+
+        If the job is the last in its group to finish then the group
+        completion handler is invoked.
+        """
+        if job.group_label is not None:
+            jobs_in_group = self.completed_in_group[job.group_label]
+            jobs_in_group.append(job)
+            if self.njobs_in_group[job.group_label] == len(jobs_in_group):
+                # All jobs in group have completed
+                print "Group '%s' has completed" % job.group_label
+                # Invoke callback on group completion
+                if self.handle_group_completion:
+                    self.__invoke_handler(self.handle_group_completion,
+                                          job.group_label,jobs_in_group)
+
+    def __invoke_handler(self,handler,*args):
+        """Internal: invoke a completion handler
+
+        If handlers are being run in the background then the
+        handler is added to the queue for the handler thread
+        (which is started if necessary), otherwise it is called
+        directly.
+        """
+        if not self.__background_handlers:
+            handler(*args)
+            return
+        self.__handler_queue.put((handler,args))
+        if self.__handler_thread is None:
+            self.__handler_thread = threading.Thread(
+                target=self.__run_handlers)
+            self.__handler_thread.daemon = True
+            self.__handler_thread.start()
+
+    def __run_handlers(self):
+        """Internal: run queued completion handlers (in a thread)
+
+        Exceptions raised by handlers are logged and otherwise
+        ignored.
+        """
+        while True:
+            handler,args = self.__handler_queue.get()
+            try:
+                handler(*args)
+            except Exception as ex:
+                logging.error("PipelineRunner: exception in completion "
+                              "handler %s: %s" % (handler,ex))
+            finally:
+                self.__handler_queue.task_done()
+
+    def __wait(self,timeout):
+        """Internal: wait between updates in blocking mode
+
+        Waits on the job runner for a job to finish (or for
+        'timeout' seconds) if there are running jobs; if only
+        background completion handlers remain then waits for
+        those to finish.
+        """
+        if self.running:
+            try:
+                wait = self.__runner.wait
+            except AttributeError:
+                # Runner can't wait for jobs
+                wait = time.sleep
+            wait(timeout)
+        elif self.__handler_queue.unfinished_tasks:
+            self.__handler_queue.join()
+        else:
+            time.sleep(timeout)
+
+    def __update_poll_interval(self,updated_status):
+        """Internal: set the interval before the next update
+
+        If the status changed on the last update then the interval
+        is reset to the minimum, otherwise it is doubled (up to the
+        maximum 'poll_interval'). The interval is then shortened if
+        a running job is expected to finish sooner, based on the
+        average run time of the completed jobs.
+        """
+        if updated_status:
+            interval = self.min_poll_interval
+        else:
+            interval = min(self.__current_poll_interval*2,
+                           self.poll_interval)
+        if self.running and self.__ntimed_jobs:
+            mean_job_time = self.__total_job_time/self.__ntimed_jobs
+            now = time.time()
+            for job in self.running.values():
+                time_to_finish = job.start_time + mean_job_time - now
+                if time_to_finish > 0:
+                    interval = min(interval,
+                                   max(time_to_finish,self.min_poll_interval))
+        self.__current_poll_interval = interval
+
+    def profile(self):
+        """Return a profile of the resources used by the pipeline
+
+        Returns a dictionary with the following items:
+
+        - 'jobs': list with a dictionary for each completed job,
+          with its name, label, group, job id, working directory,
+          status, exit status, submission and end times, elapsed
+          time, and the resources used (see
+          BaseJobRunner.resource_usage; values are None if not
+          reported by the runner)
+        - 'groups': list with a summary for each group (see
+          below); ungrouped jobs are summarised under None
+        - 'summary': summary for all the completed jobs
+
+        The summaries give the number of jobs and failures, the
+        start and end times, the 'makespan' (time from the
+        first submission to the last completion), the total wall
+        and CPU times, the critical path (the longest chain of
+        dependent jobs, by wall time) and its length, the mean
+        number of jobs running concurrently and the utilisation
+        (mean concurrency as a fraction of max_concurrent_jobs),
+        the CPU efficiency (CPU time as a fraction of wall time)
+        and the peak RSS.
+
+        Times are in seconds, and RSS in Kb.
+        """
+        groups = []
+        for group in self.groups + [None]:
+            jobs = [job for job in self.completed if job.group_label == group]
+            if jobs:
+                summary = self.__summarise_jobs(jobs)
+                summary['group'] = group
+                groups.append(summary)
+        return dict(jobs=[self.__profile_job(job) for job in self.completed],
+                    groups=groups,
+                    summary=self.__summarise_jobs(self.completed))
+
+    def write_profile(self,filename,fmt=None):
+        """Write a profile of the resources used by the pipeline
+
+        The profile (see the 'profile' method) is written either
+        as JSON, or as a tab-delimited file with one line for
+        each completed job (with a '#' header line).
+
+        Arguments:
+          filename: name of the file to write the profile to
+          fmt: (optional) either 'json' or 'tsv'; if not set
+            then the format is 'json' if the file name ends with
+            '.json' and 'tsv' otherwise
+        """
+        if fmt is None:
+            if filename.endswith('.json'):
+                fmt = 'json'
+            else:
+                fmt = 'tsv'
+        profile = self.profile()
+        with open(filename,'w') as fp:
+            if fmt == 'json':
+                json.dump(profile,fp,indent=2,sort_keys=True)
+                fp.write("\n")
+            elif fmt == 'tsv':
+                fp.write("#%s\n" % '\t'.join(PROFILE_FIELDS))
+                for job in profile['jobs']:
+                    values = []
+                    for field in PROFILE_FIELDS:
+                        value = job[field]
+                        if value is None:
+                            value = ''
+                        elif isinstance(value,float):
+                            value = "%.3f" % value
+                        values.append(str(value))
+                    fp.write("%s\n" % '\t'.join(values))
+            else:
+                raise Exception("Unrecognised profile format: '%s'" % fmt)
+
+    def __profile_job(self,job):
+        """Internal: return the profile data for a completed job
+        """
+        data = dict(name=job.name,
+                    label=job.label,
+                    group=job.group_label,
+                    job_id=job.job_id,
+                    working_dir=job.working_dir,
+                    status=job.status(),
+                    exit_status=job.exit_status,
+                    submit_time=job.start_time,
+                    end_time=job.end_time,
+                    elapsed_time=(job.end_time - job.start_time))
+        usage = job.resource_usage
+        if usage is None:
+            usage = {}
+        for key in ('queue_wait','wall_time','user_time','sys_time',
+                    'max_rss'):
+            data[key] = usage.get(key)
+        return data
+
+    def __summarise_jobs(self,jobs):
+        """Internal: return summary of resources used by jobs
+
+        See the 'profile' method for details.
+        """
+        summary = dict(njobs=len(jobs),
+                       nfailed=len([j for j in jobs if not j.isSuccessful()]),
+                       start_time=None,
+                       end_time=None,
+                       makespan=None,
+                       total_wall_time=0.0,
+                       total_cpu_time=None,
+                       critical_path=[],
+                       critical_path_time=0.0,
+                       mean_concurrency=None,
+                       utilisation=None,
+                       cpu_efficiency=None,
+                       peak_rss=None)
+        if not jobs:
+            return summary
+        summary['start_time'] = min([j.start_time for j in jobs])
+        summary['end_time'] = max([j.end_time for j in jobs])
+        summary['makespan'] = summary['end_time'] - summary['start_time']
+        # Wall and CPU times, and peak memory
+        wall_time = {}
+        cpu_time = 0.0
+        cpu_wall_time = 0.0
+        ncpu_times = 0
+        for job in jobs:
+            usage = job.resource_usage
+            if usage is None:
+                usage = {}
+            if usage.get('wall_time') is not None:
+                wall_time[job] = usage['wall_time']
+            else:
+                wall_time[job] = job.end_time - job.start_time
+            if usage.get('user_time') is not None:
+                cpu_time += usage['user_time'] + usage['sys_time']
+                cpu_wall_time += wall_time[job]
+                ncpu_times += 1
+            if usage.get('max_rss') is not None:
+                summary['peak_rss'] = max(summary['peak_rss'],
+                                          usage['max_rss'])
+        summary['total_wall_time'] = sum(wall_time.values())
+        if ncpu_times:
+            summary['total_cpu_time'] = cpu_time
+            if cpu_wall_time > 0.0:
+                summary['cpu_efficiency'] = cpu_time/cpu_wall_time
+        if summary['makespan'] > 0.0:
+            summary['mean_concurrency'] = summary['total_wall_time']/\
+                                          summary['makespan']
+            summary['utilisation'] = summary['mean_concurrency']/\
+                                     self.max_concurrent_jobs
+        # Critical path: jobs complete after the jobs they depend
+        # on, so parents are always visited before their children
+        path_time = {}
+        previous = {}
+        for job in jobs:
+            parent = None
+            for p in job.depends_on:
+                if p in path_time and \
+                   (parent is None or path_time[p] > path_time[parent]):
+                    parent = p
+            path_time[job] = wall_time[job]
+            if parent is not None:
+                path_time[job] += path_time[parent]
+            previous[job] = parent
+        job = max(jobs,key=lambda j: path_time[j])
+        summary['critical_path_time'] = path_time[job]
+        while job is not None:
+            summary['critical_path'].insert(0,job.name)
+            job = previous[job]
+        return summary
 
     def report(self):
         """Return a report of the pipeline status
@@ -485,7 +1315,7 @@ class PipelineRunner:
         # Report jobs running
         if self.nRunning() > 0:
             report += "\n%d jobs running:\n" % self.nRunning()
-            for job in self.running:
+            for job in self.running.values():
                 report += "\t%s\t%s\t%s\n" % (job.label,job.log,job.working_dir)
         # Report completed jobs
         if self.nCompleted() > 0:
@@ -496,6 +1326,38 @@ class PipelineRunner:
                                                            job.working_dir,
                                                            (job.end_time - job.start_time),
                                                            job.status())
+        # Report skipped jobs
+        if self.nSkipped() > 0:
+            report += "\n%d jobs skipped:\n" % self.nSkipped()
+            for job in self.skipped:
+                report += "\t%s\t%s\t[%s]\n" % (job.label,
+                                                job.working_dir,
+                                                job.status())
+        # Report summary of completed groups
+        if self.nCompleted() > 0:
+            profile = self.profile()
+            report += "\nSummary of completed jobs:\n"
+            for summary in profile['groups'] + [profile['summary']]:
+                group = summary.get('group','ALL')
+                if group is None:
+                    group = "(no group)"
+                report += "\t%s\t%d jobs (%d failed)\tmakespan %.1fs" \
+                          "\tcritical path %.1fs (%d jobs)" % \
+                          (group,
+                           summary['njobs'],
+                           summary['nfailed'],
+                           summary['makespan'],
+                           summary['critical_path_time'],
+                           len(summary['critical_path']))
+                if summary['utilisation'] is not None:
+                    report += "\tutilisation %.0f%%" % \
+                              (summary['utilisation']*100.0)
+                if summary['cpu_efficiency'] is not None:
+                    report += "\tCPU efficiency %.0f%%" % \
+                              (summary['cpu_efficiency']*100.0)
+                if summary['peak_rss'] is not None:
+                    report += "\tpeak RSS %dKb" % summary['peak_rss']
+                report += "\n"
         return report
 
     def __del__(self):
@@ -508,8 +1370,9 @@ class PipelineRunner:
         # Empty the queue
         while not self.jobs.empty():
             self.jobs.get()
+        self.blocked = {}
         # Terminate the running jobs
-        for job in self.running:
+        for job in self.running.values():
             logging.debug("Terminating job %s" % job.job_id)
             print "Terminating job %s" % job.job_id
             try:
@@ -535,7 +1398,9 @@ class SolidPipelineRunner(PipelineRunner):
     solid_pipeline.run()
     """
     def __init__(self,runner,script,max_concurrent_jobs=4,poll_interval=30):
-        PipelineRunner.__init__(self,runner)
+        PipelineRunner.__init__(self,runner,
+                                max_concurrent_jobs=max_concurrent_jobs,
+                                poll_interval=poll_interval)
         self.script = script
 
     def addDir(self,dirn):
@@ -50,6 +50,12 @@ class MockGE(object):
     Each time any of these are invoked, the 'update_jobs' method is
     called to check the status of any active jobs and update the
     database accordingly; this method can also be invoked directly.
+
+    Array jobs can be submitted using the '-t' option of 'qsub'.
+    Each task is stored as a separate job in the database, with
+    the id of the array (which is the id of the first task) and
+    the task number; tasks are referred to externally as
+    '<array_id>.<task_id>'.
     """
     def __init__(self,max_jobs=4,qsub_delay=0.0,qacct_delay=15.0,
                  shell='/bin/bash',database_dir=None,debug=False):
@@ -93,6 +99,8 @@ class MockGE(object):
         if init_db:
             logging.debug("Setting up DB")
             self._init_db()
+        else:
+            self._update_db()
         self._shell = shell
         self._max_jobs = max_jobs
         self._qsub_delay = qsub_delay
@@ -117,7 +125,9 @@ class MockGE(object):
           qsub_time   FLOAT,
           start_time  FLOAT,
           end_time    FLOAT,
-          exit_code   INTEGER
+          exit_code   INTEGER,
+          array_id    INTEGER,
+          task_id     INTEGER
         )
         """
         try:
@@ -128,7 +138,22 @@ class MockGE(object):
             print "Failed to set up database: %s" % ex
             raise ex
 
-    def _init_job(self,name,command,working_dir,queue,output_name,join_output):
+    def _update_db(self):
+        """
+        Add columns missing from a database made by older versions
+        """
+        cu = self._cx.cursor()
+        cu.execute("PRAGMA table_info(jobs)")
+        columns = [col['name'] for col in cu.fetchall()]
+        for column in ('array_id','task_id'):
+            if column not in columns:
+                logging.debug("Adding column '%s' to DB" % column)
+                cu.execute("ALTER TABLE jobs ADD COLUMN %s INTEGER"
+                           % column)
+        self._cx.commit()
+
+    def _init_job(self,name,command,working_dir,queue,output_name,join_output,
+                  array_id=None,task_id=None):
         """
         Create a new job id
         """
@@ -144,8 +169,8 @@ class MockGE(object):
         logging.debug("_init_job: cmd: %s" % cmd)
         try:
             sql = """
-            INSERT INTO jobs (user,state,qsub_time,name,command,working_dir,queue,output_name,join_output)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+            INSERT INTO jobs (user,state,qsub_time,name,command,working_dir,queue,output_name,join_output,array_id,task_id)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             """
             cu = self._cx.cursor()
             cu.execute(sql,(self._user(),
@@ -156,7 +181,9 @@ class MockGE(object):
                             working_dir,
                             queue,
                             output_name,
-                            join_output))
+                            join_output,
+                            array_id,
+                            task_id))
             self._cx.commit()
             return cu.lastrowid
         except Exception as ex:
@@ -168,7 +195,8 @@ class MockGE(object):
         """
         # Get job info
         sql = """
-        SELECT name,command,queue,working_dir,output_name,join_output
+        SELECT name,command,queue,working_dir,output_name,join_output,
+        array_id,task_id
         FROM jobs WHERE id==?
         """
         cu = self._cx.cursor()
@@ -180,6 +208,15 @@ class MockGE(object):
         working_dir = job['working_dir']
         output_name = job['output_name']
         join_output = job['join_output']
+        # Job id and task id as seen by the job
+        if job['array_id'] is not None:
+            ge_job_id = job['array_id']
+            ge_task_id = job['task_id']
+            output_suffix = "%s.%s" % (ge_job_id,ge_task_id)
+        else:
+            ge_job_id = job_id
+            ge_task_id = "undefined"
+            output_suffix = "%s" % job_id
         # Try to run the job
         try:
             # Output file basename
@@ -193,13 +230,13 @@ class MockGE(object):
                 out = os.path.join(working_dir,name)
             logging.debug("Output basename: %s" % out)
             # Set up stdout and stderr targets
-            stdout_file = "%s.o%s" % (out,job_id)
+            stdout_file = "%s.o%s" % (out,output_suffix)
             stdout = open(stdout_file,'w')
             logging.debug("Stdout: %s" % stdout_file)
             if join_output == 'y':
                 stderr = subprocess.STDOUT
             else:
-                stderr_file = "%s.e%s" % (out,job_id)
+                stderr_file = "%s.e%s" % (out,output_suffix)
                 stderr = open(stderr_file,'w')
                 logging.debug("Stderr: %s" % stderr_file)
             # Build a script to run the command
@@ -212,11 +249,16 @@ exit_code=$?
 echo "$exit_code" > %s/__exit_code.%d
 """ % (self._shell,queue,command,self._database_dir,job_id))
             os.chmod(script_file,0775)
+            # Set up the job environment
+            env = os.environ.copy()
+            env['JOB_ID'] = str(ge_job_id)
+            env['SGE_TASK_ID'] = str(ge_task_id)
             # Run the command
             p = subprocess.Popen(script_file,
                                  cwd=working_dir,
                                  stdout=stdout,
-                                 stderr=stderr)
+                                 stderr=stderr,
+                                 env=env)
             # Capture the job id from the output
             pid = str(p.pid)
             # Update the database
@@ -371,7 +413,8 @@ echo "$exit_code" > %s/__exit_code.%d
         Get list of the jobs
         """
         sql = """
-        SELECT id,name,user,state,qsub_time,start_time,queue FROM jobs WHERE state != 'c'
+        SELECT id,name,user,state,qsub_time,start_time,queue,array_id,task_id
+        FROM jobs WHERE state != 'c'
         """
         args = []
         if user != "\*" and user != "*":
@@ -384,14 +427,43 @@ echo "$exit_code" > %s/__exit_code.%d
     def _job_info(self,job_id):
         """
         Return info on a job
+
+        Returns a list with the info for the job, or for each
+        of its tasks if the job is an array job (empty if the
+        job hasn't completed).
         """
         sql = """
-        SELECT id,name,user,exit_code,qsub_time,start_time,end_time,queue
-        FROM jobs WHERE id==? AND state=='c'
+        SELECT id,name,user,exit_code,qsub_time,start_time,end_time,queue,
+        array_id,task_id
+        FROM jobs WHERE ((id==? AND array_id IS NULL) OR array_id==?)
+        AND state=='c'
+        ORDER BY id
         """
         cu = self._cx.cursor()
-        cu.execute(sql,(job_id,))
-        return cu.fetchone()
+        cu.execute(sql,(job_id,job_id))
+        return cu.fetchall()
+
+    def _lookup_job_ids(self,job_id,task_id=None):
+        """
+        Return the internal ids for a job or array job task
+
+        If the job is an array job and no task id is supplied
+        then the ids of all the tasks are returned.
+        """
+        if task_id is None:
+            sql = """
+            SELECT id FROM jobs WHERE (id==? AND array_id IS NULL)
+            OR array_id==?
+            """
+            args = (job_id,job_id)
+        else:
+            sql = """
+            SELECT id FROM jobs WHERE array_id==? AND task_id==?
+            """
+            args = (job_id,task_id)
+        cu = self._cx.cursor()
+        cu.execute(sql,args)
+        return [job['id'] for job in cu.fetchall()]
 
     def _mark_for_deletion(self,job_id):
         """
@@ -444,6 +516,7 @@ echo "$exit_code" > %s/__exit_code.%d
         p.add_argument("-j",action="store")
         p.add_argument("-o",action="store")
         p.add_argument("-e",action="store")
+        p.add_argument("-t",action="store")
         args,cmd = p.parse_known_args(argv)
         # Command
         logging.debug("qsub: cmd: %s" % cmd)
@@ -472,6 +545,43 @@ echo "$exit_code" > %s/__exit_code.%d
             join_output = 'y'
         else:
             join_output = 'n'
+        # Array job
+        if args.t is not None:
+            # Task range has the form 'n[-m[:s]]'
+            task_range = args.t.split(':')
+            try:
+                step = int(task_range[1])
+            except IndexError:
+                step = 1
+            task_range = task_range[0].split('-')
+            first_task = int(task_range[0])
+            try:
+                last_task = int(task_range[1])
+            except IndexError:
+                last_task = first_task
+            # Create an entry in the job table for each task
+            array_id = None
+            for task_id in xrange(first_task,last_task+1,step):
+                job_id = self._init_job(name,cmd,working_dir,queue,
+                                        output_name,join_output,
+                                        array_id=array_id,
+                                        task_id=task_id)
+                if array_id is None:
+                    # First task supplies the id for the array
+                    array_id = job_id
+                    sql = """
+                    UPDATE jobs SET array_id=? WHERE id=?
+                    """
+                    cu = self._cx.cursor()
+                    cu.execute(sql,(array_id,job_id))
+                    self._cx.commit()
+                logging.debug("Created job %s (task %s.%s)" %
+                              (job_id,array_id,task_id))
+            # Report the job id
+            print "Your job-array %s.%d-%d:%d (\"%s\") has been " \
+                "submitted" % (array_id,first_task,last_task,step,name)
+            self.update_jobs()
+            return
         # Create an initial entry in job table
         job_id = self._init_job(name,cmd,working_dir,queue,
                                 output_name,join_output)
@@ -509,7 +619,12 @@ echo "$exit_code" > %s/__exit_code.%d
         print """job-ID  prior   name       user         state submit/start at     queue                          slots ja-task-ID
 -----------------------------------------------------------------------------------------------------------------"""
         for job in jobs:
-            job_id = str(job["id"])
+            if job["array_id"] is not None:
+                job_id = str(job["array_id"])
+                task_id = str(job["task_id"])
+            else:
+                job_id = str(job["id"])
+                task_id = ""
             name = str(job["name"])
             user = str(job["user"])
             state = str(job["state"])
@@ -527,7 +642,8 @@ echo "$exit_code" > %s/__exit_code.%d
             line.append("%s" % start_time)
             line.append("%s%s" % (queue[:30],' '*(30-len(queue))))
             line.append("1")
-            print ' '.join(line)
+            line.append(task_id)
+            print ' '.join(line).rstrip()
 
     def qacct(self,argv):
         """
@@ -565,19 +681,32 @@ echo "$exit_code" > %s/__exit_code.%d
         # Job id
         job_id = int(args.j)
         # Get job info
-        job_info = self._job_info(job_id)
-        if job_info is None:
+        jobs_info = self._job_info(job_id)
+        if not jobs_info:
             logging.debug("qacct: no info returned for job %s" %
                          job_id)
             sys.stderr.write("error: job id %s not found\n" % job_id)
             return
         # Check delay time
-        elapsed_since_job_end = time.time() - job_info[6]
+        elapsed_since_job_end = time.time() - \
+                                max([info['end_time'] for info in jobs_info])
         logging.debug("qacct: elapsed time: %s" % elapsed_since_job_end)
         if elapsed_since_job_end < self._qacct_delay:
             return
         # Print info
-        job_id = job_info['id']
+        for job_info in jobs_info:
+            self._print_qacct_info(job_info)
+
+    def _print_qacct_info(self,job_info):
+        """
+        Output the qacct-style info for a single job or task
+        """
+        if job_info['array_id'] is not None:
+            job_id = job_info['array_id']
+            task_id = job_info['task_id']
+        else:
+            job_id = job_info['id']
+            task_id = "undefined"
         name = job_info['name']
         user = job_info['user']
         exit_code = job_info['exit_code']
@@ -594,7 +723,7 @@ project      NONE
 department   defaultdepartment   
 jobname      %s                
 jobnumber    %s             
-taskid       undefined
+taskid       %s
 account      sge                 
 priority     0                   
 qsub_time    %s
@@ -603,7 +732,7 @@ end_time     %s
 granted_pe   NONE                
 slots        1                   
 failed       0    
-exit_status  %s""" % (queue,user,name,job_id,
+exit_status  %s""" % (queue,user,name,job_id,task_id,
                       qsub_time,start_time,end_time,
                       exit_code)
 
@@ -620,10 +749,21 @@ exit_status  %s""" % (queue,user,name,job_id,
         args = p.parse_args(argv)
         # Loop over job ids
         for job_id in args.job_id:
+            # Job ids can have the form '<job_id>[.<task_id>]'
+            try:
+                job_id,task_id = job_id.split('.')
+                task_id = int(task_id)
+            except ValueError:
+                task_id = None
             job_id = int(job_id)
-            # Mark the job for deletion
-            self._mark_for_deletion(job_id)
-            print "Job %s has been marked for deletion" % job_id
+            # Mark the job (or array job tasks) for deletion
+            for id_ in self._lookup_job_ids(job_id,task_id):
+                self._mark_for_deletion(id_)
+            if task_id is None:
+                print "Job %s has been marked for deletion" % job_id
+            else:
+                print "Job %s.%s has been marked for deletion" % (job_id,
+                                                                  task_id)
 
 #######################################################################
 # Functions
@@ -19,6 +19,7 @@ Extracting reads from Fastq, cfasta and qual files:
 - getreads: fetch reads one-by-one from Fastq, cfasta or qual file
 - getreads_subset: fetch subset of reads specified by index
 - getreads_regexp: fetch subset of reads matching regular expression
+- getreads_random_sample: fetch random sample of reads in a single pass
 
 """
 
@@ -28,6 +29,9 @@ Extracting reads from Fastq, cfasta and qual files:
 
 import os
 import re
+import math
+import random
+import itertools
 from .utils import getlines
 
 #######################################################################
@@ -172,3 +176,82 @@ def getreads_regex(filen,pattern):
     for read in getreads(filen):
         if regex.search(''.join(read)):
             yield read
+
+def getreads_random_sample(filens,n,seed=None):
+    """
+    Fetch random sample of reads from one or more files
+
+    This generator function makes a single pass through
+    one or more sequence files (Fastq, csfasta or qual)
+    in parallel, and yields a random sample of ``n`` reads
+    which is the same for each file. This means that (for
+    example) R1/R2 pairs are kept in sync.
+
+    The sample is selected using reservoir sampling
+    ("Algorithm L"; Li, K.-H. 1994), so the total number
+    of reads doesn't need to be known in advance. The
+    sampled reads are held in memory and are returned
+    in the order that they appear in the files, once all
+    the reads have been examined.
+
+    If there are fewer than ``n`` reads in the files then
+    all the reads are returned. An exception is raised if
+    the files contain different numbers of reads.
+
+    The files can be gzipped; this function should handle
+    this invisibly provided that the file extension is
+    '.gz'.
+
+    Example usage (returns the same 100 random read
+    pairs from the R1 and R2 files):
+
+    >>> for r1,r2 in getreads_random_sample(('illumina_R1.fq',
+    ...                                      'illumina_R2.fq'),100):
+    >>> ... print r1,r2
+
+    Arguments:
+      filens (list): paths of the files to fetch reads
+        from
+      n (int): number of reads to return
+      seed (object): optional, seed for the random
+        number generator (using the same seed will
+        produce the same sample of reads)
+
+    Yields:
+      Tuple: next set of sampled read records, with one
+        read for each file (in the same order as the
+        files were supplied). Each read record is a
+        list of lines.
+    """
+    rng = random.Random(seed)
+    def random_unit():
+        # Random number in the interval (0,1)
+        u = rng.random()
+        while u == 0.0:
+            u = rng.random()
+        return u
+    if n <= 0:
+        return
+    reservoir = []
+    w = math.exp(math.log(random_unit())/n)
+    next_idx = n + int(math.floor(math.log(random_unit())/
+                                  math.log(1.0-w)))
+    for idx,reads in enumerate(itertools.izip_longest(
+            *[getreads(filen) for filen in filens])):
+        if None in reads:
+            raise Exception("Inconsistent numbers of reads between "
+                            "files")
+        if idx < n:
+            # Fill the reservoir
+            reservoir.append((idx,reads))
+        elif idx == next_idx:
+            # Replace a random item in the reservoir and
+            # determine the next read to sample
+            reservoir[rng.randrange(n)] = (idx,reads)
+            w *= math.exp(math.log(random_unit())/n)
+            next_idx += 1 + int(math.floor(math.log(random_unit())/
+                                           math.log(1.0-w)))
+    # Return the reads in file order
+    reservoir.sort(key=lambda r: r[0])
+    for idx,reads in reservoir:
+        yield reads
@@ -107,15 +107,25 @@ Alternatively the contents of a sheet (or a subset) can be rendered as text:
 ...                     include_styles=True)
 >>> data.render_as_text(start='B1',end='C6',include_columns_and_rows=True)
 
+For large amounts of data, rows can instead be streamed directly to an
+XLSX file (without building an XLSWorkBook in memory first) by using an
+XLSXStreamWorkBook:
+
+>>> xlsx = XLSXStreamWorkBook('test.xlsx')
+>>> data = xlsx.add_work_sheet('data',"My Data")
+>>> data.append_row(data=['Dozy','Beaky','Mick','Titch'])
+>>> xlsx.close()
+
 """
 
-__version__ = "0.0.8"
+__version__ = "0.2.0"
 
 #######################################################################
 # Import modules that this module depends on
 #######################################################################
  
 import re
+import math
 from collections import Iterator
 import logging
 import Spreadsheet
@@ -158,6 +168,19 @@ class Limits(XLSLimits):
     Limits for XLS files (kept for backwards compatibility)
     """
 
+# Regular expression for splitting a cell index into column and row
+CELL_INDEX_REGEX = re.compile(r'^([A-Z]+)([0-9]+)$')
+
+# Maximum number of parsed cell indices to cache
+CELL_INDEX_CACHE_SIZE = 100000
+
+# Regular expression for cell references in formulae which use
+# '#' (current column) and/or '?' (current row)
+CELL_TEMPLATE_REGEX = re.compile(r'^([A-Z]+|#)([0-9]+|\?)$')
+
+# Maximum number of compiled formulae to cache
+FORMULA_CACHE_SIZE = 10000
+
 #######################################################################
 # Class definitions
 #######################################################################
@@ -239,81 +262,49 @@ class XLSWorkBook:
                 ws.freezePanes(column=col,row=row)
         xls.save(filen)
 
-    def save_as_xlsx(self,filen):
+    def save_as_xlsx(self,filen,constant_memory=False):
         """Output the workbook contents to an XLSX-format file
 
+        The contents of each worksheet are written row by row via
+        an XLSXStreamWorkBook. Values are written using the types
+        they were stored with (e.g. integers are written directly
+        as numbers) rather than being rendered as text first.
+
         Arguments:
           filen: name of the file to write the workbook to.
+          constant_memory: (optional) if True then use xlsxwriter's
+            'constant_memory' mode, so that each row is flushed to
+            disk as soon as it has been written (default is to
+            hold the whole file in memory until it is closed)
 
         """
-        xlsx = xlsxwriter.Workbook(filen)
-        styles = {}
-        default_min_col_width = 7
+        xlsx = XLSXStreamWorkBook(filen,constant_memory=constant_memory)
         for name in self.worksheet:
             worksheet = self.worksheet[name]
-            ws = xlsx.add_worksheet(worksheet.title)
-            # Write content to worksheet cell by cell
-            start = CellIndex('A1')
-            end = CellIndex(cell(worksheet.last_column,
-                                 worksheet.last_row))
-            for col in ColumnRange(start.column,end.column):
-                # Maximum column width
-                max_width = default_min_col_width
-                for row in xrange(start.row,end.row+1):
-                    # Get the value
-                    value = worksheet.render_cell(cell(col,row),
-                                                  eval_formulae=False,
-                                                  apply_format=False)
-                    # Handle styles for this cell
-                    style = worksheet.get_style(cell(col,row))
-                    if style:
-                        style_name = style.name
-                        try:
-                            xlsx_fmt = styles[style_name]
-                        except KeyError:
-                            xlsx_fmt = xlsx.add_format()
-                            if style.bold:
-                                xlsx_fmt.set_bold()
-                            if style.color is not None:
-                                xlsx_fmt.set_color(style.color)
-                            if style.bgcolor is not None:
-                                xlsx_fmt.set_bg_color(style.bgcolor)
-                            if style.font_size is not None:
-                                xlsx_fmt.set_font_size(style.font_size)
-                            styles[style_name] = xlsx_fmt
-                    else:
-                        xlsx_fmt = None
-                    # Deal with cell content
-                    if value.startswith('='):
-                        # Cell contains formula
-                        result = eval_formula(value,worksheet)
-                        ws.write_formula(cell(col,row),value,xlsx_fmt,result)
-                        col_width = len(str(result))
-                    else:
-                        # Deal with a data item
-                        # Attempt to convert to a number type
-                        # i.e. integer/float
-                        try:
-                            # Try integer
-                            value = int(str(value))
-                        except ValueError:
-                            # Not an integer, try float
-                            try:
-                                value = float(str(value))
-                            except ValueError:
-                                # Not a float either
-                                pass
-                        # Write to the worksheet
-                        ws.write(cell(col,row),value,xlsx_fmt)
-                        col_width = len(str(value))
-                    # Handle column widths
-                    max_width = max(max_width,col_width)
-                # Set the column width
-                icol = column_index_to_integer(col)
-                ws.set_column(icol,icol,max_width*1.2)
+            worksheet.evaluate_formulae()
+            ws = xlsx.add_work_sheet(name,worksheet.title,
+                                     formula_context=worksheet)
+            # Collect the styles for each row
+            styles = {}
+            for idx in worksheet.styles:
+                column,row,icol = parse_cell_index(idx)
+                if column is None or row is None:
+                    continue
+                try:
+                    styles[row][icol] = worksheet.styles[idx]
+                except KeyError:
+                    styles[row] = { icol: worksheet.styles[idx] }
+            ncols = column_index_to_integer(worksheet.last_column) + 1
+            # Write content to worksheet row by row
+            for row,values in enumerate(worksheet.iter_rows(),1):
+                try:
+                    row_styles = [styles[row].get(icol)
+                                  for icol in xrange(ncols)]
+                except KeyError:
+                    row_styles = None
+                ws.append_row(data=values,style=row_styles)
             # Handle freeze panes
-            if worksheet.freeze_panes is not None:
-                ws.freeze_panes(worksheet.freeze_panes)
+            ws.freeze_panes = worksheet.freeze_panes
         xlsx.close()
 
 class XLSWorkSheet:
@@ -389,26 +380,35 @@ class XLSWorkSheet:
 
         """
         self.title = str(title)[:Spreadsheet.MAX_LEN_WORKSHEET_TITLE]
-        self.data = {}
         self.styles = {}
-        self.rows = []
-        self.columns = []
         self.freeze_panes = None
+        # Cell values keyed by (row,column) integer tuples
+        # (rows count from 1, columns from 0 i.e. 'A')
+        self.__cells = {}
+        # Number of cells stored in each occupied row and column
+        self.__row_counts = {}
+        self.__col_counts = {}
+        # Sorted row and column lists (None if out of date)
+        self.__rows = None
+        self.__columns = None
+        # Highest row and column indices (None if out of date)
+        self.__max_row = 0
+        self.__max_col = -1
+        # Cached results of evaluated formulae, keyed in the
+        # same way as the cells (discarded on any change)
+        self.__results = {}
+        # Keys of the formulae currently being evaluated (used
+        # to detect circular references)
+        self.__evaluating = set()
 
     def __setitem__(self,idx,value):
         """Implement 'x[idx] = value'
 
         """
-        idx = CellIndex(idx)
-        if not idx.is_full:
+        column,row,icol = parse_cell_index(idx)
+        if column is None or row is None:
             raise KeyError,"Invalid index: '%s'" % idx
-        self.data[idx.idx] = value
-        if idx.column not in self.columns:
-            self.columns.append(idx.column)
-        self.columns.sort(cmp=cmp_column_indices)
-        if idx.row not in self.rows:
-            self.rows.append(idx.row)
-        self.rows.sort()
+        self.__set(row,icol,value)
 
     def __getitem__(self,idx):
         """Implement 'value = x[idx]'
@@ -417,41 +417,135 @@ class XLSWorkSheet:
         if str(idx).isalpha():
             return XLSColumn(idx,parent=self)
         else:
-            try:
-                return self.data[idx]
-            except Exception,ex:
+            column,row,icol = parse_cell_index(idx)
+            if column is None or row is None:
                 return None
+            return self.__cells.get((row,icol))
 
     def __delitem__(self,idx):
         """Implement 'del(x[idx])'
 
         """
+        column,row,icol = parse_cell_index(idx)
         try:
-            del(self.data[idx])
+            del(self.__cells[(row,icol)])
         except KeyError:
-            pass
-        idx = CellIndex(idx)
-        if self.column_is_empty(idx.column):
-            self.columns.remove(idx.column)
-        if self.row_is_empty(idx.row):
-            self.rows.remove(idx.row)
+            return
+        if self.__results:
+            self.__results = {}
+        self.__remove_row(row)
+        self.__remove_column(icol)
+
+    def __set(self,row,icol,value):
+        """Internal: store a value using integer row and column
+
+        """
+        key = (row,icol)
+        if key not in self.__cells:
+            self.__add_row(row)
+            self.__add_column(icol)
+        self.__cells[key] = value
+        if self.__results:
+            self.__results = {}
+
+    def __add_row(self,row,n=1):
+        """Internal: record 'n' new cells in a row
+
+        """
+        try:
+            self.__row_counts[row] += n
+        except KeyError:
+            self.__row_counts[row] = n
+            self.__rows = None
+            if self.__max_row is not None and row > self.__max_row:
+                self.__max_row = row
+
+    def __add_column(self,icol,n=1):
+        """Internal: record 'n' new cells in a column
+
+        """
+        try:
+            self.__col_counts[icol] += n
+        except KeyError:
+            self.__col_counts[icol] = n
+            self.__columns = None
+            if self.__max_col is not None and icol > self.__max_col:
+                self.__max_col = icol
+
+    def __remove_row(self,row):
+        """Internal: record removal of a cell from a row
+
+        """
+        self.__row_counts[row] -= 1
+        if not self.__row_counts[row]:
+            del(self.__row_counts[row])
+            self.__rows = None
+            if row == self.__max_row:
+                self.__max_row = None
+
+    def __remove_column(self,icol):
+        """Internal: record removal of a cell from a column
+
+        """
+        self.__col_counts[icol] -= 1
+        if not self.__col_counts[icol]:
+            del(self.__col_counts[icol])
+            self.__columns = None
+            if icol == self.__max_col:
+                self.__max_col = None
+
+    @property
+    def data(self):
+        """Return a dictionary of cell values keyed by cell index
+
+        The dictionary is a copy; changing it has no effect on
+        the worksheet.
+
+        """
+        return dict([(cell(column_integer_to_index(icol),row),value)
+                     for (row,icol),value in self.__cells.iteritems()])
+
+    @property
+    def rows(self):
+        """Return sorted list of indices of rows with data
+
+        The list shouldn't be modified by the caller.
+
+        """
+        if self.__rows is None:
+            self.__rows = sorted(self.__row_counts)
+        return self.__rows
+
+    @property
+    def columns(self):
+        """Return sorted list of indices of columns with data
+
+        The list shouldn't be modified by the caller.
+
+        """
+        if self.__columns is None:
+            self.__columns = [column_integer_to_index(icol)
+                              for icol in sorted(self.__col_counts)]
+        return self.__columns
 
     @property
     def last_column(self):
         """Return index of last column with data
 
         """
-        try:
-            return self.columns[-1]
-        except IndexError:
+        if self.__max_col is None:
+            self.__max_col = max(self.__col_counts) \
+                             if self.__col_counts else -1
+        if self.__max_col < 0:
             return 'A'
+        return column_integer_to_index(self.__max_col)
 
     @property
     def next_column(self):
         """Index of first empty column after highest index with data
 
         """
-        if len(self.columns):
+        if self.__col_counts:
             return column_integer_to_index(column_index_to_integer(self.last_column)+1)
         else:
             return 'A'
@@ -461,17 +555,19 @@ class XLSWorkSheet:
         """Return index of last row with data
 
         """
-        try:
-            return int(self.rows[-1])
-        except IndexError:
+        if self.__max_row is None:
+            self.__max_row = max(self.__row_counts) \
+                             if self.__row_counts else 0
+        if self.__max_row < 1:
             return 1
+        return self.__max_row
 
     @property
     def next_row(self):
         """Index of first empty row after highest index with data
 
         """
-        if len(self.rows):
+        if self.__row_counts:
             return self.last_row + 1
         else:
             return 1
@@ -483,10 +579,11 @@ class XLSWorkSheet:
         otherwise returns True.
 
         """
-        if col not in self.columns:
+        icol = column_index_to_integer(col)
+        if icol not in self.__col_counts:
             return True
-        for row in self.rows:
-            if self[cell(col,row)] is not None:
+        for row in self.__row_counts:
+            if self.__cells.get((row,icol)) is not None:
                 return False
         return True
 
@@ -497,10 +594,10 @@ class XLSWorkSheet:
         otherwise returns True.
 
         """
-        if row not in self.rows:
+        if row not in self.__row_counts:
             return True
-        for col in self.columns:
-            if self[cell(col,row)] is not None:
+        for icol in self.__col_counts:
+            if self.__cells.get((row,icol)) is not None:
                 return False
         return True
 
@@ -552,33 +649,20 @@ class XLSWorkSheet:
           The index of the inserted column.
 
         """
-        # Get list of all columns we want to move (in reverse order)
-        columns_to_bump = []
-        try:
-            i = self.columns.index(position)
-            columns_to_bump = self.columns[i:][::-1]
-        except ValueError:
-            for col in self.columns:
-                if cmp_column_indices(col,position) > -1:
-                    i = self.columns.index(col)
-                    columns_to_bump = self.columns[i:][::-1]
-                    break
-        # Shift columns, if required
-        for col in columns_to_bump:
-            next_col = column_integer_to_index(column_index_to_integer(col)+1)
-            for row in range(1,self.last_row+1):
-                # Get cell index
-                idx = cell(col,row)
-                if idx in self.data:
-                    # Copy contents to next column
-                    self.data[cell(next_col,row)] = self.data[idx]
-                    # Remove this cell
-                    del(self.data[idx])
-        # Append a new last column index to list of columns
-        self.columns.append(self.next_column)
-        # Remove the inserted column index from the list of columns
-        if position in self.columns:
-            self.columns.remove(position)
+        # Shift cells in this and all higher columns along by one
+        ipos = column_index_to_integer(position)
+        self.__results = {}
+        moved = [(key,value) for key,value in self.__cells.iteritems()
+                 if key[1] >= ipos]
+        for key,value in moved:
+            del(self.__cells[key])
+        for (row,icol),value in moved:
+            self.__cells[(row,icol+1)] = value
+        self.__col_counts = dict([(icol+1 if icol >= ipos else icol,n)
+                                  for icol,n in self.__col_counts.iteritems()])
+        self.__columns = None
+        if self.__max_col is not None and self.__max_col >= ipos:
+            self.__max_col += 1
         # Now insert data at the new position
         self.write_column(position,data=data,text=text,fill=fill,from_row=from_row,style=style)
         return position
@@ -635,31 +719,35 @@ class XLSWorkSheet:
         # Set initial row
         if from_row is None:
             from_row = 1
+        from_row = int(from_row)
         # Write in data from a list
         if data is not None:
             items = data
         elif text is not None:
             items = text.split('\n')
         elif fill is not None:
-            items = [fill for i in range(from_row,self.last_row+1)]
+            items = [fill for i in xrange(from_row,self.last_row+1)]
         else:
             # Nothing to do
             return
-        # Add column index to list of columns
-        if col not in self.columns:
-            self.columns.append(col)
-        # Write data items to cells
+        # Write data items to cells, updating the column
+        # count once at the end
+        self.__results = {}
+        icol = column_index_to_integer(col)
+        cells = self.__cells
+        nnew = 0
         row = from_row
         for item in items:
-            self.data[cell(col,row)] = item
-            if row not in self.rows:
-                self.rows.append(row)
+            key = (row,icol)
+            if key not in cells:
+                self.__add_row(row)
+                nnew += 1
+            cells[key] = item
             if style is not None:
                 self.set_style(style,cell(col,row))
             row += 1
-        # Sort the column and row indices
-        self.columns.sort(cmp=cmp_column_indices)
-        self.rows.sort()
+        if nnew:
+            self.__add_column(icol,nnew)
 
     def insert_column_data(self,col,data,start=None,style=None):
         """Insert list of data into a column
@@ -687,11 +775,7 @@ class XLSWorkSheet:
             i = 1
         else:
             i = int(start)
-        for item in data:
-            self[cell(col,i)] = item
-            if style is not None:
-                self.set_style(style,cell(col,i))
-            i += 1
+        self.write_column(col,data=data,from_row=i,style=style)
 
     def rowof(self,s,column='A'):
         """Return row index for cell which matches string
@@ -710,8 +794,9 @@ class XLSWorkSheet:
         """
         # Get row where cell in row matches 'name'
         # i.e. look up a row index
-        for row in range(1,self.last_row+1):
-            if self[cell(column,row)] == s:
+        icol = column_index_to_integer(column)
+        for row in self.rows:
+            if self.__cells.get((row,icol)) == s:
                 return row
         raise LookupError,"No match for '%s' in column '%s'" % (s,column)
 
@@ -743,27 +828,20 @@ class XLSWorkSheet:
           The index of the inserted row.
 
         """
-        # Create a new row before the specified row
-        # All rows above it move up one position
-        # 'New' row position is actually 'before_row'
-        # Bump all rows up one position
-        # Get list of all rows we want to move (in reverse order)
-        row_list = list(range(self.last_row,position-1,-1))
-        for row in row_list:
-            next_row = row + 1
-            for col in self.columns:
-                # Get cell index
-                idx = cell(col,row)
-                if idx in self.data:
-                    # Copy contents to next row
-                    self.data[cell(col,next_row)] = self.data[idx]
-                    # Remove this cell
-                    del(self.data[idx])
-        # Add a new last row index to the list of rows
-        self.rows.append(self.next_row)
-        # Remove the inserted row index from the list
-        if position in self.rows:
-            self.rows.remove(position)
+        # Shift cells in this and all higher rows up by one
+        position = int(position)
+        self.__results = {}
+        moved = [(key,value) for key,value in self.__cells.iteritems()
+                 if key[0] >= position]
+        for key,value in moved:
+            del(self.__cells[key])
+        for (row,icol),value in moved:
+            self.__cells[(row+1,icol)] = value
+        self.__row_counts = dict([(row+1 if row >= position else row,n)
+                                  for row,n in self.__row_counts.iteritems()])
+        self.__rows = None
+        if self.__max_row is not None and self.__max_row >= position:
+            self.__max_row += 1
         # Now insert data at the new position
         self.write_row(position,data=data,text=text,fill=fill,from_column=from_column,style=style)
         return position
@@ -811,6 +889,8 @@ class XLSWorkSheet:
             inserted row
           text: optional, tab-delimited string of text to be used
             to populate the inserted row
+          fill: optional, single data item to be repeated to fill
+            the inserted row
           from_column: optional, if specified then inserted row is
             populated from that column onwards
           style: optional, an XLSStyle object to associate with the
@@ -820,31 +900,35 @@ class XLSWorkSheet:
         # Set initial column
         if from_column is None:
             from_column = 'A'
+        row = int(row)
         # Write in data from a list
         if data is not None:
             items = data
         elif text is not None:
             items = text.split('\t')
         elif fill is not None:
-            items = [fill for i in range(from_row,self.last_row+1)]
+            items = [fill for col in ColumnRange(from_column,
+                                                 self.last_column)]
         else:
             # Nothing to do
             return
-        # Add row index to list of rows
-        if row not in self.rows:
-            self.rows.append(row)
-        # Write data items to cells
-        col = from_column
+        # Write data items to cells, updating the row
+        # count once at the end
+        self.__results = {}
+        cells = self.__cells
+        nnew = 0
+        icol = column_index_to_integer(from_column)
         for item in items:
-            self.data[cell(col,row)] = item
-            if col not in self.columns:
-                self.columns.append(col)
+            key = (row,icol)
+            if key not in cells:
+                self.__add_column(icol)
+                nnew += 1
+            cells[key] = item
             if style is not None:
-                self.set_style(style,cell(col,row))
-            col = incr_col(col)
-        # Sort the column and row indices
-        self.columns.sort(cmp=cmp_column_indices)
-        self.rows.sort()
+                self.set_style(style,cell(column_integer_to_index(icol),row))
+            icol += 1
+        if nnew:
+            self.__add_row(row,nnew)
 
     def insert_row_data(self,row,data,start=None,style=None):
         """Insert list of data into a row
@@ -869,14 +953,8 @@ class XLSWorkSheet:
         """
         # Insert data items from a list into a row in the spreadsheet
         if start is None:
-            i = column_index_to_integer('A')
-        else:
-            i = column_index_to_integer(start)
-        for item in data:
-            self[cell(column_integer_to_index(i),row)] = item
-            if style is not None:
-                self.set_style(style,cell(column_integer_to_index(i),row))
-            i += 1
+            start = 'A'
+        self.write_row(row,data=data,from_column=start,style=style)
 
     def insert_block_data(self,data,col=None,row=None,style=None):
         """Insert data items from a block of text
@@ -904,19 +982,12 @@ class XLSWorkSheet:
             j = int(1)
         else:
             j = int(row)
+        if col is None:
+            col = 'A'
         for line in data.split('\n'):
-            if col is None:
-                i = column_index_to_integer('A')
-            else:
-                i = column_index_to_integer(col)
-            for item in line.strip('\n').split('\t'):
-                icol = column_integer_to_index(i)
-                if not item:
-                    item = None
-                self[cell(icol,j)] = item
-                if style is not None:
-                    self.set_style(style,cell(icol,j))
-                i += 1
+            items = [item if item else None
+                     for item in line.strip('\n').split('\t')]
+            self.write_row(j,data=items,from_column=col,style=style)
             j += 1
 
     def fill_column(self,column,item,start=None,end=None,style=None):
@@ -941,7 +1012,7 @@ class XLSWorkSheet:
 
         """
         # Fill a column with the same data item
-        if (start is None or end is None) and (not self.columns and not self.rows):
+        if (start is None or end is None) and not self.__cells:
             # Empty sheet, nothing to fill
             return
         if start is None:
@@ -952,10 +1023,7 @@ class XLSWorkSheet:
             j = self.last_row
         else:
             j = int(end)
-        for row in xrange(i,j+1):
-            self[cell(column,row)] = item
-            if style is not None:
-                self.set_style(style,cell(column,row))
+        self.write_column(column,data=[item]*(j-i+1),from_row=i,style=style)
 
     def set_style(self,cell_style,start,end=None):
         """Associate style information with one or more cells
@@ -1037,12 +1105,12 @@ class XLSWorkSheet:
         try:
             if item.startswith('='):
                 # Formula
-                item = item.replace('?',
-                                    str(CellIndex(idx).row)).replace('#',
-                                                                     str(CellIndex(idx).column))
+                column,row,icol = parse_cell_index(idx)
                 if eval_formulae:
                     logging.debug("Evaluating %s from %s" % (item,idx))
-                    item = eval_formula(item,self)
+                    item = self.lookup_value(row,icol)
+                else:
+                    item = item.replace('?',str(row)).replace('#',column)
         except AttributeError:
             pass
         if apply_format:
@@ -1092,6 +1160,8 @@ class XLSWorkSheet:
 
         """
         # Output worksheet as text (i.e. string)
+        if eval_formulae:
+            self.evaluate_formulae()
         if start is None:
             start = CellIndex('A1')
         else:
@@ -1120,6 +1190,415 @@ class XLSWorkSheet:
             text.append('\t'.join(line))
         return '\n'.join(text)
 
+    def lookup_value(self,row,icol):
+        """Return the value of a cell, evaluating any formula
+
+        If the cell contains a formula then the result of
+        evaluating it is returned instead (see 'eval_formula'),
+        otherwise the stored value is returned as-is (None for
+        an empty cell).
+
+        Formula results are cached until the worksheet is next
+        modified. A formula which refers back to its own cell
+        (either directly or via other cells) evaluates to
+        BAD_REF.
+
+        Arguments:
+          row: integer row index (counting from 1)
+          icol: integer column index (counting from zero i.e.
+            0 is column 'A')
+
+        """
+        key = (row,icol)
+        item = self.__cells.get(key)
+        try:
+            if not item.startswith('='):
+                return item
+        except AttributeError:
+            return item
+        try:
+            return self.__results[key]
+        except KeyError:
+            pass
+        if key in self.__evaluating:
+            # Circular reference
+            self.__results[key] = BAD_REF
+            return BAD_REF
+        self.__evaluating.add(key)
+        try:
+            result = compile_formula(item).evaluate(self.lookup_value,
+                                                    row,icol)
+        finally:
+            self.__evaluating.discard(key)
+        self.__results[key] = result
+        return result
+
+    def evaluate_formulae(self):
+        """Evaluate all the formulae in the worksheet
+
+        Formulae are evaluated a column at a time, with all
+        the cells in a column that contain the same formula
+        (e.g. from filling the column with '=L?-100') being
+        evaluated together in a single pass. The results are
+        cached (see 'lookup_value') and are used for subsequent
+        rendering, until the worksheet is next modified.
+
+        """
+        # Group the unevaluated formulae by column and formula
+        groups = {}
+        for key,item in self.__cells.iteritems():
+            try:
+                if not item.startswith('='):
+                    continue
+            except AttributeError:
+                continue
+            if key in self.__results:
+                continue
+            row,icol = key
+            try:
+                groups[(icol,item)].append(row)
+            except KeyError:
+                groups[(icol,item)] = [row]
+        # Evaluate each group
+        results = self.__results
+        for (icol,item),rows in sorted(groups.iteritems()):
+            rows.sort()
+            for row,result in zip(rows,
+                                  compile_formula(item).evaluate_rows(
+                                      self.lookup_value,rows,icol)):
+                results[(row,icol)] = result
+
+    def iter_rows(self,start=None,end=None):
+        """Iterate over the stored values row by row
+
+        Yields a list of the values stored in each row (with None
+        for empty cells), for the same region of the sheet that
+        'render_as_text' would output. Values are returned as they
+        were inserted, i.e. without rendering or evaluating them.
+
+        Arguments:
+          start: (optional) specify the top-lefthand most cell index to
+            start from (default is 'A1').
+          end: (optional) specify the bottom-righthand most cell index
+            to finish at (default is the cell corresponding to the
+            highest column and row indices).
+
+        """
+        if start is None:
+            start = 'A1'
+        if end is None:
+            end = cell(self.last_column,self.last_row)
+        start_column,start_row,start_icol = parse_cell_index(start)
+        end_column,end_row,end_icol = parse_cell_index(end)
+        icols = range(start_icol,end_icol+1)
+        cells = self.__cells
+        for row in xrange(start_row,end_row+1):
+            yield [cells.get((row,icol)) for icol in icols]
+
+class XLSXStreamWorkBook:
+    """Class for writing an XLSX file one row at a time
+
+    An XLSXStreamWorkBook writes rows directly to an XLSX file
+    via xlsxwriter as they are added, rather than first storing
+    them in XLSWorkSheet objects. By default xlsxwriter's
+    'constant_memory' mode is used, so that each row is flushed
+    to disk as soon as the next one is started:
+
+    >>> xlsx = XLSXStreamWorkBook('example.xlsx')
+    >>> ws = xlsx.add_work_sheet('example')
+    >>> ws.append_row(data=('Name','Value'))
+    >>> ws.append_row(data=('x',1.5))
+    >>> xlsx.close()
+
+    Sheets can't be revisited once written, so rows must be
+    added in order (although rows can be added to several sheets
+    concurrently).
+
+    """
+    def __init__(self,filen,constant_memory=True):
+        """Create a new XLSXStreamWorkBook instance
+
+        Arguments:
+          filen: name of the XLSX file to write
+          constant_memory: (optional) if True (the default) then
+            use xlsxwriter's 'constant_memory' mode
+
+        """
+        self.__xlsx = xlsxwriter.Workbook(filen,
+                                          {'constant_memory':
+                                           constant_memory})
+        self.__formats = {}
+        self.worksheet = OrderedDictionary()
+
+    def add_work_sheet(self,name,title=None,formula_context=None):
+        """Create and append a new worksheet
+
+        Arguments:
+          name: unique name for the worksheet
+          title: optional, title for the worksheet - defaults to
+            the name.
+          formula_context: optional, object holding the cells
+            being written (e.g. an XLSWorkSheet), whose
+            'lookup_value' method is used to get the results of
+            formulae; by default formulae are evaluated using the
+            values in the row being written
+
+        Returns:
+          New XLSXStreamWorkSheet object.
+
+        """
+        if name in self.worksheet:
+            raise KeyError,"Worksheet called '%s' already exists" % name
+        if title is None:
+            title = name
+        title = str(title)[:XLSXLimits.MAX_LEN_WORKSHEET_TITLE]
+        self.worksheet[name] = XLSXStreamWorkSheet(
+            self.__xlsx.add_worksheet(title),
+            self,
+            formula_context=formula_context)
+        return self.worksheet[name]
+
+    def get_format(self,style):
+        """Return the xlsxwriter format for an XLSStyle object
+
+        Formats are created on demand and shared between all the
+        cells (and sheets) with the same style.
+
+        Arguments:
+          style: XLSStyle object (or None)
+
+        Returns:
+          xlsxwriter Format object, or None if the style is empty.
+
+        """
+        if not style:
+            return None
+        style_name = style.name
+        try:
+            return self.__formats[style_name]
+        except KeyError:
+            xlsx_fmt = self.__xlsx.add_format()
+            if style.bold:
+                xlsx_fmt.set_bold()
+            if style.color is not None:
+                xlsx_fmt.set_color(style.color)
+            if style.bgcolor is not None:
+                xlsx_fmt.set_bg_color(style.bgcolor)
+            if style.font_size is not None:
+                xlsx_fmt.set_font_size(style.font_size)
+            if style.excel_number_format is not None:
+                xlsx_fmt.set_num_format(style.excel_number_format)
+            self.__formats[style_name] = xlsx_fmt
+            return xlsx_fmt
+
+    def close(self):
+        """Finish writing the XLSX file
+
+        """
+        for name in self.worksheet:
+            self.worksheet[name].close()
+        self.__xlsx.close()
+
+class XLSXStreamWorkSheet:
+    """Class representing a sheet in an XLSXStreamWorkBook
+
+    XLSXStreamWorkSheet objects shouldn't be created directly;
+    use the 'add_work_sheet' method of XLSXStreamWorkBook.
+
+    Rows are written using the 'append_row' method. Values are
+    written according to their type: ints and floats are written
+    as numbers without any conversion, strings starting with '='
+    are written as formulae ('?' and '#' are substituted as for
+    XLSWorkSheet), and other strings are written as numbers if
+    they can be converted to one (otherwise as text).
+
+    Formulae are also evaluated when they're written, so that
+    the XLSX file contains the results as well as the formulae.
+    By default only references to cells in the same row can be
+    resolved; formulae which reference other rows are written
+    without a result (Excel recalculates them on loading).
+
+    Column widths are updated as each row is written, and are
+    set when the sheet is closed. The 'freeze_panes' attribute
+    can be set at any time before the sheet is closed.
+
+    """
+    def __init__(self,ws,workbook,formula_context=None):
+        """Create a new XLSXStreamWorkSheet instance
+
+        Arguments:
+          ws: xlsxwriter Worksheet object to write to
+          workbook: parent XLSXStreamWorkBook
+          formula_context: optional, object with a 'lookup_value'
+            method used to get the results of formulae (defaults
+            to evaluating them using the row being written)
+
+        """
+        self.title = ws.get_name()
+        self.freeze_panes = None
+        self.__ws = ws
+        self.__workbook = workbook
+        if formula_context is None:
+            formula_context = self
+        self.__formula_context = formula_context
+        self.__row = 0
+        self.__current = None
+        self.__evaluating = set()
+        self.__widths = []
+        self.__min_col_width = 7
+
+    @property
+    def last_row(self):
+        """Return index of last row written
+
+        """
+        return max(self.__row,1)
+
+    @property
+    def next_row(self):
+        """Index of the row that will be written next
+
+        """
+        return self.__row + 1
+
+    def append_row(self,data=None,text=None,style=None):
+        """Write a new row at the end of the sheet
+
+        Arguments:
+          data: optional, list of data items to populate the row
+          text: optional, tab-delimited string of text to be used
+            to populate the row
+          style: optional, either an XLSStyle object to associate
+            with all the data in the row, or a list of XLSStyle
+            objects (or None) for each cell in turn
+
+        Returns:
+          The index of the written row.
+
+        """
+        if data is not None:
+            items = data
+        elif text is not None:
+            items = text.split('\t')
+        else:
+            items = []
+        self.__row += 1
+        self.__current = items
+        if isinstance(style,(list,tuple)):
+            styles = style
+        else:
+            styles = None
+            xlsx_fmt = self.__workbook.get_format(style)
+        row = self.__row - 1
+        for icol,value in enumerate(items):
+            if styles is not None:
+                try:
+                    xlsx_fmt = self.__workbook.get_format(styles[icol])
+                except IndexError:
+                    xlsx_fmt = None
+            width = self.__write(row,icol,value,xlsx_fmt)
+            # Handle column widths
+            if icol >= len(self.__widths):
+                self.__widths.extend([self.__min_col_width]*
+                                     (icol-len(self.__widths)+1))
+            if width > self.__widths[icol]:
+                self.__widths[icol] = width
+        if styles is not None:
+            # Styled cells beyond the end of the data
+            for icol in xrange(len(items),len(styles)):
+                xlsx_fmt = self.__workbook.get_format(styles[icol])
+                if xlsx_fmt is not None:
+                    self.__ws.write_blank(row,icol,None,xlsx_fmt)
+        self.__current = None
+        return self.__row
+
+    def __write(self,row,icol,value,xlsx_fmt):
+        """Internal: write a value and return its width
+
+        """
+        ws = self.__ws
+        if value is None or value == '':
+            if xlsx_fmt is not None:
+                ws.write_blank(row,icol,None,xlsx_fmt)
+            return 0
+        if type(value) in (int,long,float):
+            # Typed number
+            ws.write_number(row,icol,value,xlsx_fmt)
+            return len(str(value))
+        if not isinstance(value,basestring):
+            value = str(value)
+        if value.startswith('='):
+            # Formula
+            formula = value.replace('?',str(row+1)).replace(
+                '#',column_integer_to_index(icol))
+            try:
+                result = self.__formula_context.lookup_value(row+1,icol)
+            except KeyError:
+                # References cells which aren't available
+                ws.write_formula(row,icol,formula,xlsx_fmt)
+                return 0
+            ws.write_formula(row,icol,formula,xlsx_fmt,result)
+            return len(str(result))
+        # Attempt to convert to a number type i.e. integer/float
+        try:
+            value = int(value)
+        except ValueError:
+            try:
+                value = float(value)
+            except ValueError:
+                # Not a float either
+                pass
+        ws.write(row,icol,value,xlsx_fmt)
+        return len(str(value))
+
+    def lookup_value(self,row,icol):
+        """Return the value of a cell in the row being written
+
+        Used when evaluating formulae; only cells in the row that
+        is currently being written are available, otherwise a
+        KeyError is raised. If the cell contains a formula then
+        the result of evaluating it is returned (BAD_REF if the
+        formula refers back to its own cell).
+
+        Arguments:
+          row: integer row index (counting from 1)
+          icol: integer column index (counting from zero i.e.
+            0 is column 'A')
+
+        """
+        if self.__current is None or row != self.__row:
+            raise KeyError,"Cell '%s' isn't available" % \
+                cell(column_integer_to_index(icol),row)
+        try:
+            item = self.__current[icol]
+        except IndexError:
+            return None
+        try:
+            if not item.startswith('='):
+                return item
+        except AttributeError:
+            return item
+        if icol in self.__evaluating:
+            # Circular reference
+            return BAD_REF
+        self.__evaluating.add(icol)
+        try:
+            return compile_formula(item).evaluate(self.lookup_value,row,icol)
+        finally:
+            self.__evaluating.discard(icol)
+
+    def close(self):
+        """Set the column widths and freeze panes for the sheet
+
+        Called automatically by the 'close' method of the parent
+        XLSXStreamWorkBook.
+
+        """
+        for icol,width in enumerate(self.__widths):
+            self.__ws.set_column(icol,icol,width*1.2)
+        if self.freeze_panes is not None:
+            self.__ws.freeze_panes(self.freeze_panes)
+
 class XLSStyle:
     """Class representing a set of styling and formatting data
 
@@ -1343,17 +1822,7 @@ class CellIndex:
 
         """
         self.idx = str(idx)
-        try:
-            r = re.compile(r'^([A-Z]+)([0-9]+)$').match(idx)
-            self.column = r.group(1)
-            self.row = int(r.group(2))
-        except:
-            self.column = None
-            self.row = None
-            if str(idx).isalpha():
-                self.column = idx
-            elif str(idx).isdigit():
-                self.row = int(idx)
+        self.column,self.row = parse_cell_index(idx)[:2]
 
     @property
     def is_full(self):
@@ -1421,6 +1890,248 @@ class XLSColumn:
         """
         return cell(self.index,row)
 
+class Formula:
+    """Class representing a compiled formula
+
+    A Formula object holds a formula (e.g. '=B?+C?') which has
+    been split into its operands and operators just once, so that
+    it can be evaluated repeatedly without being parsed again.
+    Each operand is classified when the formula is compiled as
+    either a literal value, a reference to a specific cell, or a
+    reference which uses '?' and/or '#' to refer to the row and/or
+    column of the cell holding the formula.
+
+    Formula objects should be obtained via the 'compile_formula'
+    function, which caches them, rather than created directly.
+
+    Values of referenced cells are fetched using a 'lookup'
+    function, which is called with the integer row and column
+    indices of the cell (e.g. the 'lookup_value' method of an
+    XLSWorkSheet) and returns its value (with any formula that
+    the referenced cell contains already evaluated):
+
+    >>> f = compile_formula('=B?+C?')
+    >>> f.evaluate(ws.lookup_value,1,0)
+
+    The results are the same as those from 'eval_formula' for
+    the equivalent formula.
+
+    """
+    # Operand types
+    LITERAL = 0
+    REFERENCE = 1
+    TEMPLATE = 2
+    SUBSTITUTION = 3
+
+    def __init__(self,formula):
+        """Create a new Formula instance
+
+        Arguments:
+          formula: formula string, starting with '='
+
+        """
+        self.formula = formula
+        self.ops = []
+        self.operands = []
+        arg = ''
+        for c in formula[1:]:
+            if c in "+-/*":
+                self.operands.append(self.__compile_operand(arg))
+                self.ops.append(c)
+                arg = ''
+            else:
+                arg += c
+        self.operands.append(self.__compile_operand(arg))
+        # Operands which have the same value for every row in
+        # a column
+        self.__column_static = [(kind != Formula.SUBSTITUTION and
+                                 (kind != Formula.TEMPLATE or
+                                  row is not None))
+                                for kind,row,icol,arg in self.operands]
+
+    def __compile_operand(self,arg):
+        """Internal: classify an operand
+
+        Returns a tuple (kind,row,icol,arg) where 'kind' is the
+        operand type; for references 'row' and 'icol' are the
+        integer indices of the referenced cell (None if they are
+        given by '?' or '#' respectively).
+
+        """
+        if '?' in arg or '#' in arg:
+            r = CELL_TEMPLATE_REGEX.match(arg)
+            if not r:
+                return (Formula.SUBSTITUTION,None,None,arg)
+            column,row = r.groups()
+            icol = None if column == '#' else column_index_to_integer(column)
+            row = None if row == '?' else int(row)
+            return (Formula.TEMPLATE,row,icol,arg)
+        column,row,icol = parse_cell_index(arg)
+        if column is None or row is None:
+            return (Formula.LITERAL,None,None,arg)
+        return (Formula.REFERENCE,row,icol,arg)
+
+    def __operand_value(self,operand,lookup,row,icol):
+        """Internal: return the value of an operand
+
+        """
+        kind,ref_row,ref_icol,arg = operand
+        if kind == Formula.LITERAL:
+            return arg
+        if kind == Formula.REFERENCE:
+            return lookup(ref_row,ref_icol)
+        if row is None:
+            # No cell to take '?' and '#' from
+            return arg
+        if kind == Formula.TEMPLATE:
+            return lookup(row if ref_row is None else ref_row,
+                          icol if ref_icol is None else ref_icol)
+        # Substitute and then reclassify
+        arg = arg.replace('?',str(row)).replace('#',
+                                                column_integer_to_index(icol))
+        column,ref_row,ref_icol = parse_cell_index(arg)
+        if column is None or ref_row is None:
+            return arg
+        return lookup(ref_row,ref_icol)
+
+    def evaluate(self,lookup,row=None,icol=None):
+        """Evaluate the formula for a cell
+
+        Arguments:
+          lookup: function which returns the value of the cell
+            with the supplied integer row and column indices
+          row: (optional) integer row index of the cell holding
+            the formula, used for '?'
+          icol: (optional) integer column index of the cell
+            holding the formula, used for '#'
+
+        Returns:
+          The result of the evaluation, or BAD_REF if it fails.
+
+        """
+        return self.__evaluate(lookup,row,icol,None)
+
+    def evaluate_rows(self,lookup,rows,icol):
+        """Evaluate the formula for cells in multiple rows of a column
+
+        Operands which are the same for every row (literals and
+        references which don't use '?') are only looked up and
+        converted once.
+
+        Arguments:
+          lookup: function which returns the value of the cell
+            with the supplied integer row and column indices
+          rows: list of integer row indices of the cells holding
+            the formula
+          icol: integer column index of the cells holding the
+            formula
+
+        Returns:
+          List of results for each row in turn.
+
+        """
+        static = {}
+        return [self.__evaluate(lookup,row,icol,static) for row in rows]
+
+    def __evaluate(self,lookup,row,icol,static):
+        """Internal: evaluate the formula
+
+        If 'static' is a dictionary then it is used to store
+        the values of operands which are the same for every row
+        in the column.
+
+        """
+        ops = self.ops
+        nops = len(ops)
+        numbers = []
+        for i,operand in enumerate(self.operands):
+            if static is not None and self.__column_static[i]:
+                try:
+                    value = static[i]
+                except KeyError:
+                    value = self.__convert_operand(
+                        self.__operand_value(operand,lookup,row,icol),
+                        i,nops)
+                    static[i] = value
+            else:
+                value = self.__convert_operand(
+                    self.__operand_value(operand,lookup,row,icol),
+                    i,nops)
+            if not nops:
+                # Single value was referenced
+                return value
+            if value is None:
+                # Failed to convert to number
+                return BAD_REF
+            numbers.append(value)
+        return self.__calculate(numbers)
+
+    def __convert_operand(self,value,i,nops):
+        """Internal: convert an operand value to a number
+
+        Values are converted as if they had been rendered as text
+        first (so for example floats are rounded to the precision
+        of 'str'). Returns None if the value can't be converted,
+        except for a single value which is returned as a string.
+
+        """
+        t = type(value)
+        if t is int or t is long:
+            number = value
+        elif t is float:
+            number = float(str(value))
+        else:
+            value = '' if value is None else str(value)
+            try:
+                number = convert_to_number(value)
+            except ValueError:
+                if not nops:
+                    return value
+                return None
+        if i < nops and self.ops[i] == '/':
+            number = float(str(float(number)))
+        return number
+
+    def __calculate(self,numbers):
+        """Internal: combine numbers using the operators
+
+        """
+        ops = self.ops
+        if str(numbers[0])[0] not in "0123456789+-/*":
+            # Not a number that can be evaluated (e.g. 'inf')
+            # so return the formula as a string
+            formula = [str(numbers[0])]
+            for op,x in zip(ops,numbers[1:]):
+                formula.append(op)
+                formula.append(str(x))
+            return ''.join(formula)
+        for x in numbers:
+            if type(x) is float and (math.isinf(x) or math.isnan(x)):
+                # Infinities and NaNs can't be evaluated
+                return BAD_REF
+        # Multiplication and division first, then addition
+        # and subtraction (all left to right)
+        try:
+            terms = [numbers[0]]
+            term_ops = []
+            for op,x in zip(ops,numbers[1:]):
+                if op == '*':
+                    terms[-1] = terms[-1]*x
+                elif op == '/':
+                    terms[-1] = terms[-1]/x
+                else:
+                    terms.append(x)
+                    term_ops.append(op)
+            result = terms[0]
+            for op,x in zip(term_ops,terms[1:]):
+                if op == '+':
+                    result = result + x
+                else:
+                    result = result - x
+        except (ZeroDivisionError,OverflowError):
+            return BAD_REF
+        return result
+
 #######################################################################
 # Functions
 #######################################################################
@@ -1445,6 +2156,50 @@ def cell(col,row):
     """
     return "%s%s" % (col,row)
 
+_cell_index_cache = {}
+def parse_cell_index(idx):
+    """Split an XLS-style cell index into its components
+
+    Returns a tuple (column,row,icol) where 'column' is the
+    column index (e.g. 'BZ'), 'row' is the integer row index
+    and 'icol' is the integer equivalent of the column index
+    (see 'column_index_to_integer'). Components which can't
+    be determined from the index are returned as None, e.g.
+    parse_cell_index('B') returns ('B',None,1).
+
+    Results are cached, so repeatedly parsing the same index
+    is cheap.
+
+    Arguments:
+      idx: cell index e.g. 'A1', 'BZ112'
+
+    """
+    try:
+        return _cell_index_cache[idx]
+    except KeyError:
+        pass
+    except TypeError:
+        # Unhashable index
+        return (None,None,None)
+    column = None
+    row = None
+    r = CELL_INDEX_REGEX.match(str(idx))
+    if r:
+        column = r.group(1)
+        row = int(r.group(2))
+    elif str(idx).isalpha():
+        column = idx
+    elif str(idx).isdigit():
+        row = int(idx)
+    if column is not None:
+        icol = column_index_to_integer(column)
+    else:
+        icol = None
+    if len(_cell_index_cache) >= CELL_INDEX_CACHE_SIZE:
+        _cell_index_cache.clear()
+    _cell_index_cache[idx] = (column,row,icol)
+    return (column,row,icol)
+
 def incr_col(col,incr=1):
     """Return column index incremented by specific number of positions
 
@@ -1489,6 +2244,27 @@ def column_integer_to_index(idx):
         idx = idx/26-1
     return col[::-1]
 
+_formula_cache = {}
+def compile_formula(formula):
+    """Return a compiled Formula object for a formula
+
+    Formulae are only compiled once; subsequent calls for the
+    same formula return the cached Formula object.
+
+    Arguments:
+      formula: formula string starting with '=' (which may
+        include '?' and '#')
+
+    """
+    try:
+        return _formula_cache[formula]
+    except KeyError:
+        pass
+    if len(_formula_cache) >= FORMULA_CACHE_SIZE:
+        _formula_cache.clear()
+    _formula_cache[formula] = Formula(formula)
+    return _formula_cache[formula]
+
 def eval_formula(item,worksheet):
     """Evaluate a formula using the contents of a worksheet
 
@@ -1506,67 +2282,23 @@ def eval_formula(item,worksheet):
 
     * basic mathematical operations (+-*/)
 
+    The formula is compiled (see 'compile_formula') and cell
+    values are fetched using the worksheet's 'lookup_value'
+    method if it has one, otherwise via its 'render_cell'
+    method.
+
     """
     # Evaluate a formula from a cell item and return the computed value
-    logging.debug("Item is %s" % item)
-    if item.startswith('='):
-        item = item[1:]
-        logging.debug("Item reset to %s" % item)
-    else:
-        logging.debug("Returning %s" % item)
+    if not item.startswith('='):
         return item
-    ops = "+-/*"
-    formula = ''
-    arg = ''
-    nargs = 0
-    for c in item:
-        logging.debug(c)
-        if c not in ops:
-            arg += c
-        else:
-            logging.debug("-> %s" % arg)
-            if CellIndex(arg).is_full:
-                arg = worksheet.render_cell(arg,eval_formulae=True)
-            logging.debug("-> %s" % arg)
-            try:
-                arg = convert_to_number(arg) 
-                if c == '/':
-                    arg = float(arg)
-            except ValueError:
-                # Failed to convert to number
-                logging.debug("Error converting %s to number" % arg)
-                return BAD_REF
-            formula = formula + str(arg) + c
-            nargs += 1
-            arg = ''
-            logging.debug("-> %s" % formula)
-    # End of string
-    if CellIndex(arg).is_full:
-        arg = worksheet.render_cell(arg,eval_formulae=True)
-    if nargs:
-        try:
-            arg = convert_to_number(arg)
-        except ValueError:
-            # Failed to convert to float
-            logging.debug("Error converting %s to number" % arg)
-            return BAD_REF
-    else:
-        # Single value was referenced
-        try:
-            return convert_to_number(arg)
-        except ValueError:
-            return arg
-    formula = formula + str(arg)
-    logging.debug("Formula '%s'" % formula)
-    if re.compile(r"^[0-9+\-\/\*]+").match(formula):
-        try:
-            item = eval(formula)
-        except Exception,ex:
-            logging.debug("Error processing %s: %s" % (item,ex))
-            return BAD_REF
-    else:
-        item = formula
-    return item
+    try:
+        lookup = worksheet.lookup_value
+    except AttributeError:
+        def lookup(row,icol):
+            return worksheet.render_cell(cell(column_integer_to_index(icol),
+                                              row),
+                                         eval_formulae=True)
+    return compile_formula(item).evaluate(lookup)
 
 def convert_to_number(s):
     """Convert a number to float or int as appropriate
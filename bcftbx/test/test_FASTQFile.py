@@ -4,6 +4,12 @@
 from bcftbx.FASTQFile import *
 import unittest
 import cStringIO
+import itertools
+import os
+import gzip
+import json
+import shutil
+import tempfile
 
 fastq_data = """@73D9FA:3:FC:1:1:7507:1000 1:N:0:
 NACAACCTGATTAGCGGCGTTGACAGATGTATCCAT
@@ -127,6 +133,70 @@ class TestFastqIterator(unittest.TestCase):
             self.assertEqual(read.quality,fastq_source.readline().rstrip('\n'))
         self.assertEqual(nreads,5)
 
+    def test_fastq_iterator_lazy(self):
+        """Check iteration over small FASTQ file in 'lazy' mode
+        """
+        for bufsize in (2,10,CHUNKSIZE):
+            fp = cStringIO.StringIO(fastq_data)
+            fastq = FastqIterator(fp=fp,bufsize=bufsize,lazy=True)
+            nreads = 0
+            fastq_source = cStringIO.StringIO(fastq_data)
+            for read in fastq:
+                nreads += 1
+                self.assertTrue(isinstance(read,LazyFastqRead))
+                self.assertTrue(isinstance(read.seqid,SequenceIdentifier))
+                self.assertEqual(str(read.seqid),fastq_source.readline().rstrip('\n'))
+                self.assertEqual(read.sequence,fastq_source.readline().rstrip('\n'))
+                self.assertEqual(read.optid,fastq_source.readline().rstrip('\n'))
+                self.assertEqual(read.quality,fastq_source.readline().rstrip('\n'))
+            self.assertEqual(nreads,5)
+
+    def test_fastq_iterator_lazy_empty_sequence(self):
+        """Check 'lazy' iteration over FASTQ file with 'empty' sequence
+        """
+        for bufsize in (2,CHUNKSIZE):
+            fp = cStringIO.StringIO(fastq_empty_sequence)
+            fastq = FastqIterator(fp=fp,bufsize=bufsize,lazy=True)
+            reads = [r for r in fastq]
+            self.assertEqual(len(reads),5)
+            self.assertEqual(reads[3].sequence,'')
+            self.assertEqual(reads[3].quality,'')
+            self.assertEqual(reads[3].seqlen,0)
+            self.assertEqual(reads[3].maxquality,'')
+            self.assertEqual(reads[4].seqlen,36)
+            self.assertEqual(str(reads[4]),'\n'.join(
+                fastq_empty_sequence.split('\n')[16:20]))
+
+    def test_fastq_iterator_lazy_raw_record(self):
+        """Check 'lazy' iteration returns unmodified raw records
+        """
+        fp = cStringIO.StringIO(fastq_data)
+        records = [r.raw_record for r in FastqIterator(fp=fp,lazy=True)]
+        self.assertEqual(len(records),5)
+        self.assertEqual('\n'.join(records)+'\n',fastq_data)
+
+    def test_fastq_iterator_lazy_no_trailing_newline(self):
+        """Check 'lazy' iteration handles final read with no trailing newline
+        """
+        fp = cStringIO.StringIO(fastq_data.rstrip('\n'))
+        reads = [r for r in FastqIterator(fp=fp,lazy=True)]
+        self.assertEqual(len(reads),5)
+        self.assertEqual(reads[4].quality,
+                         "#--,,55777@@@@@@@CC@@C@@@@@@@@:::::<")
+
+    def test_fastq_iterator_lazy_matches_fastqread(self):
+        """Check reads from 'lazy' iteration match FastqRead equivalents
+        """
+        for r1,r2 in itertools.izip(
+                FastqIterator(fp=cStringIO.StringIO(fastq_data)),
+                FastqIterator(fp=cStringIO.StringIO(fastq_data),lazy=True)):
+            self.assertEqual(r1,r2)
+            self.assertEqual(r1.raw_seqid,r2.raw_seqid)
+            self.assertEqual(r1.seqlen,r2.seqlen)
+            self.assertEqual(r1.maxquality,r2.maxquality)
+            self.assertEqual(r1.minquality,r2.minquality)
+            self.assertEqual(r1.is_colorspace,r2.is_colorspace)
+
 class TestFastqRead(unittest.TestCase):
     """Tests of the FastqRead class
     """
@@ -178,6 +248,14 @@ class TestFastqRead(unittest.TestCase):
                          "BBA!>AA,B>;;=A%39%B8====>0?-?%9A2<)3?(4*36%A%4&+9%")
         self.assertTrue(read.is_colorspace)
 
+    def test_lazy_is_colorspace(self):
+        """Check LazyFastqRead detects colorspace correctly
+        """
+        data = "@1_14_622\nT221.0033033232320030021103233332300123110201010031\n+\nBBA!>AA,B>;;=A%39%B8====>0?-?%9A2<)3?(4*36%A%4&+9%\n"
+        read = FastqIterator(fp=cStringIO.StringIO(data),lazy=True).next()
+        self.assertTrue(read.is_colorspace)
+        self.assertEqual(read.seqlen,50)
+
     def test_equality(self):
         """Check FastqRead handles equality operator ('==')
         """
@@ -349,6 +427,106 @@ class TestNReads(unittest.TestCase):
         fp = cStringIO.StringIO(fastq_data)
         self.assertEqual(nreads(fp=fp),5)
 
+class TestComputeFastqStats(unittest.TestCase):
+    """Tests of the compute_fastq_stats function
+    """
+
+    def test_compute_fastq_stats(self):
+        """Check that compute_fastq_stats returns correct statistics
+        """
+        for bufsize in (10,1024*1024):
+            fp = cStringIO.StringIO(fastq_empty_sequence)
+            stats = compute_fastq_stats(fp=fp,bufsize=bufsize)
+            self.assertEqual(stats.nreads,5)
+            self.assertEqual(stats.total_bases,144)
+            self.assertEqual(stats.read_lengths,{ 0: 1, 36: 4 })
+            self.assertEqual(stats.min_quality,'#')
+            self.assertEqual(stats.max_quality,'C')
+
+    def test_compute_fastq_stats_no_trailing_newline(self):
+        """Check compute_fastq_stats handles missing trailing newline
+        """
+        fp = cStringIO.StringIO(fastq_data.rstrip('\n'))
+        stats = compute_fastq_stats(fp=fp)
+        self.assertEqual(stats.nreads,5)
+        self.assertEqual(stats.total_bases,180)
+
+    def test_compute_fastq_stats_bad_read_count(self):
+        """Check compute_fastq_stats raises exception for incomplete read
+        """
+        fp = cStringIO.StringIO(fastq_data+"@extra\n")
+        self.assertRaises(Exception,compute_fastq_stats,fp=fp)
+
+class TestGetFastqStats(unittest.TestCase):
+    """Tests of the get_fastq_stats function
+    """
+
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.fastq = os.path.join(self.wd,"test.fastq.gz")
+        with gzip.open(self.fastq,'w') as fp:
+            fp.write(fastq_data)
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_get_fastq_stats_writes_cache(self):
+        """Check get_fastq_stats computes statistics and writes cache
+        """
+        cache_file = self.fastq + STATS_CACHE_EXT
+        self.assertFalse(os.path.exists(cache_file))
+        stats = get_fastq_stats(self.fastq)
+        self.assertEqual(stats.nreads,5)
+        self.assertEqual(stats.total_bases,180)
+        self.assertEqual(stats.read_lengths,{ 36: 5 })
+        self.assertEqual(stats.min_quality,'#')
+        self.assertEqual(stats.max_quality,'C')
+        self.assertTrue(os.path.exists(cache_file))
+        # Reload from the cache
+        stats = get_fastq_stats(self.fastq)
+        self.assertEqual(stats.nreads,5)
+        self.assertEqual(stats.total_bases,180)
+        self.assertEqual(stats.read_lengths,{ 36: 5 })
+        self.assertEqual(stats.min_quality,'#')
+        self.assertEqual(stats.max_quality,'C')
+
+    def test_get_fastq_stats_uses_cache(self):
+        """Check get_fastq_stats, nreads and FastqAttributes use cache
+        """
+        cache_file = self.fastq + STATS_CACHE_EXT
+        get_fastq_stats(self.fastq)
+        # Doctor the cached value to check that it's used
+        with open(cache_file,'r') as fp:
+            cache = json.load(fp)
+        cache['stats']['nreads'] = 99
+        with open(cache_file,'w') as fp:
+            json.dump(cache,fp)
+        self.assertEqual(get_fastq_stats(self.fastq).nreads,99)
+        self.assertEqual(nreads(self.fastq),99)
+        self.assertEqual(FastqAttributes(self.fastq).nreads,99)
+        # Check the cache can be bypassed
+        self.assertEqual(get_fastq_stats(self.fastq,use_cache=False).nreads,5)
+        self.assertEqual(nreads(self.fastq,use_cache=False),5)
+
+    def test_get_fastq_stats_updates_stale_cache(self):
+        """Check get_fastq_stats recomputes statistics when file changes
+        """
+        self.assertEqual(get_fastq_stats(self.fastq).nreads,5)
+        with gzip.open(self.fastq,'w') as fp:
+            fp.write(fastq_data)
+            fp.write(fastq_data2)
+        self.assertEqual(get_fastq_stats(self.fastq).nreads,10)
+        self.assertEqual(get_fastq_stats(self.fastq).nreads,10)
+
+    def test_get_fastq_stats_ignores_bad_cache(self):
+        """Check get_fastq_stats handles corrupted cache file
+        """
+        cache_file = self.fastq + STATS_CACHE_EXT
+        with open(cache_file,'w') as fp:
+            fp.write("NOT JSON")
+        self.assertEqual(get_fastq_stats(self.fastq).nreads,5)
+        self.assertEqual(json.load(open(cache_file))['stats']['nreads'],5)
+
 class TestFastqsArePair(unittest.TestCase):
     """Tests of the fastqs_are_pair function
     """
@@ -360,6 +538,365 @@ class TestFastqsArePair(unittest.TestCase):
         fp2 = cStringIO.StringIO(fastq_data2)
         self.assertTrue(fastqs_are_pair(fp1=fp1,fp2=fp2,verbose=False))
 
+    def test_fastqs_are_not_pair(self):
+        """Check that fastqs with unpaired reads are recognised
+        """
+        fp1 = cStringIO.StringIO(fastq_data)
+        fp2 = cStringIO.StringIO(fastq_data2.replace('7488','7489'))
+        self.assertFalse(fastqs_are_pair(fp1=fp1,fp2=fp2,verbose=False))
+
+class TestVerifyFastqPair(unittest.TestCase):
+    """Tests of the verify_fastq_pair function
+    """
+
+    def test_verify_fastq_pair(self):
+        """Check that pair of fastqs is verified
+        """
+        result = verify_fastq_pair(fp1=cStringIO.StringIO(fastq_data),
+                                   fp2=cStringIO.StringIO(fastq_data2),
+                                   bufsize=50)
+        self.assertTrue(result.paired)
+        self.assertEqual(result.npairs,5)
+        self.assertEqual(result.position,None)
+
+    def test_verify_fastq_pair_swapped(self):
+        """Check that pair of fastqs is verified with R1 and R2 swapped
+        """
+        result = verify_fastq_pair(fp1=cStringIO.StringIO(fastq_data2),
+                                   fp2=cStringIO.StringIO(fastq_data))
+        self.assertTrue(result.paired)
+
+    def test_verify_fastq_pair_illumina(self):
+        """Check that pair of fastqs is verified for older Illumina format
+        """
+        r1 = "@HWUSI-EAS100R:6:73:941:1973#0/1\nACGT\n+\nIIII\n"
+        r2 = "@HWUSI-EAS100R:6:73:941:1973#0/2\nACGT\n+\nIIII\n"
+        result = verify_fastq_pair(fp1=cStringIO.StringIO(r1),
+                                   fp2=cStringIO.StringIO(r2))
+        self.assertTrue(result.paired)
+
+    def test_verify_fastq_pair_unpaired_read(self):
+        """Check that the first unpaired read is located
+        """
+        result = verify_fastq_pair(
+            fp1=cStringIO.StringIO(fastq_data),
+            fp2=cStringIO.StringIO(fastq_data2.replace('7488','7489')),
+            bufsize=50)
+        self.assertFalse(result.paired)
+        self.assertEqual(result.npairs,3)
+        self.assertEqual(result.position,4)
+        self.assertEqual(result.header1,
+                         "@73D9FA:3:FC:1:1:7488:1000 1:N:0:")
+        self.assertEqual(result.header2,
+                         "@73D9FA:3:FC:1:1:7489:1000 2:N:0:")
+
+    def test_verify_fastq_pair_different_lengths(self):
+        """Check that fastqs with different numbers of reads don't pair
+        """
+        result = verify_fastq_pair(
+            fp1=cStringIO.StringIO(fastq_data),
+            fp2=cStringIO.StringIO('\n'.join(
+                fastq_data2.split('\n')[:16])+'\n'))
+        self.assertFalse(result.paired)
+        self.assertEqual(result.npairs,4)
+        self.assertEqual(result.position,5)
+        self.assertEqual(result.header1,
+                         "@73D9FA:3:FC:1:1:6680:1000 1:N:0:")
+        self.assertEqual(result.header2,None)
+
+    def test_verify_fastq_pair_same_reads(self):
+        """Check that identical fastqs don't pair
+        """
+        result = verify_fastq_pair(fp1=cStringIO.StringIO(fastq_data),
+                                   fp2=cStringIO.StringIO(fastq_data))
+        self.assertFalse(result.paired)
+        self.assertEqual(result.position,1)
+
+class TestRepairFastqPairs(unittest.TestCase):
+    """Tests of the repair_fastq_pairs function
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        # Reads from fastq_data and fastq_data2
+        self.r1 = ["\n".join(fastq_data.split('\n')[i:i+4])+"\n"
+                   for i in xrange(0,20,4)]
+        self.r2 = ["\n".join(fastq_data2.split('\n')[i:i+4])+"\n"
+                   for i in xrange(0,20,4)]
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def _write_fastq(self,name,records,gzipped=False):
+        fastq = os.path.join(self.wd,name)
+        if gzipped:
+            fp = gzip.open(fastq,'wb')
+        else:
+            fp = open(fastq,'w')
+        fp.write(''.join(records))
+        fp.close()
+        return fastq
+
+    def _read_fastq(self,name):
+        with open(os.path.join(self.wd,name),'r') as fp:
+            data = fp.read().split('\n')[:-1]
+        return ["\n".join(data[i:i+4])+"\n" for i in xrange(0,len(data),4)]
+
+    def test_repair_fastq_pairs(self):
+        """Check that out-of-sync R1/R2 fastqs are repaired
+        """
+        fastq1 = self._write_fastq('r1.fastq',[self.r1[i] for i in (0,1,2,4)])
+        fastq2 = self._write_fastq('r2.fastq.gz',
+                                   [self.r2[i] for i in (4,3,2,0)],
+                                   gzipped=True)
+        result = repair_fastq_pairs([fastq1,fastq2],
+                                    os.path.join(self.wd,'out1.fastq'),
+                                    os.path.join(self.wd,'out2.fastq'),
+                                    singles=os.path.join(self.wd,
+                                                         'singles.fastq'),
+                                    tmpdir=self.wd)
+        self.assertEqual(result.npairs,3)
+        self.assertEqual(result.nsingles,2)
+        out1 = self._read_fastq('out1.fastq')
+        out2 = self._read_fastq('out2.fastq')
+        self.assertEqual(sorted(out1),sorted([self.r1[i] for i in (0,2,4)]))
+        self.assertEqual(sorted(out2),sorted([self.r2[i] for i in (0,2,4)]))
+        self.assertTrue(fastqs_are_pair(os.path.join(self.wd,'out1.fastq'),
+                                        os.path.join(self.wd,'out2.fastq'),
+                                        verbose=False))
+        self.assertEqual(sorted(self._read_fastq('singles.fastq')),
+                         sorted([self.r1[1],self.r2[3]]))
+        # Check the partitions were removed
+        self.assertEqual(sorted(os.listdir(self.wd)),
+                         ['out1.fastq','out2.fastq','r1.fastq',
+                          'r2.fastq.gz','singles.fastq'])
+
+    def test_repair_fastq_pairs_multiple_partitions(self):
+        """Check that pairs are repaired when using multiple partitions
+        """
+        fastq1 = self._write_fastq('r1.fastq',[self.r1[i] for i in (0,1,2,4)])
+        fastq2 = self._write_fastq('r2.fastq',[self.r2[i] for i in (4,3,2,0)])
+        result = repair_fastq_pairs([fastq1,fastq2],
+                                    os.path.join(self.wd,'out1.fastq'),
+                                    os.path.join(self.wd,'out2.fastq'),
+                                    tmpdir=self.wd,max_memory=100)
+        self.assertEqual(result.npairs,3)
+        self.assertEqual(result.nsingles,2)
+        self.assertTrue(fastqs_are_pair(os.path.join(self.wd,'out1.fastq'),
+                                        os.path.join(self.wd,'out2.fastq'),
+                                        verbose=False))
+
+    def test_repair_interleaved_fastq(self):
+        """Check that singletons are removed from interleaved fastq
+        """
+        fastq = self._write_fastq('interleaved.fastq',
+                                  [self.r1[0],self.r2[0],
+                                   self.r1[1],
+                                   self.r1[2],self.r2[2],
+                                   self.r2[3],
+                                   self.r1[4],self.r2[4]])
+        result = repair_fastq_pairs([fastq],
+                                    os.path.join(self.wd,'out.fastq'),
+                                    singles=os.path.join(self.wd,
+                                                         'singles.fastq'),
+                                    tmpdir=self.wd,max_memory=200)
+        self.assertEqual(result.npairs,3)
+        self.assertEqual(result.nsingles,2)
+        out = self._read_fastq('out.fastq')
+        self.assertEqual(sorted(zip(out[0::2],out[1::2])),
+                         sorted([(self.r1[i],self.r2[i]) for i in (0,2,4)]))
+        self.assertEqual(sorted(self._read_fastq('singles.fastq')),
+                         sorted([self.r1[1],self.r2[3]]))
+
+class TestSplitInterleavedFastq(unittest.TestCase):
+    """Tests of the split_interleaved_fastq function
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.out1 = os.path.join(self.wd,'r1.fastq')
+        self.out2 = os.path.join(self.wd,'r2.fastq')
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_split_interleaved_fastq(self):
+        """Check that interleaved fastq is split into R1 and R2
+        """
+        r1 = fastq_data.split('\n')
+        r2 = fastq_data2.split('\n')
+        interleaved = []
+        for i in xrange(0,20,4):
+            interleaved.extend(r1[i:i+4])
+            interleaved.extend(r2[i:i+4])
+        fp = cStringIO.StringIO('\n'.join(interleaved)+'\n')
+        self.assertEqual(split_interleaved_fastq(None,self.out1,self.out2,
+                                                 fp=fp,bufsize=50),5)
+        self.assertEqual(open(self.out1,'r').read(),fastq_data)
+        self.assertEqual(open(self.out2,'r').read(),fastq_data2)
+
+    def test_split_interleaved_fastq_unpaired(self):
+        """Check that exception is raised for unpaired reads
+        """
+        fp = cStringIO.StringIO(fastq_data+fastq_data2)
+        self.assertRaises(Exception,
+                          split_interleaved_fastq,
+                          None,self.out1,self.out2,fp=fp)
+
+    def test_split_interleaved_fastq_odd_number_of_reads(self):
+        """Check that exception is raised for odd number of reads
+        """
+        fp = cStringIO.StringIO(fastq_data)
+        self.assertRaises(Exception,
+                          split_interleaved_fastq,
+                          None,self.out1,self.out2,fp=fp)
+
+class TestQualityEncodings(unittest.TestCase):
+    """Tests of the quality_encodings function
+    """
+
+    def test_phred33(self):
+        """Check Phred+33 range gives Sanger and Illumina 1.8+
+        """
+        self.assertEqual(quality_encodings('#','C'),
+                         [('Sanger/Phred+33','Phred+33',None),
+                          ('Illumina 1.8+/Phred+33','Phred+33',
+                           'fastqsanger')])
+
+    def test_phred64(self):
+        """Check Phred+64 ranges give Solexa and Illumina 1.3+/1.5+
+        """
+        self.assertEqual(quality_encodings('B','h'),
+                         [('Solexa/Solexa+64','Solexa+64','fastqsolexa'),
+                          ('Illumina 1.3+/Phred+64','Phred+64',
+                           'fastqillumina')])
+        self.assertEqual(len(quality_encodings('C','h')),3)
+
+    def test_no_match(self):
+        """Check out-of-range qualities give no encodings
+        """
+        self.assertEqual(quality_encodings('!','h'),[])
+
+    def test_colorspace(self):
+        """Check only Sanger is considered for colorspace data
+        """
+        self.assertEqual(quality_encodings('#','C',colorspace=True),
+                         [('Sanger/Phred+33','Phred+33',
+                           'fastqcssanger')])
+        self.assertEqual(quality_encodings('C','h',colorspace=True),[])
+
+class TestSniffQualityEncoding(unittest.TestCase):
+    """Tests of the sniff_quality_encoding function
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def _make_fastq(self,name,qualities,gzip_members=1):
+        # Make a FASTQ file with one read for each quality
+        # string, optionally as a multi-member gzip file
+        records = []
+        for i,quality in enumerate(qualities):
+            records.append("@73D9FA:3:FC:1:1:%d:1000 1:N:0:\n%s\n+\n%s\n" %
+                           (i,'A'*len(quality),quality))
+        fastq = os.path.join(self.wd,name)
+        if gzip_members:
+            nrecords = len(records)/gzip_members
+            with open(fastq,'wb') as fp:
+                for i in xrange(0,len(records),nrecords):
+                    member = cStringIO.StringIO()
+                    gz = gzip.GzipFile(fileobj=member,mode='wb')
+                    gz.write(''.join(records[i:i+nrecords]))
+                    gz.close()
+                    fp.write(member.getvalue())
+        else:
+            with open(fastq,'w') as fp:
+                fp.write(''.join(records))
+        return fastq
+
+    def test_sniff_phred33(self):
+        """Check Phred+33 is identified from the first block
+        """
+        fastq = self._make_fastq('test.fastq',['#'+'I'*35]*100,
+                                 gzip_members=0)
+        sniff = sniff_quality_encoding(fastq,blocksize=1024)
+        self.assertEqual(sniff.encoding,'Phred+33')
+        self.assertEqual(sniff.encodings,['Phred+33'])
+        self.assertEqual(sniff.confidence,1.0)
+        self.assertEqual(sniff.min_quality,'#')
+        self.assertEqual(sniff.max_quality,'I')
+        self.assertEqual(sniff.nblocks,1)
+
+    def test_sniff_phred64(self):
+        """Check Phred+64 can't be distinguished from Solexa+64
+        """
+        fastq = self._make_fastq('test.fastq',['B'+'h'*35]*100,
+                                 gzip_members=0)
+        sniff = sniff_quality_encoding(fastq,blocksize=1024)
+        self.assertEqual(sniff.encoding,'Phred+64')
+        self.assertEqual(sniff.encodings,['Phred+64','Solexa+64'])
+        self.assertEqual(sniff.confidence,0.5)
+        self.assertEqual(sniff.nblocks,8)
+
+    def test_sniff_samples_later_blocks(self):
+        """Check blocks later in the file are sampled
+        """
+        qualities = ['<'+'I'*35]*100 + ['#'+'I'*35]*100
+        fastq = self._make_fastq('test.fastq',qualities,gzip_members=0)
+        sniff = sniff_quality_encoding(fastq,blocksize=1024)
+        self.assertEqual(sniff.encodings,['Phred+33'])
+        self.assertEqual(sniff.min_quality,'#')
+        self.assertEqual(sniff.nblocks,5)
+
+    def test_sniff_multi_member_gzip(self):
+        """Check later members of a gzipped file are sampled
+        """
+        qualities = ['<'+'I'*35]*100 + ['#'+'I'*35]*100
+        fastq = self._make_fastq('test.fastq.gz',qualities,
+                                 gzip_members=10)
+        sniff = sniff_quality_encoding(fastq,blocksize=1024)
+        self.assertEqual(sniff.encodings,['Phred+33'])
+        self.assertEqual(sniff.min_quality,'#')
+
+    def test_sniff_single_member_gzip(self):
+        """Check only the start of a single member gzip file is sampled
+        """
+        qualities = ['<'+'I'*35]*100 + ['#'+'I'*35]*100
+        fastq = self._make_fastq('test.fastq.gz',qualities)
+        sniff = sniff_quality_encoding(fastq,blocksize=1024)
+        self.assertEqual(sniff.encodings,['Phred+33','Solexa+64'])
+        self.assertEqual(sniff.confidence,0.5)
+        self.assertEqual(sniff.min_quality,'<')
+        self.assertEqual(sniff.nblocks,1)
+
+    def test_sniff_colorspace(self):
+        """Check only Phred+33 is considered for colorspace data
+        """
+        fastq = self._make_fastq('test.fastq',['<'+'I'*35]*100,
+                                 gzip_members=0)
+        sniff = sniff_quality_encoding(fastq,colorspace=True)
+        self.assertEqual(sniff.encodings,['Phred+33'])
+        self.assertEqual(sniff.confidence,1.0)
+
+    def test_sniff_no_encoding(self):
+        """Check no encoding is returned for out-of-range qualities
+        """
+        fastq = self._make_fastq('test.fastq',['#'+'h'*35]*100,
+                                 gzip_members=0)
+        sniff = sniff_quality_encoding(fastq)
+        self.assertEqual(sniff.encoding,None)
+        self.assertEqual(sniff.encodings,[])
+        self.assertEqual(sniff.confidence,0.0)
+
+    def test_sniff_empty_file(self):
+        """Check sniffing an empty file
+        """
+        fastq = self._make_fastq('test.fastq',[],gzip_members=0)
+        sniff = sniff_quality_encoding(fastq)
+        self.assertEqual(sniff.encoding,None)
+        self.assertEqual(sniff.nreads,0)
+        self.assertEqual(sniff.nblocks,0)
+
 #######################################################################
 # Main program
 #######################################################################
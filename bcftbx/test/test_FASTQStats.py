@@ -0,0 +1,142 @@
+#######################################################################
+# Tests for FASTQStats.py module
+#######################################################################
+from bcftbx.FASTQStats import *
+import unittest
+import cStringIO
+import os
+import gzip
+import shutil
+import tempfile
+
+fastq_data = """@EAS139:136:FC706VJ:2:2104:15343:197393 1:N:0:ATCACG
+NACGT
++
+#5@@I
+@EAS139:136:FC706VJ:2:2104:15344:197393 1:N:0:ATCACG
+AACGTTA
++
+55@@III
+@EAS139:136:FC706VJ:2:2104:15345:197393 1:N:0:CGATGT
+NANC
++
+##5@
+"""
+
+class TestCollectFastqStats(unittest.TestCase):
+    """Tests of the collect_fastq_stats function
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+
+    def test_collect_fastq_stats(self):
+        """Check statistics are collected from FASTQ data
+        """
+        stats = collect_fastq_stats(fp=cStringIO.StringIO(fastq_data))
+        self.assertEqual(stats.nreads,3)
+        self.assertEqual(stats.total_bases,16)
+        self.assertEqual(stats.read_lengths,{ 4:1, 5:1, 7:1 })
+        self.assertEqual(stats.max_read_length,7)
+        self.assertEqual(stats.base_composition,
+                         { 'A':5, 'C':3, 'G':2, 'N':3, 'T':3 })
+        self.assertEqual(stats.reads_with_n,2)
+        self.assertEqual(stats.n_content,3.0/16)
+        self.assertEqual(stats.min_quality,'#')
+        self.assertEqual(stats.max_quality,'I')
+        self.assertEqual(stats.index_sequences,{ 'ATCACG':2, 'CGATGT':1 })
+
+    def test_collect_fastq_stats_per_position(self):
+        """Check per-position distributions are collected
+        """
+        stats = collect_fastq_stats(fp=cStringIO.StringIO(fastq_data))
+        self.assertEqual(len(stats.per_position_bases),7)
+        self.assertEqual(stats.per_position_bases[0],{ 'N':2, 'A':1 })
+        self.assertEqual(stats.per_position_bases[3],{ 'G':2, 'C':1 })
+        self.assertEqual(stats.per_position_bases[6],{ 'A':1 })
+        self.assertEqual(stats.per_position_qualities[0],
+                         { '#':2, '5':1 })
+        self.assertEqual(stats.per_position_qualities[4],
+                         { 'I':2 })
+        self.assertEqual(stats.mean_quality_per_position(),
+                         [8.0,14.0,82.0/3,31.0,40.0,40.0,40.0])
+
+    def test_collect_fastq_stats_no_per_position(self):
+        """Check per-position distributions can be turned off
+        """
+        stats = collect_fastq_stats(fp=cStringIO.StringIO(fastq_data),
+                                    per_position=False)
+        self.assertEqual(stats.nreads,3)
+        self.assertEqual(stats.per_position_bases,[])
+        self.assertEqual(stats.per_position_qualities,[])
+
+    def test_collect_fastq_stats_small_bufsize(self):
+        """Check statistics don't depend on the buffer size
+        """
+        expected = collect_fastq_stats(fp=cStringIO.StringIO(fastq_data))
+        for bufsize in (1,7,50):
+            stats = collect_fastq_stats(fp=cStringIO.StringIO(fastq_data),
+                                        bufsize=bufsize)
+            self.assertEqual(stats.__dict__,expected.__dict__)
+
+    def test_collect_fastq_stats_max_reads(self):
+        """Check statistics can be limited to the first reads
+        """
+        stats = collect_fastq_stats(fp=cStringIO.StringIO(fastq_data),
+                                    max_reads=2,bufsize=10)
+        self.assertEqual(stats.nreads,2)
+        self.assertEqual(stats.read_lengths,{ 5:1, 7:1 })
+        self.assertEqual(stats.index_sequences,{ 'ATCACG':2 })
+
+    def test_collect_fastq_stats_crlf(self):
+        """Check statistics are collected from data with CRLF endings
+        """
+        stats = collect_fastq_stats(
+            fp=cStringIO.StringIO(fastq_data.replace('\n','\r\n')))
+        self.assertEqual(stats.total_bases,16)
+        self.assertEqual(stats.read_lengths,{ 4:1, 5:1, 7:1 })
+
+    def test_collect_fastq_stats_gzipped(self):
+        """Check statistics are collected from gzipped FASTQ
+        """
+        fastq = os.path.join(self.wd,'test.fastq.gz')
+        fp = gzip.open(fastq,'wb')
+        fp.write(fastq_data)
+        fp.close()
+        stats = collect_fastq_stats(fastq)
+        self.assertEqual(stats.nreads,3)
+        self.assertEqual(stats.total_bases,16)
+
+    def test_collect_fastq_stats_truncated(self):
+        """Check exception is raised for truncated FASTQ
+        """
+        self.assertRaises(Exception,
+                          collect_fastq_stats,
+                          fp=cStringIO.StringIO(fastq_data[:-8]))
+
+    def test_collect_fastq_stats_empty(self):
+        """Check statistics for empty FASTQ
+        """
+        stats = collect_fastq_stats(fp=cStringIO.StringIO(''))
+        self.assertEqual(stats.nreads,0)
+        self.assertEqual(stats.min_quality,None)
+        self.assertEqual(stats.max_read_length,0)
+        self.assertEqual(stats.n_content,0.0)
+        self.assertEqual(stats.quality_encodings(),[])
+
+    def test_quality_encodings(self):
+        """Check quality encodings are identified from the data
+        """
+        stats = collect_fastq_stats(fp=cStringIO.StringIO(fastq_data))
+        self.assertEqual([e[0] for e in stats.quality_encodings()],
+                         ['Sanger/Phred+33','Illumina 1.8+/Phred+33'])
+
+#######################################################################
+# Main program
+#######################################################################
+
+if __name__ == "__main__":
+    # Run the tests
+    unittest.main()
@@ -5,10 +5,14 @@ from bcftbx.JobRunner import *
 from bcftbx.mockGE import setup_mock_GE
 from bcftbx.mockGE import MockGE
 import bcftbx.utils
+import bcftbx.JobRunner
 import unittest
 import tempfile
 import time
 import shutil
+import sys
+import signal
+import subprocess
 
 class TestSimpleJobRunner(unittest.TestCase):
 
@@ -65,6 +69,35 @@ class TestSimpleJobRunner(unittest.TestCase):
         self.assertEqual(os.path.dirname(runner.logFile(jobid)),self.working_dir)
         self.assertEqual(os.path.dirname(runner.errFile(jobid)),self.working_dir)
 
+    def test_simple_job_runner_resource_usage(self):
+        """Test SimpleJobRunner records resources used by a job
+        """
+        runner = SimpleJobRunner()
+        jobid = self.run_job(runner,'test',self.working_dir,
+                             'sleep',('0.2',))
+        self.assertEqual(runner.resource_usage(jobid),None)
+        self.wait_for_jobs(runner,jobid)
+        usage = runner.resource_usage(jobid)
+        self.assertEqual(usage['queue_wait'],0.0)
+        self.assertTrue(usage['wall_time'] >= 0.2)
+        self.assertTrue(usage['user_time'] >= 0.0)
+        self.assertTrue(usage['sys_time'] >= 0.0)
+        self.assertTrue(usage['max_rss'] > 0)
+
+    def test_simple_job_runner_wait(self):
+        """Test SimpleJobRunner 'wait' returns when a job finishes
+        """
+        runner = SimpleJobRunner()
+        jobid = self.run_job(runner,'test',self.working_dir,
+                             'sleep',('0.2',))
+        start_time = time.time()
+        self.assertTrue(runner.wait(30.0))
+        self.assertTrue((time.time() - start_time) < 10.0)
+        self.assertFalse(runner.isRunning(jobid))
+        self.assertEqual(runner.exit_status(jobid),0)
+        # Nothing left to finish
+        self.assertFalse(runner.wait(0.1))
+
     def test_simple_job_runner_exit_status(self):
         """Test SimpleJobRunner returns correct exit status
         """
@@ -170,6 +203,438 @@ class TestSimpleJobRunner(unittest.TestCase):
         self.assertEqual(os.path.dirname(runner.logFile(jobid3)),self.log_dir)
         self.assertEqual(os.path.dirname(runner.errFile(jobid3)),self.log_dir)
 
+class TestLocalPoolJobRunner(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory to work in
+        self.working_dir = self.make_tmp_dir()
+        self.log_dir = None
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+        if self.log_dir is not None:
+            shutil.rmtree(self.log_dir)
+
+    def make_tmp_dir(self):
+        return tempfile.mkdtemp()
+
+    def wait_for_jobs(self,runner,*args):
+        poll_interval = 0.01
+        ntries = 0
+        running_jobs = True
+        # Check running jobs
+        while ntries < 1000 and running_jobs:
+            running_jobs = False
+            for jobid in args:
+                if runner.isRunning(jobid):
+                    running_jobs = True
+            if running_jobs:
+                time.sleep(poll_interval)
+                ntries += 1
+        # All jobs finished
+        if not running_jobs:
+            return
+        # Otherwise we've reached the timeout limit
+        self.fail("Timed out waiting for test job")
+
+    def test_local_pool_job_runner(self):
+        """Test LocalPoolJobRunner with basic shell command
+        """
+        # Create a runner and execute the echo command
+        runner = LocalPoolJobRunner(cpus=2)
+        jobid = runner.run('test',self.working_dir,'echo',('this is a test',))
+        self.wait_for_jobs(runner,jobid)
+        # Check outputs
+        self.assertEqual(runner.name(jobid),'test')
+        self.assertEqual(runner.exit_status(jobid),0)
+        self.assertEqual(os.path.dirname(runner.logFile(jobid)),
+                         self.working_dir)
+        self.assertEqual(open(runner.logFile(jobid)).read(),
+                         "this is a test\n")
+        self.assertTrue(os.path.isfile(runner.errFile(jobid)))
+        # Check resource usage was recorded
+        usage = runner.resource_usage(jobid)
+        self.assertNotEqual(usage,None)
+        self.assertTrue(usage['max_rss'] > 0)
+        self.assertTrue(usage['user_time'] >= 0.0)
+        self.assertTrue(usage['sys_time'] >= 0.0)
+
+    def test_local_pool_job_runner_queue_wait(self):
+        """Test LocalPoolJobRunner records time jobs wait for resources
+        """
+        runner = LocalPoolJobRunner(cpus=1)
+        jobid1 = runner.run('test1',self.working_dir,'sleep',('0.3',))
+        jobid2 = runner.run('test2',self.working_dir,'sleep',('0.1',))
+        self.wait_for_jobs(runner,jobid1,jobid2)
+        self.assertTrue(runner.resource_usage(jobid1)['queue_wait'] < 0.3)
+        self.assertTrue(runner.resource_usage(jobid2)['queue_wait'] >= 0.3)
+        self.assertTrue(runner.resource_usage(jobid2)['wall_time'] >= 0.1)
+
+    def test_local_pool_job_runner_wait(self):
+        """Test LocalPoolJobRunner 'wait' returns when a job finishes
+        """
+        runner = LocalPoolJobRunner(cpus=1)
+        jobid1 = runner.run('test1',self.working_dir,'sleep',('0.2',))
+        jobid2 = runner.run('test2',self.working_dir,'sleep',('0.2',))
+        start_time = time.time()
+        self.assertTrue(runner.wait(30.0))
+        self.assertTrue((time.time() - start_time) < 10.0)
+        # First job finished so second should now be started
+        self.assertEqual(runner.list(),[jobid2])
+        self.assertEqual(runner.slots_in_use,1)
+        self.assertEqual(runner.exit_status(jobid1),0)
+        self.wait_for_jobs(runner,jobid2)
+
+    def test_local_pool_job_runner_exit_status(self):
+        """Test LocalPoolJobRunner returns correct exit status
+        """
+        runner = LocalPoolJobRunner(cpus=2)
+        jobid_ok = runner.run('test_ok',self.working_dir,
+                              '/bin/bash',('-c','exit 0',))
+        jobid_error = runner.run('test_error',self.working_dir,
+                                 '/bin/bash',('-c','exit 1',))
+        self.wait_for_jobs(runner,jobid_ok,jobid_error)
+        self.assertEqual(runner.exit_status(jobid_ok),0)
+        self.assertEqual(runner.exit_status(jobid_error),1)
+
+    def test_local_pool_job_runner_slot_accounting(self):
+        """Test LocalPoolJobRunner only starts jobs when slots are free
+        """
+        runner = LocalPoolJobRunner(cpus=4)
+        jobid1 = runner.run('test1',self.working_dir,'sleep',('1',),
+                            nslots=3)
+        jobid2 = runner.run('test2',self.working_dir,'sleep',('0.1',),
+                            nslots=2)
+        # Both jobs are listed but only the first is running
+        self.assertEqual(sorted(runner.list()),sorted([jobid1,jobid2]))
+        self.assertEqual(runner.slots_in_use,3)
+        self.assertEqual(runner.exit_status(jobid2),None)
+        self.assertFalse(os.path.exists(runner.logFile(jobid2)))
+        # Second job starts once the first has finished
+        self.wait_for_jobs(runner,jobid1)
+        self.assertEqual(runner.slots_in_use,2)
+        self.assertTrue(os.path.exists(runner.logFile(jobid2)))
+        self.wait_for_jobs(runner,jobid2)
+        self.assertEqual(runner.slots_in_use,0)
+        self.assertEqual(runner.exit_status(jobid1),0)
+        self.assertEqual(runner.exit_status(jobid2),0)
+
+    def test_local_pool_job_runner_memory_accounting(self):
+        """Test LocalPoolJobRunner only starts jobs when memory is free
+        """
+        runner = LocalPoolJobRunner(cpus=4,mem=8)
+        jobid1 = runner.run('test1',self.working_dir,'sleep',('0.5',),
+                            mem_gb=6)
+        jobid2 = runner.run('test2',self.working_dir,'sleep',('0.1',),
+                            mem_gb=4)
+        self.assertEqual(runner.mem_in_use,6)
+        self.assertEqual(runner.slots_in_use,1)
+        self.wait_for_jobs(runner,jobid1)
+        self.assertEqual(runner.mem_in_use,4)
+        self.wait_for_jobs(runner,jobid2)
+        self.assertEqual(runner.mem_in_use,0)
+
+    def test_local_pool_job_runner_oversized_job(self):
+        """Test LocalPoolJobRunner runs job requesting too many slots
+        """
+        runner = LocalPoolJobRunner(cpus=2)
+        jobid = runner.run('test',self.working_dir,'sleep',('0.1',),
+                           nslots=4)
+        self.wait_for_jobs(runner,jobid)
+        self.assertEqual(runner.exit_status(jobid),0)
+
+    def test_local_pool_job_runner_termination(self):
+        """Test LocalPoolJobRunner can terminate running and waiting jobs
+        """
+        runner = LocalPoolJobRunner(cpus=1)
+        jobid1 = runner.run('test1',self.working_dir,'sleep',('60',))
+        jobid2 = runner.run('test2',self.working_dir,'sleep',('60',))
+        self.assertTrue(runner.terminate(jobid2))
+        self.assertTrue(runner.terminate(jobid1))
+        self.assertEqual(runner.list(),[])
+        self.assertNotEqual(runner.exit_status(jobid1),0)
+        self.assertNotEqual(runner.exit_status(jobid2),0)
+        self.assertEqual(runner.slots_in_use,0)
+
+    def test_local_pool_job_runner_set_log_dir(self):
+        """Test LocalPoolJobRunner explicitly setting log directory
+        """
+        self.log_dir = self.make_tmp_dir()
+        runner = LocalPoolJobRunner(log_dir=self.log_dir,join_logs=True)
+        jobid = runner.run('test',self.working_dir,'echo',('this is a test',))
+        self.wait_for_jobs(runner,jobid)
+        self.assertEqual(os.path.dirname(runner.logFile(jobid)),self.log_dir)
+        self.assertTrue(os.path.isfile(runner.logFile(jobid)))
+        self.assertEqual(runner.errFile(jobid),None)
+
+python_pool_test_functions = """import sys
+import os
+import time
+def hello(args):
+    print "Hello %s" % ' '.join(args)
+    sys.stderr.write("Working dir %s\\n" % os.getcwd())
+def fail(args):
+    raise Exception("Failed")
+def exit_code(args):
+    sys.exit(int(args[0]))
+def sleep(args):
+    time.sleep(float(args[0]))
+def pid(args):
+    print os.getpid()
+def main():
+    print "Arguments %s" % ' '.join(sys.argv[1:])
+"""
+
+class TestPythonPoolJobRunner(unittest.TestCase):
+
+    def setUp(self):
+        # Create a temporary directory to work in
+        self.working_dir = self.make_tmp_dir()
+        self.log_dir = None
+        # Module with test functions
+        self.module_dir = self.make_tmp_dir()
+        self.module_file = os.path.join(self.module_dir,
+                                        "pythonpooltest.py")
+        with open(self.module_file,'w') as fp:
+            fp.write(python_pool_test_functions)
+        sys.path.insert(0,self.module_dir)
+
+    def tearDown(self):
+        sys.path.remove(self.module_dir)
+        shutil.rmtree(self.module_dir)
+        shutil.rmtree(self.working_dir)
+        if self.log_dir is not None:
+            shutil.rmtree(self.log_dir)
+
+    def make_tmp_dir(self):
+        return tempfile.mkdtemp()
+
+    def wait_for_jobs(self,runner,*args):
+        poll_interval = 0.01
+        ntries = 0
+        running_jobs = True
+        # Check running jobs
+        while ntries < 1000 and running_jobs:
+            running_jobs = False
+            for jobid in args:
+                if runner.isRunning(jobid):
+                    running_jobs = True
+            if running_jobs:
+                time.sleep(poll_interval)
+                ntries += 1
+        # All jobs finished
+        if not running_jobs:
+            return
+        # Otherwise we've reached the timeout limit
+        self.fail("Timed out waiting for test job")
+
+    def test_python_pool_job_runner(self):
+        """Test PythonPoolJobRunner runs a Python function
+        """
+        runner = PythonPoolJobRunner(workers=2)
+        jobid = runner.run('test',self.working_dir,
+                           "%s:hello" % self.module_file,('world',))
+        self.wait_for_jobs(runner,jobid)
+        self.assertEqual(runner.name(jobid),'test')
+        self.assertEqual(runner.exit_status(jobid),0)
+        self.assertEqual(runner.list(),[])
+        self.assertEqual(runner.logFile(jobid),
+                         os.path.join(self.working_dir,"test.o%s" % jobid))
+        self.assertEqual(open(runner.logFile(jobid)).read(),
+                         "Hello world\n")
+        self.assertEqual(open(runner.errFile(jobid)).read(),
+                         "Working dir %s\n" % self.working_dir)
+        usage = runner.resource_usage(jobid)
+        self.assertTrue(usage['wall_time'] >= 0.0)
+        self.assertTrue(usage['user_time'] >= 0.0)
+
+    def test_python_pool_job_runner_module_target(self):
+        """Test PythonPoolJobRunner runs function from a module
+        """
+        runner = PythonPoolJobRunner(workers=1)
+        jobid = runner.run('test',self.working_dir,
+                           "pythonpooltest:hello",('world',))
+        self.wait_for_jobs(runner,jobid)
+        self.assertEqual(runner.exit_status(jobid),0)
+        self.assertEqual(open(runner.logFile(jobid)).read(),
+                         "Hello world\n")
+
+    def test_python_pool_job_runner_exit_status(self):
+        """Test PythonPoolJobRunner returns correct exit status
+        """
+        runner = PythonPoolJobRunner(workers=4)
+        jobid_ok = runner.run('test_ok',self.working_dir,
+                              "pythonpooltest:exit_code",('0',))
+        jobid_error = runner.run('test_error',self.working_dir,
+                                 "pythonpooltest:exit_code",('3',))
+        jobid_fail = runner.run('test_fail',self.working_dir,
+                                "pythonpooltest:fail",())
+        jobid_script = runner.run('test_script',self.working_dir,
+                                  '/bin/bash',('-c','exit 2'))
+        self.wait_for_jobs(runner,jobid_ok,jobid_error,jobid_fail,
+                           jobid_script)
+        self.assertEqual(runner.exit_status(jobid_ok),0)
+        self.assertEqual(runner.exit_status(jobid_error),3)
+        self.assertEqual(runner.exit_status(jobid_fail),1)
+        self.assertTrue("Exception: Failed" in
+                        open(runner.errFile(jobid_fail)).read())
+        self.assertEqual(runner.exit_status(jobid_script),2)
+
+    def test_python_pool_job_runner_reuses_workers(self):
+        """Test PythonPoolJobRunner runs jobs in the same worker
+        """
+        runner = PythonPoolJobRunner(workers=1)
+        jobids = [runner.run('test',self.working_dir,
+                             "pythonpooltest:pid",())
+                  for i in xrange(4)]
+        # Only one job runs at a time
+        self.assertEqual(sorted(runner.list()),jobids)
+        self.wait_for_jobs(runner,*jobids)
+        pids = set([open(runner.logFile(jobid)).read()
+                    for jobid in jobids])
+        self.assertEqual(len(pids),1)
+        self.assertNotEqual(pids.pop().strip(),str(os.getpid()))
+
+    def test_python_pool_job_runner_wait(self):
+        """Test PythonPoolJobRunner 'wait' returns when a job finishes
+        """
+        runner = PythonPoolJobRunner(workers=1)
+        jobid = runner.run('test',self.working_dir,
+                           "pythonpooltest:sleep",('0.2',))
+        start_time = time.time()
+        self.assertTrue(runner.wait(30.0))
+        self.assertTrue((time.time() - start_time) < 10.0)
+        self.assertEqual(runner.list(),[])
+        self.assertEqual(runner.exit_status(jobid),0)
+
+    def test_python_pool_job_runner_termination(self):
+        """Test PythonPoolJobRunner can terminate jobs
+        """
+        runner = PythonPoolJobRunner(workers=1)
+        jobid1 = runner.run('test1',self.working_dir,
+                            "pythonpooltest:sleep",('60',))
+        jobid2 = runner.run('test2',self.working_dir,
+                            "pythonpooltest:sleep",('60',))
+        jobid3 = runner.run('test3',self.working_dir,
+                            "pythonpooltest:hello",('again',))
+        self.assertTrue(runner.terminate(jobid2))
+        self.assertTrue(runner.terminate(jobid1))
+        self.assertFalse(runner.isRunning(jobid1))
+        self.assertFalse(runner.isRunning(jobid2))
+        self.assertEqual(runner.exit_status(jobid1),-signal.SIGTERM)
+        self.assertEqual(runner.exit_status(jobid2),-signal.SIGTERM)
+        # Pool still runs jobs
+        self.wait_for_jobs(runner,jobid3)
+        self.assertEqual(runner.exit_status(jobid3),0)
+
+    def test_python_pool_job_runner_termination_other_job(self):
+        """Test PythonPoolJobRunner worker isn't killed for another job
+        """
+        runner = PythonPoolJobRunner(workers=1)
+        jobid = runner.run('test',self.working_dir,
+                           "pythonpooltest:sleep",('1',))
+        # Wait for the worker to report its pid
+        pids = runner._PythonPoolJobRunner__pids
+        ntries = 0
+        while jobid not in pids and ntries < 1000:
+            runner.list()
+            time.sleep(0.01)
+            ntries += 1
+        # Signal the worker with a different job to terminate
+        runner._PythonPoolJobRunner__kill_jobs[0] = int(jobid) + 1
+        os.kill(pids[jobid],signal.SIGTERM)
+        self.wait_for_jobs(runner,jobid)
+        self.assertEqual(runner.exit_status(jobid),0)
+
+    def test_python_pool_job_runner_terminate_multiple_jobs(self):
+        """Test PythonPoolJobRunner can terminate several running jobs
+        """
+        runner = PythonPoolJobRunner(workers=3)
+        jobids = [runner.run('test',self.working_dir,
+                             "pythonpooltest:sleep",('60',))
+                  for i in xrange(3)]
+        for jobid in jobids:
+            self.assertTrue(runner.terminate(jobid))
+        for jobid in jobids:
+            self.assertFalse(runner.isRunning(jobid))
+            self.assertEqual(runner.exit_status(jobid),-signal.SIGTERM)
+        # All workers were killed and replaced, so a new job
+        # runs straight away
+        jobid = runner.run('test',self.working_dir,
+                           "pythonpooltest:hello",('again',))
+        self.wait_for_jobs(runner,jobid)
+        self.assertEqual(runner.exit_status(jobid),0)
+
+    def test_python_pool_job_runner_terminate_script(self):
+        """Test PythonPoolJobRunner terminates scripts run by workers
+        """
+        runner = PythonPoolJobRunner(workers=1)
+        pid_file = os.path.join(self.working_dir,"sleep.pid")
+        script = os.path.join(self.working_dir,"sleep.sh")
+        with open(script,'w') as fp:
+            fp.write("#!/bin/sh\nsleep 60 &\necho $! >%s\nwait\n"
+                     % pid_file)
+        os.chmod(script,0775)
+        jobid = runner.run('test',self.working_dir,script,())
+        ntries = 0
+        while not os.path.exists(pid_file) and ntries < 1000:
+            time.sleep(0.01)
+            ntries += 1
+        time.sleep(0.1)
+        sleep_pid = int(open(pid_file).read())
+        self.assertTrue(runner.terminate(jobid))
+        self.assertEqual(runner.exit_status(jobid),-signal.SIGTERM)
+        # Process started by the script is also killed
+        ntries = 0
+        while ntries < 1000:
+            try:
+                os.kill(sleep_pid,0)
+            except OSError:
+                break
+            time.sleep(0.01)
+            ntries += 1
+        self.assertRaises(OSError,os.kill,sleep_pid,0)
+
+    def test_python_pool_job_runner_releases_pids(self):
+        """Test PythonPoolJobRunner doesn't keep pids of finished jobs
+        """
+        runner = PythonPoolJobRunner(workers=2)
+        jobids = [runner.run('test',self.working_dir,
+                             "pythonpooltest:hello",('world',))
+                  for i in xrange(10)]
+        self.wait_for_jobs(runner,*jobids)
+        # Allow any outstanding pids to arrive
+        time.sleep(0.2)
+        self.assertEqual(runner.list(),[])
+        self.assertEqual(runner._PythonPoolJobRunner__pids,{})
+        self.assertTrue(runner._PythonPoolJobRunner__pid_queue.empty())
+
+    def test_python_pool_job_runner_no_arguments(self):
+        """Test PythonPoolJobRunner runs function with no arguments
+        """
+        runner = PythonPoolJobRunner(workers=1)
+        jobid = runner.run('test',self.working_dir,
+                           "pythonpooltest:main",('-o','out.txt'))
+        self.wait_for_jobs(runner,jobid)
+        self.assertEqual(runner.exit_status(jobid),0)
+        self.assertEqual(open(runner.logFile(jobid)).read(),
+                         "Arguments -o out.txt\n")
+
+    def test_python_pool_job_runner_set_log_dir(self):
+        """Test PythonPoolJobRunner writes logs to log dir
+        """
+        self.log_dir = self.make_tmp_dir()
+        runner = PythonPoolJobRunner(log_dir=self.log_dir,join_logs=True)
+        jobid = runner.run('test',self.working_dir,
+                           "pythonpooltest:hello",('world',))
+        self.wait_for_jobs(runner,jobid)
+        self.assertEqual(os.path.dirname(runner.logFile(jobid)),
+                         self.log_dir)
+        self.assertEqual(runner.errFile(jobid),None)
+        self.assertEqual(open(runner.logFile(jobid)).read(),
+                         "Hello world\nWorking dir %s\n" %
+                         self.working_dir)
+
 class TestGEJobRunner(unittest.TestCase):
 
     def setUp(self):
@@ -322,6 +787,65 @@ class TestGEJobRunner(unittest.TestCase):
         self.assertEqual(runner.exit_status(jobid_ok),0)
         self.assertEqual(runner.exit_status(jobid_error),1)
 
+    def test_ge_job_runner_resource_usage(self):
+        """Test GEJobRunner records resources used by a job
+        """
+        runner = GEJobRunner(ge_extra_args=self.ge_extra_args)
+        jobid = self.run_job(runner,'test',self.working_dir,
+                             'sleep',('1',))
+        self.wait_for_jobs(runner,jobid)
+        usage = runner.resource_usage(jobid)
+        self.assertTrue(usage['queue_wait'] >= 0.0)
+        self.assertTrue(usage['wall_time'] >= 1.0)
+        self.assertTrue(usage['user_time'] >= 0.0)
+        self.assertTrue(usage['sys_time'] >= 0.0)
+
+    def test_ge_job_runner_wait(self):
+        """Test GEJobRunner 'wait' returns when a job finishes
+        """
+        runner = GEJobRunner(ge_extra_args=self.ge_extra_args)
+        # Nothing running
+        self.assertFalse(runner.wait(0.1))
+        jobid = self.run_job(runner,'test',self.working_dir,
+                             'sleep',('0.5',))
+        self.update_jobs()
+        start_time = time.time()
+        self.assertTrue(runner.wait(30.0))
+        self.assertTrue((time.time() - start_time) < 10.0)
+        self.wait_for_jobs(runner,jobid)
+        self.assertEqual(runner.exit_status(jobid),0)
+
+    def test_ge_job_runner_attach(self):
+        """Test GEJobRunner can attach to job from another runner
+        """
+        runner1 = GEJobRunner(ge_extra_args=self.ge_extra_args)
+        jobid = self.run_job(runner1,'test',self.working_dir,
+                             'sleep',('1',))
+        info = runner1.attach_info(jobid)
+        runner2 = GEJobRunner(ge_extra_args=self.ge_extra_args)
+        self.assertTrue(runner2.attach(jobid,info))
+        self.assertFalse(runner2.attach(jobid,info))
+        self.assertTrue(runner2.isRunning(jobid))
+        self.wait_for_jobs(runner2,jobid)
+        self.assertEqual(runner2.exit_status(jobid),0)
+        self.assertEqual(runner2.name(jobid),'test')
+        self.assertEqual(runner2.logFile(jobid),runner1.logFile(jobid))
+        self.assertTrue(runner2.resource_usage(jobid)['wall_time'] >= 1.0)
+
+    def test_ge_job_runner_attach_to_lost_job(self):
+        """Test GEJobRunner handles attached job which has vanished
+        """
+        runner = GEJobRunner(ge_extra_args=self.ge_extra_args)
+        info = dict(name='lost',
+                    log_dir=self.working_dir,
+                    exit_code_file=os.path.join(self.working_dir,
+                                                'missing'),
+                    submit_time=None)
+        self.assertTrue(runner.attach('99999',info))
+        self.wait_for_jobs(runner,'99999')
+        self.assertEqual(runner.exit_status('99999'),127)
+        self.assertEqual(runner.attach_info('99999'),None)
+
     def test_ge_job_runner_termination(self):
         """Test GEJobRunner can terminate a running job
 
@@ -468,6 +992,105 @@ class TestGEJobRunner(unittest.TestCase):
         # Check the queue
         self.assertEqual(runner.queue(jobid),"mock.q")
 
+    def test_ge_job_runner_run_batch(self):
+        """Test GEJobRunner submits multiple commands as array job
+        """
+        # Create a runner and submit a batch of commands
+        runner = GEJobRunner(ge_extra_args=self.ge_extra_args)
+        jobids = runner.run_batch('test_batch',
+                                  ((self.working_dir,'/bin/bash',
+                                    ('-c','echo task 1; exit 0')),
+                                   (self.working_dir,'/bin/bash',
+                                    ('-c','echo task 2; exit 1')),
+                                   (self.working_dir,'/bin/bash',
+                                    ('-c','echo task 3; exit 2'))))
+        self.assertEqual(len(jobids),3)
+        # Job ids should be tasks in the same array job
+        array_id = jobids[0].split('.')[0]
+        self.assertEqual(jobids,["%s.%d" % (array_id,i) for i in (1,2,3)])
+        for jobid in jobids:
+            self.assertTrue(jobid in runner.list())
+        self.wait_for_jobs(runner,*jobids)
+        # Check outputs for each task
+        for i,jobid in enumerate(jobids):
+            self.assertFalse(jobid in runner.list())
+            self.assertEqual(runner.name(jobid),'test_batch')
+            self.assertEqual(runner.exit_status(jobid),i)
+            self.assertEqual(os.path.dirname(runner.logFile(jobid)),
+                             self.working_dir)
+            self.assertTrue(os.path.isfile(runner.logFile(jobid)),
+                            "Stdout file '%s': not a file" %
+                            runner.logFile(jobid))
+            self.assertTrue(os.path.isfile(runner.errFile(jobid)),
+                            "Stderr file '%s': not a file" %
+                            runner.errFile(jobid))
+            self.assertEqual(open(runner.logFile(jobid)).read(),
+                             "task %d\n" % (i+1))
+
+    def test_ge_job_runner_run_batch_set_log_dir(self):
+        """Test GEJobRunner array job with explicit log directory
+        """
+        # Create a temporary log directory
+        self.log_dir = self.make_tmp_dir()
+        # Create a runner and submit a batch of commands
+        runner = GEJobRunner(log_dir=self.log_dir,
+                             ge_extra_args=self.ge_extra_args)
+        jobids = runner.run_batch('test_batch',
+                                  ((self.working_dir,'echo',('task 1',)),
+                                   (self.working_dir,'echo',('task 2',))))
+        self.wait_for_jobs(runner,*jobids)
+        # Check log files are in the log directory
+        for jobid in jobids:
+            self.assertEqual(runner.exit_status(jobid),0)
+            self.assertTrue(os.path.isfile(runner.logFile(jobid)))
+            self.assertTrue(os.path.isfile(runner.errFile(jobid)))
+            self.assertEqual(os.path.dirname(runner.logFile(jobid)),
+                             self.log_dir)
+
+    def test_ge_job_runner_run_batch_termination(self):
+        """Test GEJobRunner can terminate a single array job task
+        """
+        # Create a runner and submit a batch of commands
+        runner = GEJobRunner(ge_extra_args=self.ge_extra_args)
+        jobids = runner.run_batch('test_batch',
+                                  ((self.working_dir,'sleep',('60s',)),
+                                   (self.working_dir,'sleep',('1s',))))
+        self.assertTrue(runner.isRunning(jobids[0]))
+        # Terminate the first task
+        runner.terminate(jobids[0])
+        self.update_jobs()
+        self.assertFalse(runner.isRunning(jobids[0]))
+        self.assertNotEqual(runner.exit_status(jobids[0]),0)
+        # Second task should complete normally
+        self.wait_for_jobs(runner,jobids[1])
+        self.assertEqual(runner.exit_status(jobids[1]),0)
+
+    def test_ge_job_runner_list_scans_admin_dir_once(self):
+        """Test GEJobRunner 'list' doesn't check files for each job
+        """
+        # Create a runner and execute several commands
+        runner = GEJobRunner(ge_extra_args=self.ge_extra_args)
+        jobids = [self.run_job(runner,'test%d' % i,self.working_dir,
+                               'sleep',('1s',)) for i in xrange(4)]
+        # Count calls to os.path.exists while waiting for
+        # the jobs to complete
+        exists = os.path.exists
+        nexists_calls = []
+        def counting_exists(path):
+            nexists_calls.append(path)
+            return exists(path)
+        os.path.exists = counting_exists
+        try:
+            self.wait_for_jobs(runner,*jobids)
+        finally:
+            os.path.exists = exists
+        self.assertEqual(nexists_calls,[])
+        # Check exit codes and queues
+        for jobid in jobids:
+            self.assertFalse(jobid in runner.list())
+            self.assertEqual(runner.exit_status(jobid),0)
+            self.assertEqual(runner.queue(jobid),"mock.q")
+
 class TestFetchRunnerFunction(unittest.TestCase):
     """Tests for the fetch_runner function
     """
@@ -491,11 +1114,62 @@ class TestFetchRunnerFunction(unittest.TestCase):
         self.assertTrue(isinstance(runner,GEJobRunner))
         self.assertEqual(runner.ge_extra_args,['-j','y'])
 
+    def test_fetch_local_pool_job_runner(self):
+        """fetch_runner returns a LocalPoolJobRunner
+        """
+        runner = fetch_runner("local(cpus=64,mem=256G)")
+        self.assertTrue(isinstance(runner,LocalPoolJobRunner))
+        self.assertEqual(runner.cpus,64)
+        self.assertEqual(runner.mem,256.0)
+        runner = fetch_runner("local(cpus=8,mem=512M)")
+        self.assertEqual(runner.cpus,8)
+        self.assertEqual(runner.mem,0.5)
+        runner = fetch_runner("local")
+        self.assertTrue(isinstance(runner,LocalPoolJobRunner))
+        self.assertEqual(runner.mem,None)
+
+    def test_fetch_python_pool_job_runner(self):
+        """fetch_runner returns a PythonPoolJobRunner
+        """
+        runner = fetch_runner("python(workers=4)")
+        self.assertTrue(isinstance(runner,PythonPoolJobRunner))
+        self.assertEqual(runner.workers,4)
+        runner = fetch_runner("PythonPoolJobRunner")
+        self.assertTrue(isinstance(runner,PythonPoolJobRunner))
+        self.assertRaises(Exception,fetch_runner,"python(cpus=4)")
+
+    def test_fetch_local_pool_job_runner_bad_args(self):
+        """fetch_runner raises exception for bad local runner arguments
+        """
+        self.assertRaises(Exception,fetch_runner,"local(cpus=4,disk=10G)")
+
     def test_fetch_bad_runner_raises_exception(self):
         """fetch_runner raises exception for unknown runner
         """
         self.assertRaises(Exception,fetch_runner,"SimpleRunner")
 
+class TestReapFunction(unittest.TestCase):
+    """Tests for the internal _reap function
+    """
+
+    def test_reap(self):
+        """_reap returns exit status of finished process
+        """
+        p = subprocess.Popen(["/bin/sh","-c","exit 3"])
+        status,rusage = bcftbx.JobRunner._reap(p,0)
+        self.assertEqual(status,3)
+        self.assertNotEqual(rusage,None)
+        self.assertEqual(p.returncode,3)
+
+    def test_reap_already_reaped_process(self):
+        """_reap reports failure for process reaped elsewhere
+        """
+        p = subprocess.Popen(["/bin/true"])
+        os.waitpid(p.pid,0)
+        status,rusage = bcftbx.JobRunner._reap(p,0)
+        self.assertEqual(status,127)
+        self.assertEqual(rusage,None)
+
 #######################################################################
 # Main program
 #######################################################################
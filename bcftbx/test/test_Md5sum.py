@@ -6,6 +6,7 @@ from bcftbx.test.mock_data import ExampleDirSpiders,ExampleDirLanguages
 import unittest
 import os
 import tempfile
+import shutil
 import cStringIO
 
 test_text = """Md5sum is a Python module with functions for generating
@@ -45,11 +46,67 @@ class TestMd5sum(unittest.TestCase):
         self.assertEqual(md5sum(fp),
                          '08a6facee51e5435b9ef3744bd4dd5dc')
 
+    def test_md5sum_for_stream_without_readinto(self):
+        """md5sum function generates correct MD5 hash for stream without 'readinto'
+        """
+        fp = cStringIO.StringIO(test_text)
+        self.assertEqual(md5sum(fp),
+                         '08a6facee51e5435b9ef3744bd4dd5dc')
+
+    def test_md5sum_small_blocksize(self):
+        """md5sum function generates correct MD5 hash reading small blocks
+        """
+        self.assertEqual(md5sum(self.filen,blocksize=7),
+                         '08a6facee51e5435b9ef3744bd4dd5dc')
+        self.assertEqual(md5sum(cStringIO.StringIO(test_text),blocksize=7),
+                         '08a6facee51e5435b9ef3744bd4dd5dc')
+
     def test_no_file_name(self):
         """md5sum function handles 'None' as input file name
         """
         self.assertRaises(Exception,md5sum,None)
 
+class TestOrderedMap(unittest.TestCase):
+
+    def test_ordered_map_serial(self):
+        """ordered_map applies function serially
+        """
+        self.assertEqual(list(ordered_map(lambda x: x*x,xrange(10))),
+                         [x*x for x in xrange(10)])
+
+    def test_ordered_map_threads(self):
+        """ordered_map returns results in input order using threads
+        """
+        import time
+        def delayed_square(x):
+            # Make earlier items finish last
+            time.sleep(0.001*(50-x))
+            return x*x
+        self.assertEqual(list(ordered_map(delayed_square,xrange(50),
+                                          nthreads=4)),
+                         [x*x for x in xrange(50)])
+
+    def test_ordered_map_threads_no_items(self):
+        """ordered_map handles empty input using threads
+        """
+        self.assertEqual(list(ordered_map(lambda x: x,[],nthreads=4)),[])
+
+    def test_ordered_map_threads_raises_exception(self):
+        """ordered_map re-raises exception from function using threads
+        """
+        def fail_on_five(x):
+            if x == 5:
+                raise IOError("Failed on 5")
+            return x
+        results = []
+        try:
+            for x in ordered_map(fail_on_five,xrange(10),nthreads=4):
+                results.append(x)
+            self.fail("IOError not raised")
+        except IOError:
+            pass
+        self.assertEqual(results,[0,1,2,3,4])
+
 class TestMd5CheckerMd5cmpFiles(unittest.TestCase):
     """Tests for the 'md5cmp_files' method of the Md5Checker class
 
@@ -239,6 +296,20 @@ class TestMd5CheckerMd5cmpDirs(unittest.TestCase):
             self.assertEqual(Md5Checker.MD5_OK,status,
                              "Failed for %s (status %d)" % (f,status))
 
+    def test_cmp_identical_dirs_using_threads(self):
+        """Md5Checker.md5cmp_dirs with identical directories using threads
+        """
+        files = [f for f,status in Md5Checker.md5cmp_dirs(self.dir1.dirn,
+                                                          self.dir2.dirn)]
+        threaded_files = []
+        for f,status in Md5Checker.md5cmp_dirs(self.dir1.dirn,
+                                               self.dir2.dirn,
+                                               nthreads=4):
+            self.assertEqual(Md5Checker.MD5_OK,status,
+                             "Failed for %s (status %d)" % (f,status))
+            threaded_files.append(f)
+        self.assertEqual(files,threaded_files)
+
     def test_cmp_identical_dirs_ignore_links(self):
         """Md5Checker.md5cmp_dirs with identical directories ignoring links
         """
@@ -288,6 +359,24 @@ class TestMd5CheckerMd5cmpDirs(unittest.TestCase):
             else:
                 self.assertEqual(Md5Checker.MD5_OK,status)
 
+    def test_cmp_different_dirs_different_file_using_threads(self):
+        """Md5Checker.md5cmp_dirs with different directories using threads
+        """
+        # Replace file in target with different content and
+        # add an additional file in reference
+        self.dir2.add_file("goodbye","Goooooodbyeeee!")
+        self.dir1.add_file("portuguese/ola","Hello!")
+        for f,status in Md5Checker.md5cmp_dirs(self.dir1.dirn,
+                                               self.dir2.dirn,
+                                               links=Md5Checker.IGNORE_LINKS,
+                                               nthreads=4):
+            if os.path.basename(f) == "goodbye":
+                self.assertEqual(Md5Checker.MD5_FAILED,status)
+            elif f == "portuguese/ola":
+                self.assertEqual(Md5Checker.MISSING_TARGET,status)
+            else:
+                self.assertEqual(Md5Checker.MD5_OK,status)
+
     def test_cmp_different_dirs_file_is_dir(self):
         """Md5Checker.md5cmp_dirs with different directories ('file' is dir)
         """
@@ -346,6 +435,18 @@ class TestMd5CheckerComputeMd5sms(unittest.TestCase):
             self.assertTrue(f in files,"%s doesn't appear in file list?" % f)
             self.assertEqual(md5,self.example_dir.checksum_for_file(f))
 
+    def test_compute_md5sums_using_threads(self):
+        """Md5Checker.compute_md5sums returns md5sums in order using threads
+
+        """
+        # Add a broken link
+        self.example_dir.add_link("broken","missing.txt")
+        md5sums = list(Md5Checker.compute_md5sums(self.example_dir.dirn))
+        self.assertNotEqual(len(md5sums),0)
+        self.assertEqual(list(Md5Checker.compute_md5sums(self.example_dir.dirn,
+                                                         nthreads=4)),
+                         md5sums)
+
 class TestMd5CheckerVerifyMd5sms(unittest.TestCase):
     """Tests for the 'verify_md5sums' method of the Md5Checker class
 
@@ -377,6 +478,208 @@ class TestMd5CheckerVerifyMd5sms(unittest.TestCase):
         # Check no files were missed
         self.assertEqual(len(files),0)
 
+    def test_verify_md5sums_using_threads(self):
+        """Md5Checker.verify_md5sums checks 'md5sum'-format file using threads
+
+        """
+        # Create MD5sum 'file' with one bad checksum
+        files = self.example_dir.filelist(full_path=True)
+        md5sums = []
+        for f in files:
+            md5sums.append("%s  %s" % (md5sum(f),f))
+        md5sums[0] = "%s  %s" % ('0'*32,files[0])
+        md5sums = '\n'.join(md5sums)
+        fp = cStringIO.StringIO(md5sums)
+        # Run verification
+        results = list(Md5Checker.verify_md5sums(fp=fp,nthreads=4))
+        self.assertEqual([f for f,status in results],files)
+        self.assertEqual(results[0][1],Md5Checker.MD5_FAILED)
+        for f,status in results[1:]:
+            self.assertEqual(status,Md5Checker.MD5_OK)
+
+    def test_verify_md5sums_ignores_comments(self):
+        """Md5Checker.verify_md5sums ignores comment lines
+
+        """
+        # Create manifest-style 'file' with stat lines
+        md5sums = []
+        for f in self.example_dir.filelist(full_path=True):
+            md5sums.append("#stat: 1 2 3")
+            md5sums.append("%s  %s" % (md5sum(f),f))
+        md5sums = '\n'.join(md5sums)
+        fp = cStringIO.StringIO(md5sums)
+        # Run verification
+        files = self.example_dir.filelist(full_path=True)
+        results = list(Md5Checker.verify_md5sums(fp=fp))
+        self.assertEqual([f for f,status in results],files)
+        for f,status in results:
+            self.assertEqual(status,Md5Checker.MD5_OK)
+
+class TestMd5CheckerComputeManifest(unittest.TestCase):
+    """Tests for the 'compute_manifest' method of the Md5Checker class
+
+    """
+    def setUp(self):
+        self.example_dir = ExampleDirLanguages()
+        self.example_dir.create_directory()
+
+    def tearDown(self):
+        self.example_dir.delete_directory()
+
+    def test_compute_manifest(self):
+        """Md5Checker.compute_manifest returns md5sums and stat information
+
+        """
+        files = self.example_dir.filelist(include_links=True,full_path=False)
+        for f,md5,stat,hashed in Md5Checker.compute_manifest(
+                self.example_dir.dirn):
+            self.assertTrue(f in files)
+            self.assertEqual(md5,self.example_dir.checksum_for_file(f))
+            self.assertEqual(stat,
+                             file_stat(os.path.join(self.example_dir.dirn,f)))
+            self.assertTrue(hashed)
+
+    def test_compute_manifest_skips_unchanged_files(self):
+        """Md5Checker.compute_manifest reuses md5sums for unchanged files
+
+        """
+        dirn = self.example_dir.dirn
+        # Previous manifest with dummy checksums for two files, one
+        # of which has been modified since
+        previous = Md5Manifest()
+        previous.add("hello",'0'*32,file_stat(os.path.join(dirn,"hello")))
+        previous.add("goodbye",'0'*32,(1,2,3))
+        for f,md5,stat,hashed in Md5Checker.compute_manifest(
+                dirn,previous=previous,nthreads=2):
+            if f == "hello":
+                self.assertEqual(md5,'0'*32)
+                self.assertFalse(hashed)
+            else:
+                self.assertEqual(md5,self.example_dir.checksum_for_file(f))
+                self.assertTrue(hashed)
+
+class TestMd5CheckerVerifyManifest(unittest.TestCase):
+    """Tests for the 'verify_manifest' method of the Md5Checker class
+
+    """
+    def setUp(self):
+        self.example_dir = ExampleDirLanguages()
+        self.example_dir.create_directory()
+        self.files = self.example_dir.filelist(full_path=True)
+
+    def tearDown(self):
+        self.example_dir.delete_directory()
+
+    def test_verify_manifest_without_stat_information(self):
+        """Md5Checker.verify_manifest rehashes files without stat information
+
+        """
+        manifest = Md5Manifest()
+        for f in self.files:
+            manifest.add(f,md5sum(f))
+        results = list(Md5Checker.verify_manifest(manifest))
+        self.assertEqual([r[0] for r in results],self.files)
+        for f,status,hashed in results:
+            self.assertEqual(status,Md5Checker.MD5_OK)
+            self.assertTrue(hashed)
+            # Stat information should have been updated
+            self.assertEqual(manifest.stat(f),file_stat(f))
+
+    def test_verify_manifest_skips_unchanged_files(self):
+        """Md5Checker.verify_manifest skips unchanged files
+
+        """
+        manifest = Md5Manifest()
+        for f in self.files:
+            # Dummy checksums which would fail if rehashed
+            manifest.add(f,'0'*32,file_stat(f))
+        for f,status,hashed in Md5Checker.verify_manifest(manifest,
+                                                          nthreads=2):
+            self.assertEqual(status,Md5Checker.MD5_OK)
+            self.assertFalse(hashed)
+
+    def test_verify_manifest_modified_and_missing_files(self):
+        """Md5Checker.verify_manifest handles modified and missing files
+
+        """
+        manifest = Md5Manifest()
+        for f in self.files:
+            manifest.add(f,md5sum(f),file_stat(f))
+        manifest.add(os.path.join(self.example_dir.dirn,"missing"),'0'*32)
+        # Modify one of the files (also changes link 'hi')
+        self.example_dir.add_file("hello","Hello again!")
+        for f,status,hashed in Md5Checker.verify_manifest(manifest):
+            if os.path.basename(f) in ("hello","hi"):
+                self.assertEqual(status,Md5Checker.MD5_FAILED)
+                self.assertTrue(hashed)
+            elif os.path.basename(f) == "missing":
+                self.assertEqual(status,Md5Checker.MISSING_TARGET)
+                self.assertFalse(hashed)
+            else:
+                self.assertEqual(status,Md5Checker.MD5_OK)
+                self.assertFalse(hashed)
+
+class TestMd5Manifest(unittest.TestCase):
+    """Tests for the Md5Manifest class
+
+    """
+    def test_read_md5sum_file(self):
+        """Md5Manifest reads plain md5sum output
+        """
+        m = Md5Manifest(fp=cStringIO.StringIO(
+            "08a6facee51e5435b9ef3744bd4dd5dc  test.txt\n"
+            "0b26e313ed4a7ca6904b0e9369e5b957  sub dir/test 2.txt\n"))
+        self.assertEqual(len(m),2)
+        self.assertEqual(list(m),
+                         [('test.txt','08a6facee51e5435b9ef3744bd4dd5dc',None),
+                          ('sub dir/test 2.txt',
+                           '0b26e313ed4a7ca6904b0e9369e5b957',None)])
+
+    def test_read_manifest_file(self):
+        """Md5Manifest reads manifest with stat lines
+        """
+        m = Md5Manifest(fp=cStringIO.StringIO(
+            "#stat: 123 1520934129123456000 5382617\n"
+            "08a6facee51e5435b9ef3744bd4dd5dc  test.txt\n"
+            "0b26e313ed4a7ca6904b0e9369e5b957  test2.txt\n"))
+        self.assertTrue('test.txt' in m)
+        self.assertEqual(m.chksum('test.txt'),
+                         '08a6facee51e5435b9ef3744bd4dd5dc')
+        self.assertEqual(m.stat('test.txt'),(123,1520934129123456000,5382617))
+        self.assertEqual(m.stat('test2.txt'),None)
+
+    def test_read_bad_stat_line(self):
+        """Md5Manifest raises exception for bad stat line
+        """
+        self.assertRaises(IndexError,Md5Manifest,
+                          fp=cStringIO.StringIO(
+                              "#stat: 123 abc\n"
+                              "08a6facee51e5435b9ef3744bd4dd5dc  test.txt\n"))
+
+    def test_write_manifest(self):
+        """Md5Manifest writes manifest file which can be read back
+        """
+        m = Md5Manifest()
+        m.add('test.txt','08a6facee51e5435b9ef3744bd4dd5dc',
+              (123,1520934129123456000,5382617))
+        m.add('test2.txt','0b26e313ed4a7ca6904b0e9369e5b957')
+        m.set_stat('test2.txt',(456,1520934129000000000,5382618))
+        fp = cStringIO.StringIO()
+        m.write(fp=fp)
+        self.assertEqual(fp.getvalue(),
+                         "#stat: 123 1520934129123456000 5382617\n"
+                         "08a6facee51e5435b9ef3744bd4dd5dc  test.txt\n"
+                         "#stat: 456 1520934129000000000 5382618\n"
+                         "0b26e313ed4a7ca6904b0e9369e5b957  test2.txt\n")
+        tmpdir = tempfile.mkdtemp()
+        try:
+            manifest_file = os.path.join(tmpdir,"checksums")
+            m.write(manifest_file)
+            self.assertEqual(list(Md5Manifest(manifest_file)),list(m))
+            self.assertEqual(os.listdir(tmpdir),["checksums"])
+        finally:
+            shutil.rmtree(tmpdir)
+
 class TestMd5CheckReporter(unittest.TestCase):
     """Test the Md5CheckReporter class
 
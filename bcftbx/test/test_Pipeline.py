@@ -6,10 +6,14 @@ import unittest
 import tempfile
 import shutil
 import time
+import json
 import bcftbx.utils
 from bcftbx.JobRunner import SimpleJobRunner
 from bcftbx.JobRunner import GEJobRunner
+from bcftbx.JobRunner import LocalPoolJobRunner
+from bcftbx.mockGE import setup_mock_GE
 from bcftbx.Pipeline import Job
+from bcftbx.Pipeline import PipelineRunner
 from bcftbx.Pipeline import GetSolidDataFiles
 from bcftbx.Pipeline import GetSolidPairedEndFiles
 from bcftbx.Pipeline import GetFastqFiles
@@ -239,6 +243,508 @@ class TestJobWithGEJobRunner(unittest.TestCase):
         self.assertFalse(job.errorState())
         self.assertEqual(job.status(),"Finished")
 
+class CountingJobRunner(SimpleJobRunner):
+    """SimpleJobRunner which counts calls to 'list' and 'isRunning'
+    """
+    def __init__(self,*args,**kws):
+        SimpleJobRunner.__init__(self,*args,**kws)
+        self.nlist = 0
+        self.nisrunning = 0
+    def list(self):
+        self.nlist += 1
+        return SimpleJobRunner.list(self)
+    def isRunning(self,job_id):
+        self.nisrunning += 1
+        return SimpleJobRunner.isRunning(self,job_id)
+
+class TestPipelineRunner(unittest.TestCase):
+    """Unit tests for the PipelineRunner class
+
+    """
+    def setUp(self):
+        # Create a temporary directory to work in
+        self.working_dir = tempfile.mkdtemp()
+        self.log_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.working_dir)
+        shutil.rmtree(self.log_dir)
+
+    def test_pipelinerunner_run_jobs(self):
+        """PipelineRunner runs queued jobs and invokes handlers
+        """
+        completed_jobs = []
+        completed_groups = {}
+        def group_completed(group,jobs):
+            completed_groups[group] = [job.label for job in jobs]
+        pipeline = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir),
+                                  max_concurrent_jobs=3,
+                                  poll_interval=0.5,
+                                  min_poll_interval=0.05,
+                                  jobCompletionHandler=
+                                  lambda job: completed_jobs.append(job.label),
+                                  groupCompletionHandler=group_completed)
+        for i in xrange(4):
+            pipeline.queueJob(self.working_dir,"sleep",("0.1",),
+                              label="a%d" % i,group="group_a")
+        for i in xrange(3):
+            pipeline.queueJob(self.working_dir,"sleep",("0.2",),
+                              label="b%d" % i,group="group_b")
+        pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="c")
+        self.assertEqual(pipeline.nWaiting(),8)
+        pipeline.run()
+        self.assertEqual(pipeline.nWaiting(),0)
+        self.assertEqual(pipeline.nRunning(),0)
+        self.assertEqual(pipeline.nCompleted(),8)
+        self.assertEqual(sorted(completed_jobs),
+                         ["a0","a1","a2","a3","b0","b1","b2","c"])
+        self.assertEqual(sorted(completed_groups.keys()),
+                         ["group_a","group_b"])
+        self.assertEqual(sorted(completed_groups["group_a"]),
+                         ["a0","a1","a2","a3"])
+        self.assertEqual(sorted(completed_groups["group_b"]),
+                         ["b0","b1","b2"])
+        for job in pipeline.completed:
+            self.assertEqual(job.exit_status,0)
+
+    def test_pipelinerunner_non_blocking(self):
+        """PipelineRunner runs jobs in non-blocking mode
+        """
+        pipeline = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir),
+                                  max_concurrent_jobs=2)
+        for i in xrange(3):
+            pipeline.queueJob(self.working_dir,"sleep",("0.1",),
+                              label="a%d" % i)
+        pipeline.run(blocking=False)
+        self.assertEqual(pipeline.nRunning(),2)
+        self.assertEqual(pipeline.nWaiting(),1)
+        ntries = 0
+        while pipeline.isRunning() and ntries < 100:
+            ntries += 1
+            time.sleep(0.1)
+        self.assertFalse(pipeline.isRunning())
+        self.assertEqual(pipeline.nCompleted(),3)
+
+    def test_pipelinerunner_single_list_call_per_update(self):
+        """PipelineRunner queries runner once per update for running jobs
+        """
+        runner = CountingJobRunner(log_dir=self.log_dir)
+        pipeline = PipelineRunner(runner,max_concurrent_jobs=4)
+        for i in xrange(4):
+            pipeline.queueJob(self.working_dir,"sleep",("0.5",),
+                              label="a%d" % i)
+        pipeline.run(blocking=False)
+        self.assertEqual(pipeline.nRunning(),4)
+        runner.nlist = 0
+        runner.nisrunning = 0
+        pipeline.update()
+        self.assertEqual(runner.nlist,1)
+        self.assertEqual(runner.nisrunning,0)
+        ntries = 0
+        while pipeline.isRunning() and ntries < 100:
+            ntries += 1
+            time.sleep(0.1)
+        self.assertEqual(pipeline.nCompleted(),4)
+
+    def test_pipelinerunner_adaptive_poll_interval(self):
+        """PipelineRunner doesn't wait for full poll interval between jobs
+        """
+        pipeline = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir),
+                                  max_concurrent_jobs=1,
+                                  poll_interval=30,
+                                  min_poll_interval=0.1)
+        for i in xrange(3):
+            pipeline.queueJob(self.working_dir,"sleep",("0.2",),
+                              label="a%d" % i)
+        start_time = time.time()
+        pipeline.run()
+        self.assertEqual(pipeline.nCompleted(),3)
+        self.assertTrue((time.time() - start_time) < 10.0)
+
+    def test_pipelinerunner_starts_successors_on_completion(self):
+        """PipelineRunner starts dependent jobs as soon as parents finish
+        """
+        pipeline = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir),
+                                  max_concurrent_jobs=1,
+                                  poll_interval=60,
+                                  min_poll_interval=30)
+        a = pipeline.queueJob(self.working_dir,"sleep",("0.2",),label="a")
+        b = pipeline.queueJob(self.working_dir,"sleep",("0.2",),label="b",
+                              depends_on=[a])
+        c = pipeline.queueJob(self.working_dir,"sleep",("0.2",),label="c")
+        start_time = time.time()
+        pipeline.run()
+        self.assertEqual(pipeline.nCompleted(),3)
+        self.assertTrue((time.time() - start_time) < 10.0)
+        self.assertTrue(b.start_time >= a.end_time)
+
+    def test_pipelinerunner_background_handlers(self):
+        """PipelineRunner runs completion handlers in the background
+        """
+        handler_times = {}
+        def slow_handler(job):
+            time.sleep(0.5)
+            handler_times[job.label] = time.time()
+        completed_groups = []
+        pipeline = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir),
+                                  max_concurrent_jobs=1,
+                                  poll_interval=0.5,
+                                  min_poll_interval=0.05,
+                                  jobCompletionHandler=slow_handler,
+                                  groupCompletionHandler=
+                                  lambda group,jobs: completed_groups.append(
+                                      (group,len(jobs),len(handler_times))),
+                                  background_handlers=True)
+        a = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="a",
+                              group="group")
+        b = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="b",
+                              group="group")
+        pipeline.run()
+        self.assertFalse(pipeline.isRunning())
+        # All handlers finished before 'run' returned, in order
+        self.assertEqual(sorted(handler_times.keys()),["a","b"])
+        self.assertEqual(completed_groups,[("group",2,2)])
+        # Second job didn't wait for handler of the first
+        self.assertTrue(b.start_time < handler_times["a"])
+
+    def test_pipelinerunner_resume_from_journal(self):
+        """PipelineRunner doesn't rerun jobs which completed in previous run
+        """
+        journal = os.path.join(self.working_dir,"pipeline.journal")
+        def make_pipeline(completed_jobs):
+            pipeline = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir),
+                                      poll_interval=0.5,
+                                      min_poll_interval=0.05,
+                                      jobCompletionHandler=
+                                      lambda job: completed_jobs.append(
+                                          job.label),
+                                      journal=journal)
+            a = pipeline.queueJob(self.working_dir,"/bin/bash",
+                                  ("-c","echo a >> a.out"),label="a",
+                                  outputs=("a.out",))
+            b = pipeline.queueJob(self.working_dir,"/bin/bash",
+                                  ("-c","test -f ok"),label="b",
+                                  depends_on=[a])
+            c = pipeline.queueJob(self.working_dir,"/bin/bash",
+                                  ("-c","echo c >> c.out"),label="c",
+                                  depends_on=[b])
+            return (pipeline,a,b,c)
+        # First run: job 'b' fails so 'c' is skipped
+        completed_jobs = []
+        pipeline,a,b,c = make_pipeline(completed_jobs)
+        pipeline.run()
+        self.assertEqual(completed_jobs,["a","b"])
+        self.assertFalse(b.isSuccessful())
+        self.assertTrue(c.skipped)
+        self.assertTrue(os.path.exists(journal))
+        # Second run: 'a' isn't rerun
+        open(os.path.join(self.working_dir,"ok"),'w').close()
+        completed_jobs = []
+        pipeline,a,b,c = make_pipeline(completed_jobs)
+        pipeline.run(resume=True)
+        self.assertEqual(completed_jobs,["b","c"])
+        self.assertTrue(a.restored)
+        self.assertTrue(a.isSuccessful())
+        self.assertFalse(b.restored)
+        self.assertEqual(pipeline.nCompleted(),3)
+        self.assertEqual(open(os.path.join(self.working_dir,
+                                           "a.out")).read(),"a\n")
+        # Third run: nothing to do
+        completed_jobs = []
+        pipeline,a,b,c = make_pipeline(completed_jobs)
+        pipeline.run(resume=True)
+        self.assertEqual(completed_jobs,[])
+        self.assertEqual(pipeline.nCompleted(),3)
+        # Fourth run: output from 'a' removed so it's rerun, along
+        # with the jobs that depend on it
+        os.remove(os.path.join(self.working_dir,"a.out"))
+        completed_jobs = []
+        pipeline,a,b,c = make_pipeline(completed_jobs)
+        pipeline.run(resume=True)
+        self.assertEqual(completed_jobs,["a","b","c"])
+        self.assertFalse(a.restored)
+        self.assertFalse(c.restored)
+
+    def test_pipelinerunner_resume_ignores_earlier_runs(self):
+        """PipelineRunner doesn't resume from journal of an earlier run
+        """
+        journal = os.path.join(self.working_dir,"pipeline.journal")
+        class CrashingRunner(SimpleJobRunner):
+            def run(self,*args,**kws):
+                raise Exception("Crashed")
+        def make_pipeline(runner,completed_jobs):
+            pipeline = PipelineRunner(runner,
+                                      poll_interval=0.5,
+                                      min_poll_interval=0.05,
+                                      jobCompletionHandler=
+                                      lambda job: completed_jobs.append(
+                                          job.label),
+                                      journal=journal)
+            a = pipeline.queueJob(self.working_dir,"/bin/bash",
+                                  ("-c","echo a >> a.out"),label="a")
+            return (pipeline,a)
+        # First run completes
+        completed_jobs = []
+        pipeline,a = make_pipeline(SimpleJobRunner(log_dir=self.log_dir),
+                                   completed_jobs)
+        pipeline.run()
+        self.assertEqual(completed_jobs,["a"])
+        # Second (new) run dies before starting any jobs
+        completed_jobs = []
+        pipeline,a = make_pipeline(CrashingRunner(log_dir=self.log_dir),
+                                   completed_jobs)
+        self.assertRaises(Exception,pipeline.run)
+        self.assertEqual(completed_jobs,[])
+        # Resuming the second run doesn't restore the job from
+        # the first run
+        completed_jobs = []
+        pipeline,a = make_pipeline(SimpleJobRunner(log_dir=self.log_dir),
+                                   completed_jobs)
+        pipeline.run(resume=True)
+        self.assertEqual(completed_jobs,["a"])
+        self.assertFalse(a.restored)
+        self.assertEqual(open(os.path.join(self.working_dir,
+                                           "a.out")).read(),"a\na\n")
+
+    def test_pipelinerunner_job_resources(self):
+        """PipelineRunner passes job resource requests to the runner
+        """
+        pipeline = PipelineRunner(LocalPoolJobRunner(cpus=2,
+                                                     log_dir=self.log_dir),
+                                  max_concurrent_jobs=4,
+                                  poll_interval=0.5,
+                                  min_poll_interval=0.05)
+        events = os.path.join(self.working_dir,"events")
+        for i in xrange(3):
+            pipeline.queueJob(self.working_dir,"/bin/bash",
+                              ("-c","echo start >>%s; sleep 0.2; "
+                               "echo end >>%s" % (events,events)),
+                              label="a%d" % i,nslots=2)
+        pipeline.run()
+        self.assertEqual(pipeline.nCompleted(),3)
+        for job in pipeline.completed:
+            self.assertEqual(job.nslots,2)
+            self.assertEqual(job.exit_status,0)
+        # Each job needs all the slots, so they can't overlap
+        self.assertEqual(open(events).read().split(),
+                         ["start","end"]*3)
+
+    def test_pipelinerunner_profile(self):
+        """PipelineRunner reports resource usage profile
+        """
+        pipeline = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir),
+                                  max_concurrent_jobs=2,
+                                  poll_interval=0.5,
+                                  min_poll_interval=0.05)
+        a = pipeline.queueJob(self.working_dir,"sleep",("0.2",),label="a",
+                              group="sample1")
+        b = pipeline.queueJob(self.working_dir,"sleep",("0.3",),label="b",
+                              group="sample1",depends_on=[a])
+        c = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="c",
+                              group="sample1")
+        d = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="d")
+        pipeline.run()
+        # Per-job resource usage
+        for job in (a,b,c,d):
+            self.assertNotEqual(job.resource_usage,None)
+        profile = pipeline.profile()
+        self.assertEqual(sorted([j['label'] for j in profile['jobs']]),
+                         ['a','b','c','d'])
+        for job in profile['jobs']:
+            self.assertEqual(job['exit_status'],0)
+            self.assertTrue(job['wall_time'] > 0.0)
+            self.assertTrue(job['max_rss'] > 0)
+        # Group summaries
+        self.assertEqual([g['group'] for g in profile['groups']],
+                         ['sample1',None])
+        summary = profile['groups'][0]
+        self.assertEqual(summary['njobs'],3)
+        self.assertEqual(summary['nfailed'],0)
+        self.assertEqual(summary['critical_path'],["sleep.a","sleep.b"])
+        self.assertTrue(summary['critical_path_time'] >= 0.5)
+        self.assertTrue(summary['makespan'] >= 0.5)
+        self.assertTrue(summary['utilisation'] > 0.0)
+        self.assertEqual(profile['summary']['njobs'],4)
+        # Report includes the summary
+        self.assertTrue("sample1\t3 jobs (0 failed)" in pipeline.report())
+        # Write profile as JSON and TSV
+        json_file = os.path.join(self.working_dir,"profile.json")
+        pipeline.write_profile(json_file)
+        self.assertEqual(json.load(open(json_file))['summary']['njobs'],4)
+        tsv_file = os.path.join(self.working_dir,"profile.tsv")
+        pipeline.write_profile(tsv_file)
+        lines = open(tsv_file).read().strip().split('\n')
+        self.assertTrue(lines[0].startswith("#name\tlabel\tgroup"))
+        self.assertEqual(len(lines),5)
+
+    def test_pipelinerunner_dependencies(self):
+        """PipelineRunner starts jobs once their dependencies complete
+        """
+        pipeline = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir),
+                                  max_concurrent_jobs=2,
+                                  poll_interval=0.5,
+                                  min_poll_interval=0.05)
+        a1 = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="a1")
+        a2 = pipeline.queueJob(self.working_dir,"sleep",("0.5",),label="a2")
+        b1 = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="b1",
+                               depends_on=[a1])
+        c = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="c",
+                              depends_on=[a2,b1])
+        self.assertEqual(pipeline.nWaiting(),4)
+        pipeline.run()
+        self.assertEqual(pipeline.nWaiting(),0)
+        self.assertEqual(pipeline.nCompleted(),4)
+        self.assertEqual(pipeline.nSkipped(),0)
+        # Dependent jobs start only after their parents finish
+        self.assertTrue(b1.start_time >= a1.end_time)
+        self.assertTrue(c.start_time >= a2.end_time)
+        self.assertTrue(c.start_time >= b1.end_time)
+        # b1 doesn't wait for the unrelated job a2
+        self.assertTrue(b1.start_time < a2.end_time)
+        for job in pipeline.completed:
+            self.assertTrue(job.isSuccessful())
+
+    def test_pipelinerunner_dependency_from_other_pipeline(self):
+        """PipelineRunner rejects dependencies on jobs from another pipeline
+        """
+        other = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir))
+        a = other.queueJob(self.working_dir,"sleep",("0.1",),label="a")
+        pipeline = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir),
+                                  poll_interval=0.5,
+                                  min_poll_interval=0.05)
+        self.assertRaises(Exception,
+                          pipeline.queueJob,
+                          self.working_dir,"sleep",("0.1",),label="b",
+                          group="sample1",depends_on=[a])
+        # Nothing was added to the pipeline
+        self.assertEqual(pipeline.nWaiting(),0)
+        self.assertEqual(pipeline.groups,[])
+        pipeline.run()
+        self.assertEqual(pipeline.nCompleted(),0)
+
+    def test_pipelinerunner_failed_dependency_skips_descendants(self):
+        """PipelineRunner skips jobs which depend on a failed job
+        """
+        completed_groups = {}
+        def group_completed(group,jobs):
+            completed_groups[group] = sorted([job.label for job in jobs])
+        pipeline = PipelineRunner(SimpleJobRunner(log_dir=self.log_dir),
+                                  max_concurrent_jobs=2,
+                                  poll_interval=0.5,
+                                  min_poll_interval=0.05,
+                                  groupCompletionHandler=group_completed)
+        a = pipeline.queueJob(self.working_dir,"false",(),label="a",
+                              group="sample1")
+        b = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="b",
+                              group="sample1",depends_on=[a])
+        c = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="c",
+                              group="sample1",depends_on=[b])
+        d = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="d",
+                              group="sample2")
+        e = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="e",
+                              group="sample2",depends_on=[d])
+        pipeline.run()
+        self.assertEqual(pipeline.nWaiting(),0)
+        self.assertEqual(pipeline.nRunning(),0)
+        self.assertEqual(pipeline.nCompleted(),3)
+        self.assertEqual(pipeline.nSkipped(),2)
+        self.assertFalse(a.isSuccessful())
+        self.assertTrue(b.skipped)
+        self.assertTrue(c.skipped)
+        self.assertEqual(b.status(),"Skipped")
+        self.assertEqual(b.job_id,None)
+        self.assertTrue(e.isSuccessful())
+        self.assertEqual(completed_groups,{ "sample1": ["a","b","c"],
+                                            "sample2": ["d","e"] })
+        # Jobs queued after a failure are skipped immediately
+        f = pipeline.queueJob(self.working_dir,"sleep",("0.1",),label="f",
+                              depends_on=[c])
+        self.assertTrue(f.skipped)
+        self.assertEqual(pipeline.nWaiting(),0)
+
+class TestPipelineRunnerWithMockGE(unittest.TestCase):
+    """Unit tests for the PipelineRunner class using mock Grid Engine
+
+    """
+    def setUp(self):
+        # Set up mockGE utilities
+        self.database_dir = tempfile.mkdtemp(dir=os.getcwd())
+        self.bin_dir = tempfile.mkdtemp(dir=os.getcwd())
+        self.old_path = os.environ['PATH']
+        os.environ['PATH'] = self.bin_dir + os.pathsep + self.old_path
+        setup_mock_GE(bindir=self.bin_dir,
+                      database_dir=self.database_dir,
+                      qsub_delay=0.4,
+                      qacct_delay=15.0,
+                      debug=False)
+        # Create a temporary directory to work in
+        self.working_dir = tempfile.mkdtemp(dir=os.getcwd())
+
+    def tearDown(self):
+        os.environ['PATH'] = self.old_path
+        shutil.rmtree(self.database_dir)
+        shutil.rmtree(self.bin_dir)
+        shutil.rmtree(self.working_dir)
+
+    def test_pipelinerunner_submits_array_job(self):
+        """PipelineRunner submits jobs using same script as array job
+        """
+        pipeline = PipelineRunner(GEJobRunner(),
+                                  max_concurrent_jobs=4,
+                                  poll_interval=0.5,
+                                  min_poll_interval=0.1)
+        for i in xrange(3):
+            pipeline.queueJob(self.working_dir,"/bin/bash",
+                              ("-c","exit %d" % i),label="a%d" % i)
+        pipeline.queueJob(self.working_dir,"echo",("hello",),label="b")
+        pipeline.run(blocking=False)
+        # First three jobs are tasks in the same array job
+        job_ids = sorted(pipeline.running.keys())
+        self.assertEqual(len(job_ids),4)
+        array_job_ids = [job_id for job_id in job_ids if '.' in job_id]
+        self.assertEqual(len(array_job_ids),3)
+        self.assertEqual(len(set([job_id.split('.')[0]
+                                  for job_id in array_job_ids])),1)
+        # Wait for the pipeline to finish
+        ntries = 0
+        while pipeline.isRunning() and ntries < 100:
+            ntries += 1
+            time.sleep(0.1)
+        self.assertFalse(pipeline.isRunning())
+        self.assertEqual(pipeline.nCompleted(),4)
+        exit_status = dict([(job.label,job.exit_status)
+                            for job in pipeline.completed])
+        self.assertEqual(exit_status,{ 'a0': 0, 'a1': 1, 'a2': 2, 'b': 0 })
+
+    def test_pipelinerunner_resume_attaches_to_running_jobs(self):
+        """PipelineRunner re-attaches to GE jobs from previous run
+        """
+        journal = os.path.join(self.working_dir,"pipeline.journal")
+        # Start the job in the first pipeline
+        pipeline1 = PipelineRunner(GEJobRunner(),
+                                   poll_interval=0.5,
+                                   min_poll_interval=0.1,
+                                   journal=journal)
+        pipeline1.queueJob(self.working_dir,"sleep",("2",),label="a")
+        pipeline1.run(blocking=False)
+        job_id = pipeline1.running.keys()[0]
+        # Resume with a new pipeline and runner
+        pipeline2 = PipelineRunner(GEJobRunner(),
+                                   poll_interval=0.5,
+                                   min_poll_interval=0.1,
+                                   journal=journal)
+        job = pipeline2.queueJob(self.working_dir,"sleep",("2",),label="a")
+        pipeline2.run(blocking=False,resume=True)
+        self.assertEqual(pipeline2.running.keys(),[job_id])
+        ntries = 0
+        while pipeline2.isRunning() and ntries < 200:
+            ntries += 1
+            time.sleep(0.1)
+        self.assertFalse(pipeline2.isRunning())
+        self.assertEqual(job.job_id,job_id)
+        self.assertEqual(job.exit_status,0)
+        self.assertFalse(job.restored)
+
 class TestGetSolidDataFiles(unittest.TestCase):
     """Unit tests for GetSolidDataFiles function
 
@@ -205,3 +205,89 @@ AAF#FJJJJJJJJJJJ
                            for i in (0,)]
         for r1,r2 in zip(reference_reads,fastq_reads):
             self.assertEqual(r1,r2)
+
+class TestGetreadsRandomSampleFunction(unittest.TestCase):
+    """Tests for the 'getreads_random_sample' function
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        # Make example R1/R2 Fastqs with 100 reads each
+        self.fastq_r1 = os.path.join(self.wd,"example_R1.fastq")
+        self.fastq_r2 = os.path.join(self.wd,"example_R2.fastq.gz")
+        self.reads_r1 = []
+        self.reads_r2 = []
+        with open(self.fastq_r1,'w') as fp1:
+            with gzip.open(self.fastq_r2,'w') as fp2:
+                for i in xrange(100):
+                    r1 = ["@K00311:43:HL3LWBBXX:8:1101:%d:1121 1:N:0:CNATGT"
+                          % i,"GCCNGACAGCAGAAAT","+","AAF#FJJJJJJJJJJJ"]
+                    r2 = ["@K00311:43:HL3LWBBXX:8:1101:%d:1121 2:N:0:CNATGT"
+                          % i,"GGGNGTCATTGATCAT","+","AAF#FJJJJJJJJJJJ"]
+                    fp1.write('\n'.join(r1)+'\n')
+                    fp2.write('\n'.join(r2)+'\n')
+                    self.reads_r1.append(r1)
+                    self.reads_r2.append(r2)
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+    def test_getreads_random_sample(self):
+        """getreads_random_sample: get random sample from Fastq file
+        """
+        reads = [r for r in getreads_random_sample((self.fastq_r1,),10)]
+        self.assertEqual(len(reads),10)
+        indices = []
+        for r in reads:
+            self.assertEqual(len(r),1)
+            indices.append(self.reads_r1.index(r[0]))
+        # Reads should be unique and in file order
+        self.assertEqual(indices,sorted(set(indices)))
+    def test_getreads_random_sample_pairs(self):
+        """getreads_random_sample: R1/R2 samples are kept in sync
+        """
+        reads = [r for r in getreads_random_sample((self.fastq_r1,
+                                                    self.fastq_r2),10)]
+        self.assertEqual(len(reads),10)
+        for r1,r2 in reads:
+            self.assertEqual(self.reads_r1.index(r1),
+                             self.reads_r2.index(r2))
+    def test_getreads_random_sample_seed(self):
+        """getreads_random_sample: same seed gives the same sample
+        """
+        sample1 = [r for r in getreads_random_sample((self.fastq_r1,),10,
+                                                     seed=12345)]
+        sample2 = [r for r in getreads_random_sample((self.fastq_r1,),10,
+                                                     seed=12345)]
+        sample3 = [r for r in getreads_random_sample((self.fastq_r1,),10,
+                                                     seed=54321)]
+        self.assertEqual(sample1,sample2)
+        self.assertNotEqual(sample1,sample3)
+    def test_getreads_random_sample_more_than_available(self):
+        """getreads_random_sample: return all reads if sample is too large
+        """
+        reads = [r[0] for r in getreads_random_sample((self.fastq_r1,),
+                                                      1000)]
+        self.assertEqual(reads,self.reads_r1)
+    def test_getreads_random_sample_zero(self):
+        """getreads_random_sample: sample of zero reads
+        """
+        reads = [r for r in getreads_random_sample((self.fastq_r1,),0)]
+        self.assertEqual(reads,[])
+    def test_getreads_random_sample_is_uniform(self):
+        """getreads_random_sample: all reads are equally likely to be sampled
+        """
+        counts = [0]*100
+        for seed in xrange(500):
+            for r in getreads_random_sample((self.fastq_r1,),10,seed=seed):
+                counts[self.reads_r1.index(r[0])] += 1
+        # Each read is expected to be sampled 50 times
+        self.assertTrue(min(counts) > 20)
+        self.assertTrue(max(counts) < 80)
+        self.assertTrue(abs(sum(counts[:50])-sum(counts[50:])) < 250)
+    def test_getreads_random_sample_inconsistent_reads(self):
+        """getreads_random_sample: raise exception for inconsistent files
+        """
+        fastq = os.path.join(self.wd,"short.fastq")
+        with open(fastq,'w') as fp:
+            fp.write('\n'.join(self.reads_r1[0])+'\n')
+        self.assertRaises(Exception,
+                          list,
+                          getreads_random_sample((self.fastq_r1,fastq),10))
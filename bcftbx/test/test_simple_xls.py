@@ -6,6 +6,8 @@ import unittest
 import itertools
 import os
 import tempfile
+import shutil
+import zipfile
 
 class TestXLSWorkBook(unittest.TestCase):
     """
@@ -65,6 +67,84 @@ class TestXLSWorkBook(unittest.TestCase):
         wb.save_as_xlsx(xlsx_out)
         # Check file exists
         self.assertTrue(os.path.isfile(xlsx_out))
+    def test_work_book_save_as_xlsx_constant_memory(self):
+        wb = XLSWorkBook("Test")
+        self.wd = tempfile.mkdtemp()
+        # Add content
+        ws = wb.add_work_sheet('test','Test')
+        self._add_test_worksheet(ws)
+        # Save out to XLSX file
+        xlsx_out = os.path.join(self.wd,'test.xlsx')
+        wb.save_as_xlsx(xlsx_out,constant_memory=True)
+        # Check file exists
+        self.assertTrue(os.path.isfile(xlsx_out))
+
+class TestXLSXStreamWorkBook(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.xlsx_out = os.path.join(self.wd,'test.xlsx')
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+    def _sheet_xml(self,n=1):
+        # Return the XML for a sheet in the output file
+        return zipfile.ZipFile(self.xlsx_out).read(
+            'xl/worksheets/sheet%d.xml' % n)
+    def test_add_worksheet(self):
+        xlsx = XLSXStreamWorkBook(self.xlsx_out)
+        ws = xlsx.add_work_sheet('wsheet1','Test #1')
+        self.assertEqual(ws,xlsx.worksheet['wsheet1'])
+        self.assertEqual(ws.title,'Test #1')
+        self.assertRaises(KeyError,xlsx.add_work_sheet,'wsheet1')
+        xlsx.close()
+        self.assertTrue(os.path.isfile(self.xlsx_out))
+    def test_append_row(self):
+        xlsx = XLSXStreamWorkBook(self.xlsx_out)
+        ws = xlsx.add_work_sheet('test')
+        self.assertEqual(ws.next_row,1)
+        self.assertEqual(ws.last_row,1)
+        self.assertEqual(ws.append_row(data=('x',1,2.5,None,'7')),1)
+        self.assertEqual(ws.append_row(text="y\t3\t4.5",
+                                       style=XLSStyle(bold=True)),2)
+        self.assertEqual(ws.next_row,3)
+        self.assertEqual(ws.last_row,2)
+        xlsx.close()
+        xml = self._sheet_xml()
+        self.assertTrue('<c r="B1"><v>1</v></c>' in xml)
+        self.assertTrue('<c r="C1"><v>2.5</v></c>' in xml)
+        self.assertFalse('<c r="D1"' in xml)
+        self.assertTrue('<c r="E1"><v>7</v></c>' in xml)
+        self.assertTrue('<c r="C2" s="1"><v>4.5</v></c>' in xml)
+    def test_append_row_with_formulae(self):
+        xlsx = XLSXStreamWorkBook(self.xlsx_out)
+        ws = xlsx.add_work_sheet('test')
+        ws.append_row(data=(1,2,'=A?+B?','=C?*2'))
+        ws.append_row(data=(3,4,'=C1+B?'))
+        xlsx.close()
+        xml = self._sheet_xml()
+        # Formulae referencing the same row have results
+        self.assertTrue('<f>A1+B1</f><v>3</v>' in xml)
+        self.assertTrue('<f>C1*2</f><v>6</v>' in xml)
+        # Formulae referencing other rows don't
+        self.assertTrue('<f>C1+B2</f><v>0</v>' in xml)
+    def test_append_row_with_circular_formulae(self):
+        xlsx = XLSXStreamWorkBook(self.xlsx_out)
+        ws = xlsx.add_work_sheet('test')
+        ws.append_row(data=(1,'=B?+1','=D?*2','=C?-A?'))
+        xlsx.close()
+        xml = self._sheet_xml()
+        self.assertTrue('<f>B1+1</f><v>%s</v>' % BAD_REF in xml)
+        self.assertTrue('<f>D1*2</f><v>%s</v>' % BAD_REF in xml)
+    def test_freeze_panes(self):
+        xlsx = XLSXStreamWorkBook(self.xlsx_out)
+        ws = xlsx.add_work_sheet('test')
+        ws.append_row(data=('Name','Value'))
+        ws.freeze_panes = 'A2'
+        ws.append_row(data=('x',1))
+        xlsx.close()
+        self.assertTrue('<pane ySplit="1" topLeftCell="A2"' in
+                        self._sheet_xml())
 
 class TestXLSWorkSheet(unittest.TestCase):
     """
@@ -392,6 +472,59 @@ class TestXLSWorkSheet(unittest.TestCase):
         self.assertEqual(ws.rows,[5,12,93])
         self.assertEqual(ws.next_column,'BA')
         self.assertEqual(ws.next_row,94)
+    def test_columns_sorted_beyond_z(self):
+        ws = self.ws
+        ws['AB1'] = "AB"
+        ws['Z1'] = "Z"
+        ws['A1'] = "A"
+        self.assertEqual(ws.columns,['A','Z','AB'])
+        self.assertEqual(ws.last_column,'AB')
+    def test_columns_and_rows_after_delete(self):
+        ws = self.ws
+        ws['B2'] = "B2"
+        ws['D7'] = "D7"
+        ws['D3'] = "D3"
+        del(ws['D7'])
+        self.assertEqual(ws.columns,['B','D'])
+        self.assertEqual(ws.rows,[2,3])
+        del(ws['D3'])
+        self.assertEqual(ws.columns,['B'])
+        self.assertEqual(ws.rows,[2])
+        self.assertEqual(ws.last_column,'B')
+        self.assertEqual(ws.last_row,2)
+        del(ws['B2'])
+        self.assertEqual(ws.columns,[])
+        self.assertEqual(ws.rows,[])
+        self.assertEqual(ws.next_column,'A')
+        self.assertEqual(ws.next_row,1)
+    def test_columns_and_rows_after_insert(self):
+        ws = self.ws
+        ws['A1'] = "A1"
+        ws['C3'] = "C3"
+        ws.insert_column('B')
+        self.assertEqual(ws.columns,['A','D'])
+        self.assertEqual(ws['D3'],"C3")
+        self.assertEqual(ws.last_column,'D')
+        ws.insert_row(2)
+        self.assertEqual(ws.rows,[1,4])
+        self.assertEqual(ws['D4'],"C3")
+        self.assertEqual(ws.last_row,4)
+    def test_iter_rows(self):
+        ws = self.ws
+        ws['A1'] = "A1"
+        ws['C1'] = 3
+        ws['B3'] = "=A1"
+        self.assertEqual(list(ws.iter_rows()),[['A1',None,3],
+                                               [None,None,None],
+                                               [None,'=A1',None]])
+        self.assertEqual(list(ws.iter_rows(start='B2',end='C3')),
+                         [[None,None],['=A1',None]])
+    def test_data(self):
+        ws = self.ws
+        self.assertEqual(ws.data,{})
+        ws['A1'] = "A1"
+        ws.append_row(data=['x','y'])
+        self.assertEqual(ws.data,{'A1':"A1",'A2':'x','B2':'y'})
     def test_render_cell(self):
         self.ws.insert_column_data(self.ws.next_column,['4.5'])
         self.assertEqual(self.ws.render_cell('A1'),'4.5')
@@ -416,6 +549,57 @@ class TestXLSWorkSheet(unittest.TestCase):
         self.assertEqual(self.ws.render_cell('A3',eval_formulae=True),'0.5')
         self.assertEqual(self.ws.render_cell('A3',eval_formulae=True,apply_format=True),
                          '50.0%')
+    def test_render_cell_formula_after_update(self):
+        ws = self.ws
+        ws.write_column('A',data=[1,2])
+        ws.write_column('B',fill='=A?*2')
+        self.assertEqual(ws.render_cell('B2',eval_formulae=True),'4')
+        ws['A2'] = 5
+        self.assertEqual(ws.render_cell('B2',eval_formulae=True),'10')
+        ws.insert_row(1,data=[7])
+        self.assertEqual(ws.render_cell('B3',eval_formulae=True),'10')
+        self.assertEqual(ws.render_cell('B2',eval_formulae=True),'2')
+        del(ws['A2'])
+        self.assertEqual(ws.render_cell('B2',eval_formulae=True),BAD_REF)
+    def test_evaluate_formulae(self):
+        ws = self.ws
+        ws.write_column('A',data=[1,2,3])
+        ws.write_column('B',fill='=A?-100')
+        ws['C1'] = '=B1+B3'
+        ws.evaluate_formulae()
+        self.assertEqual(ws.lookup_value(1,1),-99)
+        self.assertEqual(ws.lookup_value(3,1),-97)
+        self.assertEqual(ws.lookup_value(1,2),-196)
+        self.assertEqual(ws.lookup_value(2,0),2)
+        self.assertEqual(ws.lookup_value(2,2),None)
+        ws.write_row(3,data=[10])
+        self.assertEqual(ws.lookup_value(1,2),-189)
+    def test_render_cell_formula_self_reference(self):
+        ws = self.ws
+        ws['A1'] = '=A1+1'
+        ws['B1'] = '=A1*2'
+        ws['C1'] = '=C1'
+        self.assertEqual(ws.render_cell('B1',eval_formulae=True),BAD_REF)
+        self.assertEqual(ws.render_cell('A1',eval_formulae=True),BAD_REF)
+        self.assertEqual(ws.render_cell('C1',eval_formulae=True),BAD_REF)
+        self.assertEqual(ws.render_as_text(eval_formulae=True),
+                         '\t'.join([BAD_REF]*3))
+    def test_render_cell_formula_indirect_cycle(self):
+        ws = self.ws
+        ws['A1'] = '=B1+1'
+        ws['B1'] = '=C1*2'
+        ws['C1'] = '=A1-3'
+        ws['D1'] = '=C1+A1'
+        ws['E1'] = 4
+        ws['F1'] = '=E1+1'
+        ws.evaluate_formulae()
+        for idx in ('A1','B1','C1','D1'):
+            self.assertEqual(ws.render_cell(idx,eval_formulae=True),BAD_REF)
+        self.assertEqual(ws.render_cell('F1',eval_formulae=True),'5')
+        # Breaking the cycle allows the formulae to be evaluated
+        ws['C1'] = 1
+        self.assertEqual(ws.render_cell('A1',eval_formulae=True),'3')
+        self.assertEqual(ws.render_cell('D1',eval_formulae=True),'4')
 
 class TestCellIndex(unittest.TestCase):
     """
@@ -438,6 +622,17 @@ class TestCellIndex(unittest.TestCase):
         self.assertTrue(str(CellIndex('A')),'A')
         self.assertTrue(str(CellIndex('1')),'1')
 
+class TestParseCellIndex(unittest.TestCase):
+    """
+    """
+    def test_parse_cell_index(self):
+        self.assertEqual(parse_cell_index('A1'),('A',1,0))
+        self.assertEqual(parse_cell_index('ZB567'),('ZB',567,677))
+        self.assertEqual(parse_cell_index('B'),('B',None,1))
+        self.assertEqual(parse_cell_index('12'),(None,12,None))
+        self.assertEqual(parse_cell_index(12),(None,12,None))
+        self.assertEqual(parse_cell_index('!1#2'),(None,None,None))
+
 class TestColumnIndexToInteger(unittest.TestCase):
     """
     """
@@ -610,6 +805,42 @@ class TestEvalFormula(unittest.TestCase):
         self.assertEqual(eval_formula("=A1-D2",self.ws),-1.0)
         self.assertEqual(eval_formula("=A1*D2",self.ws),2.0)
         self.assertEqual(eval_formula("=A1/D2",self.ws),0.5)
+    def test_operator_precedence(self):
+        self.assertEqual(eval_formula("=A1+A2*A3",self.ws),7.0)
+        self.assertEqual(eval_formula("=C1-A2/A1-A3",self.ws),2.0)
+        self.assertEqual(eval_formula("=7/2",self.ws),3.5)
+    def test_bad_references(self):
+        self.assertEqual(eval_formula("=-5",self.ws),BAD_REF)
+        self.assertEqual(eval_formula("=A1 + A2",self.ws),BAD_REF)
+        self.assertEqual(eval_formula("=A?+1",self.ws),BAD_REF)
+        self.assertEqual(eval_formula("=A1/0",self.ws),BAD_REF)
+        self.assertEqual(eval_formula("=2*inf",self.ws),BAD_REF)
+        self.assertEqual(eval_formula("=inf*2",self.ws),"inf*2")
+
+class TestCompileFormula(unittest.TestCase):
+    """
+    """
+    def setUp(self):
+        self.values = { (1,0): 1, (2,0): 2.5, (1,1): 'x' }
+        self.lookup = lambda row,icol: self.values.get((row,icol))
+    def test_compile_formula_is_cached(self):
+        self.assertTrue(compile_formula('=A?+1') is compile_formula('=A?+1'))
+    def test_evaluate(self):
+        self.assertEqual(compile_formula('=A1+A2').evaluate(self.lookup),3.5)
+        self.assertEqual(compile_formula('=B1').evaluate(self.lookup),'x')
+        self.assertEqual(compile_formula('=B1*2').evaluate(self.lookup),
+                         BAD_REF)
+        self.assertEqual(compile_formula('=C1').evaluate(self.lookup),'')
+    def test_evaluate_with_substitutions(self):
+        self.assertEqual(compile_formula('=A?*2').evaluate(self.lookup,2,1),
+                         5.0)
+        self.assertEqual(compile_formula('=#?').evaluate(self.lookup,1,1),'x')
+        self.assertEqual(compile_formula('=?-#1').evaluate(self.lookup,2,0),
+                         1)
+    def test_evaluate_rows(self):
+        formula = compile_formula('=A?+A1')
+        self.assertEqual(formula.evaluate_rows(self.lookup,[1,2,3],1),
+                         [2,3.5,BAD_REF])
 
 class TestFormatValue(unittest.TestCase):
     """
@@ -163,6 +163,183 @@ AAF#FJJJJJJJJJJJ
         for l1,l2 in zip(self.example_text.split('\n'),lines):
             self.assertEqual(l1,l2)
 
+    def test_getlines_from_gzipped_file_with_backends(self):
+        """getlines: read lines from a gzipped file using different backends
+        """
+        # Make an example gzipped file
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        with gzip.open(example_file,'w') as fp:
+            fp.write(self.example_text)
+        # Read lines
+        for backend in ('gzip','zlib','bgzf','pipe','auto'):
+            lines = getlines(example_file,gzip_backend=backend)
+            for l1,l2 in zip(self.example_text.split('\n'),lines):
+                self.assertEqual(l1,l2)
+
+def write_bgzf_file(filen,data,blocksize=16):
+    # Helper to write data to a BGZF format file, using
+    # 'blocksize' bytes of uncompressed data per block
+    # (plus the empty EOF block)
+    import zlib
+    import struct
+    with open(filen,'wb') as fp:
+        blocks = [data[i:i+blocksize]
+                  for i in xrange(0,len(data),blocksize)]
+        for block in blocks + ['']:
+            compressor = zlib.compressobj(6,zlib.DEFLATED,-zlib.MAX_WBITS)
+            cdata = compressor.compress(block) + compressor.flush()
+            fp.write('\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff')
+            fp.write(struct.pack('<H',6))
+            fp.write('BC' + struct.pack('<HH',2,len(cdata)+25))
+            fp.write(cdata)
+            fp.write(struct.pack('<iI',zlib.crc32(block),len(block)))
+
+class TestOpenGzippedFile(unittest.TestCase):
+    """Unit tests for the open_gzipped_file function
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.example_text = ''.join(["Line %d of the example text\n" % i
+                                     for i in xrange(1000)])
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+    def test_open_gzipped_file(self):
+        """open_gzipped_file: read data using each backend
+        """
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        with gzip.open(example_file,'w') as fp:
+            fp.write(self.example_text)
+        for backend in ('gzip','zlib','bgzf','pipe','auto'):
+            fp = open_gzipped_file(example_file,backend=backend)
+            self.assertEqual(fp.read(),self.example_text)
+            fp.close()
+    def test_open_gzipped_file_multiple_members(self):
+        """open_gzipped_file: read data from multi-member gzipped file
+        """
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        with open(example_file,'wb') as fp:
+            for i in xrange(0,len(self.example_text),1000):
+                with gzip.GzipFile(fileobj=fp,mode='wb') as gz:
+                    gz.write(self.example_text[i:i+1000])
+        self.assertFalse(is_bgzf_file(example_file))
+        for backend in ('gzip','zlib','bgzf','pipe','auto'):
+            fp = open_gzipped_file(example_file,backend=backend)
+            self.assertEqual(fp.read(),self.example_text)
+            fp.close()
+    def test_open_gzipped_file_bgzf(self):
+        """open_gzipped_file: read data from BGZF file
+        """
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        write_bgzf_file(example_file,self.example_text,blocksize=1000)
+        self.assertTrue(is_bgzf_file(example_file))
+        for backend in ('gzip','zlib','bgzf','pipe','auto'):
+            fp = open_gzipped_file(example_file,backend=backend)
+            self.assertEqual(fp.read(),self.example_text)
+            fp.close()
+    def test_open_gzipped_file_readlines(self):
+        """open_gzipped_file: iterate over lines
+        """
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        write_bgzf_file(example_file,self.example_text,blocksize=100)
+        for backend in ('zlib','bgzf','pipe'):
+            fp = open_gzipped_file(example_file,backend=backend)
+            self.assertEqual([line for line in fp],
+                             self.example_text.splitlines(True))
+            fp.close()
+    def test_open_gzipped_file_unrecognised_backend(self):
+        """open_gzipped_file: raise exception for unrecognised backend
+        """
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        with gzip.open(example_file,'w') as fp:
+            fp.write(self.example_text)
+        self.assertRaises(Exception,
+                          open_gzipped_file,
+                          example_file,
+                          backend='unknown')
+
+class TestBgzfReader(unittest.TestCase):
+    """Unit tests for the BgzfReader class
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.example_text = ''.join(["Line %d of the example text\n" % i
+                                     for i in xrange(1000)])
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+    def test_bgzf_reader(self):
+        """BgzfReader: read data using multiple threads and batches
+        """
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        write_bgzf_file(example_file,self.example_text,blocksize=100)
+        reader = BgzfReader(example_file,nthreads=2,blocks_per_batch=3)
+        self.assertEqual(reader.read(),self.example_text)
+        reader.close()
+    def test_bgzf_reader_corrupted_block(self):
+        """BgzfReader: raise IOError for corrupted block
+        """
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        write_bgzf_file(example_file,self.example_text,blocksize=100)
+        with open(example_file,'r+b') as fp:
+            # Corrupt the CRC of the first block
+            fp.seek(12+6)
+            cdata = fp.read()
+        with open(example_file,'r+b') as fp:
+            fp.seek(12+6+cdata.index('\x1f\x8b')-8)
+            fp.write('\x00\x00\x00\x00')
+        reader = BgzfReader(example_file,nthreads=2)
+        self.assertRaises(IOError,reader.read)
+        reader.close()
+
+class TestPipeReader(unittest.TestCase):
+    """Unit tests for the PipeReader class
+    """
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.example_text = ''.join(["Line %d of the example text\n" % i
+                                     for i in xrange(1000)])
+    def tearDown(self):
+        shutil.rmtree(self.wd)
+    def test_pipe_reader(self):
+        """PipeReader: read output from 'gzip -dc'
+        """
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        with gzip.open(example_file,'w') as fp:
+            fp.write(self.example_text)
+        reader = PipeReader(['gzip','-dc',example_file])
+        self.assertEqual(reader.read(),self.example_text)
+        reader.close()
+    def test_pipe_reader_failed_command(self):
+        """PipeReader: raise IOError if command fails
+        """
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        with open(example_file,'w') as fp:
+            fp.write(self.example_text)
+        reader = PipeReader(['gzip','-dc',example_file])
+        self.assertRaises(IOError,reader.read)
+        reader.close()
+    def test_pipe_reader_lots_of_stderr(self):
+        """PipeReader: command writing lots to stderr doesn't block
+        """
+        reader = PipeReader(['/bin/sh','-c',
+                             'yes warning | head -c 1000000 >&2; '
+                             'echo done; exit 1'])
+        try:
+            reader.read()
+            self.fail("IOError not raised")
+        except IOError as ex:
+            self.assertTrue("warning" in str(ex))
+        reader.close()
+    def test_pipe_reader_close_before_eof(self):
+        """PipeReader: closing before EOF terminates the subprocess
+        """
+        example_file = os.path.join(self.wd,"example.txt.gz")
+        with gzip.open(example_file,'w') as fp:
+            fp.write(self.example_text*100)
+        reader = PipeReader(['gzip','-dc',example_file])
+        self.assertEqual(reader.read(10),self.example_text[:10])
+        reader.close()
+        self.assertTrue(reader.closed)
+
 class TestPathInfo(unittest.TestCase):
     """Unit tests for the PathInfo utility class
 
@@ -21,6 +21,11 @@ General utility classes:
 File reading utilities:
 
   getlines
+  open_gzipped_file
+  ZlibReader
+  BgzfReader
+  PipeReader
+  is_bgzf_file
 
 File system wrappers and utilities:
 
@@ -90,6 +95,13 @@ import grp
 import datetime
 import re
 import socket
+import io
+import zlib
+import struct
+import subprocess
+import tempfile
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
 #######################################################################
 # Module constants
@@ -98,6 +110,15 @@ import socket
 # Default size of data to read from file
 CHUNKSIZE = 102400
 
+# Default backend for reading gzipped files (see
+# 'open_gzipped_file'); can be overridden by setting
+# BCFTBX_GZIP_BACKEND in the environment
+GZIP_BACKEND = os.environ.get('BCFTBX_GZIP_BACKEND','auto')
+
+# External programs which can be used for gzip decompression
+# (in order of preference)
+GZIP_PROGRAMS = ('igzip','pigz')
+
 #######################################################################
 # General utility classes
 #######################################################################
@@ -206,7 +227,7 @@ class OrderedDictionary:
 # File reading utilities
 #######################################################################
 
-def getlines(filen):
+def getlines(filen,gzip_backend=None):
     """
     Fetch lines from a file and return them one by one
 
@@ -228,15 +249,21 @@ def getlines(filen):
     this invisibly provided that the file extension is
     '.gz'.
 
+    The backend used to read gzipped files can be
+    specified via the 'gzip_backend' argument (see
+    'open_gzipped_file' for the available backends).
+
     Arguments:
       filen (str): path of the file to read lines from
+      gzip_backend (str): optional, backend to use for
+        reading gzipped files (defaults to GZIP_BACKEND)
 
     Yields:
       String: next line of text from the file, with any
         newline character removed.
     """
     if filen.split('.')[-1] == 'gz':
-        fp = gzip.open(filen,'rb')
+        fp = open_gzipped_file(filen,backend=gzip_backend)
     else:
         fp = open(filen,'rb')
     # Read in data in chunks
@@ -265,6 +292,347 @@ def getlines(filen):
         # Return the lines one at a time
         for line in lines:
             yield line
+    fp.close()
+
+class _DecompressedReader(io.RawIOBase):
+    """
+    Base class for raw readers returning decompressed data
+
+    Subclasses should implement the '_next_block' method,
+    which should return the next block of decompressed
+    data as a string (or an empty string at EOF); this
+    class takes care of serving the data via 'readinto'.
+
+    Instances are intended to be wrapped in an
+    'io.BufferedReader' (as done by 'open_gzipped_file'),
+    which provides the full set of file-like methods.
+    """
+    def __init__(self):
+        io.RawIOBase.__init__(self)
+        self._block = ''
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def _next_block(self):
+        raise NotImplementedError("Subclass must implement '_next_block'")
+
+    def readinto(self,b):
+        while self._pos >= len(self._block):
+            self._block = self._next_block()
+            self._pos = 0
+            if not self._block:
+                return 0
+        n = min(len(b),len(self._block)-self._pos)
+        b[:n] = self._block[self._pos:self._pos+n]
+        self._pos += n
+        return n
+
+class ZlibReader(_DecompressedReader):
+    """
+    Read data from a gzipped file using zlib
+
+    Decompresses the file in-process using a 'zlib'
+    decompression object, and handles files which consist
+    of multiple concatenated gzip members (e.g. BGZF files,
+    or the output from 'pigz'). Trailing null padding after
+    the final member is ignored.
+    """
+    def __init__(self,filen,bufsize=CHUNKSIZE):
+        """
+        Create a new ZlibReader
+
+        Arguments:
+          filen (str): path to the gzipped file
+          bufsize (int): optional, number of bytes of
+            compressed data to read at a time
+        """
+        _DecompressedReader.__init__(self)
+        self._fp = open(filen,'rb')
+        self._bufsize = bufsize
+        self._decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+        self._eof = False
+
+    def _next_block(self):
+        while not self._eof:
+            data = self._fp.read(self._bufsize)
+            if not data:
+                self._eof = True
+                return self._decompressor.flush()
+            block = self._decompressor.decompress(data)
+            unused = self._decompressor.unused_data
+            while unused:
+                # End of one gzip member: start a new
+                # decompressor for the next one
+                if not unused.strip('\0'):
+                    # Trailing padding
+                    break
+                self._decompressor = zlib.decompressobj(16+zlib.MAX_WBITS)
+                block += self._decompressor.decompress(unused)
+                unused = self._decompressor.unused_data
+            if block:
+                return block
+        return ''
+
+    def close(self):
+        if not self.closed:
+            self._fp.close()
+        _DecompressedReader.close(self)
+
+class BgzfReader(_DecompressedReader):
+    """
+    Read data from a BGZF file inflating blocks in parallel
+
+    BGZF files (as produced by e.g. 'bgzip' and 'bcl2fastq')
+    consist of a series of independent gzip members, each
+    of which records its own compressed size in the gzip
+    header. This means that the blocks can be read without
+    decompressing them, and then inflated concurrently using
+    a pool of threads (zlib releases the GIL while inflating).
+
+    Blocks are read and inflated in batches; the next batch
+    is dispatched to the pool before the current one is
+    returned, so reading and decompression overlap. The
+    data is always returned in file order.
+    """
+    def __init__(self,filen,nthreads=None,blocks_per_batch=None):
+        """
+        Create a new BgzfReader
+
+        Arguments:
+          filen (str): path to the BGZF file
+          nthreads (int): optional, number of threads to
+            use for decompression (defaults to the number of
+            CPUs up to a maximum of 4)
+          blocks_per_batch (int): optional, number of blocks
+            to decompress in each batch (defaults to 16
+            blocks per thread)
+        """
+        _DecompressedReader.__init__(self)
+        if nthreads is None:
+            nthreads = min(multiprocessing.cpu_count(),4)
+        if blocks_per_batch is None:
+            blocks_per_batch = 16*nthreads
+        self._fp = open(filen,'rb')
+        self._filen = filen
+        self._pool = ThreadPool(nthreads)
+        self._blocks_per_batch = blocks_per_batch
+        self._pending = self._submit_batch()
+
+    def _read_block(self):
+        # Read the next complete BGZF block (compressed
+        # data and trailer), or return None at EOF
+        header = self._fp.read(12)
+        if not header:
+            return None
+        if len(header) < 12 or header[:4] != '\x1f\x8b\x08\x04':
+            raise IOError("%s: not a valid BGZF file" % self._filen)
+        xlen = struct.unpack('<H',header[10:12])[0]
+        extra = self._fp.read(xlen)
+        bsize = None
+        i = 0
+        while i+4 <= len(extra):
+            slen = struct.unpack('<H',extra[i+2:i+4])[0]
+            if extra[i:i+2] == 'BC' and slen == 2:
+                bsize = struct.unpack('<H',extra[i+4:i+6])[0]
+                break
+            i += 4 + slen
+        if bsize is None:
+            raise IOError("%s: BGZF block size not found" % self._filen)
+        block = self._fp.read(bsize - xlen - 11)
+        if len(block) != bsize - xlen - 11:
+            raise IOError("%s: truncated BGZF block" % self._filen)
+        return block
+
+    def _submit_batch(self):
+        blocks = []
+        for i in xrange(self._blocks_per_batch):
+            block = self._read_block()
+            if block is None:
+                break
+            blocks.append(block)
+        if not blocks:
+            return None
+        return self._pool.map_async(_inflate_bgzf_block,blocks)
+
+    def _next_block(self):
+        while self._pending is not None:
+            result = self._pending
+            self._pending = self._submit_batch()
+            block = ''.join(result.get())
+            if block:
+                return block
+        return ''
+
+    def close(self):
+        if not self.closed:
+            self._fp.close()
+            self._pool.terminate()
+        _DecompressedReader.close(self)
+
+def _inflate_bgzf_block(block):
+    # Decompress the raw deflate data from a BGZF block
+    # and check it against the CRC and size in the trailer
+    data = zlib.decompress(block[:-8],-zlib.MAX_WBITS)
+    crc,isize = struct.unpack('<iI',block[-8:])
+    if len(data) != isize or zlib.crc32(data) != crc:
+        raise IOError("BGZF block failed CRC/size check")
+    return data
+
+class PipeReader(_DecompressedReader):
+    """
+    Read the output from an external decompression program
+
+    Runs a command such as 'pigz -dc FILE' as a subprocess
+    and returns its standard output, so that decompression
+    happens in a separate process from the reader.
+
+    An IOError is raised at EOF if the command returns a
+    non-zero exit status; closing the reader before EOF
+    terminates the subprocess. The command's stderr is sent
+    to a temporary file (rather than a pipe, which could
+    fill up and block the command) and is included in the
+    error message.
+    """
+    def __init__(self,cmd,bufsize=CHUNKSIZE):
+        """
+        Create a new PipeReader
+
+        Arguments:
+          cmd (list): command line to run, as a list
+          bufsize (int): optional, number of bytes to
+            read from the pipe at a time
+        """
+        _DecompressedReader.__init__(self)
+        self._cmd = cmd
+        self._bufsize = bufsize
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(cmd,
+                                         stdout=subprocess.PIPE,
+                                         stderr=self._stderr)
+
+    def _next_block(self):
+        block = os.read(self._process.stdout.fileno(),self._bufsize)
+        if not block:
+            if self._process.wait() != 0:
+                self._stderr.seek(0)
+                stderr = self._stderr.read()
+                raise IOError("'%s' returned status %s: %s" %
+                              (' '.join(self._cmd),
+                               self._process.returncode,
+                               stderr.strip()))
+        return block
+
+    def close(self):
+        if not self.closed:
+            if self._process.poll() is None:
+                self._process.terminate()
+            self._process.stdout.close()
+            self._process.wait()
+            self._stderr.close()
+        _DecompressedReader.close(self)
+
+def is_bgzf_file(filen):
+    """
+    Check if a file is in BGZF format
+
+    Checks whether the header of the first gzip member
+    has the 'BC' extra subfield which holds the BGZF
+    block size.
+
+    Arguments:
+      filen (str): path to the file to check
+
+    Returns:
+      Boolean: True if the file appears to be BGZF, False
+        otherwise.
+    """
+    with open(filen,'rb') as fp:
+        header = fp.read(18)
+    return (len(header) == 18 and
+            header[:4] == '\x1f\x8b\x08\x04' and
+            header[12:14] == 'BC')
+
+def open_gzipped_file(filen,backend=None,nthreads=None):
+    """
+    Return a file-like object for reading a gzipped file
+
+    The decompression is performed by one of the following
+    backends:
+
+    - 'gzip': the standard library 'gzip' module
+    - 'zlib': in-process decompression using 'zlib' (see
+      'ZlibReader')
+    - 'bgzf': inflate BGZF blocks in parallel using a pool
+      of threads (see 'BgzfReader'); falls back to 'zlib'
+      if the file isn't BGZF
+    - 'pipe': read the output of an external decompression
+      program ('igzip' or 'pigz') run as a subprocess (see
+      'PipeReader'); falls back to 'zlib' if neither
+      program is found on the PATH
+    - 'auto': use 'pipe' if an external program is
+      available, otherwise 'bgzf'
+
+    Additional backends can be added to the GZIP_BACKENDS
+    dictionary, which maps backend names to functions with
+    the signature 'func(filen,nthreads)'.
+
+    Arguments:
+      filen (str): path to the gzipped file
+      backend (str): optional, name of the backend to use
+        (defaults to the value of GZIP_BACKEND)
+      nthreads (int): optional, number of threads to use
+        for backends which support it
+
+    Returns:
+      File-like object opened for reading the decompressed
+        data.
+    """
+    if backend is None:
+        backend = GZIP_BACKEND
+    try:
+        open_func = GZIP_BACKENDS[backend]
+    except KeyError:
+        raise Exception("'%s': unrecognised gzip backend" % backend)
+    return open_func(filen,nthreads)
+
+def _open_gzip(filen,nthreads=None):
+    return gzip.open(filen,'rb')
+
+def _open_zlib(filen,nthreads=None):
+    return io.BufferedReader(ZlibReader(filen),buffer_size=CHUNKSIZE)
+
+def _open_bgzf(filen,nthreads=None):
+    if not is_bgzf_file(filen):
+        return _open_zlib(filen)
+    return io.BufferedReader(BgzfReader(filen,nthreads=nthreads),
+                             buffer_size=CHUNKSIZE)
+
+def _open_pipe(filen,nthreads=None):
+    for name in GZIP_PROGRAMS:
+        program = find_program(name)
+        if program:
+            return io.BufferedReader(PipeReader([program,'-dc',filen]),
+                                     buffer_size=CHUNKSIZE)
+    logging.debug("No external gzip program found, falling back "
+                  "to zlib")
+    return _open_zlib(filen)
+
+def _open_auto(filen,nthreads=None):
+    for name in GZIP_PROGRAMS:
+        if find_program(name):
+            return _open_pipe(filen,nthreads)
+    return _open_bgzf(filen,nthreads)
+
+# Mapping of gzip backend names to functions
+GZIP_BACKENDS = {
+    'gzip': _open_gzip,
+    'zlib': _open_zlib,
+    'bgzf': _open_bgzf,
+    'pipe': _open_pipe,
+    'auto': _open_auto,
+}
 
 #######################################################################
 # File system wrappers and utilities
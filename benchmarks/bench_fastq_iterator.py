@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+#
+#     bench_fastq_iterator.py: benchmark FastqIterator modes
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+"""
+Benchmark iterating over a Fastq file with FastqIterator, comparing
+the default mode (FastqRead objects) against the 'lazy' mode
+(LazyFastqRead objects), in reads/sec and peak RSS.
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import sys
+import os
+import time
+import random
+import resource
+import tempfile
+import subprocess
+import argparse
+from bcftbx.FASTQFile import FastqIterator
+
+#######################################################################
+# Functions
+#######################################################################
+
+def make_fastq(filen,nreads,length=150):
+    """
+    Write a synthetic Illumina 1.8+ Fastq file
+    """
+    rand = random.Random(12345)
+    # Draw sequences and qualities from a pool to keep
+    # generation time down
+    seqs = [''.join([rand.choice('ACGTN') for j in xrange(length)])
+            for i in xrange(100)]
+    quals = [''.join([rand.choice('#AFJ<') for j in xrange(length)])
+             for i in xrange(100)]
+    with open(filen,'w') as fp:
+        for i in xrange(nreads):
+            fp.write("@K00311:43:HL3LWBBXX:%d:1101:%d:%d 1:N:0:CNATGT\n"
+                     "%s\n+\n%s\n" % (i%8+1,
+                                       rand.randint(1000,30000),i,
+                                       rand.choice(seqs),
+                                       rand.choice(quals)))
+
+def run_mode(fastq,lazy,access):
+    """
+    Iterate over Fastq and print nreads, time and peak RSS (kB)
+    """
+    start = time.time()
+    n = 0
+    for read in FastqIterator(fastq,lazy=lazy):
+        n += 1
+        if access == 'seqid':
+            read.seqid
+        elif access == 'sequence':
+            read.sequence
+        elif access == 'all':
+            read.seqid
+            read.sequence
+            read.quality
+    elapsed = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print "%d\t%f\t%d" % (n,elapsed,peak_rss)
+
+#######################################################################
+# Main program
+#######################################################################
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Benchmark FastqIterator "
+                                "in default and 'lazy' modes")
+    p.add_argument('--access',choices=('none','seqid','sequence','all'),
+                   default='none',
+                   help="read attributes to access in the loop "
+                   "(default: none)")
+    p.add_argument('--nreads',type=int,default=1000000,
+                   help="number of reads in synthetic Fastq "
+                   "(default: 1000000)")
+    p.add_argument('--mode',choices=('default','lazy'),
+                   help=argparse.SUPPRESS)
+    p.add_argument('fastq',nargs='?',
+                   help="Fastq file to use (default: generate "
+                   "synthetic Fastq)")
+    args = p.parse_args()
+    if args.mode:
+        # Child process: run a single mode
+        run_mode(args.fastq,(args.mode == 'lazy'),args.access)
+        sys.exit(0)
+    fastq = args.fastq
+    tmp_fastq = None
+    if fastq is None:
+        fd,tmp_fastq = tempfile.mkstemp(suffix='.fastq')
+        os.close(fd)
+        print "Generating %d reads in %s" % (args.nreads,tmp_fastq)
+        make_fastq(tmp_fastq,args.nreads)
+        fastq = tmp_fastq
+    try:
+        print "Mode\tAccess\tReads\tTime(s)\tReads/sec\tPeak RSS(kB)"
+        for mode in ('default','lazy'):
+            output = subprocess.check_output([sys.executable,__file__,
+                                              '--mode',mode,
+                                              '--access',args.access,
+                                              fastq])
+            n,elapsed,peak_rss = output.strip().split('\t')
+            n = int(n)
+            elapsed = float(elapsed)
+            print "%s\t%s\t%d\t%.2f\t%.0f\t%s" % (mode,args.access,n,elapsed,
+                                                   n/elapsed,peak_rss)
+    finally:
+        if tmp_fastq:
+            os.remove(tmp_fastq)
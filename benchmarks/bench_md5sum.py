@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+#
+#     bench_md5sum.py: benchmark Md5Checker MD5 sum computation
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+"""
+Benchmark computing MD5 sums for a directory of mixed large and
+small files with Md5Checker.compute_md5sums, comparing different
+numbers of worker threads, in MB/sec and files/sec.
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import os
+import time
+import shutil
+import tempfile
+import argparse
+from bcftbx.Md5sum import Md5Checker
+
+#######################################################################
+# Functions
+#######################################################################
+
+def make_test_dir(dirn,nlarge,large_size,nsmall,small_size):
+    """
+    Populate a directory with a mixture of large and small files
+    """
+    block = os.urandom(1024*1024)
+    for i in xrange(nlarge):
+        with open(os.path.join(dirn,"large%03d.bin" % i),'wb') as fp:
+            remaining = large_size
+            while remaining > 0:
+                fp.write(block[:min(remaining,len(block))])
+                remaining -= len(block)
+            # Make each file distinct
+            fp.write(str(i))
+    for i in xrange(nsmall):
+        subdir = os.path.join(dirn,"small%02d" % (i%10))
+        if not os.path.exists(subdir):
+            os.mkdir(subdir)
+        with open(os.path.join(subdir,"small%05d.txt" % i),'wb') as fp:
+            fp.write(os.urandom(small_size))
+
+def dir_size(dirn):
+    """
+    Return total number and size of files under a directory
+    """
+    nfiles = 0
+    nbytes = 0
+    for f in Md5Checker.walk(dirn):
+        nfiles += 1
+        nbytes += os.path.getsize(f)
+    return (nfiles,nbytes)
+
+def run(dirn,nthreads):
+    """
+    Compute MD5 sums for directory and return elapsed time
+    """
+    start = time.time()
+    for f,chksum in Md5Checker.compute_md5sums(dirn,nthreads=nthreads):
+        pass
+    return time.time() - start
+
+#######################################################################
+# Main program
+#######################################################################
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Benchmark computing MD5 "
+                                "sums for a directory using different "
+                                "numbers of threads")
+    p.add_argument('--threads',default='1,2,4,8',
+                   help="comma-separated list of thread counts to "
+                   "test (default: 1,2,4,8)")
+    p.add_argument('--nlarge',type=int,default=8,
+                   help="number of large files in synthetic directory "
+                   "(default: 8)")
+    p.add_argument('--large-size',type=int,default=64,
+                   help="size of large files in MB (default: 64)")
+    p.add_argument('--nsmall',type=int,default=2000,
+                   help="number of small files in synthetic directory "
+                   "(default: 2000)")
+    p.add_argument('--small-size',type=int,default=4,
+                   help="size of small files in kB (default: 4)")
+    p.add_argument('dirn',nargs='?',
+                   help="directory to use (default: generate "
+                   "synthetic directory)")
+    args = p.parse_args()
+    dirn = args.dirn
+    tmp_dir = None
+    if dirn is None:
+        tmp_dir = tempfile.mkdtemp()
+        print "Generating %d x %dMB and %d x %dkB files in %s" % \
+            (args.nlarge,args.large_size,args.nsmall,args.small_size,tmp_dir)
+        make_test_dir(tmp_dir,
+                      args.nlarge,args.large_size*1024*1024,
+                      args.nsmall,args.small_size*1024)
+        dirn = tmp_dir
+    try:
+        nfiles,nbytes = dir_size(dirn)
+        # Warm the page cache so that all runs see the same conditions
+        run(dirn,1)
+        print "Threads\tFiles\tMB\tTime(s)\tMB/sec\tFiles/sec"
+        for nthreads in [int(n) for n in args.threads.split(',')]:
+            elapsed = run(dirn,nthreads)
+            print "%d\t%d\t%.1f\t%.2f\t%.1f\t%.0f" % \
+                (nthreads,nfiles,nbytes/1024.0/1024.0,elapsed,
+                 nbytes/1024.0/1024.0/elapsed,nfiles/elapsed)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir)
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+#
+#     bench_pipeline_runner.py: benchmark PipelineRunner scheduling
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+"""
+Benchmark the PipelineRunner scheduler by queueing a large number
+of trivial jobs and running them to completion, using either the
+mock Grid Engine utilities from bcftbx.mockGE with GEJobRunner, or
+SimpleJobRunner.
+
+Reports the elapsed time, the throughput in jobs/sec, the number
+of scheduler updates and the number of calls made to the runner's
+'list' and 'isRunning' methods.
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import sys
+import os
+import time
+import shutil
+import atexit
+import tempfile
+import argparse
+from bcftbx.JobRunner import SimpleJobRunner
+from bcftbx.JobRunner import GEJobRunner
+from bcftbx.Pipeline import PipelineRunner
+from bcftbx.mockGE import setup_mock_GE
+
+#######################################################################
+# Classes
+#######################################################################
+
+class CallCounter(object):
+    """
+    Wrap a job runner and count calls to selected methods
+    """
+    def __init__(self,runner,methods=('list','isRunning')):
+        self._runner = runner
+        self.counts = dict([(m,0) for m in methods])
+        for m in methods:
+            setattr(self,m,self._counted(m))
+    def _counted(self,method):
+        f = getattr(self._runner,method)
+        def wrapper(*args,**kws):
+            self.counts[method] += 1
+            return f(*args,**kws)
+        return wrapper
+    def __getattr__(self,attr):
+        return getattr(self._runner,attr)
+
+class CountingPipelineRunner(PipelineRunner):
+    """
+    PipelineRunner which counts calls to 'update'
+    """
+    def __init__(self,*args,**kws):
+        PipelineRunner.__init__(self,*args,**kws)
+        self.nupdates = 0
+    def update(self):
+        self.nupdates += 1
+        PipelineRunner.update(self)
+
+#######################################################################
+# Main program
+#######################################################################
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Benchmark PipelineRunner "
+                                "with a large number of queued jobs")
+    p.add_argument('--njobs',type=int,default=5000,
+                   help="number of jobs to queue (default: 5000)")
+    p.add_argument('--runner',choices=('mockGE','simple'),
+                   default='mockGE',
+                   help="job runner to use (default: mockGE)")
+    p.add_argument('--max-concurrent-jobs',type=int,default=4,
+                   help="maximum number of concurrent jobs "
+                   "(default: 4)")
+    p.add_argument('--groups',type=int,default=10,
+                   help="number of groups to divide jobs between "
+                   "(default: 10)")
+    p.add_argument('--poll-interval',type=float,default=30,
+                   help="maximum poll interval (default: 30)")
+    p.add_argument('--min-poll-interval',type=float,default=1,
+                   help="minimum poll interval (default: 1)")
+    args = p.parse_args()
+    # Set up working area
+    pwd = os.getcwd()
+    tmp_dir = tempfile.mkdtemp()
+    # Registered before the runner so that it's removed after
+    # GEJobRunner has cleaned up its admin directory
+    atexit.register(shutil.rmtree,tmp_dir)
+    os.chdir(tmp_dir)
+    try:
+        if args.runner == 'mockGE':
+            bin_dir = os.path.join(tmp_dir,"bin")
+            os.mkdir(bin_dir)
+            setup_mock_GE(bindir=bin_dir,
+                          database_dir=os.path.join(tmp_dir,"mockGE"),
+                          qsub_delay=0.0,
+                          qacct_delay=0.0)
+            os.environ['PATH'] = bin_dir + os.pathsep + os.environ['PATH']
+            runner = GEJobRunner(log_dir=tmp_dir)
+        else:
+            runner = SimpleJobRunner(log_dir=tmp_dir)
+        runner = CallCounter(runner)
+        ncompleted_groups = []
+        pipeline = CountingPipelineRunner(
+            runner,
+            max_concurrent_jobs=args.max_concurrent_jobs,
+            poll_interval=args.poll_interval,
+            min_poll_interval=args.min_poll_interval,
+            groupCompletionHandler=lambda group,jobs:
+            ncompleted_groups.append(group))
+        for i in xrange(args.njobs):
+            pipeline.queueJob(tmp_dir,"true",[],label="job%d" % i,
+                              group="group%d" % (i%args.groups))
+        # Run the pipeline (discarding the progress reporting)
+        print "Running %d jobs using %s" % (args.njobs,args.runner)
+        stdout = sys.stdout
+        start_time = time.time()
+        try:
+            sys.stdout = open(os.devnull,'w')
+            pipeline.run()
+        finally:
+            sys.stdout = stdout
+        elapsed = time.time() - start_time
+        # Report
+        print "Jobs completed   : %d" % pipeline.nCompleted()
+        print "Groups completed : %d" % len(ncompleted_groups)
+        print "Elapsed time (s) : %.1f" % elapsed
+        print "Jobs/sec         : %.1f" % (pipeline.nCompleted()/elapsed)
+        print "Updates          : %d" % pipeline.nupdates
+        print "'list' calls     : %d" % runner.counts['list']
+        print "'isRunning' calls: %d" % runner.counts['isRunning']
+    finally:
+        os.chdir(pwd)
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+#
+#     bench_simple_xls.py: benchmark populating XLSWorkSheet objects
+#     Copyright (C) University of Manchester 2018 Peter Briggs
+#
+"""
+Benchmark filling a simple_xls.XLSWorkSheet with a large number of
+cells (by default 1M), either cell-by-cell, row-by-row (append_row)
+or column-by-column (write_column), in cells/sec and peak RSS.
+
+The 'formula' mode fills the first column with numbers and the others
+with a formula referencing it (e.g. '=A?-100'), and includes the time
+taken to evaluate all the formulae.
+"""
+
+#######################################################################
+# Imports
+#######################################################################
+
+import sys
+import time
+import resource
+import subprocess
+import argparse
+from bcftbx.simple_xls import XLSWorkSheet
+from bcftbx.simple_xls import cell
+from bcftbx.simple_xls import column_integer_to_index
+
+#######################################################################
+# Functions
+#######################################################################
+
+def run_mode(mode,nrows,ncols):
+    """
+    Fill a worksheet and print ncells, time and peak RSS (kB)
+    """
+    columns = [column_integer_to_index(i) for i in xrange(ncols)]
+    ws = XLSWorkSheet('benchmark')
+    start = time.time()
+    if mode == 'cell':
+        for row in xrange(1,nrows+1):
+            for col in columns:
+                ws[cell(col,row)] = row
+    elif mode == 'row':
+        data = range(ncols)
+        for row in xrange(nrows):
+            ws.append_row(data=data)
+    elif mode == 'column':
+        data = range(nrows)
+        for col in columns:
+            ws.write_column(col,data=data)
+    elif mode == 'formula':
+        ws.write_column(columns[0],data=range(nrows))
+        for col in columns[1:]:
+            ws.write_column(col,fill='=%s?-100' % columns[0])
+        ws.render_as_text(eval_formulae=True)
+    # Check the extent of the sheet so that any deferred work
+    # is included in the timing
+    assert ws.last_row == nrows
+    assert ws.last_column == columns[-1]
+    assert len(ws.rows) == nrows
+    assert len(ws.columns) == ncols
+    elapsed = time.time() - start
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print "%d\t%f\t%d" % (nrows*ncols,elapsed,peak_rss)
+
+#######################################################################
+# Main program
+#######################################################################
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description="Benchmark filling an "
+                                "XLSWorkSheet cell-wise, row-wise, "
+                                "column-wise and with formulae")
+    p.add_argument('--nrows',type=int,default=100000,
+                   help="number of rows to fill (default: 100000)")
+    p.add_argument('--ncols',type=int,default=10,
+                   help="number of columns to fill (default: 10)")
+    p.add_argument('--modes',default='cell,row,column,formula',
+                   help="comma-separated list of modes to test "
+                   "(default: cell,row,column,formula)")
+    p.add_argument('--mode',choices=('cell','row','column','formula'),
+                   help=argparse.SUPPRESS)
+    args = p.parse_args()
+    if args.mode:
+        # Child process: run a single mode
+        run_mode(args.mode,args.nrows,args.ncols)
+        sys.exit(0)
+    print "Filling %d rows x %d columns" % (args.nrows,args.ncols)
+    print "Mode\tCells\tTime(s)\tCells/sec\tPeak RSS(kB)"
+    for mode in args.modes.split(','):
+        output = subprocess.check_output([sys.executable,__file__,
+                                          '--mode',mode,
+                                          '--nrows',str(args.nrows),
+                                          '--ncols',str(args.ncols)])
+        n,elapsed,peak_rss = output.strip().split('\t')
+        n = int(n)
+        elapsed = float(elapsed)
+        print "%s\t%d\t%.2f\t%.0f\t%s" % (mode,n,elapsed,n/elapsed,peak_rss)
@@ -19,17 +19,25 @@ This program was originally written to deal with HiSEQ data where
 dual-indexed and single indexed barcoding protocols were mixed in the same
 sequencing run.
 
+Reads are assigned to barcodes by looking up their index sequences in a
+table of all the sequences within the allowed number of mismatches of
+each barcode (see the BarcodeIndex class). FASTQ files are processed in
+parallel if multiple processes are requested via the -n option.
+
 """
 
 #######################################################################
 # Import modules that this module depends on
 #######################################################################
 
-__version__ = "0.0.1"
+__version__ = "0.1.0"
 
 import os
 import sys
 import optparse
+import itertools
+import gzip
+import multiprocessing
 
 # Put .. onto Python search path for modules
 SHARE_DIR = os.path.abspath(
@@ -97,80 +105,431 @@ class BarcodeMatcher:
             return False
         return True
 
+class BarcodeIndex:
+    """BarcodeIndex
+
+    Class for assigning index sequences to one of a set of barcodes.
+
+    Every sequence within the maximum number of mismatches of each
+    barcode is generated up front and stored in a dictionary, so
+    that assigning an index sequence needs just one lookup (per
+    distinct barcode length) rather than comparing it against each
+    barcode in turn.
+
+    Example usage:
+    >>> b = BarcodeIndex(["ACCTAG","TTGCAA"],max_mismatches=1)
+    >>> b.match("ACCTAC") # returns "ACCTAG"
+    >>> b.match("GGGGGG") # returns None
+
+    As with BarcodeMatcher, only the first len(barcode) bases of
+    an index sequence are compared with each barcode. If an index
+    sequence matches more than one barcode then the barcode with
+    the fewest mismatches is returned (the longest barcode, if
+    they have different lengths). Sequences which are equally
+    close to two or more barcodes of the same length are ambiguous
+    and don't match anything; the 'collisions' property lists the
+    pairs of barcodes for which this happens.
+
+    Index sequences containing characters which can't appear in
+    the generated sequences (i.e. not in 'ACGTN' or the barcodes
+    themselves, for example '.') aren't in the lookup tables, so
+    these are compared directly with each barcode instead.
+
+    """
+
+    def __init__(self,barcodes,max_mismatches=0):
+        """Create a new BarcodeIndex
+
+        Arguments:
+          barcodes: list of barcode (i.e. index) sequences
+          max_mismatches: maximum number of mismatches allowed while
+            still considering a sequence to match a barcode (default
+            is zero i.e. no mismatches)
+
+        """
+        self.__collisions = set()
+        self.__max_mismatches = max_mismatches
+        # Characters which can appear in the lookup tables
+        self.__alphabet = set('ACGTN')
+        # Collect the closest barcodes for each sequence
+        self.__barcodes = {}
+        neighbours = {}
+        for barcode in barcodes:
+            self.__barcodes.setdefault(len(barcode),[]).append(barcode)
+            self.__alphabet.update(barcode)
+            lookup = neighbours.setdefault(len(barcode),{})
+            for seq,nmismatches in mismatch_neighbourhood(barcode,
+                                                          max_mismatches):
+                try:
+                    n,matches = lookup[seq]
+                except KeyError:
+                    lookup[seq] = (nmismatches,[barcode])
+                    continue
+                if nmismatches < n:
+                    lookup[seq] = (nmismatches,[barcode])
+                elif nmismatches == n and barcode not in matches:
+                    matches.append(barcode)
+        # Build the lookup tables (longest barcodes first)
+        self.__tables = []
+        for length in sorted(neighbours,reverse=True):
+            lookup = {}
+            for seq,(n,matches) in neighbours[length].iteritems():
+                if len(matches) == 1:
+                    lookup[seq] = (matches[0],n)
+                else:
+                    # Ambiguous
+                    lookup[seq] = (None,n)
+                    for pair in itertools.combinations(sorted(matches),2):
+                        self.__collisions.add(pair)
+            self.__tables.append((length,lookup))
+
+    @property
+    def collisions(self):
+        """Return sorted list of pairs of barcodes which collide
+
+        Each item is a tuple of two barcodes, which have at least
+        one sequence equally close to both of them.
+
+        """
+        return sorted(self.__collisions)
+
+    def match(self,index_sequence):
+        """Return the barcode matching an index sequence
+
+        Arguments:
+          index_sequence: barcode/index sequence being tested
+
+        Returns:
+          Matching barcode, or None if there is no match (or if
+          the match is ambiguous).
+
+        """
+        best = None
+        best_n = None
+        for length,lookup in self.__tables:
+            seq = index_sequence[:length]
+            try:
+                barcode,n = lookup[seq]
+            except KeyError:
+                if self.__alphabet.issuperset(seq):
+                    continue
+                barcode,n = self.__compare(seq,length)
+                if n is None:
+                    continue
+            if best_n is None or n < best_n:
+                best = barcode
+                best_n = n
+                if n == 0:
+                    break
+        return best
+
+    def __compare(self,seq,length):
+        """Internal: compare a sequence directly with the barcodes
+
+        Arguments:
+          seq: sequence to compare
+          length: length of the barcodes to compare with
+
+        Returns:
+          Tuple (barcode,nmismatches) for the closest barcode of
+          the specified length (barcode is None if the match is
+          ambiguous), or (None,None) if there is no match.
+
+        """
+        if len(seq) < length:
+            return (None,None)
+        best = []
+        best_n = None
+        for barcode in self.__barcodes[length]:
+            n = len([i for i in xrange(length) if seq[i] != barcode[i]])
+            if n > self.__max_mismatches:
+                continue
+            if best_n is None or n < best_n:
+                best = [barcode]
+                best_n = n
+            elif n == best_n:
+                best.append(barcode)
+        if len(best) == 1:
+            return (best[0],best_n)
+        return (None,best_n)
+
 #######################################################################
 # Module Functions
 #######################################################################
 
-def demultiplex_fastq(fastq_file,barcodes,nmismatches):
+def mismatch_neighbourhood(seq,max_mismatches,alphabet='ACGTN'):
+    """Generate all sequences within a number of mismatches of a sequence
+
+    Yields tuples (sequence,nmismatches) starting with the sequence
+    itself (with zero mismatches). Only positions in the original
+    sequence which contain one of the characters in the alphabet
+    are varied (so for example the '-' separating the two parts of
+    a dual index must always match).
+
+    Arguments:
+      seq: sequence to generate the neighbourhood of
+      max_mismatches: maximum number of mismatched positions
+      alphabet: (optional) string of characters to substitute at
+        each position (default is 'ACGTN')
+
+    """
+    yield (seq,0)
+    positions = [i for i,c in enumerate(seq) if c in alphabet]
+    for nmismatches in xrange(1,max_mismatches+1):
+        for idxs in itertools.combinations(positions,nmismatches):
+            substitutions = [[c for c in alphabet if c != seq[i]]
+                             for i in idxs]
+            for bases in itertools.product(*substitutions):
+                s = list(seq)
+                for i,c in zip(idxs,bases):
+                    s[i] = c
+                yield (''.join(s),nmismatches)
+
+def demultiplex_fastq(fastq_file,barcodes,nmismatches,gzip_output=False,
+                      batch_size=10000):
     """Perform demultiplexing of a FASTQ file
 
     Demultiplex reads in a FASTQ file given information about a set of 
     barcode/index sequences.
 
     Produces a file for each barcode, plus another for 'unbinned'
-    reads.
+    reads (including reads which match more than one barcode
+    equally well).
+
+    The index sequence for each read is taken from the end of the
+    sequence identifier line (i.e. Illumina 1.8+ format), and
+    reads are written out unmodified in batches.
 
     Arguments:
       fastq_file: FASTQ file to be demultiplexed (can be gzipped)
       barcodes: list of barcode sequences to use for demultiplexing
       nmismatches: maxiumum number of mismatched bases allowed when
         testing whether barcode sequences match
+      gzip_output: (optional) if True then write gzip-compressed
+        output files (default is to write uncompressed files)
+      batch_size: (optional) number of reads to hold for each
+        output file before writing them
 
     Returns:
-      No return value
+      Dictionary with the number of reads assigned to each barcode
+      (keyed by the barcode index sequence) and to 'unbinned', or
+      None if there are no barcodes for the lane.
+
     """
     # Start
     print "Processing %s" % fastq_file
     info = IlluminaData.IlluminaFastq(fastq_file)
     # Set up output files
     output_files = {}
+    if gzip_output:
+        ext = ".fastq.gz"
+        open_output = gzip.open
+    else:
+        ext = ".fastq"
+        open_output = open
     # Weed out barcodes that aren't associated with this lane
     local_barcodes = []
     for barcode in barcodes:
         if barcode['lane'] != info.lane_number:
             continue
         local_barcodes.append(barcode)
-        output_file_name = "%s_%s_L%03d_R%d_%03d.fastq" % (barcode['name'],
-                                                           barcode['index'],
-                                                           info.lane_number,
-                                                           info.read_number,
-                                                           info.set_number)
-        print "\t%s\t%s" % (barcode['index'],output_file_name)
-        if os.path.exists(output_file_name):
-            print "\t%s: already exists,exiting" % output_file_name
-            sys.exit(1)
-        output_files[barcode['index']] = open(output_file_name,'w')
     # Check if there's anything to do
     if len(local_barcodes) == 0:
-        return
-    # Also make a file for unbinned reads
-    unbinned_file_name = "unbinned_L%03d_R%d_%03d.fastq" % (info.lane_number,
-                                                            info.read_number,
-                                                            info.set_number)
-    if os.path.exists(unbinned_file_name):
-        print "\t%s: already exists,exiting" % unbinned_file_name
-        sys.exit(1)
-    output_files['unbinned'] = open(unbinned_file_name,'w')
+        return None
+    # Check for collisions between barcodes
+    index = BarcodeIndex([barcode['index'] for barcode in local_barcodes],
+                         nmismatches)
+    for collision in index.collisions:
+        print "\tWARNING %s and %s can't be distinguished with %d " \
+            "mismatch(es), ambiguous reads will be unbinned" % \
+            (collision[0],collision[1],nmismatches)
+    # Open the output files, including one for unbinned reads
+    output_file_names = {}
+    for barcode in local_barcodes:
+        output_file_name = "%s_%s_L%03d_R%d_%03d%s" % (barcode['name'],
+                                                       barcode['index'],
+                                                       info.lane_number,
+                                                       info.read_number,
+                                                       info.set_number,
+                                                       ext)
+        print "\t%s\t%s" % (barcode['index'],output_file_name)
+        output_file_names[barcode['index']] = output_file_name
+    output_file_names[None] = "unbinned_L%03d_R%d_%03d%s" % \
+                              (info.lane_number,
+                               info.read_number,
+                               info.set_number,
+                               ext)
+    for output_file_name in output_file_names.values():
+        if os.path.exists(output_file_name):
+            raise IOError,"%s: already exists" % output_file_name
+    for barcode in output_file_names:
+        output_files[barcode] = open_output(output_file_names[barcode],'wb')
     # Process reads
+    batches = dict([(barcode,[]) for barcode in output_files])
+    match = index.match
     nreads = 0
-    for read in FASTQFile.FastqIterator(fastq_file):
+    counts = dict([(barcode,0) for barcode in output_files])
+    for read in FASTQFile.FastqIterator(fastq_file,lazy=True):
         nreads += 1
-        matched_read = False
-        this_barcode = read.seqid.index_sequence
-        for barcode in local_barcodes:
-            if barcode['matcher'].match(this_barcode,nmismatches):
-                ##print "Matched %s against %s" % (this_barcode,barcodes[barcode]['name'])
-                output_files[barcode['index']].write(str(read)+'\n')
-                matched_read = True
-                break
-        # Put in unbinned if no match
-        if not matched_read:
-            output_files['unbinned'].write(str(read)+'\n')
-        ##if nreads > 100: break
-    # Close files
-    for barcode in local_barcodes:
-        output_files[barcode['index']].close()
-    print "\tMatched %d reads for %s" % (nreads,os.path.basename(fastq_file))
+        seqid = read.raw_seqid
+        barcode = match(seqid[seqid.rfind(':')+1:].rstrip())
+        batch = batches[barcode]
+        batch.append(read.raw_record)
+        if len(batch) == batch_size:
+            output_files[barcode].write('\n'.join(batch)+'\n')
+            counts[barcode] += len(batch)
+            del(batch[:])
+    # Write remaining reads and close files
+    for barcode in output_files:
+        batch = batches[barcode]
+        if batch:
+            output_files[barcode].write('\n'.join(batch)+'\n')
+            counts[barcode] += len(batch)
+        output_files[barcode].close()
+    counts['unbinned'] = counts[None]
+    del(counts[None])
+    print "\tMatched %d/%d reads for %s" % (nreads-counts['unbinned'],
+                                            nreads,
+                                            os.path.basename(fastq_file))
+    return counts
+
+def _demultiplex_fastq(args):
+    """Internal: call 'demultiplex_fastq' with a tuple of arguments
+
+    Used when running via a multiprocessing pool.
+
+    """
+    return demultiplex_fastq(*args)
+
+#######################################################################
+# Tests
+#######################################################################
+
+import unittest
+import tempfile
+import shutil
+
+class TestBarcodeIndex(unittest.TestCase):
+    def test_exact_match(self):
+        b = BarcodeIndex(['ACCTAG','TTGCAA'])
+        self.assertEqual(b.match('ACCTAG'),'ACCTAG')
+        self.assertEqual(b.match('TTGCAA'),'TTGCAA')
+        self.assertEqual(b.match('ACCTAC'),None)
+        self.assertEqual(b.collisions,[])
+    def test_match_with_mismatches(self):
+        b = BarcodeIndex(['ACCTAG','TTGCAA'],max_mismatches=1)
+        self.assertEqual(b.match('ACCTAC'),'ACCTAG')
+        self.assertEqual(b.match('NTGCAA'),'TTGCAA')
+        self.assertEqual(b.match('ACCTCC'),None)
+    def test_match_longer_index_sequence(self):
+        b = BarcodeIndex(['ACCTAG'],max_mismatches=1)
+        self.assertEqual(b.match('ACCTAGTT'),'ACCTAG')
+        self.assertEqual(b.match('ACCTACTT'),'ACCTAG')
+        self.assertEqual(b.match('ACCTA'),None)
+    def test_match_prefers_fewest_mismatches(self):
+        b = BarcodeIndex(['ACCTAG','ACCTAC'],max_mismatches=1)
+        self.assertEqual(b.match('ACCTAG'),'ACCTAG')
+        self.assertEqual(b.match('ACCTAC'),'ACCTAC')
+        # Equally close to both barcodes
+        self.assertEqual(b.match('ACCTAA'),None)
+        self.assertEqual(b.collisions,[('ACCTAC','ACCTAG')])
+    def test_match_prefers_longest_barcode(self):
+        b = BarcodeIndex(['ACCTAG','ACCTAGTT'])
+        self.assertEqual(b.match('ACCTAGTT'),'ACCTAGTT')
+        self.assertEqual(b.match('ACCTAGCC'),'ACCTAG')
+        self.assertEqual(b.collisions,[])
+    def test_agrees_with_barcode_matcher(self):
+        barcodes = ['ACCTAG','TTGCAA']
+        b = BarcodeIndex(barcodes,max_mismatches=1)
+        for seq in itertools.product('ACGT',repeat=6):
+            seq = ''.join(seq)
+            matches = [barcode for barcode in barcodes
+                       if BarcodeMatcher(barcode).match(seq,1)]
+            if matches:
+                self.assertEqual(b.match(seq),matches[0])
+            else:
+                self.assertEqual(b.match(seq),None)
+    def test_match_index_sequence_with_other_characters(self):
+        b = BarcodeIndex(['ACGTAC','TTGCAA'],max_mismatches=1)
+        self.assertEqual(b.match('ACGTA.'),'ACGTAC')
+        self.assertEqual(b.match('.CGTAC'),'ACGTAC')
+        self.assertEqual(b.match('ACGT..'),None)
+        self.assertTrue(BarcodeMatcher('ACGTAC').match('ACGTA.',1))
+        b = BarcodeIndex(['ACGTAC'])
+        self.assertEqual(b.match('ACGTA.'),None)
+
+class TestMismatchNeighbourhood(unittest.TestCase):
+    def test_no_mismatches(self):
+        self.assertEqual(list(mismatch_neighbourhood('ACGT',0)),
+                         [('ACGT',0)])
+    def test_one_mismatch(self):
+        neighbours = list(mismatch_neighbourhood('AC',1))
+        self.assertEqual(neighbours[0],('AC',0))
+        self.assertEqual(sorted(neighbours[1:]),
+                         [('AA',1),('AG',1),('AN',1),('AT',1),
+                          ('CC',1),('GC',1),('NC',1),('TC',1)])
+    def test_two_mismatches(self):
+        neighbours = list(mismatch_neighbourhood('ACGTAC',2))
+        self.assertEqual(len(neighbours),1+6*4+15*16)
+        self.assertEqual(len(set([seq for seq,n in neighbours])),
+                         len(neighbours))
+    def test_separator_not_varied(self):
+        neighbours = list(mismatch_neighbourhood('A-C',1))
+        self.assertEqual(len(neighbours),1+2*4)
+        for seq,n in neighbours:
+            self.assertEqual(seq[1],'-')
+
+class TestDemultiplexFastq(unittest.TestCase):
+    def setUp(self):
+        self.wd = tempfile.mkdtemp()
+        self.pwd = os.getcwd()
+        self.fastq = os.path.join(self.wd,
+                                  "lane6_Undetermined_L006_R1_001.fastq")
+        with open(self.fastq,'w') as fp:
+            fp.write("""@HWI-700511R:233:C446JACXX:6:1101:1241:2242 1:N:0:CCGTCCAT
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+@HWI-700511R:233:C446JACXX:6:1101:1280:2080 1:N:0:GTCNNCAT
+CGAGCTCGAATTCAT
++
+<0<<BFF<0BFFFII
+@HWI-700511R:233:C446JACXX:6:1101:1241:2242 1:N:0:CCGTGCAT
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+""")
+        os.chdir(self.wd)
+    def tearDown(self):
+        os.chdir(self.pwd)
+        shutil.rmtree(self.wd)
+    def test_demultiplex_fastq(self):
+        barcodes = [{ 'name': 'PB1', 'index': 'CCGTCCAT', 'lane': 6 },
+                    { 'name': 'PB2', 'index': 'ATTAGA', 'lane': 5 }]
+        counts = demultiplex_fastq(self.fastq,barcodes,1,batch_size=1)
+        self.assertEqual(counts,{ 'CCGTCCAT': 2, 'unbinned': 1 })
+        self.assertEqual(sorted(os.listdir(self.wd)),
+                         ['PB1_CCGTCCAT_L006_R1_001.fastq',
+                          'lane6_Undetermined_L006_R1_001.fastq',
+                          'unbinned_L006_R1_001.fastq'])
+        self.assertEqual(open('unbinned_L006_R1_001.fastq').read(),
+                         """@HWI-700511R:233:C446JACXX:6:1101:1280:2080 1:N:0:GTCNNCAT
+CGAGCTCGAATTCAT
++
+<0<<BFF<0BFFFII
+""")
+        self.assertRaises(IOError,
+                          demultiplex_fastq,self.fastq,barcodes,1)
+    def test_demultiplex_fastq_gzip_output(self):
+        barcodes = [{ 'name': 'PB1', 'index': 'CCGTCCAT', 'lane': 6 }]
+        counts = demultiplex_fastq(self.fastq,barcodes,0,gzip_output=True)
+        self.assertEqual(counts,{ 'CCGTCCAT': 1, 'unbinned': 2 })
+        self.assertEqual(
+            len(gzip.open('PB1_CCGTCCAT_L006_R1_001.fastq.gz').read().\
+                split('\n')),5)
+    def test_demultiplex_fastq_no_barcodes_for_lane(self):
+        barcodes = [{ 'name': 'PB2', 'index': 'ATTAGA', 'lane': 5 }]
+        self.assertEqual(demultiplex_fastq(self.fastq,barcodes,1),None)
 
 #######################################################################
 # Main program
@@ -192,6 +551,14 @@ if __name__ == "__main__":
     p.add_option("--samplesheet",action="store",dest="sample_sheet",default=None,
                  help="specify SampleSheet.csv file to read barcodes, sample names and lane "
                  "assignments from (as an alternative to --barcode).")
+    p.add_option("-m","--mismatches",action="store",dest="mismatches",type="int",
+                 default=1,help="maximum number of mismatches allowed when matching "
+                 "index sequences to barcodes (default: 1)")
+    p.add_option("--gzip",action="store_true",dest="gzip",default=False,
+                 help="write the output FASTQ files gzip-compressed")
+    p.add_option("-n","--nprocs",action="store",dest="nprocs",type="int",
+                 default=1,help="number of FASTQ files to process in parallel "
+                 "(default: 1)")
 
     # Parse command line
     options,args = p.parse_args()
@@ -208,7 +575,6 @@ if __name__ == "__main__":
         print "Assigning barcode '%s' in lane %s to %s" % (barcode,lane,name)
         barcodes.append({ 'name': name,
                           'index': barcode,
-                          'matcher': BarcodeMatcher(barcode),
                           'lane': int(lane)})
 
     # Read from sample sheet (if supplied)
@@ -222,7 +588,6 @@ if __name__ == "__main__":
             print "Assigning barcode '%s' in lane %s to %s" % (barcode,lane,name)
             barcodes.append({ 'name': name,
                               'index': barcode,
-                              'matcher': BarcodeMatcher(barcode),
                               'lane': int(lane) })
     if len(barcodes) < 1:
         p.error("need at least one --barcode and/or --samplesheet assignment")
@@ -231,9 +596,24 @@ if __name__ == "__main__":
     p = IlluminaData.IlluminaProject(undetermined_dir)
 
     # Loop over "samples" and match barcodes
+    jobs = []
     for s in p.samples:
         for fq in s.fastq:
             fastq = os.path.join(s.dirn,fq)
-            demultiplex_fastq(fastq,barcodes,1)
+            jobs.append((fastq,barcodes,options.mismatches,options.gzip))
+    try:
+        if options.nprocs > 1:
+            pool = multiprocessing.Pool(options.nprocs)
+            try:
+                pool.map(_demultiplex_fastq,jobs)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            for job in jobs:
+                _demultiplex_fastq(job)
+    except IOError,ex:
+        sys.stderr.write("%s, exiting\n" % ex)
+        sys.exit(1)
     print "Finished"
 
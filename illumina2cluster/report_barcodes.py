@@ -14,16 +14,22 @@
 Count and report the barcode/index sequences (AKA tags) in one or more
 Fastq file from an Illumina sequencer.
 
+Index sequences (including dual indexes e.g. 'i7+i5') and lane numbers
+are counted directly from the read headers, optionally reading several
+Fastqs in parallel, and can be reported separately for each lane.
+
 """
 
 #######################################################################
 # Import modules that this module depends on
 #######################################################################
 
-__version__ = "0.0.2"
+__version__ = "0.1.0"
 
 import sys
 import optparse
+import itertools
+import multiprocessing
 import bcftbx.FASTQFile as FASTQFile
 
 #######################################################################
@@ -39,6 +45,8 @@ class Barcodes:
 
         """
         self._counts = {}
+        self._lane_counts = {}
+        self._index = None
 
     def load(self,fastq=None,fp=None):
         """Read in fastq data and collect index sequence info
@@ -52,12 +60,45 @@ class Barcodes:
            fp: file-like object opened for reading
 
         """
-        for read in FASTQFile.FastqIterator(fastq_file=fastq,fp=fp):
-            seq = read.seqid.index_sequence
-            if seq not in self._counts:
-                self._counts[seq] = 1
-            else:
-                self._counts[seq] += 1
+        self.add(count_index_sequences(fastq=fastq,fp=fp))
+
+    def add(self,counts):
+        """Add counts of index sequences
+
+        Arguments:
+          counts: dictionary of counts keyed by (lane,index_sequence)
+            tuples, as returned by 'count_index_sequences'
+
+        """
+        for (lane,seq),count in counts.iteritems():
+            try:
+                self._counts[seq] += count
+            except KeyError:
+                self._counts[seq] = count
+            lane_counts = self._lane_counts.setdefault(lane,{})
+            try:
+                lane_counts[seq] += count
+            except KeyError:
+                lane_counts[seq] = count
+        self._index = None
+
+    def lanes(self):
+        """Return sorted list of lanes that index sequences came from
+
+        """
+        return sorted(self._lane_counts.keys())
+
+    def for_lane(self,lane):
+        """Return a Barcodes instance for a single lane
+
+        The new instance only has the counts for the index
+        sequences from the specified lane.
+
+        """
+        barcodes = Barcodes()
+        barcodes.add(dict([((lane,seq),count) for seq,count in
+                           self._lane_counts.get(lane,{}).iteritems()]))
+        return barcodes
 
     def sequences(self):
         """Return list of barcode sequences
@@ -98,18 +139,183 @@ class Barcodes:
         within the tolerance of allowed mismatches, and
         return as a list.
 
+        Rather than comparing the sequence with every other
+        one, all the possible sequences which match it (see
+        'mismatch_neighbours') are looked up in an index of
+        the sequences, so this is only efficient for small
+        numbers of mismatches.
+
+        """
+        if max_mismatches == 0:
+            if seq in self._counts:
+                return [seq]
+            return []
+        if self._index is None:
+            self._index = SequenceIndex(self._counts.keys())
+        return self._index.matches(seq,max_mismatches)
+
+class SequenceIndex:
+    """Class for finding sequences which match within mismatches
+
+    Stores a set of sequences so that all those which match
+    a given sequence (according to 'sequences_match') can be
+    found by looking up the possible matching sequences,
+    rather than by comparing every pair of sequences.
+
+    >>> index = SequenceIndex(['ACGT','ACGA','TTTT'])
+    >>> index.matches('ACGG',1) # returns ['ACGA','ACGT']
+
+    """
+    def __init__(self,seqs):
+        """Create a new SequenceIndex instance
+
+        Arguments:
+          seqs: list of sequences to index (any which are None
+            are ignored)
+
+        """
+        self.__seqs = {}
+        self.__prefixes = {}
+        alphabet = set()
+        for seq in seqs:
+            if seq is None:
+                continue
+            self.__seqs.setdefault(len(seq),set()).add(seq)
+            alphabet.update(seq)
+        self.__alphabet = ''.join(sorted(alphabet))
+
+    def __prefix_index(self,length,prefix_length):
+        """Internal: map prefixes to sequences of a specific length
+
+        """
+        key = (length,prefix_length)
+        try:
+            return self.__prefixes[key]
+        except KeyError:
+            pass
+        prefixes = {}
+        for seq in self.__seqs[length]:
+            prefixes.setdefault(seq[:prefix_length],[]).append(seq)
+        self.__prefixes[key] = prefixes
+        return prefixes
+
+    def matches(self,seq,max_mismatches):
+        """Return sorted list of sequences matching a sequence
+
+        Arguments:
+          seq: sequence to find matches for
+          max_mismatches: maximum number of mismatches
+
         """
-        grp = []
-        for s in self.sequences():
-            if s not in grp and sequences_match(s,seq,max_mismatches):
-                grp.append(s)
-        grp.sort()
-        return grp
+        grp = set()
+        for length in self.__seqs:
+            if length <= len(seq):
+                # Sequences are compared over the shorter length
+                seqs = self.__seqs[length]
+                for s in mismatch_neighbours(seq[:length],max_mismatches,
+                                             self.__alphabet):
+                    if s in seqs:
+                        grp.add(s)
+            else:
+                prefixes = self.__prefix_index(length,len(seq))
+                for s in mismatch_neighbours(seq,max_mismatches,
+                                             self.__alphabet):
+                    try:
+                        grp.update(prefixes[s])
+                    except KeyError:
+                        pass
+        return sorted(grp)
 
 #######################################################################
 # Functions
 #######################################################################
 
+def count_index_sequences(fastq=None,fp=None):
+    """Count the index sequences for each lane in Fastq data
+
+    The index sequence and lane for each read are taken
+    directly from the sequence identifier line of the
+    record, without creating any FastqRead objects.
+
+    The input FASTQ can be either a text file or a compressed
+    (gzipped) FASTQ, specified via a file name (using the 'fastq'
+    argument), or a file-like object opened for line reading
+    (using the 'fp' argument).
+
+    Arguments:
+      fastq: name of the FASTQ file to read
+      fp: file-like object opened for reading
+
+    Returns:
+      Dictionary of counts keyed by (lane,index_sequence) tuples.
+
+    """
+    if fp is None:
+        fp = FASTQFile.get_fastq_file_handle(fastq)
+        close_fp = True
+    else:
+        close_fp = False
+    counts = {}
+    try:
+        for line in itertools.islice(fp,0,None,4):
+            fields = line.rstrip().split(':')
+            if len(fields) == 10:
+                # Illumina 1.8+ e.g.
+                # @EAS139:136:FC706VJ:2:2104:15343:197393 1:Y:18:ATCACG
+                key = (fields[3],fields[9])
+            else:
+                seqid = FASTQFile.SequenceIdentifier(line)
+                key = (seqid.flowcell_lane,seqid.index_sequence)
+            try:
+                counts[key] += 1
+            except KeyError:
+                counts[key] = 1
+    finally:
+        if close_fp:
+            fp.close()
+    return counts
+
+def mismatch_neighbours(seq,max_mismatches,alphabet='ACGTN'):
+    """Generate all sequences which match a sequence within mismatches
+
+    Yields every sequence of the same length which 'sequences_match'
+    would consider to match 'seq' with 'max_mismatches' (where
+    'max_mismatches' is at least 1), using the characters in
+    'alphabet'. As with 'sequences_match', an 'N' in either sequence
+    always counts as a mismatch.
+
+    Arguments:
+      seq: sequence to generate matches for
+      max_mismatches: maximum number of mismatches
+      alphabet: (optional) string of characters which can appear
+        in the matching sequences (default is 'ACGTN')
+
+    """
+    positions = [i for i,c in enumerate(seq) if c != 'N']
+    ns = [i for i,c in enumerate(seq) if c == 'N']
+    nfree = max_mismatches - len(ns)
+    if nfree < 0:
+        return
+    for nmismatches in xrange(0,nfree+1):
+        for idxs in itertools.combinations(positions,nmismatches):
+            # Positions with an 'N' can hold anything, other
+            # positions must change
+            substitutions = [alphabet for i in ns] + \
+                            [[c for c in alphabet if c != seq[i]]
+                             for i in idxs]
+            idxs = ns + list(idxs)
+            for bases in itertools.product(*substitutions):
+                s = list(seq)
+                for i,c in zip(idxs,bases):
+                    s[i] = c
+                yield ''.join(s)
+
+def _count_index_sequences(fastq):
+    """Internal: wrapper for 'count_index_sequences' for use in a pool
+
+    """
+    return count_index_sequences(fastq=fastq)
+
 def sequences_match(seq1,seq2,max_mismatches=0):
     """Determine whether two sequences match with specified tolerance
 
@@ -135,24 +341,54 @@ def sequences_match(seq1,seq2,max_mismatches=0):
                 return False
     return True
 
-def main(fastqs,cutoff):
+def main(fastqs,cutoff,top=None,per_lane=False,nprocs=1):
     """Main program
 
     Arguments:
       fastqs: list of FASTQ files to read sequences from
       cutoff: set the minimum number of reads that a barcode must appear in
         before it is reported
+      top: (optional) maximum number of barcodes to report
+      per_lane: (optional) if True then report barcodes separately
+        for each lane
+      nprocs: (optional) number of FASTQ files to read in parallel
 
     """
     barcodes = Barcodes()
-    for fastq_file in fastqs:
-        print "Reading in data from %s" % fastq_file
-        barcodes.load(fastq=fastq_file)
+    if nprocs > 1:
+        print "Reading in data from %d files" % len(fastqs)
+        pool = multiprocessing.Pool(nprocs)
+        try:
+            for counts in pool.imap_unordered(_count_index_sequences,fastqs):
+                barcodes.add(counts)
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for fastq_file in fastqs:
+            print "Reading in data from %s" % fastq_file
+            barcodes.load(fastq=fastq_file)
+    if per_lane:
+        for lane in barcodes.lanes():
+            print "Lane %s" % lane
+            report(barcodes.for_lane(lane),cutoff,top)
+    else:
+        report(barcodes,cutoff,top)
+
+def report(barcodes,cutoff,top=None):
+    """Report the most common barcodes
+
+    Arguments:
+      barcodes: populated Barcodes instance
+      cutoff: set the minimum number of reads that a barcode must appear in
+        before it is reported
+      top: (optional) maximum number of barcodes to report
+
+    """
     print "Total # barcode sequences: %d" % len(barcodes.sequences())
     print "Determining top barcode sequences"
-    ordered_seqs = sorted(barcodes.sequences(),
-                          cmp=lambda x,y: cmp(barcodes.count_for(y),
-                                              barcodes.count_for(x)))
+    ordered_seqs = sorted(barcodes.sequences(),key=barcodes.count_for,
+                          reverse=True)
     print "Rank = position after sorting from most to least common"
     print "Index sequence = the barcode sequence"
     print "Count = number of reads with this exact index sequence"
@@ -160,20 +396,26 @@ def main(fastqs,cutoff):
     print "2 mismatches = number of reads which match this index allowing 2 mismatches"
     print "Matching indices = list of higher ranked sequences matching this one (if any)"
     print "Rank\tIndex sequence\tCount\t1 mismatch\t2 mismatches\tMatching indices"
+    rank = dict([(seq,i) for i,seq in enumerate(ordered_seqs)])
     for i,seq in enumerate(ordered_seqs):
         n_exact = barcodes.count_for(seq)
         n_1mismatch = barcodes.count_for(*barcodes.group(seq,1))
         n_2mismatch = barcodes.count_for(*barcodes.group(seq,2))
         match_seqs = []
-        for i1,seq1 in enumerate(ordered_seqs[:i]):
-            if sequences_match(seq,seq1,2):
-                match_seqs.append("%d:'%s'" % (i1+1,seq1))
+        for seq1 in barcodes.group(seq,2):
+            if rank[seq1] < i:
+                match_seqs.append((rank[seq1],seq1))
+        match_seqs = ["%d:'%s'" % (i1+1,seq1)
+                      for i1,seq1 in sorted(match_seqs)]
         print "%d\t%s\t%d\t%d\t%d\t[%s]" % (i+1,seq,
                                           n_exact,n_1mismatch,n_2mismatch,
                                           ','.join(match_seqs))
         if n_exact < cutoff:
             print "...remainder occur less than %d times (set by --cutoff)" % cutoff
             break
+        if top is not None and i+1 >= top:
+            print "...remainder not reported (set by --top)"
+            break
 
 #######################################################################
 # Tests
@@ -212,6 +454,90 @@ GAAACGCGGCACAGA
         group = b.group('CCGTCCAT')
         self.assertEqual(b.count_for(*group),2)
 
+    def test_barcodes_per_lane(self):
+        fastq_data = cStringIO.StringIO(
+"""@HWI-700511R:233:C446JACXX:6:1101:1241:2242 1:N:0:CCGTCCAT+TTAGGC
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+@HWI-700511R:233:C446JACXX:7:1101:1280:2080 1:N:0:CCGTCCAT+TTAGGC
+CGAGCTCGAATTCAT
++
+<0<<BFF<0BFFFII
+@HWI-700511R:233:C446JACXX:6:1101:1241:2242 1:N:0:CCGTCCAT+TTAGGA
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+""")
+        b = Barcodes()
+        b.load(fp=fastq_data)
+        self.assertEqual(b.lanes(),['6','7'])
+        self.assertEqual(b.count_for('CCGTCCAT+TTAGGC'),2)
+        self.assertEqual(b.group('CCGTCCAT+TTAGGC'),['CCGTCCAT+TTAGGA',
+                                                     'CCGTCCAT+TTAGGC'])
+        lane6 = b.for_lane('6')
+        self.assertEqual(lane6.sequences(),['CCGTCCAT+TTAGGA',
+                                            'CCGTCCAT+TTAGGC'])
+        self.assertEqual(lane6.count_for('CCGTCCAT+TTAGGC'),1)
+        lane7 = b.for_lane('7')
+        self.assertEqual(lane7.sequences(),['CCGTCCAT+TTAGGC'])
+        self.assertEqual(lane7.group('CCGTCCAT+TTAGGA'),['CCGTCCAT+TTAGGC'])
+
+class TestCountIndexSequencesFunction(unittest.TestCase):
+    def test_count_index_sequences(self):
+        fastq_data = cStringIO.StringIO(
+"""@HWI-700511R:233:C446JACXX:6:1101:1241:2242 1:N:0:CCGTCCAT
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+@HWI-700511R:233:C446JACXX:7:1101:1280:2080 1:N:0:CCGTCCAT
+CGAGCTCGAATTCAT
++
+<0<<BFF<0BFFFII
+@HWI-700511R:233:C446JACXX:6:1101:1241:2242 1:N:0:CCGTCCAT
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+@HWUSI-EAS100R:6:73:941:1973#0/1
+GAAACGCGGCACAGA
++
+<BBFFBFFBBFFF7B
+""")
+        self.assertEqual(count_index_sequences(fp=fastq_data),
+                         { ('6','CCGTCCAT'): 2,
+                           ('7','CCGTCCAT'): 1,
+                           ('6',None): 1 })
+
+class TestMismatchNeighboursFunction(unittest.TestCase):
+    def test_mismatch_neighbours(self):
+        self.assertEqual(sorted(mismatch_neighbours('AC',1,'ACN')),
+                         ['AA','AC','AN','CC','NC'])
+    def test_mismatch_neighbours_handle_ns(self):
+        self.assertEqual(sorted(mismatch_neighbours('AN',1,'ACN')),
+                         ['AA','AC','AN'])
+        self.assertEqual(list(mismatch_neighbours('NN',1,'ACN')),[])
+    def test_mismatch_neighbours_agree_with_sequences_match(self):
+        for seq in ('ACGT','ANGT','NNGT'):
+            for max_mismatches in (1,2):
+                expected = sorted([''.join(s)
+                            for s in itertools.product('ACGTN',repeat=4)
+                            if sequences_match(seq,''.join(s),
+                                               max_mismatches)])
+                self.assertEqual(sorted(mismatch_neighbours(seq,
+                                                            max_mismatches)),
+                                 expected)
+
+class TestSequenceIndex(unittest.TestCase):
+    def test_sequence_index(self):
+        index = SequenceIndex(['ACGT','ACGA','TTTT',None])
+        self.assertEqual(index.matches('ACGG',1),['ACGA','ACGT'])
+        self.assertEqual(index.matches('TTTT',1),['TTTT'])
+        self.assertEqual(index.matches('GGGG',2),[])
+    def test_sequence_index_different_lengths(self):
+        index = SequenceIndex(['ACGT','ACG','ACGTTT'])
+        self.assertEqual(index.matches('ACGA',1),['ACG','ACGT','ACGTTT'])
+        self.assertEqual(index.matches('AC',1),['ACG','ACGT','ACGTTT'])
+
 class TestSequencesMatchFunction(unittest.TestCase):
     def test_sequences_match_exact(self):
         self.assertTrue(sequences_match('AGGTCTA','AGGTCTA'))
@@ -248,11 +574,19 @@ if __name__ == "__main__":
     p.add_option('--cutoff',action='store',dest='cutoff',default=1000000,type='int',
                  help="Minimum number of times a barcode sequence must appear to be "
                  "reported (default is 1000000)")
+    p.add_option('--top',action='store',dest='top',default=None,type='int',
+                 help="Maximum number of barcode sequences to report (default is "
+                 "to report all those above the cutoff)")
+    p.add_option('--per-lane',action='store_true',dest='per_lane',default=False,
+                 help="Report barcode sequences separately for each lane")
+    p.add_option('-n','--nprocs',action='store',dest='nprocs',default=1,type='int',
+                 help="Number of Fastq files to read in parallel (default is 1)")
     options,args = p.parse_args()
     if len(args) == 0:
         p.error("Must supply at least one Fastq file")
     try:
-        main(args,options.cutoff)
+        main(args,options.cutoff,top=options.top,per_lane=options.per_lane,
+             nprocs=options.nprocs)
     except KeyboardInterrupt:
         print "Terminating following Ctrl-C"
         pass
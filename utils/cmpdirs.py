@@ -19,7 +19,7 @@ Compare the contents of two directories.
 # Module metadata
 #######################################################################
 
-__version__ = '0.0.3'
+__version__ = '0.1.0'
 
 #######################################################################
 # Import modules that this module depends on
@@ -30,6 +30,9 @@ import os
 import optparse
 import logging
 import itertools
+import functools
+import threading
+import hashlib
 from multiprocessing import Pool
 
 # Put .. onto Python search path for modules
@@ -39,6 +42,13 @@ SHARE_DIR = os.path.abspath(
 sys.path.append(SHARE_DIR)
 import bcftbx.Md5sum as Md5sum
 
+#######################################################################
+# Module constants
+#######################################################################
+
+# Number of file pairs sent to each worker process at a time
+POOL_CHUNKSIZE = 16
+
 #######################################################################
 # Classes
 #######################################################################
@@ -114,7 +124,126 @@ def yield_filepairs(dir1,dir2,include_dirs=False):
                 f2 = os.path.join(dir2,os.path.relpath(f1,dir1))
                 yield (f1,f2)
 
-def cmp_filepair(file_pair):
+def md5sum_head_tail(filen,nbytes):
+    """Compute MD5 sum for the start and end of a file
+
+    Returns the MD5 sum of the first 'nbytes' bytes of the
+    file concatenated with the last 'nbytes' bytes (with any
+    overlap between the two only included once).
+
+    Arguments:
+      filen: path to the file
+      nbytes: number of bytes to include from the start
+        and end of the file
+
+    """
+    chksum = hashlib.md5()
+    with open(filen,'rb') as fp:
+        chksum.update(fp.read(nbytes))
+        fp.seek(0,os.SEEK_END)
+        size = fp.tell()
+        if size > nbytes:
+            fp.seek(max(nbytes,size-nbytes))
+            chksum.update(fp.read(nbytes))
+    return chksum.hexdigest()
+
+def md5sum_pair(f1,f2,md5func=Md5sum.md5sum,concurrent=True):
+    """Compute MD5 sums for a pair of files concurrently
+
+    The checksum for 'f2' is computed in a separate thread
+    while the checksum for 'f1' is computed in the calling
+    thread. Any exception raised while computing either
+    checksum is re-raised.
+
+    Arguments:
+      f1: path to the first file
+      f2: path to the second file
+      md5func: function which takes a file path and returns
+        an MD5 sum (defaults to 'Md5sum.md5sum')
+      concurrent: if False then compute the checksums one
+        after the other in the calling thread
+
+    Returns:
+      Tuple (md5_1,md5_2).
+
+    """
+    if not concurrent:
+        return (md5func(f1),md5func(f2))
+    result = {}
+    def md5_f2():
+        try:
+            result['md5'] = md5func(f2)
+        except Exception as ex:
+            result['error'] = ex
+    t = threading.Thread(target=md5_f2)
+    t.start()
+    try:
+        md5_1 = md5func(f1)
+    finally:
+        t.join()
+    if 'error' in result:
+        raise result['error']
+    return (md5_1,result['md5'])
+
+def cmp_files(f1,f2,quick=False,head_tail=None):
+    """Compare a pair of files using a tiered set of checks
+
+    The comparisons are done in order of increasing cost,
+    stopping as soon as the outcome is known:
+
+    1. the file sizes are compared and the files are taken
+       to be different if the sizes differ;
+    2. if 'quick' is True then files with the same size and
+       modification time (to the nearest second) are taken
+       to be the same, without being read;
+    3. if 'head_tail' is set then MD5 sums are computed for
+       the first and last 'head_tail' bytes of each file,
+       and the files are taken to be different if these
+       differ;
+    4. finally MD5 sums are computed for the full files.
+
+    Checksums for files larger than Md5sum.BLOCKSIZE are
+    computed for both files concurrently.
+
+    Arguments:
+      f1: path to the reference file
+      f2: path to the file to be checked
+      quick: (optional) if True then trust size and
+        modification time
+      head_tail: (optional) if set then compare MD5 sums
+        for this many bytes from the start and end of each
+        file before comparing the full MD5 sums
+
+    Returns:
+      Md5Checker constant representing the outcome of the
+      comparison.
+
+    """
+    try:
+        st1 = os.stat(f1)
+        st2 = os.stat(f2)
+        if st1.st_size != st2.st_size:
+            return Md5sum.Md5Checker.MD5_FAILED
+        if quick and int(st1.st_mtime) == int(st2.st_mtime):
+            return Md5sum.Md5Checker.MD5_OK
+        concurrent = (st1.st_size > Md5sum.BLOCKSIZE)
+        if head_tail and st1.st_size > 2*head_tail:
+            md5_1,md5_2 = md5sum_pair(f1,f2,
+                                      lambda f: md5sum_head_tail(f,head_tail),
+                                      concurrent=concurrent)
+            if md5_1 != md5_2:
+                return Md5sum.Md5Checker.MD5_FAILED
+        md5_1,md5_2 = md5sum_pair(f1,f2,concurrent=concurrent)
+        if md5_1 == md5_2:
+            return Md5sum.Md5Checker.MD5_OK
+        else:
+            return Md5sum.Md5Checker.MD5_FAILED
+    except (IOError,OSError) as ex:
+        # Error accessing one or both files
+        logging.error("%s: error while generating MD5 sums: '%s'" % (f1,ex))
+        return Md5sum.Md5Checker.MD5_ERROR
+
+def cmp_filepair(file_pair,quick=False,head_tail=None):
     """Compare a pair of files
 
     'file_pair' is a tuple consisting of a pair of file paths
@@ -125,6 +254,12 @@ def cmp_filepair(file_pair):
 
     Arguments:
       file_pair: tuple 
+      quick: (optional) if True then trust size and
+        modification time when comparing files (see
+        'cmp_files')
+      head_tail: (optional) number of bytes from the start
+        and end of files to compare before comparing the
+        full MD5 sums (see 'cmp_files')
 
     """
     f1,f2 = file_pair
@@ -135,16 +270,14 @@ def cmp_filepair(file_pair):
         if not os.path.lexists(f2):
             result = Md5sum.Md5Checker.MISSING_TARGET
         elif os.path.islink(f1):
-            print "%s: is link" % f1
             # Compare links
             if os.path.islink(f2):
-                print "%s: is link" % f2
                 if os.readlink(f1) == os.readlink(f2):
                     result = Md5sum.Md5Checker.LINKS_SAME
                 else:
                     result = Md5sum.Md5Checker.LINKS_DIFFER
             else:
-                print "%s: is not link" % f2
+                logging.debug("%s: is link, %s: is not link" % (f1,f2))
                 result = Md5sum.Md5Checker.TYPES_DIFFER
         elif os.path.isdir(f1):
             # Compare directories
@@ -154,10 +287,11 @@ def cmp_filepair(file_pair):
                 result = Md5sum.Md5Checker.TYPES_DIFFER
         else:
             # Compare files
-            result = Md5sum.Md5Checker.md5cmp_files(f1,f2)
+            result = cmp_files(f1,f2,quick=quick,head_tail=head_tail)
     return CmpResult(f1,f2,result)
 
-def cmp_dirs(dir1,dir2,n=1):
+def cmp_dirs(dir1,dir2,n=1,quick=False,head_tail=None,verbose=True,
+             chunksize=POOL_CHUNKSIZE):
     """Compare the contents of a pair of directories
 
     Arguments:
@@ -165,6 +299,16 @@ def cmp_dirs(dir1,dir2,n=1):
       dir2: directory to compare against reference
       n:    number of processors to use (defaults to 1
             i.e. single core)
+      quick: (optional) if True then trust size and
+            modification time when comparing files
+      head_tail: (optional) number of bytes from the start
+            and end of files to compare before comparing the
+            full MD5 sums
+      verbose: (optional) if True (the default) then report
+            the result of every comparison; otherwise only
+            report failures
+      chunksize: (optional) number of file pairs to send to
+            each worker process at a time when n > 1
 
     Returns:
       Dictionary where keys are comparison result codes
@@ -173,13 +317,19 @@ def cmp_dirs(dir1,dir2,n=1):
 
     """
     counts = {}
+    cmp_func = functools.partial(cmp_filepair,
+                                 quick=quick,
+                                 head_tail=head_tail)
     if n == 1:
-        mapper = itertools.imap
+        results = itertools.imap(cmp_func,yield_filepairs(dir1,dir2))
     else:
         pool = Pool(n)
-        mapper = pool.imap
-    for result in mapper(cmp_filepair,yield_filepairs(dir1,dir2)):
-        print "%s: %s" % (result.relpath(dir1),result.status_message)
+        results = pool.imap(cmp_func,yield_filepairs(dir1,dir2),
+                            chunksize=chunksize)
+    for result in results:
+        if verbose or result.status not in (Md5sum.Md5Checker.MD5_OK,
+                                            Md5sum.Md5Checker.LINKS_SAME):
+            print "%s: %s" % (result.relpath(dir1),result.status_message)
         try:
             counts[result.status] += 1
         except KeyError:
@@ -203,10 +353,24 @@ if __name__ == '__main__':
     p.add_option('-n',action='store',dest='n_processors',
                  default=1,type='int',
                  help="specify number of cores to use")
+    p.add_option('--quick',action='store_true',dest='quick',default=False,
+                 help="trust file sizes and modification times: files "
+                 "with the same size and modification time are treated "
+                 "as identical without computing MD5 sums")
+    p.add_option('--head-tail',action='store',dest='head_tail',
+                 default=0,type='int',metavar='N',
+                 help="before computing full MD5 sums, compare MD5 sums "
+                 "for the first and last N Mb of each file")
+    p.add_option('-q','--quiet',action='store_false',dest='verbose',
+                 default=True,
+                 help="only report failed comparisons (and the summary)")
     options,args = p.parse_args()
     if len(args) != 2:
         p.error("supply two directories to compare")
-    counts = cmp_dirs(args[0],args[1],n=options.n_processors)
+    counts = cmp_dirs(args[0],args[1],n=options.n_processors,
+                      quick=options.quick,
+                      head_tail=options.head_tail*1024*1024,
+                      verbose=options.verbose)
     if counts:
         total = sum([counts[x] for x in counts])
     else:
@@ -22,7 +22,7 @@ to perform the underlying operations.
 # Module metadata
 #######################################################################
 
-__version__ = "0.3.2"
+__version__ = "0.5.0"
 
 #######################################################################
 # Import modules that this module depends on
@@ -43,7 +43,7 @@ import bcftbx.Md5sum as Md5sum
 # Functions
 #######################################################################
 
-def compute_md5sums(dirn,output_file=None,relative=False):
+def compute_md5sums(dirn,output_file=None,relative=False,nthreads=1):
     """Compute and write MD5 sums for all files in a directory
 
     Walks the directory tree under the specified directory and
@@ -59,6 +59,8 @@ def compute_md5sums(dirn,output_file=None,relative=False):
       output_file: (optional) name of file to write MD5 sums to
       relative: if True then output file paths relative to
         the supplied directory (otherwise write absolute paths)
+      nthreads: (optional) number of threads to use when
+        computing the MD5 sums (default is 1)
 
     Returns:
       Zero on success, 1 if errors were encountered
@@ -68,7 +70,8 @@ def compute_md5sums(dirn,output_file=None,relative=False):
         fp = open(output_file,'w')
     else:
         fp = sys.stdout
-    for filen,chksum in Md5sum.Md5Checker.compute_md5sums(dirn):
+    for filen,chksum in Md5sum.Md5Checker.compute_md5sums(dirn,
+                                                          nthreads=nthreads):
         if not relative:
             filen = os.path.join(dirn,filen)
         fp.write("%s  %s\n" % (chksum,filen))
@@ -76,6 +79,55 @@ def compute_md5sums(dirn,output_file=None,relative=False):
         fp.close()
     return retval
 
+def compute_md5sums_incremental(dirn,output_file,relative=False,
+                                nthreads=1,verbose=False):
+    """Compute and write an MD5 manifest for all files in a directory
+
+    Walks the directory tree under the specified directory and
+    writes a manifest with the MD5 sum and stat information for
+    each file it finds (see the 'Md5Manifest' class).
+
+    If the output file already exists then it is read first, and
+    files which have the same size, modification time and inode
+    as recorded there are not rehashed. Files which are no longer
+    present are dropped from the manifest.
+
+    Arguments:
+      dirn: directory to run the MD5 sum computation on
+      output_file: name of the manifest file to update
+      relative: if True then output file paths relative to
+        the supplied directory (otherwise write absolute paths)
+      nthreads: (optional) number of threads to use when
+        computing the MD5 sums (default is 1)
+      verbose: (optional) if True then report a summary of
+        the number of files that were skipped, rehashed or
+        missing
+
+    Returns:
+      Zero on success, 1 if errors were encountered
+    """
+    if os.path.exists(output_file):
+        previous = Md5sum.Md5Manifest(output_file)
+    else:
+        previous = Md5sum.Md5Manifest()
+    manifest = Md5sum.Md5Manifest()
+    n_skipped = 0
+    n_rehashed = 0
+    for filen,chksum,stat,hashed in \
+        Md5sum.Md5Checker.compute_manifest(dirn,previous=previous,
+                                           nthreads=nthreads):
+        if not relative:
+            filen = os.path.join(dirn,filen)
+        manifest.add(filen,chksum,stat)
+        if hashed:
+            n_rehashed += 1
+        else:
+            n_skipped += 1
+    n_missing = len([f for f,chksum,stat in previous if f not in manifest])
+    manifest.write(output_file)
+    report_incremental(n_skipped,n_rehashed,n_missing,verbose)
+    return 0
+
 def compute_md5sum_for_file(filen,output_file=None):
     """Compute and write MD5 sum for specifed file
 
@@ -109,7 +161,7 @@ def compute_md5sum_for_file(filen,output_file=None):
         fp.close()
     return retval
 
-def verify_md5sums(chksum_file,verbose=False):
+def verify_md5sums(chksum_file,verbose=False,nthreads=1):
     """Check the MD5 sums for all entries specified in a file
 
     For all entries in the supplied file, check the MD5 sum is
@@ -124,19 +176,72 @@ def verify_md5sums(chksum_file,verbose=False):
       verbose: (optional) if True then report status for all
         files checked, plus a summary; otherwise only report
         failures
+      nthreads: (optional) number of threads to use when
+        computing the MD5 sums (default is 1)
 
     Returns:
       Zero on success, 1 if errors were encountered
 
     """
     # Set up reporter object
-    reporter = Md5sum.Md5CheckReporter(Md5sum.Md5Checker.verify_md5sums(chksum_file),
-                                       verbose=verbose)
+    reporter = Md5sum.Md5CheckReporter(
+        Md5sum.Md5Checker.verify_md5sums(chksum_file,nthreads=nthreads),
+        verbose=verbose)
     # Summarise
     if verbose: reporter.summary()
     return reporter.status
 
-def diff_directories(dirn1,dirn2,verbose=False):
+def verify_md5sums_incremental(chksum_file,verbose=False,nthreads=1):
+    """Check MD5 sums in a manifest, skipping unchanged files
+
+    For all entries in the supplied manifest file, check whether
+    the file has changed since its MD5 sum was last computed or
+    verified (based on the size, modification time and inode);
+    unchanged files are skipped, otherwise the MD5 sum is computed
+    and checked. The manifest is then updated with the current
+    stat information for the files that passed.
+
+    Plain md5sum files (i.e. without stat information) can also
+    be supplied, in which case all files will be rehashed on the
+    first run.
+
+    Arguments:
+      chksum_file: name of the manifest file
+      verbose: (optional) if True then report status for all
+        files checked, plus a summary; otherwise only report
+        failures
+      nthreads: (optional) number of threads to use when
+        computing the MD5 sums (default is 1)
+
+    Returns:
+      Zero on success, 1 if errors were encountered
+    """
+    manifest = Md5sum.Md5Manifest(chksum_file)
+    reporter = Md5sum.Md5CheckReporter(verbose=verbose)
+    n_skipped = 0
+    n_rehashed = 0
+    n_missing = 0
+    for filen,status,hashed in \
+        Md5sum.Md5Checker.verify_manifest(manifest,nthreads=nthreads):
+        reporter.add_result(filen,status)
+        if status == Md5sum.Md5Checker.MISSING_TARGET:
+            n_missing += 1
+        elif hashed:
+            n_rehashed += 1
+        else:
+            n_skipped += 1
+    # Store updated stat information
+    try:
+        manifest.write(chksum_file)
+    except (IOError,OSError), ex:
+        logging.warning("%s: unable to update manifest: %s" %
+                        (chksum_file,ex))
+    # Summarise
+    if verbose: reporter.summary()
+    report_incremental(n_skipped,n_rehashed,n_missing,verbose)
+    return reporter.status
+
+def diff_directories(dirn1,dirn2,verbose=False,nthreads=1):
     """Check one directory against another using MD5 sums
 
     This compares one directory against another by computing the
@@ -157,14 +262,17 @@ def diff_directories(dirn1,dirn2,verbose=False):
       dirn2: "target" directory to be compared to dirn1
       verbose: (optional) if True then report status for all
         files checked; otherwise only report summary
+      nthreads: (optional) number of threads to use when
+        computing the MD5 sums (default is 1)
 
     Returns:
       Zero on success, 1 if errors were encountered
 
     """
     # Set up reporter object
-    reporter = Md5sum.Md5CheckReporter(Md5sum.Md5Checker.md5cmp_dirs(dirn1,dirn2),
-                                       verbose=verbose)
+    reporter = Md5sum.Md5CheckReporter(
+        Md5sum.Md5Checker.md5cmp_dirs(dirn1,dirn2,nthreads=nthreads),
+        verbose=verbose)
     # Summarise
     if verbose: reporter.summary()
     return reporter.status
@@ -197,6 +305,21 @@ def diff_files(filen1,filen2,verbose=False):
             print "ERROR: unable to compute one or both MD5 sums"
     return reporter.status
 
+def report_incremental(n_skipped,n_rehashed,n_missing,verbose=False):
+    """Write summary of an incremental operation to stdout
+
+    Arguments:
+      n_skipped: number of unchanged files that weren't rehashed
+      n_rehashed: number of new or modified files that were hashed
+      n_missing: number of files in the manifest that weren't found
+      verbose: if False then don't write anything
+    """
+    report("Incremental:\n"
+           "\t%d skipped (unchanged)\n"
+           "\t%d rehashed (new or modified)\n"
+           "\t%d missing" % (n_skipped,n_rehashed,n_missing),
+           verbose)
+
 def report(msg,verbose=False):
     """Write text to stdout
 
@@ -231,6 +354,17 @@ if __name__ == "__main__":
                  help="read MD5 sums from the specified file and check them")
     p.add_option('-q','--quiet',action="store_false",dest="verbose",default=True,
                  help="suppress output messages and only report failures")
+    p.add_option('-n','--threads',action="store",dest="nthreads",type="int",
+                 default=1,
+                 help="use NTHREADS threads to compute MD5 sums for multiple "
+                 "files in parallel (default: 1)")
+    p.add_option('--incremental',action="store_true",dest="incremental",
+                 default=False,
+                 help="use a manifest which also records the size, "
+                 "modification time and inode of each file, and only "
+                 "hash files which are new or have changed since the "
+                 "manifest was last written (for checksum generation, "
+                 "requires -o; for -c, the manifest is updated)")
 
     # Directory differencing
     group = optparse.OptionGroup(p,"Directory comparison (-d, --diff)",
@@ -263,6 +397,8 @@ if __name__ == "__main__":
 
     # Process the command line
     options,arguments = p.parse_args()
+    if options.nthreads < 1:
+        p.error("-n: number of threads must be a positive integer")
 
     # Set up logging output
     logging.basicConfig(format='%(message)s')
@@ -276,9 +412,17 @@ if __name__ == "__main__":
         if not os.path.isfile(chksum_file):
             p.error("Checksum '%s' file not found (or is not a file)" % chksum_file)
         # Do the verification
-        status = verify_md5sums(chksum_file,verbose=options.verbose)
+        if options.incremental:
+            status = verify_md5sums_incremental(chksum_file,
+                                                verbose=options.verbose,
+                                                nthreads=options.nthreads)
+        else:
+            status = verify_md5sums(chksum_file,verbose=options.verbose,
+                                    nthreads=options.nthreads)
     elif options.diff:
         # Running in "diff" mode
+        if options.incremental:
+            p.error("--incremental: not supported with -d")
         if len(arguments) != 2:
             p.error("-d: takes two arguments but got %s: %s"
                     % (len(arguments),arguments))
@@ -293,7 +437,8 @@ if __name__ == "__main__":
             report("Recursively check copies of files in %s against originals in %s" %
                    (target,source),
                    options.verbose)
-            status = diff_directories(source,target,verbose=options.verbose)
+            status = diff_directories(source,target,verbose=options.verbose,
+                                      nthreads=options.nthreads)
         elif os.path.isfile(source) and os.path.isfile(target):
             # Compare two files
             report("Checking MD5 sums for %s and %s" % (source,target),options.verbose)
@@ -309,8 +454,17 @@ if __name__ == "__main__":
         if options.chksum_file:
             output_file = options.chksum_file
         # Generate the checksums
-        if os.path.isdir(arguments[0]):
-            status = compute_md5sums(arguments[0],output_file)
+        if options.incremental:
+            if not os.path.isdir(arguments[0]):
+                p.error("--incremental: needs a directory")
+            if not output_file:
+                p.error("--incremental: needs -o CHKSUM_FILE")
+            status = compute_md5sums_incremental(arguments[0],output_file,
+                                                 nthreads=options.nthreads,
+                                                 verbose=options.verbose)
+        elif os.path.isdir(arguments[0]):
+            status = compute_md5sums(arguments[0],output_file,
+                                     nthreads=options.nthreads)
         elif os.path.isfile(arguments[0]):
             status = compute_md5sum_for_file(arguments[0],output_file)
         else:
@@ -6,11 +6,15 @@ import unittest
 import os
 import tempfile
 import shutil
+import hashlib
 from bcftbx.Md5sum import Md5Checker
 from bcftbx.test.mock_data import TestUtils,ExampleDirLanguages
 from cmpdirs import yield_filepairs
 from cmpdirs import cmp_filepair
 from cmpdirs import cmp_dirs
+from cmpdirs import cmp_files
+from cmpdirs import md5sum_head_tail
+from cmpdirs import md5sum_pair
 
 class TestYieldFilepairs(unittest.TestCase):
     def setUp(self):
@@ -46,6 +50,97 @@ class TestYieldFilepairs(unittest.TestCase):
         self.assertEqual(len(expected),0,
                          "Some paths not returned: %s" % expected)
 
+class TestMd5sumHeadTail(unittest.TestCase):
+    def setUp(self):
+        # Create working directory for test files etc
+        self.wd = TestUtils.make_dir()
+    def tearDown(self):
+        # Remove the container dir
+        TestUtils.remove_dir(self.wd)
+    def test_md5sum_head_tail(self):
+        """md5sum_head_tail computes MD5 sum for start and end of file
+        """
+        f = TestUtils.make_file('test_file',"0123456789",basedir=self.wd)
+        self.assertEqual(md5sum_head_tail(f,3),
+                         hashlib.md5("012789").hexdigest())
+        self.assertEqual(md5sum_head_tail(f,6),
+                         hashlib.md5("0123456789").hexdigest())
+        self.assertEqual(md5sum_head_tail(f,20),
+                         hashlib.md5("0123456789").hexdigest())
+
+class TestMd5sumPair(unittest.TestCase):
+    def setUp(self):
+        # Create working directory for test files etc
+        self.wd = TestUtils.make_dir()
+    def tearDown(self):
+        # Remove the container dir
+        TestUtils.remove_dir(self.wd)
+    def test_md5sum_pair(self):
+        """md5sum_pair computes MD5 sums for two files
+        """
+        f1 = TestUtils.make_file('test_file1',"Lorum ipsum",basedir=self.wd)
+        f2 = TestUtils.make_file('test_file2',"lorum ipsum",basedir=self.wd)
+        expected = (hashlib.md5("Lorum ipsum").hexdigest(),
+                    hashlib.md5("lorum ipsum").hexdigest())
+        self.assertEqual(md5sum_pair(f1,f2),expected)
+        self.assertEqual(md5sum_pair(f1,f2,concurrent=False),expected)
+    def test_md5sum_pair_raises_exception(self):
+        """md5sum_pair raises exception if either file is missing
+        """
+        f1 = TestUtils.make_file('test_file1',"Lorum ipsum",basedir=self.wd)
+        f2 = os.path.join(self.wd,'missing')
+        self.assertRaises(IOError,md5sum_pair,f1,f2)
+        self.assertRaises(IOError,md5sum_pair,f2,f1)
+
+class TestCmpFiles(unittest.TestCase):
+    def setUp(self):
+        # Create working directory for test files etc
+        self.wd = TestUtils.make_dir()
+    def tearDown(self):
+        # Remove the container dir
+        TestUtils.remove_dir(self.wd)
+    def test_cmp_files_different_sizes(self):
+        """cmp_files flags mismatch between files with different sizes
+        """
+        f1 = TestUtils.make_file('test_file1',"Lorum ipsum",basedir=self.wd)
+        f2 = TestUtils.make_file('test_file2',"Lorum ipsum!",basedir=self.wd)
+        self.assertEqual(cmp_files(f1,f2),Md5Checker.MD5_FAILED)
+    def test_cmp_files_quick(self):
+        """cmp_files trusts size and modification time in 'quick' mode
+        """
+        f1 = TestUtils.make_file('test_file1',"Lorum ipsum",basedir=self.wd)
+        f2 = TestUtils.make_file('test_file2',"lorum ipsum",basedir=self.wd)
+        os.utime(f1,(1500000000,1500000000))
+        os.utime(f2,(1500000000,1500000000))
+        self.assertEqual(cmp_files(f1,f2,quick=True),Md5Checker.MD5_OK)
+        self.assertEqual(cmp_files(f1,f2),Md5Checker.MD5_FAILED)
+        # Different modification times
+        os.utime(f2,(1500000100,1500000100))
+        self.assertEqual(cmp_files(f1,f2,quick=True),Md5Checker.MD5_FAILED)
+    def test_cmp_files_head_tail(self):
+        """cmp_files compares start and end of files before full files
+        """
+        data = "ABCDEFGHIJ"*300000
+        f1 = TestUtils.make_file('test_file1',data,basedir=self.wd)
+        f2 = TestUtils.make_file('test_file2',data,basedir=self.wd)
+        f3 = TestUtils.make_file('test_file3',"x"+data[1:],basedir=self.wd)
+        f4 = TestUtils.make_file('test_file4',
+                                 data[:1000000]+"x"+data[1000001:],
+                                 basedir=self.wd)
+        for head_tail in (None,1024):
+            self.assertEqual(cmp_files(f1,f2,head_tail=head_tail),
+                             Md5Checker.MD5_OK)
+            self.assertEqual(cmp_files(f1,f3,head_tail=head_tail),
+                             Md5Checker.MD5_FAILED)
+            self.assertEqual(cmp_files(f1,f4,head_tail=head_tail),
+                             Md5Checker.MD5_FAILED)
+    def test_cmp_files_error(self):
+        """cmp_files returns MD5_ERROR if file can't be read
+        """
+        f1 = TestUtils.make_file('test_file1',"Lorum ipsum",basedir=self.wd)
+        self.assertEqual(cmp_files(f1,os.path.join(self.wd,'missing')),
+                         Md5Checker.MD5_ERROR)
+
 class TestCmpFilepair(unittest.TestCase):
     def setUp(self):
         # Create working directory for test files etc
@@ -140,3 +235,16 @@ class TestCmpDirs(unittest.TestCase):
         self.assertEqual(count[Md5Checker.MD5_FAILED],1)
         self.assertEqual(count[Md5Checker.LINKS_DIFFER],1)
 
+    def test_cmp_dirs_different_dirs_multiple_processes(self):
+        """cmp_dirs works for different directories using multiple processes
+        """
+        # Add differing files
+        self.dref.add_file("more","Yet another file")
+        self.dcpy.add_file("more","Yet another file, again")
+        # Compare dirs
+        for quick in (False,True):
+            count = cmp_dirs(self.dref.dirn,self.dcpy.dirn,n=2,quick=quick,
+                             chunksize=4)
+            self.assertEqual(count[Md5Checker.MD5_OK],7)
+            self.assertEqual(count[Md5Checker.LINKS_SAME],6)
+            self.assertEqual(count[Md5Checker.MD5_FAILED],1)
@@ -7,11 +7,15 @@ import os
 import tempfile
 import shutil
 from bcftbx.test.mock_data import TestUtils,ExampleDirScooby
+from bcftbx.Md5sum import Md5Manifest
+from bcftbx.Md5sum import Md5Checker
 from md5checker import diff_directories
 from md5checker import diff_files
 from md5checker import compute_md5sum_for_file
 from md5checker import compute_md5sums
 from md5checker import verify_md5sums
+from md5checker import compute_md5sums_incremental
+from md5checker import verify_md5sums_incremental
 
 class TestMd5sums(unittest.TestCase):
     """Test computing and verifying MD5 sums via files
@@ -54,6 +58,17 @@ class TestMd5sums(unittest.TestCase):
         for l1,l2 in zip(reference_checksums,checksums):
             self.assertEqual(l1,l2)
 
+    def test_compute_md5sums_using_threads(self):
+        """compute_md5sums make md5sum file for test directory using threads
+        """
+        compute_md5sums('.',output_file=self.checksum_file,relative=True,
+                        nthreads=4)
+        checksums = open(self.checksum_file,'r').read().split('\n')
+        checksums.sort()
+        reference_checksums = self.reference_checksums.split('\n')
+        reference_checksums.sort()
+        self.assertEqual(reference_checksums,checksums)
+
     def test_verify_md5sums(self):
         # Verify md5sums for test directory
         fp = open(self.checksum_file,'w')
@@ -61,6 +76,45 @@ class TestMd5sums(unittest.TestCase):
         fp.close()
         self.assertEqual(verify_md5sums(self.checksum_file),0)
 
+    def test_compute_md5sums_incremental(self):
+        """compute_md5sums_incremental makes and updates manifest file
+        """
+        compute_md5sums_incremental('.',self.checksum_file,relative=True)
+        manifest = Md5Manifest(self.checksum_file)
+        checksums = ["%s  %s" % (chksum,f) for f,chksum,stat in manifest]
+        checksums.append('')
+        checksums.sort()
+        reference_checksums = self.reference_checksums.split('\n')
+        reference_checksums.sort()
+        self.assertEqual(reference_checksums,checksums)
+        for f,chksum,stat in manifest:
+            self.assertNotEqual(stat,None)
+        # Put a dummy checksum in the manifest: it should be kept
+        # on update as the file itself is unchanged
+        f = list(manifest)[0][0]
+        manifest.add(f,'0'*32,manifest.stat(f))
+        manifest.write(self.checksum_file)
+        compute_md5sums_incremental('.',self.checksum_file,relative=True)
+        self.assertEqual(Md5Manifest(self.checksum_file).chksum(f),'0'*32)
+
+    def test_verify_md5sums_incremental(self):
+        """verify_md5sums_incremental verifies and updates manifest file
+        """
+        # Start from plain md5sum file
+        fp = open(self.checksum_file,'w')
+        fp.write(self.reference_checksums)
+        fp.close()
+        self.assertEqual(verify_md5sums_incremental(self.checksum_file),0)
+        # Stat information should have been added
+        manifest = Md5Manifest(self.checksum_file)
+        for f,chksum,stat in manifest:
+            self.assertNotEqual(stat,None)
+        # Modify a file so that verification fails
+        fp = open('test.txt','w')
+        fp.write("This has been changed\n")
+        fp.close()
+        self.assertEqual(verify_md5sums_incremental(self.checksum_file),1)
+
     def test_compute_md5sum_for_file(self):
         # Compute md5sum for a single file
         compute_md5sum_for_file('test.txt',output_file=self.checksum_file)
@@ -139,6 +193,29 @@ class TestDiffDirectoriesFunction(unittest.TestCase):
         self.assertEqual(diff_directories(self.dir1.dirn,self.dir2.dirn),0)
         self.assertNotEqual(diff_directories(self.dir2.dirn,self.dir1.dirn),0)
 
+    def test_diff_directories_using_threads(self):
+        """diff_directories: compare directories using threads
+
+        """
+        self.dir1.add_file("diff.txt","This is one version of the file")
+        self.dir2.add_file("diff.txt","This is another version of the file")
+        # Record the number of threads passed to md5cmp_dirs
+        md5cmp_dirs = Md5Checker.__dict__['md5cmp_dirs']
+        nthreads = []
+        def wrapped_md5cmp_dirs(cls,d1,d2,**kws):
+            nthreads.append(kws.get('nthreads'))
+            return md5cmp_dirs.__get__(None,cls)(d1,d2,**kws)
+        Md5Checker.md5cmp_dirs = classmethod(wrapped_md5cmp_dirs)
+        try:
+            self.assertEqual(diff_directories(self.dir1.dirn,self.dir1.dirn,
+                                              nthreads=4),0)
+            self.assertNotEqual(diff_directories(self.dir1.dirn,
+                                                 self.dir2.dirn,
+                                                 nthreads=4),0)
+        finally:
+            Md5Checker.md5cmp_dirs = md5cmp_dirs
+        self.assertEqual(nthreads,[4,4])
+
     def test_different_file(self):
         """diff_directories: file differs between directories
 